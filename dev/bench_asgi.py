@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""Compare serving concurrent help requests with WSGI (a pool of threads,
+one per in-flight request) vs. gened.asgi.ASGIApp (one event loop).
+
+Both modes run in this process against a temporary database, calling the
+app directly (no server or sockets), with LLM calls handled by the mock
+provider (MOCK_LLM) at a fixed latency -- so this measures how many requests
+can wait on the LLM at once, not the cost of HTTP.  All requests arrive at
+once, and latencies include any time spent waiting for a thread.
+
+The app's environment (SECRET_KEY, etc.) is read from .env, as with `flask run`.
+
+Usage: python dev/bench_asgi.py [-n REQUESTS] [-t THREADS] [--delay SECONDS]
+"""
+
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+from urllib.parse import urlencode
+
+from dotenv import find_dotenv, load_dotenv
+from flask import Flask
+from werkzeug.test import EnvironBuilder
+
+import codehelp
+from codehelp.loadtest import LoadTestParams, setup_users
+from gened.asgi import ASGIApp
+from gened.db import init_db
+
+PASSWORD = "bench"  # noqa: S105 -- a throwaway user in a temporary database
+
+
+def make_app(instance_path: Path, delay: float) -> Flask:
+    app = codehelp.create_app(
+        test_config={
+            'DATABASE': str(instance_path / 'bench.db'),
+            'MOCK_LLM': True,
+            'LLM_MOCK_LATENCY_MEAN': delay,
+            'LLM_MOCK_TOKENS_PER_SECOND': 10_000,
+            'LLM_KEY_MAX_INFLIGHT': None,
+            'JOB_WORKERS': 0,
+        },
+        instance_path=instance_path,
+    )
+    with app.app_context():
+        init_db()
+        setup_users(LoadTestParams(users=1, classes=1), PASSWORD)
+    return app
+
+
+def login(app: Flask) -> str:
+    """Log in the benchmark user, returning the session cookie header."""
+    client = app.test_client()
+    client.post('/auth/local_login', data={'username': f"{codehelp.loadtest.USER_PREFIX}0", 'password': PASSWORD})
+    cookie = client.get_cookie('session')
+    assert cookie is not None
+    return f"session={cookie.value}"
+
+
+def form(i: int) -> dict[str, str]:
+    # a distinct issue for every request, so no two are coalesced or cached
+    return {'code': "print(x)", 'error': "NameError: name 'x' is not defined", 'issue': f"Request {i}"}
+
+
+def bench_wsgi(app: Flask, cookie: str, num_requests: int, num_threads: int) -> list[float]:
+    def one_request(i: int) -> float:
+        environ = EnvironBuilder(path='/help/request', method='POST', data=form(i), headers=[('Cookie', cookie)]).get_environ()
+        statuses = []
+
+        def start_response(status: str, headers: list[tuple[str, str]], exc_info: Any = None) -> Callable[[bytes], None]:  # noqa: ARG001
+            statuses.append(status)
+            return lambda _data: None
+
+        b"".join(app.wsgi_app(environ, start_response))
+        assert statuses == ["302 FOUND"], statuses
+        return time.perf_counter() - start
+
+    # all requests arrive at once; those waiting for a thread are queued, as in a WSGI server
+    start = time.perf_counter()
+    with ThreadPoolExecutor(num_threads) as pool:
+        return list(pool.map(one_request, range(num_requests)))
+
+
+async def bench_asgi(app: ASGIApp, cookie: str, num_requests: int) -> list[float]:
+    async def one_request(i: int) -> float:
+        body = urlencode(form(i)).encode()
+        scope = {
+            'type': 'http', 'http_version': '1.1', 'method': 'POST', 'scheme': 'http',
+            'path': '/help/request', 'root_path': '', 'query_string': b"",
+            'headers': [
+                (b"host", b"localhost"),
+                (b"cookie", cookie.encode()),
+                (b"content-type", b"application/x-www-form-urlencoded"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        }
+        received = False
+        statuses = []
+
+        async def receive() -> dict[str, Any]:
+            nonlocal received
+            if received:
+                await asyncio.Event().wait()  # no disconnect
+            received = True
+            return {'type': 'http.request', 'body': body}
+
+        async def send(message: dict[str, Any]) -> None:
+            if message['type'] == 'http.response.start':
+                statuses.append(message['status'])
+
+        await app(scope, receive, send)
+        assert statuses == [302], statuses
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    return list(await asyncio.gather(*(one_request(i) for i in range(num_requests))))
+
+
+def report(name: str, times: list[float], wall: float) -> None:
+    times_ms = sorted(t * 1000 for t in times)
+    p95 = times_ms[int(len(times_ms) * 0.95) - 1]
+    print(f"{name:>12}:  {len(times)/wall:8.1f} req/s   mean {statistics.mean(times_ms):7.2f} ms   median {statistics.median(times_ms):7.2f} ms   p95 {p95:7.2f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--requests', type=int, default=500, help="concurrent requests")
+    parser.add_argument('-t', '--threads', type=int, default=32, help="WSGI threads (as in a threaded WSGI server)")
+    parser.add_argument('--delay', type=float, default=2.0, help="simulated completion latency in seconds")
+    args = parser.parse_args()
+
+    load_dotenv(find_dotenv(usecwd=True))  # SECRET_KEY, etc., as for `flask run`
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        app = make_app(Path(temp_dir), args.delay)
+        cookie = login(app)
+
+        # warm up (imports, templates, background loop startup)
+        bench_wsgi(app, cookie, 4, 4)
+
+        start = time.perf_counter()
+        times = bench_wsgi(app, cookie, args.requests, args.threads)
+        report(f"WSGI ({args.threads}t)", times, time.perf_counter() - start)
+
+        asgi_app = ASGIApp(app)
+
+        async def run_asgi() -> None:
+            await bench_asgi(asgi_app, cookie, 4)  # warm up
+            start = time.perf_counter()
+            times = await bench_asgi(asgi_app, cookie, args.requests)
+            report("ASGI", times, time.perf_counter() - start)
+
+        asyncio.run(run_asgi())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""Compare request throughput with and without pooled database connections
+(gened.db.ConnectionPool; DB_POOL_SIZE=0 opens a new connection for every
+request).
+
+Requests for a few database-backed pages are made from a pool of threads,
+calling the app directly (no server or sockets) with a temporary database.
+
+The app's environment (SECRET_KEY, etc.) is read from .env, as with `flask run`.
+
+Usage: python dev/bench_db_pool.py [-n REQUESTS] [-t THREADS]
+"""
+
+import argparse
+import statistics
+import tempfile
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+from dotenv import find_dotenv, load_dotenv
+from flask import Flask
+from werkzeug.test import EnvironBuilder
+
+import codehelp
+from codehelp.loadtest import USER_PREFIX, LoadTestParams, setup_users
+from gened.db import close_db_pool, get_db_pool_stats, init_db
+
+PASSWORD = "bench"  # noqa: S105 -- a throwaway user in a temporary database
+PATHS = ['/help/', '/profile/', '/tutor/']
+
+
+def make_app(instance_path: Path) -> Flask:
+    app = codehelp.create_app(
+        test_config={
+            'DATABASE': str(instance_path / 'bench.db'),
+            'JOB_WORKERS': 0,
+        },
+        instance_path=instance_path,
+    )
+    with app.app_context():
+        init_db()
+        setup_users(LoadTestParams(users=1, classes=1), PASSWORD)
+    return app
+
+
+def login(app: Flask) -> str:
+    """Log in the benchmark user, returning the session cookie header."""
+    client = app.test_client()
+    client.post('/auth/local_login', data={'username': f"{USER_PREFIX}0", 'password': PASSWORD, 'next': ''})
+    cookie = client.get_cookie('session')
+    assert cookie is not None
+    return f"session={cookie.value}"
+
+
+def bench(app: Flask, cookie: str, num_requests: int, num_threads: int) -> list[float]:
+    def one_request(i: int) -> float:
+        environ = EnvironBuilder(path=PATHS[i % len(PATHS)], headers=[('Cookie', cookie)]).get_environ()
+        statuses = []
+
+        def start_response(status: str, headers: list[tuple[str, str]], exc_info: Any = None) -> Callable[[bytes], None]:  # noqa: ARG001
+            statuses.append(status)
+            return lambda _data: None
+
+        start = time.perf_counter()
+        b"".join(app.wsgi_app(environ, start_response))
+        assert statuses == ["200 OK"], statuses
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(num_threads) as pool:
+        return list(pool.map(one_request, range(num_requests)))
+
+
+def report(name: str, times: list[float], wall: float) -> None:
+    times_ms = sorted(t * 1000 for t in times)
+    p95 = times_ms[int(len(times_ms) * 0.95) - 1]
+    print(f"{name:>12}:  {len(times)/wall:8.1f} req/s   mean {statistics.mean(times_ms):7.2f} ms   median {statistics.median(times_ms):7.2f} ms   p95 {p95:7.2f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--requests', type=int, default=2000)
+    parser.add_argument('-t', '--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    load_dotenv(find_dotenv(usecwd=True))  # SECRET_KEY, etc., as for `flask run`
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        app = make_app(Path(temp_dir))
+        cookie = login(app)
+
+        # warm up (imports, templates)
+        bench(app, cookie, 20, 1)
+
+        for name, pool_size in [('unpooled', 0), ('pooled', max(args.threads, 1))]:
+            app.config['DB_POOL_SIZE'] = pool_size
+            close_db_pool(app)
+            with app.app_context():
+                before = get_db_pool_stats()
+            start = time.perf_counter()
+            times = bench(app, cookie, args.requests, args.threads)
+            report(name, times, time.perf_counter() - start)
+            with app.app_context():
+                after = get_db_pool_stats()
+            print(f"{'':>12}   connections: {after.hits - before.hits} reused, {after.misses - before.misses} opened")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""Compare per-request overhead of running LLM completions via asyncio.run()
+(a new event loop per request) vs. gened.async_runner.run_sync() (one
+persistent loop per process).
+
+Completions are mocked with gened.testing.mocks, so this measures only the
+overhead of the loop, the client, and the OpenAI library -- no network.
+
+Usage: python dev/bench_event_loop.py [-n REQUESTS] [-t THREADS] [--delay SECONDS]
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from collections.abc import Callable, Coroutine
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from unittest.mock import patch
+
+from flask import Flask
+
+from gened.async_runner import run_sync
+from gened.client_pool import get_pool_stats
+from gened.openai_client import OpenAIClient
+from gened.testing.mocks import mock_async_completion
+
+Runner = Callable[[Coroutine[Any, Any, Any]], Any]
+
+
+def bench(app: Flask, runner: Runner, num_requests: int, num_threads: int) -> list[float]:
+    def one_request(_: int) -> float:
+        with app.app_context():
+            start = time.perf_counter()
+            # as in a request: a new client per request, two concurrent completions
+            client = OpenAIClient("gpt-4o-mini", "fake-key")
+            async def completions() -> None:
+                await asyncio.gather(
+                    client.get_completion(prompt="main"),
+                    client.get_completion(prompt="sufficient"),
+                )
+            runner(completions())
+            return time.perf_counter() - start
+
+    with ThreadPoolExecutor(num_threads) as pool:
+        return list(pool.map(one_request, range(num_requests)))
+
+
+def report(name: str, times: list[float], wall: float) -> None:
+    times_ms = sorted(t * 1000 for t in times)
+    p95 = times_ms[int(len(times_ms) * 0.95) - 1]
+    print(f"{name:>12}:  {len(times)/wall:8.1f} req/s   mean {statistics.mean(times_ms):7.2f} ms   median {statistics.median(times_ms):7.2f} ms   p95 {p95:7.2f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--requests', type=int, default=500)
+    parser.add_argument('-t', '--threads', type=int, default=8)
+    parser.add_argument('--delay', type=float, default=0.0, help="simulated completion latency in seconds")
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config['ASYNC_TIMEOUT'] = 60
+
+    runners: dict[str, Runner] = {
+        'asyncio.run': asyncio.run,
+        'run_sync': run_sync,
+    }
+
+    with patch("openai.resources.chat.AsyncCompletions.create", mock_async_completion(delay=args.delay)):
+        # warm up (imports, pydantic model construction, background loop startup)
+        for runner in runners.values():
+            bench(app, runner, 10, 1)
+
+        for name, runner in runners.items():
+            before = get_pool_stats()
+            start = time.perf_counter()
+            times = bench(app, runner, args.requests, args.threads)
+            wall = time.perf_counter() - start
+            report(name, times, wall)
+            after = get_pool_stats()
+            hits, misses = after.hits - before.hits, after.misses - before.misses
+            print(f"{'':>12}   client pool: {hits} hits, {misses} misses")
+
+
+if __name__ == '__main__':
+    main()
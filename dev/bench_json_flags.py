@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""Compare the analytics queries that read flags out of JSON (json_extract()
+over queries' responses, json_each() over chats) with the same queries
+reading the has_error / is_insufficient generated columns and the
+chats.user_message_count column.
+
+A temporary database is filled with synthetic queries and chats, spread over
+the last 30 days, then each query is timed both ways.  Filling the database
+takes a while, as the tables' triggers maintain the usage rollups and message
+counts for every row.
+
+The app's environment (SECRET_KEY, etc.) is read from .env, as with `flask run`.
+
+Usage: python dev/bench_json_flags.py [-n QUERIES] [-c CHATS] [-r REPEATS]
+"""
+
+import argparse
+import statistics
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from dotenv import find_dotenv, load_dotenv
+from flask import Flask
+
+import codehelp
+from codehelp.loadtest import LoadTestParams, setup_users
+from gened.db import get_db, init_db
+
+PASSWORD = "bench"  # noqa: S105 -- a throwaway user in a temporary database
+
+RESPONSE_OK = '[{"model": "gpt-4o-mini", "finish_reason": "stop", "usage": {"prompt_tokens": 900, "completion_tokens": 300, "total_tokens": 1200}}]'
+RESPONSE_ERROR = '[{"error": "Error (RateLimitError).  Something went wrong with this query."}]'
+TEXT_OK = '{"main": "' + "A helpful response.  " * 40 + '"}'
+TEXT_INSUFFICIENT = '{"insufficient": "Please share more of your code.", "main": "' + "A helpful response.  " * 40 + '"}'
+CHAT = '[' + ', '.join(
+    f'{{"role": "user", "content": "Question {i}?"}}, {{"role": "assistant", "content": "{"An answer.  " * 30}"}}'
+    for i in range(4)
+) + ']'
+
+# The days_since window of gen_query_charts(): before, with just the range
+# bound on query_time added, and after
+WINDOW_JSON = """
+    SELECT
+        CAST(julianday() AS INTEGER) - CAST(julianday(queries.query_time) AS INTEGER) AS days_since,
+        COUNT(queries.id) AS queries,
+        SUM(json_extract(queries.response_json, '$[0].error') IS NOT NULL) AS errors,
+        SUM(json_extract(queries.response_text, '$.insufficient') IS NOT NULL) AS insufficient
+    FROM queries
+    WHERE days_since <= 14
+    GROUP BY days_since
+"""
+WINDOW_JSON_BOUNDED = WINDOW_JSON.replace("WHERE days_since <= 14", "WHERE days_since <= 14 AND queries.query_time >= date('now', '-15 days')")
+WINDOW_COLUMNS = """
+    SELECT
+        CAST(julianday() AS INTEGER) - CAST(julianday(queries.query_time) AS INTEGER) AS days_since,
+        COUNT(queries.id) AS queries,
+        SUM(queries.has_error) AS errors,
+        SUM(queries.is_insufficient) AS insufficient
+    FROM queries
+    WHERE days_since <= 14
+    AND queries.query_time >= date('now', '-15 days')
+    GROUP BY days_since
+"""
+
+# The tutor_admin chat list, before and after
+CHATS_JSON = """
+    SELECT
+        chats.id AS id,
+        users.display_name AS user,
+        chats.topic AS topic,
+        (
+            SELECT COUNT(*)
+            FROM json_each(chats.chat_json)
+            WHERE json_extract(json_each.value, '$.role')='user'
+        ) as "user messages"
+    FROM chats
+    JOIN users ON chats.user_id=users.id
+    ORDER BY chats.id DESC
+"""
+CHATS_COLUMN = """
+    SELECT
+        chats.id AS id,
+        users.display_name AS user,
+        chats.topic AS topic,
+        chats.user_message_count AS "user messages"
+    FROM chats
+    JOIN users ON chats.user_id=users.id
+    ORDER BY chats.id DESC
+"""
+
+
+def make_app(instance_path: Path, num_queries: int, num_chats: int) -> Flask:
+    app = codehelp.create_app(
+        test_config={
+            'DATABASE': str(instance_path / 'bench.db'),
+            'JOB_WORKERS': 0,
+        },
+        instance_path=instance_path,
+    )
+    with app.app_context():
+        init_db()
+        setup_users(LoadTestParams(users=100, classes=10), PASSWORD)
+        db = get_db()
+        db.execute("""
+            WITH RECURSIVE
+                n(i) AS (SELECT 1 UNION ALL SELECT i+1 FROM n WHERE i < ?),
+                members AS (SELECT roles.user_id, roles.id AS role_id, ROW_NUMBER() OVER (ORDER BY roles.id) - 1 AS num FROM roles)
+            INSERT INTO queries (query_time, code, error, issue, response_json, response_text, user_id, role_id)
+            SELECT
+                datetime('now', printf('-%d seconds', (? - i) * 30 * 86400 / ?)),
+                'code', 'error', 'issue',
+                CASE WHEN i % 50 = 0 THEN ? ELSE ? END,
+                CASE WHEN i % 10 = 0 THEN ? ELSE ? END,
+                members.user_id,
+                members.role_id
+            FROM n
+            JOIN members ON members.num = n.i % (SELECT COUNT(*) FROM members)
+        """, [num_queries, num_queries, num_queries, RESPONSE_ERROR, RESPONSE_OK, TEXT_INSUFFICIENT, TEXT_OK])
+        db.execute("""
+            WITH RECURSIVE
+                n(i) AS (SELECT 1 UNION ALL SELECT i+1 FROM n WHERE i < ?),
+                members AS (SELECT roles.user_id, roles.id AS role_id, ROW_NUMBER() OVER (ORDER BY roles.id) - 1 AS num FROM roles)
+            INSERT INTO chats (topic, chat_json, user_id, role_id)
+            SELECT 'topic', ?, members.user_id, members.role_id
+            FROM n
+            JOIN members ON members.num = n.i % (SELECT COUNT(*) FROM members)
+        """, [num_chats, CHAT])
+        db.commit()
+        db.execute("ANALYZE")
+    return app
+
+
+def bench(fn: Callable[[], int], repeats: int) -> list[float]:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        assert fn() > 0
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def report(name: str, times: list[float]) -> None:
+    times_ms = [t * 1000 for t in times]
+    print(f"{name:>24}:  median {statistics.median(times_ms):9.2f} ms   max {max(times_ms):9.2f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--queries', type=int, default=1_000_000)
+    parser.add_argument('-c', '--chats', type=int, default=1_000_000)
+    parser.add_argument('-r', '--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    load_dotenv(find_dotenv(usecwd=True))  # SECRET_KEY, etc., as for `flask run`
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        start = time.perf_counter()
+        app = make_app(Path(temp_dir), args.queries, args.chats)
+        print(f"Inserted {args.queries} queries and {args.chats} chats in {time.perf_counter() - start:.1f} s")
+
+        with app.app_context():
+            db = get_db()
+            assert db.execute(WINDOW_JSON).fetchall() == db.execute(WINDOW_JSON_BOUNDED).fetchall() == db.execute(WINDOW_COLUMNS).fetchall()
+            assert db.execute(CHATS_JSON).fetchall() == db.execute(CHATS_COLUMN).fetchall()
+
+            def run(sql: str) -> Callable[[], int]:
+                return lambda: len(db.execute(sql).fetchall())
+
+            print("Query charts, last 14 days:")
+            report("json_extract()", bench(run(WINDOW_JSON), args.repeats))
+            report("json_extract(), bounded", bench(run(WINDOW_JSON_BOUNDED), args.repeats))
+            report("generated columns", bench(run(WINDOW_COLUMNS), args.repeats))
+            print("Tutor chats list:")
+            report("json_each()", bench(run(CHATS_JSON), args.repeats))
+            report("user_message_count", bench(run(CHATS_COLUMN), args.repeats))
+
+
+if __name__ == '__main__':
+    main()
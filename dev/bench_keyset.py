@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""Compare fetching deep pages of the admin queries table with OFFSET and
+with keyset pagination (before_id; see gened.app_data.PageCursor).
+
+A temporary database is filled with synthetic queries, then pages at several
+depths are fetched through the registered 'queries' data source both ways.
+Filling the database takes a while, as the queries table's triggers maintain
+the usage rollups for every row.
+
+The app's environment (SECRET_KEY, etc.) is read from .env, as with `flask run`.
+
+Usage: python dev/bench_keyset.py [-n QUERIES] [-p PAGE_SIZE] [-r REPEATS]
+"""
+
+import argparse
+import statistics
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from dotenv import find_dotenv, load_dotenv
+from flask import Flask
+
+import codehelp
+from codehelp.loadtest import LoadTestParams, setup_users
+from gened.app_data import Filters, get_registered_data_source
+from gened.db import get_db, init_db
+
+PASSWORD = "bench"  # noqa: S105 -- a throwaway user in a temporary database
+
+
+def make_app(instance_path: Path, num_queries: int) -> Flask:
+    app = codehelp.create_app(
+        test_config={
+            'DATABASE': str(instance_path / 'bench.db'),
+            'JOB_WORKERS': 0,
+        },
+        instance_path=instance_path,
+    )
+    with app.app_context():
+        init_db()
+        setup_users(LoadTestParams(users=100, classes=10), PASSWORD)
+        db = get_db()
+        db.execute("""
+            WITH RECURSIVE
+                n(i) AS (SELECT 1 UNION ALL SELECT i+1 FROM n WHERE i < ?),
+                members AS (SELECT roles.user_id, roles.id AS role_id, ROW_NUMBER() OVER (ORDER BY roles.id) - 1 AS num FROM roles)
+            INSERT INTO queries (query_time, code, error, issue, response_json, response_text, user_id, role_id)
+            SELECT
+                datetime('now', printf('-%d minutes', ? - i)),
+                'code', 'error', 'issue', '{}', '{"main": "response"}',
+                members.user_id,
+                members.role_id
+            FROM n
+            JOIN members ON members.num = n.i % (SELECT COUNT(*) FROM members)
+        """, [num_queries, num_queries])
+        db.commit()
+        db.execute("ANALYZE")
+    return app
+
+
+def bench(fn: Callable[[], int], repeats: int) -> list[float]:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        assert fn() > 0
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def report(name: str, times: list[float]) -> None:
+    times_ms = [t * 1000 for t in times]
+    print(f"{name:>24}:  median {statistics.median(times_ms):9.2f} ms   max {max(times_ms):9.2f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--queries', type=int, default=1_000_000)
+    parser.add_argument('-p', '--page-size', type=int, default=100)
+    parser.add_argument('-r', '--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    load_dotenv(find_dotenv(usecwd=True))  # SECRET_KEY, etc., as for `flask run`
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        start = time.perf_counter()
+        app = make_app(Path(temp_dir), args.queries)
+        print(f"Inserted {args.queries} queries in {time.perf_counter() - start:.1f} s")
+
+        filters = Filters()
+        depths = [d for d in (0, 1_000, 10_000, 100_000, args.queries // 2, args.queries - args.page_size) if 0 <= d < args.queries]
+        with app.app_context():
+            get_queries = get_registered_data_source('queries').function
+            for depth in sorted(set(depths)):
+                # the id of the row just before the page, as a client's cursor would hold
+                before_id = None
+                if depth > 0:
+                    before_id = get_db().execute("SELECT id FROM queries ORDER BY id DESC LIMIT 1 OFFSET ?", [depth - 1]).fetchone()['id']
+
+                def by_offset(depth: int = depth) -> int:
+                    return len(get_queries(filters, limit=args.page_size, offset=depth).fetchall())
+
+                def by_keyset(before_id: int | None = before_id) -> int:
+                    return len(get_queries(filters, limit=args.page_size, before_id=before_id).fetchall())
+
+                print(f"Page at row {depth}:")
+                report("offset", bench(by_offset, args.repeats))
+                report("keyset (before_id)", bench(by_keyset, args.repeats))
+
+
+if __name__ == '__main__':
+    main()
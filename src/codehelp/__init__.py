@@ -8,8 +8,9 @@ from typing import Any
 from flask.app import Flask
 
 from gened import base
+from gened.asgi import ASGIApp
 
-from . import context_config, deletion_handler, helper, queries, tutor
+from . import context_config, deletion_handler, helper, loadtest, queries, tutor
 
 
 def create_app(test_config: dict[str, Any] | None = None, instance_path: Path | None = None) -> Flask:
@@ -59,7 +60,19 @@ def create_app(test_config: dict[str, Any] | None = None, instance_path: Path |
     # and grab a reference to the app's markdown filter
     context_config.register(app)
 
+    # add the load-test driver command
+    loadtest.init_app(app)
+
     # add navbar items
     app.config['NAVBAR_ITEM_TEMPLATES'].append("tutor_nav_item.html")
 
     return app
+
+
+def create_asgi_app(test_config: dict[str, Any] | None = None, instance_path: Path | None = None) -> ASGIApp:
+    ''' ASGI app factory (e.g., `uvicorn --factory codehelp:create_asgi_app`).
+
+    Serves the same app, with its LLM-heavy views running natively on the
+    server's event loop (see gened.asgi).
+    '''
+    return ASGIApp(create_app(test_config, instance_path))
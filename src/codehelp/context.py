@@ -4,7 +4,7 @@
 
 import json
 from dataclasses import asdict, dataclass
-from sqlite3 import Row
+from sqlite3 import Connection, Row
 
 from flask import current_app
 from jinja2 import Environment
@@ -161,11 +161,15 @@ def get_context_by_name(ctx_name: str) -> ContextConfig | None:
     return ContextConfig.from_row(context_row)
 
 
-def record_context_string(context_str: str) -> int:
+def record_context_string(context_str: str, db: Connection | None = None) -> int:
     """ Ensure a context string is recorded in the context_strings
         table, and return its row ID.
+
+        Uses the given connection (e.g., in a queued write; see
+        gened.db_writer), or get_db() by default.
     """
-    db = get_db()
+    if db is None:
+        db = get_db()
     # Add the context string to the context_strings table, but if it's a duplicate, just get the row ID of the existing one.
     # The "UPDATE SET id=id" is a no-op, but it allows the "RETURNING" to work in case of a conflict as well.
     cur = db.execute("INSERT INTO context_strings (ctx_str) VALUES (?) ON CONFLICT DO UPDATE SET id=id RETURNING id", [context_str])
@@ -4,12 +4,15 @@
 
 import asyncio
 import json
+from collections.abc import AsyncIterator
 from contextlib import suppress
-from unittest.mock import patch
+from dataclasses import dataclass, field
+from sqlite3 import Connection
+from typing import Any
 
 from flask import (
     Blueprint,
-    abort,
+    current_app,
     flash,
     make_response,
     redirect,
@@ -20,8 +23,9 @@ from flask import (
 from werkzeug.wrappers.response import Response
 
 from gened.app_data import DataAccessError, get_query, get_user_data
+from gened.asgi import async_view
+from gened.async_runner import iter_async, run_async, run_sync
 from gened.auth import (
-    admin_required,
     class_enabled_required,
     get_auth,
     login_required,
@@ -29,8 +33,12 @@ from gened.auth import (
 )
 from gened.classes import switch_class
 from gened.db import get_db
-from gened.llm import LLM, with_llm
-from gened.testing.mocks import mock_async_completion
+from gened.db_writer import flush_writes_async, queue_write, write_async
+from gened.jobs import enqueue_job, get_job_status, register_job_handler
+from gened.llm import LLM, get_job_llm, with_llm
+from gened.llm_telemetry import CallTag
+from gened.response_storage import save_responses
+from gened.sse import sse_event, sse_response
 
 from . import prompts
 from .context import (
@@ -115,8 +123,11 @@ def help_view(query_id: int) -> str | Response:
         flash("Invalid id.", "warning")
         return make_response(render_template("error.html"), 400)
 
+    pending = not query_row['response'] and _has_pending_job(query_id)
     if query_row['response']:
         responses = json.loads(query_row['response'])
+    elif pending:
+        responses = {}
     else:
         responses = {'error': "*No response -- an error occurred.  Please try again.*"}
 
@@ -127,27 +138,51 @@ def help_view(query_id: int) -> str | Response:
     else:
         topics = []
 
-    return render_template("help_view.html", query=query_row, responses=responses, history=history, topics=topics)
+    if current_app.config['STREAMING_RESPONSES'] and _is_streamable(query_id):
+        stream_url = url_for(".help_stream", query_id=query_id)
+    else:
+        stream_url = None
+
+    status_url = url_for(".help_status", query_id=query_id) if pending else None
+
+    return render_template("help_view.html", query=query_row, responses=responses, history=history, topics=topics, stream_url=stream_url, status_url=status_url)
+
+
+def _has_pending_job(query_id: int) -> bool:
+    '''Whether a query's response is being generated by a background job.'''
+    return get_job_status(f"query:{query_id}") in ('queued', 'running')
+
+
+@bp.route("/status/<int:query_id>")
+@login_required
+def help_status(query_id: int) -> dict[str, bool] | Response:
+    ''' Report whether a query's response is complete, for the help_view page to poll while it is pending. '''
+    try:
+        get_query(query_id)
+    except DataAccessError:
+        return make_response({'error': "Invalid id."}, 400)
+    return {'done': not _has_pending_job(query_id)}
 
 
-async def run_query_prompts(llm: LLM, context: ContextConfig | None, code: str, error: str, issue: str) -> tuple[list[dict[str, str]], dict[str, str]]:
+async def run_query_prompts(llm: LLM, context_str: str | None, code: str, error: str, issue: str, *, query_id: int | None = None) -> tuple[list[dict[str, str]], dict[str, str]]:
     ''' Run the given query against the coding help system of prompts.
+    API calls are tagged with query_id, if given.
 
     Returns a tuple containing:
       1) A list of response objects from the OpenAI completion (to be stored in the database)
       2) A dictionary of response text, potentially including keys 'insufficient' and 'main'.
     '''
-    context_str = context.prompt_str() if context is not None else None
-
     # Launch the "sufficient detail" check concurrently with the main prompt to save time
     task_main = asyncio.create_task(
         llm.get_completion(
             messages=prompts.make_main_prompt(code, error, issue, context_str),
+            tag=CallTag('main', query_id=query_id),
         )
     )
     task_sufficient = asyncio.create_task(
         llm.get_completion(
             messages=prompts.make_sufficient_prompt(code, error, issue, context_str),
+            tag=CallTag('sufficient', query_id=query_id),
         )
     )
 
@@ -158,10 +193,10 @@ async def run_query_prompts(llm: LLM, context: ContextConfig | None, code: str,
     response_main, response_txt = await task_main
     responses.append(response_main)
 
-    if "```" in response_txt or "should look like" in response_txt or "should look something like" in response_txt:
+    if _needs_cleanup(response_txt):
         # That's probably too much code.  Let's clean it up...
         cleanup_prompt = prompts.make_cleanup_prompt(response_text=response_txt)
-        cleanup_response, cleanup_response_txt = await llm.get_completion(prompt=cleanup_prompt)
+        cleanup_response, cleanup_response_txt = await llm.get_completion(prompt=cleanup_prompt, tag=CallTag('cleanup', query_id=query_id))
         responses.append(cleanup_response)
         response_txt = cleanup_response_txt
 
@@ -170,66 +205,149 @@ async def run_query_prompts(llm: LLM, context: ContextConfig | None, code: str,
     response_sufficient, response_sufficient_txt = await task_sufficient
     responses.append(response_sufficient)
 
+    return responses, _make_response_texts(response_main, response_txt, response_sufficient_txt)
+
+
+def _needs_cleanup(response_txt: str) -> bool:
+    return "```" in response_txt or "should look like" in response_txt or "should look something like" in response_txt
+
+
+def _make_response_texts(response_main: dict[str, str], response_txt: str, response_sufficient_txt: str) -> dict[str, str]:
     if 'error' in response_main:
-        return responses, {'error': response_txt}
+        return {'error': response_txt}
     elif response_sufficient_txt.endswith("OK") or "OK." in response_sufficient_txt or "```" in response_sufficient_txt or "is sufficient for me" in response_sufficient_txt or response_sufficient_txt.startswith("Error ("):
         # We're using just the main response.
-        return responses, {'main': response_txt}
+        return {'main': response_txt}
     else:
         # Give them the request for more information plus the main response, in case it's helpful.
-        return responses, {'insufficient': response_sufficient_txt, 'main': response_txt}
+        return {'insufficient': response_sufficient_txt, 'main': response_txt}
 
 
-def run_query(llm: LLM, context: ContextConfig | None, code: str, error: str, issue: str) -> int:
-    query_id = record_query(context, code, error, issue)
+@dataclass
+class StreamedQueryResult:
+    responses: list[dict[str, str]] = field(default_factory=list)  # response objects from all completed completions
+    texts: dict[str, str] | None = None  # set once all prompts have completed
+    main_text: str = ""  # text received so far for the main (or cleanup) response
 
-    responses, texts = asyncio.run(run_query_prompts(llm, context, code, error, issue))
+
+async def stream_query_prompts(llm: LLM, context_str: str | None, code: str, error: str, issue: str, *, result: StreamedQueryResult, query_id: int | None = None) -> AsyncIterator[tuple[str, str]]:
+    ''' Run the given query against the coding help system of prompts, as in
+    run_query_prompts(), streaming the main response as it is generated.
+
+    Yields (event, text) tuples:
+      ('delta', text): the next piece of the main response text
+      ('reset', ''): the main response will be replaced by a cleaned-up version, streamed next
+
+    The final outputs (as returned by run_query_prompts()) are stored in `result`.
+    '''
+
+    # The "sufficient detail" check is not shown until complete, so it is not streamed.
+    task_sufficient = asyncio.create_task(
+        llm.get_completion(
+            messages=prompts.make_sufficient_prompt(code, error, issue, context_str),
+            tag=CallTag('sufficient', query_id=query_id),
+        )
+    )
+
+    try:
+        stream = await llm.stream_completion(
+            messages=prompts.make_main_prompt(code, error, issue, context_str),
+            tag=CallTag('main', query_id=query_id),
+        )
+        async for delta in stream:
+            result.main_text += delta
+            yield 'delta', delta
+        assert stream.response is not None
+        response_main, response_txt = stream.response, stream.text
+        result.responses.append(response_main)
+
+        if _needs_cleanup(response_txt):
+            # That's probably too much code.  Let's clean it up...
+            yield 'reset', ''
+            result.main_text = ""
+            cleanup_prompt = prompts.make_cleanup_prompt(response_text=response_txt)
+            stream = await llm.stream_completion(prompt=cleanup_prompt, tag=CallTag('cleanup', query_id=query_id))
+            async for delta in stream:
+                result.main_text += delta
+                yield 'delta', delta
+            assert stream.response is not None
+            result.responses.append(stream.response)
+            response_txt = stream.text
+
+        response_sufficient, response_sufficient_txt = await task_sufficient
+        result.responses.append(response_sufficient)
+
+        result.texts = _make_response_texts(response_main, response_txt, response_sufficient_txt)
+
+    finally:
+        task_sufficient.cancel()  # no effect if already complete
+
+
+async def run_query(llm: LLM, context: ContextConfig | None, code: str, error: str, issue: str) -> int:
+    query_id = await record_query(context, code, error, issue)
+
+    context_str = context.prompt_str() if context is not None else None
+    responses, texts = await run_async(run_query_prompts(llm, context_str, code, error, issue, query_id=query_id))
 
     record_response(query_id, responses, texts)
 
     return query_id
 
 
-def record_query(context: ContextConfig | None, code: str, error: str, issue: str) -> int:
+def _run_query_job(payload: dict[str, Any]) -> None:
+    ''' Generate and record the response to a query submitted with BACKGROUND_QUERIES (see gened/jobs.py). '''
+    query_id = payload['query_id']
     db = get_db()
-    auth = get_auth()
-    role_id = auth.cur_class.role_id if auth.cur_class else None
+    query_row = db.execute("""
+        SELECT queries.code, queries.error, queries.issue, queries.response_text, context_strings.ctx_str
+        FROM queries
+        LEFT JOIN context_strings ON context_strings.id = queries.context_string_id
+        WHERE queries.id = ?
+    """, [query_id]).fetchone()
+    if query_row is None:
+        return  # deleted since it was submitted
+    if query_row['response_text'] is not None:
+        return  # already answered, e.g. by an earlier run of this job that lost its lease
+
+    llm = get_job_llm(payload['class_id'])
+    responses, texts = run_sync(run_query_prompts(llm, query_row['ctx_str'], query_row['code'], query_row['error'], query_row['issue'], query_id=query_id))
 
-    if context is not None:
-        context_name = context.name
-        context_str = context.prompt_str()
-        context_string_id = record_context_string(context_str)
-    else:
-        context_name = None
-        context_string_id = None
+    record_response(query_id, responses, texts)
 
-    cur = db.execute(
-        "INSERT INTO queries (context_name, context_string_id, code, error, issue, user_id, role_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
-        [context_name, context_string_id, code, error, issue, auth.user_id, role_id]
-    )
-    new_row_id = cur.lastrowid
-    db.commit()
 
-    assert new_row_id is not None
+register_job_handler('codehelp_query', _run_query_job)
 
-    return new_row_id
 
+async def record_query(context: ContextConfig | None, code: str, error: str, issue: str) -> int:
+    auth = get_auth()
+    user_id = auth.user_id
+    role_id = auth.cur_class.role_id if auth.cur_class else None
+    context_name = context.name if context is not None else None
+    context_str = context.prompt_str() if context is not None else None
 
-def record_response(query_id: int, responses: list[dict[str, str]], texts: dict[str, str]) -> None:
-    db = get_db()
+    def insert_query(db: Connection) -> int:
+        context_string_id = record_context_string(context_str, db) if context_str is not None else None
+        cur = db.execute(
+            "INSERT INTO queries (context_name, context_string_id, code, error, issue, user_id, role_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [context_name, context_string_id, code, error, issue, user_id, role_id]
+        )
+        assert cur.lastrowid is not None
+        return cur.lastrowid
 
-    db.execute(
-        "UPDATE queries SET response_json=?, response_text=? WHERE id=?",
-        [json.dumps(responses), json.dumps(texts), query_id]
-    )
-    db.commit()
+    return await write_async(insert_query)
+
+
+def record_response(query_id: int, responses: list[dict[str, str]], texts: dict[str, str]) -> None:
+    # committed by the end of the request (or job); see gened.db_writer
+    queue_write(lambda db: save_responses(db, query_id, responses, texts))
 
 
 @bp.route("/request", methods=["POST"])
+@async_view
 @login_required
 @class_enabled_required
 @with_llm(spend_token=True)
-def help_request(llm: LLM) -> Response:
+async def help_request(llm: LLM) -> Response:
     if 'context' in request.form:
         context = get_context_by_name(request.form['context'])
         if context is None:
@@ -243,33 +361,85 @@ def help_request(llm: LLM) -> Response:
 
     # TODO: limit length of code/error/issue
 
-    query_id = run_query(llm, context, code, error, issue)
+    if current_app.config['STREAMING_RESPONSES']:
+        # The response will be generated and streamed by help_stream(), requested by the help_view page.
+        query_id = await record_query(context, code, error, issue)
+    elif current_app.config['BACKGROUND_QUERIES']:
+        # The response will be generated by a background job; the help_view page waits for it.
+        query_id = await record_query(context, code, error, issue)
+        enqueue_job('codehelp_query', {'query_id': query_id, 'class_id': llm.class_id}, ref=f"query:{query_id}")
+    else:
+        query_id = await run_query(llm, context, code, error, issue)
 
     return redirect(url_for(".help_view", query_id=query_id))
 
 
-@bp.route("/load_test", methods=["POST"])
-@admin_required
-@with_llm(use_system_key=True)  # get a populated LLM; not actually used (API is mocked)
-def load_test(llm: LLM) -> Response:
-    # Require that we're logged in as the load_test admin user
+# A query's response can be streamed by the user who submitted it, shortly after
+# it is submitted; after that, a missing response is treated as an error.
+
+def _is_streamable(query_id: int) -> bool:
+    db = get_db()
     auth = get_auth()
-    if auth.user is None or auth.user.display_name != 'load_test':
-        return abort(403)
+    row = db.execute(
+        "SELECT 1 FROM queries WHERE id=? AND user_id=? AND response_json IS NULL AND query_time > datetime('now', '-5 minutes')",
+        [query_id, auth.user_id]
+    ).fetchone()
+    return row is not None
 
-    context = ContextConfig(name="__LOADTEST_Context")
-    code = "__LOADTEST_Code"
-    error = "__LOADTEST_Error"
-    issue = "__LOADTEST_Issue"
 
-    # Monkey-patch to not call the API but simulate it with a delay
-    with patch("openai.resources.chat.AsyncCompletions.create") as mocked:
-        # simulate a 2 second delay for a network request
-        mocked.side_effect = mock_async_completion(delay=2.0)
+async def _claim_streamable_query(query_id: int) -> bool:
+    '''Mark a streamable query as in progress, so its response is only generated once.'''
+    auth = get_auth()
+    user_id = auth.user_id
+    return await write_async(lambda db: db.execute(
+        "UPDATE queries SET response_json='[]' WHERE id=? AND user_id=? AND response_json IS NULL AND query_time > datetime('now', '-5 minutes')",
+        [query_id, user_id]
+    ).rowcount == 1)
 
-        query_id = run_query(llm, context, code, error, issue)
 
-    return redirect(url_for(".help_view", query_id=query_id))
+@bp.route("/stream/<int:query_id>")
+@async_view
+@login_required
+@class_enabled_required
+@with_llm(spend_token=False, check_tokens=False)  # a token was spent when the query was submitted
+async def help_stream(llm: LLM, query_id: int) -> Response:
+    ''' Generate the response to a recently-submitted query, streamed as Server-Sent Events.
+
+    Events: 'delta' and 'reset' (see stream_query_prompts()), then 'done' once
+    the response has been recorded.  If the query is not streamable (e.g.,
+    it already has a response), 'done' is sent immediately.
+    '''
+    async def generate() -> AsyncIterator[str]:
+        try:
+            query_row = get_query(query_id)
+        except DataAccessError:
+            query_row = None
+
+        if query_row is None or not await _claim_streamable_query(query_id):
+            yield sse_event('done')
+            return
+
+        # use the context string recorded with the query
+        context_str = get_context_string_by_id(query_row['context_string_id']) if query_row['context_string_id'] else None
+        result = StreamedQueryResult()
+
+        try:
+            async for event, text in iter_async(stream_query_prompts(llm, context_str, query_row['code'], query_row['error'], query_row['issue'], result=result, query_id=query_id)):
+                yield sse_event(event, text)
+        finally:
+            # Record whatever we have, even if the client disconnected or an error occurred
+            if result.texts is not None:
+                texts = result.texts
+            else:
+                texts = {'error': "*The response was interrupted before it was complete.  Please try again.*"}
+                if result.main_text:
+                    texts['main'] = result.main_text
+            record_response(query_id, result.responses, texts)
+
+        await flush_writes_async()  # 'done' tells the page to reload, showing the recorded response
+        yield sse_event('done')
+
+    return sse_response(generate())
 
 
 @bp.route("/post_helpful", methods=["POST"])
@@ -286,11 +456,12 @@ def post_helpful() -> str:
 
 
 @bp.route("/topics/html/<int:query_id>", methods=["GET", "POST"])
+@async_view
 @login_required
 @tester_required
 @with_llm(spend_token=False)
-def get_topics_html(llm: LLM, query_id: int) -> str:
-    topics = get_topics(llm, query_id)
+async def get_topics_html(llm: LLM, query_id: int) -> str:
+    topics = await get_topics(llm, query_id)
     if not topics:
         return render_template("topics_fragment.html", error=True)
     else:
@@ -298,15 +469,16 @@ def get_topics_html(llm: LLM, query_id: int) -> str:
 
 
 @bp.route("/topics/raw/<int:query_id>", methods=["GET", "POST"])
+@async_view
 @login_required
 @tester_required
 @with_llm(spend_token=False)
-def get_topics_raw(llm: LLM, query_id: int) -> list[str]:
-    topics = get_topics(llm, query_id)
+async def get_topics_raw(llm: LLM, query_id: int) -> list[str]:
+    topics = await get_topics(llm, query_id)
     return topics
 
 
-def get_topics(llm: LLM, query_id: int) -> list[str]:
+async def get_topics(llm: LLM, query_id: int) -> list[str]:
     try:
         query_row = get_query(query_id)
     except DataAccessError:
@@ -329,7 +501,7 @@ def get_topics(llm: LLM, query_id: int) -> list[str]:
         responses['main']
     )
 
-    response, response_txt = asyncio.run(llm.get_completion(messages=messages))
+    response, response_txt = await run_async(llm.get_completion(messages=messages, tag=CallTag('topics', query_id=query_id)))
 
     # Verify it is actually JSON
     # May be "Error (..." if an API error occurs, or every now and then may get "Here is the JSON: ..." or similar.
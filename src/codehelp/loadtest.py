@@ -0,0 +1,361 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""A load-test driver for a running CodeHelp instance (`flask loadtest`).
+
+The driver creates synthetic users (local-auth, named __LOADTEST_User_<n>) in
+synthetic user classes (__LOADTEST_Class_<n>) with the tutor enabled, then runs
+concurrent "virtual users" against the instance over HTTP.  Each logs in and
+runs sessions that mirror normal use:
+
+  help_form -> help_request -> help_view [-> help_stream | -> help_status... -> help_view]
+  -> tutor_create -> tutor_view [-> tutor_stream]
+  -> tutor_message -> tutor_view [-> tutor_stream]
+
+Every request is timed, and the report gives throughput and latency
+percentiles per endpoint.  Results can be written as JSON, along with the
+parameters, the mock LLM configuration, and the git commit, for comparison
+across commits.
+
+The instance under test should use the mock LLM provider (MOCK_LLM; see
+gened/mock_llm.py) so that LLM latency is simulated consistently and no real
+API is called.  Run the command with the same instance folder and
+configuration as the server, so the synthetic users and classes are created
+in its database and the report records the mock settings it is using.
+"""
+
+import datetime as dt
+import json
+import re
+import secrets
+import subprocess
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import asdict, dataclass, field
+from http.cookies import SimpleCookie
+from pathlib import Path
+from typing import Any
+
+import click
+import httpx
+from flask import Flask, current_app
+from werkzeug.security import generate_password_hash
+
+from gened.classes import create_user_class
+from gened.db import AUTH_PROVIDER_LOCAL, get_db
+from gened.mock_llm import MockLLMConfig
+
+USER_PREFIX = "__LOADTEST_User_"
+CLASS_PREFIX = "__LOADTEST_Class_"
+
+_EXPERIMENT = "chats_experiment"  # enables the tutor in a class
+
+# Synthetic query/message contents
+_CODE = "def mean(nums):\n    return sum(nums) / len(nums)\n\nprint(mean([]))"
+_ERROR = "ZeroDivisionError: division by zero"
+_ISSUE = "Why does my function crash when the list is empty?"
+_TOPIC = "How do Python lists work?"
+_MESSAGE = "Can you explain that with a small example?"
+
+_POLL_INTERVAL = 0.5  # seconds between polls for a background query's completion
+_MAX_POLLS = 600
+
+
+@dataclass(frozen=True)
+class LoadTestParams:
+    users: int = 10       # concurrent virtual users
+    classes: int = 2      # classes the users are spread across
+    sessions: int = 5     # sessions run by each user
+    streaming: bool = False  # whether the instance streams responses (STREAMING_RESPONSES)
+    background: bool = False  # whether the instance generates query responses in the background (BACKGROUND_QUERIES)
+
+
+@dataclass(frozen=True)
+class Sample:
+    endpoint: str
+    seconds: float
+    ok: bool
+
+
+@dataclass
+class Results:
+    samples: list[Sample] = field(default_factory=list)
+    sessions: int = 0
+    failed_sessions: int = 0
+    elapsed: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, sample: Sample) -> None:
+        with self._lock:
+            self.samples.append(sample)
+
+    def end_session(self, *, ok: bool) -> None:
+        with self._lock:
+            self.sessions += 1
+            if not ok:
+                self.failed_sessions += 1
+
+
+def setup_users(params: LoadTestParams, password: str) -> list[str]:
+    """Create (or reuse) the synthetic users and classes, setting each user's password.
+
+    Returns the users' usernames.
+    """
+    db = get_db()
+    password_hash = generate_password_hash(password)
+
+    usernames = []
+    for i in range(params.users):
+        username = f"{USER_PREFIX}{i}"
+        row = db.execute("SELECT user_id FROM auth_local WHERE username=?", [username]).fetchone()
+        if row:
+            db.execute("UPDATE auth_local SET password=? WHERE user_id=?", [password_hash, row['user_id']])
+        else:
+            cur = db.execute("INSERT INTO users(auth_provider, auth_name, query_tokens) VALUES(?, ?, 0)",
+                             [AUTH_PROVIDER_LOCAL, username])
+            db.execute("INSERT INTO auth_local(user_id, username, password) VALUES(?, ?, ?)",
+                       [cur.lastrowid, username, password_hash])
+        usernames.append(username)
+    db.commit()
+
+    db.execute("INSERT OR IGNORE INTO experiments(name, description) VALUES(?, ?)", [_EXPERIMENT, "Experimental tutor chats feature."])
+    experiment_id = db.execute("SELECT id FROM experiments WHERE name=?", [_EXPERIMENT]).fetchone()['id']
+
+    user_ids = [
+        db.execute("SELECT user_id FROM auth_local WHERE username=?", [username]).fetchone()['user_id']
+        for username in usernames
+    ]
+    for c in range(params.classes):
+        class_name = f"{CLASS_PREFIX}{c}"
+        members = user_ids[c::params.classes]
+        if not members:
+            continue
+        row = db.execute("SELECT id FROM classes WHERE name=?", [class_name]).fetchone()
+        # the first member creates the class (as its instructor); the rest join as students
+        class_id = row['id'] if row else create_user_class(members[0], class_name, "loadtest")
+        db.execute("INSERT OR IGNORE INTO experiment_class(experiment_id, class_id) VALUES(?, ?)", [experiment_id, class_id])
+        for user_id in members:
+            db.execute("INSERT OR IGNORE INTO roles(user_id, class_id, role) VALUES(?, ?, 'student')", [user_id, class_id])
+            db.execute("UPDATE users SET last_class_id=? WHERE id=?", [class_id, user_id])
+    db.commit()
+
+    return usernames
+
+
+class SessionFailedError(Exception):
+    """A session could not continue; raised with the endpoint that failed."""
+
+
+class VirtualUser:
+    """A user making requests with its own connection and session cookie.
+
+    Cookies are tracked manually: the session cookie is marked Secure, and
+    httpx would not send it back to a plain-HTTP test instance.
+    """
+    def __init__(self, client: httpx.Client, results: Results) -> None:
+        self._client = client
+        self._results = results
+        self._cookies: dict[str, str] = {}
+
+    def request(self, endpoint: str, method: str, url: str, *, data: dict[str, str] | None = None, redirect: bool = False) -> httpx.Response:
+        """Make a request, timing it (including reading the full body) as the given endpoint.
+
+        If `redirect` is True, a redirect is the expected response.  Raises
+        SessionFailedError for any unexpected response.
+        """
+        headers = {'Cookie': "; ".join(f"{name}={value}" for name, value in self._cookies.items())} if self._cookies else {}
+        start = time.perf_counter()
+        try:
+            response = self._client.request(method, url, data=data, headers=headers)
+            response.read()
+        except httpx.HTTPError as e:
+            self._results.add(Sample(endpoint, time.perf_counter() - start, ok=False))
+            raise SessionFailedError(endpoint) from e
+        elapsed = time.perf_counter() - start
+
+        for header in response.headers.get_list('set-cookie'):
+            cookie: SimpleCookie = SimpleCookie(header)
+            self._cookies.update({name: morsel.value for name, morsel in cookie.items()})
+
+        ok = response.is_redirect if redirect else response.status_code == 200  # noqa: PLR2004 (HTTP OK)
+        self._results.add(Sample(endpoint, elapsed, ok))
+        if not ok:
+            raise SessionFailedError(endpoint)
+        return response
+
+    def login(self, username: str, password: str) -> None:
+        response = self.request('login', 'POST', "/auth/local_login", data={'username': username, 'password': password}, redirect=True)
+        if "/auth/login" in response.headers['location']:
+            raise SessionFailedError('login')
+
+    def _follow(self, endpoint: str, response: httpx.Response, pattern: str) -> int:
+        """Follow a redirect to a newly-created item's page, returning the item's id."""
+        location = response.headers['location']
+        match = re.search(pattern, location)
+        if not match:
+            raise SessionFailedError(endpoint)
+        self.request(endpoint, 'GET', location)
+        return int(match.group(1))
+
+    def _wait_for_query(self, query_id: int) -> None:
+        for _ in range(_MAX_POLLS):
+            if self.request('help_status', 'GET', f"/help/status/{query_id}").json()['done']:
+                self.request('help_view', 'GET', f"/help/view/{query_id}")
+                return
+            time.sleep(_POLL_INTERVAL)
+        raise SessionFailedError('help_status')
+
+    def run_session(self, *, streaming: bool, background: bool) -> None:
+        self.request('help_form', 'GET', "/help/")
+        response = self.request('help_request', 'POST', "/help/request", data={'code': _CODE, 'error': _ERROR, 'issue': _ISSUE}, redirect=True)
+        query_id = self._follow('help_view', response, r"/help/view/(\d+)")
+        if streaming:
+            self.request('help_stream', 'GET', f"/help/stream/{query_id}")
+        elif background:
+            self._wait_for_query(query_id)
+
+        response = self.request('tutor_create', 'POST', "/tutor/chat/create", data={'topic': _TOPIC}, redirect=True)
+        chat_id = self._follow('tutor_view', response, r"/tutor/chat/(\d+)")
+        if streaming:
+            self.request('tutor_stream', 'GET', f"/tutor/stream/{chat_id}")
+
+        response = self.request('tutor_message', 'POST', "/tutor/message", data={'id': str(chat_id), 'message': _MESSAGE}, redirect=True)
+        self._follow('tutor_view', response, r"/tutor/chat/(\d+)")
+        if streaming:
+            self.request('tutor_stream', 'GET', f"/tutor/stream/{chat_id}")
+
+
+def run_load_test(params: LoadTestParams, usernames: list[str], password: str, make_client: Callable[[], httpx.Client]) -> Results:
+    """Run params.sessions sessions for each user, all users concurrently (one thread each)."""
+    results = Results()
+
+    def run_user(username: str) -> None:
+        with make_client() as client:
+            user = VirtualUser(client, results)
+            try:
+                user.login(username, password)
+            except SessionFailedError:
+                return
+            for _ in range(params.sessions):
+                try:
+                    user.run_session(streaming=params.streaming, background=params.background)
+                    results.end_session(ok=True)
+                except SessionFailedError:
+                    results.end_session(ok=False)
+
+    threads = [threading.Thread(target=run_user, args=(username,), daemon=True) for username in usernames]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.elapsed = time.perf_counter() - start
+
+    return results
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Get the q-th quantile (0-1) of the given sorted values (nearest-rank)."""
+    return sorted_values[min(len(sorted_values) - 1, max(0, int(q * len(sorted_values) + 0.5) - 1))]
+
+
+def summarize(results: Results) -> dict[str, Any]:
+    """Summarize results as overall throughput and per-endpoint counts and latencies (in ms)."""
+    by_endpoint: dict[str, list[Sample]] = {}
+    for sample in results.samples:
+        by_endpoint.setdefault(sample.endpoint, []).append(sample)
+
+    endpoints = {}
+    for endpoint, samples in by_endpoint.items():
+        latencies = sorted(sample.seconds * 1000 for sample in samples if sample.ok)
+        endpoints[endpoint] = {
+            'count': len(samples),
+            'errors': sum(not sample.ok for sample in samples),
+            'rps': len(samples) / results.elapsed if results.elapsed else 0.0,
+        } | ({
+            'p50_ms': round(percentile(latencies, 0.50), 1),
+            'p95_ms': round(percentile(latencies, 0.95), 1),
+            'p99_ms': round(percentile(latencies, 0.99), 1),
+            'max_ms': round(latencies[-1], 1),
+        } if latencies else {})
+
+    return {
+        'elapsed_s': round(results.elapsed, 3),
+        'requests': len(results.samples),
+        'errors': sum(not sample.ok for sample in results.samples),
+        'rps': len(results.samples) / results.elapsed if results.elapsed else 0.0,
+        'sessions': results.sessions,
+        'failed_sessions': results.failed_sessions,
+        'endpoints': endpoints,
+    }
+
+
+def format_report(summary: dict[str, Any]) -> str:
+    lines = [
+        f"{'endpoint':<14} {'count':>7} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}",
+    ]
+    for endpoint, stats in summary['endpoints'].items():
+        lines.append(
+            f"{endpoint:<14} {stats['count']:>7} {stats['errors']:>7} {stats['rps']:>8.2f}"
+            + "".join(f" {stats.get(key, float('nan')):>9.1f}" for key in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms'))
+        )
+    lines.append(
+        f"\n{summary['requests']} requests ({summary['errors']} errors) in {summary['elapsed_s']:.1f}s: {summary['rps']:.2f} req/s;"
+        f" {summary['sessions']} sessions ({summary['failed_sessions']} failed)"
+    )
+    return "\n".join(lines)
+
+
+def _git_commit() -> str | None:
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=Path(__file__).parent)  # noqa: S607 (git from PATH)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+@click.command('loadtest')
+@click.option('--url', default="http://127.0.0.1:5000", help="Base URL of the running instance.")
+@click.option('--users', default=LoadTestParams.users, help="Number of concurrent virtual users.")
+@click.option('--classes', default=LoadTestParams.classes, help="Number of classes to spread the users across.")
+@click.option('--sessions', default=LoadTestParams.sessions, help="Number of sessions run by each user.")
+@click.option('--output', type=click.Path(dir_okay=False, path_type=Path), help="Write the results to this file as JSON.")
+def loadtest_command(url: str, users: int, classes: int, sessions: int, output: Path | None) -> None:
+    """Drive synthetic user sessions against a running instance and report latencies per endpoint."""
+    config = current_app.config
+    if not config['MOCK_LLM']:
+        click.secho("Warning: MOCK_LLM is not set; the instance may call a real LLM API.", fg='yellow')
+
+    params = LoadTestParams(
+        users=users,
+        classes=classes,
+        sessions=sessions,
+        streaming=config['STREAMING_RESPONSES'],
+        background=config['BACKGROUND_QUERIES'],
+    )
+    password = secrets.token_urlsafe(12)
+    usernames = setup_users(params, password)
+    click.echo(f"Running {sessions} sessions for each of {users} users in {classes} classes against {url}...")
+
+    results = run_load_test(params, usernames, password, lambda: httpx.Client(base_url=url, timeout=120))
+    summary = summarize(results)
+    click.echo(format_report(summary))
+
+    if output:
+        report = {
+            'timestamp': dt.datetime.now(dt.UTC).isoformat(),
+            'commit': _git_commit(),
+            'url': url,
+            'params': asdict(params),
+            'mock_llm': config['MOCK_LLM'],
+            'mock_config': asdict(MockLLMConfig.from_app_config()),
+            'results': summary,
+        }
+        output.write_text(json.dumps(report, indent=2))
+        click.echo(f"Results written to {output}")
+
+
+def init_app(app: Flask) -> None:
+    app.cli.add_command(loadtest_command)
@@ -0,0 +1,10 @@
+-- SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+--
+-- SPDX-License-Identifier: AGPL-3.0-only
+
+BEGIN;
+
+-- Claims on chats' streamed responses (see tutor.chat_stream())
+ALTER TABLE chats ADD COLUMN responding_since DATETIME;
+
+COMMIT;
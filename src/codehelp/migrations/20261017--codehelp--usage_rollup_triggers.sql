@@ -0,0 +1,97 @@
+-- SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+--
+-- SPDX-License-Identifier: AGPL-3.0-only
+
+BEGIN;
+
+-- Usage of the app, one row per query, for the usage rollups (see gened/usage.py)
+DROP VIEW IF EXISTS usage_events;
+CREATE VIEW usage_events AS
+SELECT
+    queries.id,
+    queries.user_id,
+    queries.role_id,
+    roles.class_id,
+    classes_lti.lti_consumer_id AS consumer_id,
+    date(queries.query_time) AS day,
+    CASE WHEN json_valid(queries.response_json) THEN json_extract(queries.response_json, '$[0].error') IS NOT NULL ELSE 0 END AS error,
+    CASE WHEN json_valid(queries.response_text) THEN json_extract(queries.response_text, '$.insufficient') IS NOT NULL ELSE 0 END AS insufficient
+FROM queries
+LEFT JOIN roles ON roles.id=queries.role_id
+LEFT JOIN classes_lti ON classes_lti.class_id=roles.class_id
+;
+
+-- Keep the usage rollups up to date: a query is added to them when inserted,
+-- removed before it is deleted, and removed and re-added around an update
+-- that may change how it is counted.
+CREATE TRIGGER queries_usage_insert AFTER INSERT ON queries
+BEGIN
+    INSERT INTO usage_user_daily (user_id, day, queries, errors, insufficient)
+        SELECT user_id, day, 1, error, insufficient FROM usage_events WHERE id=NEW.id
+        ON CONFLICT DO UPDATE SET queries=queries+1, errors=errors+excluded.errors, insufficient=insufficient+excluded.insufficient;
+    INSERT INTO usage_role_daily (role_id, day, queries, errors, insufficient)
+        SELECT role_id, day, 1, error, insufficient FROM usage_events WHERE id=NEW.id AND role_id IS NOT NULL
+        ON CONFLICT DO UPDATE SET queries=queries+1, errors=errors+excluded.errors, insufficient=insufficient+excluded.insufficient;
+    INSERT INTO usage_class_daily (class_id, day, queries, errors, insufficient)
+        SELECT class_id, day, 1, error, insufficient FROM usage_events WHERE id=NEW.id AND class_id IS NOT NULL
+        ON CONFLICT DO UPDATE SET queries=queries+1, errors=errors+excluded.errors, insufficient=insufficient+excluded.insufficient;
+    INSERT INTO usage_consumer_daily (consumer_id, day, queries, errors, insufficient)
+        SELECT consumer_id, day, 1, error, insufficient FROM usage_events WHERE id=NEW.id AND consumer_id IS NOT NULL
+        ON CONFLICT DO UPDATE SET queries=queries+1, errors=errors+excluded.errors, insufficient=insufficient+excluded.insufficient;
+END;
+
+CREATE TRIGGER queries_usage_delete BEFORE DELETE ON queries
+BEGIN
+    UPDATE usage_user_daily SET queries=queries-1, errors=errors-ev.error, insufficient=usage_user_daily.insufficient-ev.insufficient
+        FROM (SELECT * FROM usage_events WHERE id=OLD.id) AS ev WHERE usage_user_daily.user_id=ev.user_id AND usage_user_daily.day=ev.day;
+    UPDATE usage_role_daily SET queries=queries-1, errors=errors-ev.error, insufficient=usage_role_daily.insufficient-ev.insufficient
+        FROM (SELECT * FROM usage_events WHERE id=OLD.id) AS ev WHERE usage_role_daily.role_id=ev.role_id AND usage_role_daily.day=ev.day;
+    UPDATE usage_class_daily SET queries=queries-1, errors=errors-ev.error, insufficient=usage_class_daily.insufficient-ev.insufficient
+        FROM (SELECT * FROM usage_events WHERE id=OLD.id) AS ev WHERE usage_class_daily.class_id=ev.class_id AND usage_class_daily.day=ev.day;
+    UPDATE usage_consumer_daily SET queries=queries-1, errors=errors-ev.error, insufficient=usage_consumer_daily.insufficient-ev.insufficient
+        FROM (SELECT * FROM usage_events WHERE id=OLD.id) AS ev WHERE usage_consumer_daily.consumer_id=ev.consumer_id AND usage_consumer_daily.day=ev.day;
+END;
+
+CREATE TRIGGER queries_usage_update_before BEFORE UPDATE OF query_time, user_id, role_id, response_json, response_text ON queries
+BEGIN
+    UPDATE usage_user_daily SET queries=queries-1, errors=errors-ev.error, insufficient=usage_user_daily.insufficient-ev.insufficient
+        FROM (SELECT * FROM usage_events WHERE id=OLD.id) AS ev WHERE usage_user_daily.user_id=ev.user_id AND usage_user_daily.day=ev.day;
+    UPDATE usage_role_daily SET queries=queries-1, errors=errors-ev.error, insufficient=usage_role_daily.insufficient-ev.insufficient
+        FROM (SELECT * FROM usage_events WHERE id=OLD.id) AS ev WHERE usage_role_daily.role_id=ev.role_id AND usage_role_daily.day=ev.day;
+    UPDATE usage_class_daily SET queries=queries-1, errors=errors-ev.error, insufficient=usage_class_daily.insufficient-ev.insufficient
+        FROM (SELECT * FROM usage_events WHERE id=OLD.id) AS ev WHERE usage_class_daily.class_id=ev.class_id AND usage_class_daily.day=ev.day;
+    UPDATE usage_consumer_daily SET queries=queries-1, errors=errors-ev.error, insufficient=usage_consumer_daily.insufficient-ev.insufficient
+        FROM (SELECT * FROM usage_events WHERE id=OLD.id) AS ev WHERE usage_consumer_daily.consumer_id=ev.consumer_id AND usage_consumer_daily.day=ev.day;
+END;
+
+CREATE TRIGGER queries_usage_update_after AFTER UPDATE OF query_time, user_id, role_id, response_json, response_text ON queries
+BEGIN
+    INSERT INTO usage_user_daily (user_id, day, queries, errors, insufficient)
+        SELECT user_id, day, 1, error, insufficient FROM usage_events WHERE id=NEW.id
+        ON CONFLICT DO UPDATE SET queries=queries+1, errors=errors+excluded.errors, insufficient=insufficient+excluded.insufficient;
+    INSERT INTO usage_role_daily (role_id, day, queries, errors, insufficient)
+        SELECT role_id, day, 1, error, insufficient FROM usage_events WHERE id=NEW.id AND role_id IS NOT NULL
+        ON CONFLICT DO UPDATE SET queries=queries+1, errors=errors+excluded.errors, insufficient=insufficient+excluded.insufficient;
+    INSERT INTO usage_class_daily (class_id, day, queries, errors, insufficient)
+        SELECT class_id, day, 1, error, insufficient FROM usage_events WHERE id=NEW.id AND class_id IS NOT NULL
+        ON CONFLICT DO UPDATE SET queries=queries+1, errors=errors+excluded.errors, insufficient=insufficient+excluded.insufficient;
+    INSERT INTO usage_consumer_daily (consumer_id, day, queries, errors, insufficient)
+        SELECT consumer_id, day, 1, error, insufficient FROM usage_events WHERE id=NEW.id AND consumer_id IS NOT NULL
+        ON CONFLICT DO UPDATE SET queries=queries+1, errors=errors+excluded.errors, insufficient=insufficient+excluded.insufficient;
+END;
+
+-- Backfill the rollups from existing queries (as `flask usage-rollups rebuild`)
+DELETE FROM usage_user_daily;
+INSERT INTO usage_user_daily (user_id, day, queries, errors, insufficient)
+    SELECT user_id, day, COUNT(*), SUM(error), SUM(insufficient) FROM usage_events WHERE user_id IS NOT NULL GROUP BY user_id, day;
+DELETE FROM usage_role_daily;
+INSERT INTO usage_role_daily (role_id, day, queries, errors, insufficient)
+    SELECT role_id, day, COUNT(*), SUM(error), SUM(insufficient) FROM usage_events WHERE role_id IS NOT NULL GROUP BY role_id, day;
+DELETE FROM usage_class_daily;
+INSERT INTO usage_class_daily (class_id, day, queries, errors, insufficient)
+    SELECT class_id, day, COUNT(*), SUM(error), SUM(insufficient) FROM usage_events WHERE class_id IS NOT NULL GROUP BY class_id, day;
+DELETE FROM usage_consumer_daily;
+INSERT INTO usage_consumer_daily (consumer_id, day, queries, errors, insufficient)
+    SELECT consumer_id, day, COUNT(*), SUM(error), SUM(insufficient) FROM usage_events WHERE consumer_id IS NOT NULL GROUP BY consumer_id, day;
+
+COMMIT;
@@ -0,0 +1,36 @@
+-- SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+--
+-- SPDX-License-Identifier: AGPL-3.0-only
+
+BEGIN;
+
+-- Keep users' last activity times up to date (see the user_activity view)
+CREATE TRIGGER queries_activity_insert AFTER INSERT ON queries
+BEGIN
+    UPDATE users SET last_query_time=NEW.query_time
+        WHERE id=NEW.user_id AND (last_query_time IS NULL OR last_query_time < NEW.query_time);
+    UPDATE users SET last_instructor_activity=NEW.query_time
+        WHERE id IN (
+            SELECT r_inst.user_id
+            FROM roles AS r_student
+            JOIN roles AS r_inst ON r_inst.class_id=r_student.class_id
+            WHERE r_student.id=NEW.role_id
+              AND r_inst.role='instructor'
+        )
+        AND (last_instructor_activity IS NULL OR last_instructor_activity < NEW.query_time);
+END;
+
+-- Backfill from existing queries
+UPDATE users SET last_query_time=(
+    SELECT MAX(queries.query_time) FROM queries WHERE queries.user_id=users.id
+);
+UPDATE users SET last_instructor_activity=(
+    SELECT MAX(queries.query_time)
+    FROM roles AS r_inst
+    JOIN roles AS r_student ON r_student.class_id=r_inst.class_id
+    JOIN queries ON queries.role_id=r_student.id
+    WHERE r_inst.user_id=users.id
+      AND r_inst.role='instructor'
+);
+
+COMMIT;
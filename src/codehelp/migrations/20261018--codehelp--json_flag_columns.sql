@@ -0,0 +1,47 @@
+-- SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+--
+-- SPDX-License-Identifier: AGPL-3.0-only
+
+BEGIN;
+
+-- Flags read by the usage rollups and charts, so the JSON is not parsed on every read.
+-- (ALTER TABLE can only add VIRTUAL generated columns; the index below stores their values.)
+ALTER TABLE queries ADD COLUMN has_error BOOLEAN GENERATED ALWAYS AS (CASE WHEN json_valid(response_json) THEN json_extract(response_json, '$[0].error') IS NOT NULL ELSE 0 END) VIRTUAL;
+ALTER TABLE queries ADD COLUMN is_insufficient BOOLEAN GENERATED ALWAYS AS (CASE WHEN json_valid(response_text) THEN json_extract(response_text, '$.insufficient') IS NOT NULL ELSE 0 END) VIRTUAL;
+CREATE INDEX queries_by_time_flags ON queries(query_time, has_error, is_insufficient);
+
+DROP VIEW IF EXISTS usage_events;
+CREATE VIEW usage_events AS
+SELECT
+    queries.id,
+    queries.user_id,
+    queries.role_id,
+    roles.class_id,
+    classes_lti.lti_consumer_id AS consumer_id,
+    date(queries.query_time) AS day,
+    queries.has_error AS error,
+    queries.is_insufficient AS insufficient
+FROM queries
+LEFT JOIN roles ON roles.id=queries.role_id
+LEFT JOIN classes_lti ON classes_lti.class_id=roles.class_id
+;
+
+-- A generated column cannot use json_each(), so user_message_count is kept
+-- up to date by triggers whenever chat_json is written.
+ALTER TABLE chats ADD COLUMN user_message_count INTEGER NOT NULL DEFAULT 0;
+CREATE TRIGGER chats_user_messages_insert AFTER INSERT ON chats
+BEGIN
+    UPDATE chats SET user_message_count=(
+        CASE WHEN json_valid(NEW.chat_json) THEN (SELECT COUNT(*) FROM json_each(NEW.chat_json) WHERE json_extract(json_each.value, '$.role')='user') ELSE 0 END
+    ) WHERE id=NEW.id;
+END;
+CREATE TRIGGER chats_user_messages_update AFTER UPDATE OF chat_json ON chats
+BEGIN
+    UPDATE chats SET user_message_count=(
+        CASE WHEN json_valid(NEW.chat_json) THEN (SELECT COUNT(*) FROM json_each(NEW.chat_json) WHERE json_extract(json_each.value, '$.role')='user') ELSE 0 END
+    ) WHERE id=NEW.id;
+END;
+-- Backfill existing chats (through the update trigger)
+UPDATE chats SET chat_json=chat_json;
+
+COMMIT;
@@ -7,6 +7,9 @@ from sqlite3 import Cursor
 from gened.app_data import (
     ChartData,
     Filters,
+    TableQuery,
+    class_joins,
+    query_rows,
     register_admin_chart,
     register_data,
 )
@@ -14,14 +17,74 @@ from gened.db import get_db
 from gened.tables import Col, DataTable, NumCol, ResponseCol, TimeCol, UserCol
 
 
+def _usage_source(filters: Filters) -> str:
+    """Choose the smallest usage rollup table that can be filtered by all of the given filters, joined to the tables the filters refer to."""
+    names = {f.spec.name for f in filters}
+    if 'role' in names or ('user' in names and names & {'class', 'consumer'}):
+        return """
+            usage_role_daily AS usage
+            JOIN roles ON roles.id=usage.role_id
+            JOIN users ON users.id=roles.user_id
+            LEFT JOIN classes ON classes.id=roles.class_id
+            LEFT JOIN classes_lti ON classes.id=classes_lti.class_id
+            LEFT JOIN consumers ON consumers.id=classes_lti.lti_consumer_id
+        """
+    if names & {'class', 'consumer'}:
+        return """
+            usage_class_daily AS usage
+            JOIN classes ON classes.id=usage.class_id
+            LEFT JOIN classes_lti ON classes.id=classes_lti.class_id
+            LEFT JOIN consumers ON consumers.id=classes_lti.lti_consumer_id
+        """
+    return """
+        usage_user_daily AS usage
+        JOIN users ON users.id=usage.user_id
+    """
+
+
 def gen_query_charts(filters: Filters) -> list[ChartData]:
     """ Generate chart data for CodeHelp query charts.
     Filter using same filters as set in the admin interface
     (passed in where_clause and where_params).
+
+    Daily counts are read from the usage rollups (see gened/usage.py) unless
+    filtered to a single query.
     """
     db = get_db()
 
-    where_clause, where_params = filters.make_where(['consumer', 'class', 'user', 'role', 'query'])
+    if any(f.spec.name == 'query' for f in filters):
+        where_clause, where_params = filters.make_where(['consumer', 'class', 'user', 'role', 'query'])
+        daily_counts = f"""
+            SELECT
+                CAST(julianday() AS INTEGER) - CAST(julianday(queries.query_time) AS INTEGER) AS days_since,
+                COUNT(queries.id) AS queries,
+                SUM(queries.has_error) AS errors,
+                SUM(queries.is_insufficient) AS insufficient
+            FROM queries
+            JOIN users ON queries.user_id=users.id
+            LEFT JOIN auth_providers ON users.auth_provider=auth_providers.id
+            LEFT JOIN roles ON queries.role_id=roles.id
+            LEFT JOIN classes ON roles.class_id=classes.id
+            LEFT JOIN classes_lti ON classes.id=classes_lti.class_id
+            LEFT JOIN consumers ON consumers.id=classes_lti.lti_consumer_id
+            WHERE days_since <= 14
+            AND queries.query_time >= date('now', '-15 days')  -- a superset of the window that can use queries_by_time_flags
+            AND {where_clause}
+            GROUP BY days_since
+        """  # noqa: S608 -- where_clause is built from fixed column names
+    else:
+        where_clause, where_params = filters.make_where(['consumer', 'class', 'user', 'role'])
+        daily_counts = f"""
+            SELECT
+                CAST(julianday(date('now')) - julianday(usage.day) AS INTEGER) AS days_since,
+                SUM(usage.queries) AS queries,
+                SUM(usage.errors) AS errors,
+                SUM(usage.insufficient) AS insufficient
+            FROM {_usage_source(filters)}
+            WHERE usage.day >= date('now', '-14 days')
+            AND {where_clause}
+            GROUP BY usage.day
+        """  # noqa: S608 -- where_clause is built from fixed column names
 
     # https://www.sqlite.org/lang_with.html#recursive_query_examples
     usage_data = db.execute(f"""
@@ -33,23 +96,7 @@ def gen_query_charts(filters: Filters) -> list[ChartData]:
             COALESCE(errors, 0) AS errors,
             COALESCE(insufficient, 0) AS insufficient
         FROM cnt
-        LEFT JOIN (
-        SELECT
-            CAST(julianday() AS INTEGER) - CAST(julianday(queries.query_time) AS INTEGER) AS days_since,
-            COUNT(queries.id) AS queries,
-            SUM(json_extract(queries.response_json, '$[0].error') IS NOT NULL) AS errors,
-            SUM(json_extract(queries.response_text, '$.insufficient') IS NOT NULL) AS insufficient
-            FROM queries
-            JOIN users ON queries.user_id=users.id
-            LEFT JOIN auth_providers ON users.auth_provider=auth_providers.id
-            LEFT JOIN roles ON queries.role_id=roles.id
-            LEFT JOIN classes ON roles.class_id=classes.id
-            LEFT JOIN classes_lti ON classes.id=classes_lti.class_id
-            LEFT JOIN consumers ON consumers.id=classes_lti.lti_consumer_id
-            WHERE days_since <= 14
-            AND {where_clause}
-            GROUP BY days_since
-        ) ON days_since = val
+        LEFT JOIN ({daily_counts}) ON days_since = val
         ORDER BY days_since DESC
     """, where_params).fetchall()
     days_since = [row['days_since'] for row in usage_data]
@@ -74,9 +121,11 @@ def gen_query_charts(filters: Filters) -> list[ChartData]:
     return charts
 
 
-def get_queries(filters: Filters, limit: int=-1, offset: int=0) -> Cursor:
-    db = get_db()
+def get_queries(filters: Filters, limit: int=-1, offset: int=0, before_id: int | None=None, table_query: TableQuery | None=None) -> Cursor:
     where_clause, where_params = filters.make_where(['consumer', 'class', 'user', 'role', 'query'])
+    if before_id is not None:
+        where_clause += " AND queries.id < ?"
+        where_params.append(before_id)
     sql = f"""
         SELECT
             queries.id AS id,
@@ -95,17 +144,10 @@ def get_queries(filters: Filters, limit: int=-1, offset: int=0) -> Cursor:
         FROM queries
         JOIN users ON queries.user_id=users.id
         LEFT JOIN auth_providers ON users.auth_provider=auth_providers.id
-        LEFT JOIN roles ON UNLIKELY(queries.role_id=roles.id)  -- UNLIKELY() to help query planner in older sqlite versions
-        LEFT JOIN classes ON UNLIKELY(roles.class_id=classes.id)
-        LEFT JOIN classes_lti ON classes.id=classes_lti.class_id
-        LEFT JOIN consumers ON consumers.id=classes_lti.lti_consumer_id
+        {class_joins(filters, 'queries.role_id')}
         WHERE {where_clause}
-        ORDER BY queries.id DESC
-        LIMIT ?
-        OFFSET ?
     """
-    cur = db.execute(sql, [*where_params, limit, offset])
-    return cur
+    return query_rows(sql, where_params, order_by="id DESC", limit=limit, offset=offset, table_query=table_query)
 
 
 queries_table = DataTable(
@@ -2,12 +2,13 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-only
 
-import asyncio
 import json
-from sqlite3 import Row
+from collections.abc import AsyncIterator
+from sqlite3 import Connection, Row
 
 from flask import (
     Blueprint,
+    current_app,
     flash,
     make_response,
     redirect,
@@ -19,11 +20,16 @@ from werkzeug.wrappers.response import Response
 
 import gened.admin
 from gened.app_data import get_query
+from gened.asgi import async_view
+from gened.async_runner import iter_async, run_async
 from gened.auth import get_auth, login_required
 from gened.classes import switch_class
 from gened.db import get_db
+from gened.db_writer import write_async
 from gened.experiments import experiment_required
 from gened.llm import LLM, ChatMessage, with_llm
+from gened.llm_telemetry import CallTag
+from gened.sse import sse_event, sse_response
 from gened.tables import Col, DataTable, NumCol
 
 from . import prompts
@@ -91,8 +97,9 @@ def tutor_form(class_id: int | None = None, ctx_name: str | None = None) -> str
 
 
 @bp.route("/chat/create", methods=["POST"])
+@async_view
 @with_llm()
-def start_chat(llm: LLM) -> Response:
+async def start_chat(llm: LLM) -> Response:
     topic = request.form['topic']
 
     if 'context' in request.form:
@@ -103,16 +110,19 @@ def start_chat(llm: LLM) -> Response:
     else:
         context = None
 
-    chat_id = create_chat(topic, context)
+    chat_id = await create_chat(topic, context)
 
-    run_chat_round(llm, chat_id)
+    if not current_app.config['STREAMING_RESPONSES']:
+        await run_chat_round(llm, chat_id)
+    # otherwise, the response is streamed by chat_stream(), requested by the chat_interface page
 
     return redirect(url_for("tutor.chat_interface", chat_id=chat_id))
 
 
 @bp.route("/chat/create_from_query", methods=["POST"])
+@async_view
 @with_llm()
-def start_chat_from_query(llm: LLM) -> Response:
+async def start_chat_from_query(llm: LLM) -> Response:
     topic = request.form['topic']
 
     # build context from the specified query
@@ -121,9 +131,10 @@ def start_chat_from_query(llm: LLM) -> Response:
     assert query_row
     context = get_context_by_name(query_row['context_name'])
 
-    chat_id = create_chat(topic, context)
+    chat_id = await create_chat(topic, context)
 
-    run_chat_round(llm, chat_id)
+    if not current_app.config['STREAMING_RESPONSES']:
+        await run_chat_round(llm, chat_id)
 
     return redirect(url_for("tutor.chat_interface", chat_id=chat_id))
 
@@ -138,32 +149,32 @@ def chat_interface(chat_id: int) -> str | Response:
 
     chat_history = get_chat_history()
 
-    return render_template("tutor_view.html", chat_id=chat_id, topic=topic, context_name=context_name, chat=chat, chat_history=chat_history)
+    auth = get_auth()
+    if current_app.config['STREAMING_RESPONSES'] and _is_pending(chat) and auth.user_id == _get_chat_owner(chat_id) and not _is_responding(chat_id):
+        stream_url = url_for("tutor.chat_stream", chat_id=chat_id)
+    else:
+        stream_url = None
 
+    return render_template("tutor_view.html", chat_id=chat_id, topic=topic, context_name=context_name, chat=chat, chat_history=chat_history, stream_url=stream_url)
 
-def create_chat(topic: str, context: ContextConfig | None) -> int:
-    db = get_db()
+
+async def create_chat(topic: str, context: ContextConfig | None) -> int:
     auth = get_auth()
     user_id = auth.user_id
     role_id = auth.cur_class.role_id if auth.cur_class else None
+    context_name = context.name if context is not None else None
+    context_str = context.prompt_str() if context is not None else None
 
-    if context is not None:
-        context_name = context.name
-        context_string_id = record_context_string(context.prompt_str())
-    else:
-        context_name = None
-        context_string_id = None
-
-    cur = db.execute(
-        "INSERT INTO chats (user_id, role_id, topic, context_name, context_string_id, chat_json) VALUES (?, ?, ?, ?, ?, ?)",
-        [user_id, role_id, topic, context_name, context_string_id, json.dumps([])]
-    )
-    new_row_id = cur.lastrowid
+    def insert_chat(db: Connection) -> int:
+        context_string_id = record_context_string(context_str, db) if context_str is not None else None
+        cur = db.execute(
+            "INSERT INTO chats (user_id, role_id, topic, context_name, context_string_id, chat_json) VALUES (?, ?, ?, ?, ?, ?)",
+            [user_id, role_id, topic, context_name, context_string_id, json.dumps([])]
+        )
+        assert cur.lastrowid is not None
+        return cur.lastrowid
 
-    db.commit()
-
-    assert new_row_id is not None
-    return new_row_id
+    return await write_async(insert_chat)
 
 
 def get_chat_history(limit: int = 10) -> list[Row]:
@@ -209,80 +220,195 @@ def get_chat(chat_id: int) -> tuple[list[ChatMessage], str, str, str]:
     return chat, topic, context_name, context_string
 
 
-def get_response(llm: LLM, chat: list[ChatMessage]) -> tuple[dict[str, str], str]:
+async def get_response(llm: LLM, chat: list[ChatMessage], *, chat_id: int | None = None) -> tuple[dict[str, str], str]:
     ''' Get a new 'assistant' completion for the specified chat.
 
     Parameters:
       - chat: A list of dicts, each containing a message with 'role' and 'content' keys,
               following the OpenAI chat completion API spec.
+      - chat_id: The chat's id, if it is stored, to tag the API call with.
 
     Returns a tuple containing:
       1) A response object from the OpenAI completion (to be stored in the database).
       2) The response text.
     '''
-    response, text = asyncio.run(llm.get_completion(messages=chat))
+    response, text = await run_async(llm.get_completion(messages=chat, tag=CallTag('tutor', chat_id=chat_id)))
 
     return response, text
 
 
-def save_chat(chat_id: int, chat: list[ChatMessage]) -> None:
+def _is_pending(chat: list[ChatMessage]) -> bool:
+    '''A chat is waiting for a response from the tutor if it is new or the user spoke last.'''
+    return not chat or chat[-1]['role'] == 'user'
+
+
+def _get_chat_owner(chat_id: int) -> int | None:
+    db = get_db()
+    row = db.execute("SELECT user_id FROM chats WHERE id=?", [chat_id]).fetchone()
+    return row['user_id'] if row else None
+
+
+# A claim on a chat's response older than this is taken to be from a stream that died without releasing it.
+_CLAIM_EXPIRY = "-5 minutes"
+
+
+def _is_responding(chat_id: int) -> bool:
+    '''Whether a response to the chat is being streamed by another request.'''
     db = get_db()
-    db.execute(
+    row = db.execute("SELECT 1 FROM chats WHERE id=? AND responding_since > datetime('now', ?)", [chat_id, _CLAIM_EXPIRY]).fetchone()
+    return row is not None
+
+
+async def _claim_pending_chat(chat_id: int, user_id: int) -> bool:
+    '''Mark a chat as being responded to, so its response is only generated once.'''
+    return await write_async(lambda db: db.execute(
+        "UPDATE chats SET responding_since=CURRENT_TIMESTAMP WHERE id=? AND user_id=? AND (responding_since IS NULL OR responding_since <= datetime('now', ?))",
+        [chat_id, user_id, _CLAIM_EXPIRY]
+    ).rowcount == 1)
+
+
+async def _release_chat(chat_id: int, chat: list[ChatMessage] | None) -> None:
+    '''Release a claim from _claim_pending_chat(), saving the chat with its response (if given).'''
+    if chat is None:
+        await write_async(lambda db: db.execute("UPDATE chats SET responding_since=NULL WHERE id=?", [chat_id]))
+    else:
+        await write_async(lambda db: db.execute("UPDATE chats SET chat_json=?, responding_since=NULL WHERE id=?", [json.dumps(chat), chat_id]))
+
+
+def _expand_chat(topic: str, context_string: str, chat: list[ChatMessage]) -> list[ChatMessage]:
+    '''Get an expanded version of the chat messages to send to the API.
+    Insert a system prompt beforehand and an internal monologue after to guide the assistant.
+    '''
+    return [
+        {'role': 'system', 'content': prompts.make_chat_sys_prompt(topic, context_string)},
+        *chat,  # chat is a list; expand it here with *
+        {'role': 'assistant', 'content': prompts.tutor_monologue},
+    ]
+
+
+async def save_chat(chat_id: int, chat: list[ChatMessage]) -> None:
+    # waits for the commit, as the chat is often read back immediately (e.g., in run_chat_round())
+    await write_async(lambda db: db.execute(
         "UPDATE chats SET chat_json=? WHERE id=?",
         [json.dumps(chat), chat_id]
-    )
-    db.commit()
+    ))
 
 
-def run_chat_round(llm: LLM, chat_id: int, message: str|None = None) -> None:
-    # Get the specified chat
+async def add_user_message(chat_id: int, message: str) -> None:
     try:
-        chat, topic, context_name, context_string = get_chat(chat_id)
+        chat, _, _, _ = get_chat(chat_id)
     except (ChatNotFoundError, AccessDeniedError):
         return
 
+    chat.append({
+        'role': 'user',
+        'content': message,
+    })
+    await save_chat(chat_id, chat)
+
+
+async def run_chat_round(llm: LLM, chat_id: int, message: str|None = None) -> None:
     # Add the new message to the chat
     if message is not None:
-        chat.append({
-            'role': 'user',
-            'content': message,
-        })
+        await add_user_message(chat_id, message)
 
-    save_chat(chat_id, chat)
+    # Get the specified chat
+    try:
+        chat, topic, context_name, context_string = get_chat(chat_id)
+    except (ChatNotFoundError, AccessDeniedError):
+        return
 
     # Get a response (completion) from the API using an expanded version of the chat messages
-    # Insert a system prompt beforehand and an internal monologue after to guide the assistant
-    expanded_chat : list[ChatMessage] = [
-        {'role': 'system', 'content': prompts.make_chat_sys_prompt(topic, context_string)},
-        *chat,  # chat is a list; expand it here with *
-        {'role': 'assistant', 'content': prompts.tutor_monologue},
-    ]
+    expanded_chat = _expand_chat(topic, context_string, chat)
 
-    response_obj, response_txt = get_response(llm, expanded_chat)
+    response_obj, response_txt = await get_response(llm, expanded_chat, chat_id=chat_id)
 
     # Update the chat w/ the response
     chat.append({
         'role': 'assistant',
         'content': response_txt,
     })
-    save_chat(chat_id, chat)
+    await save_chat(chat_id, chat)
 
 
 @bp.route("/message", methods=["POST"])
+@async_view
 @with_llm()
-def new_message(llm: LLM) -> Response:
+async def new_message(llm: LLM) -> Response:
     chat_id = int(request.form["id"])
     new_msg = request.form["message"]
 
     # TODO: limit length
 
-    # Run a round of the chat with the given message.
-    run_chat_round(llm, chat_id, new_msg)
+    if current_app.config['STREAMING_RESPONSES']:
+        # Just add the message; the response is streamed by chat_stream(), requested by the chat_interface page.
+        await add_user_message(chat_id, new_msg)
+    else:
+        # Run a round of the chat with the given message.
+        await run_chat_round(llm, chat_id, new_msg)
 
     # Send the user back to the now-updated chat view
     return redirect(url_for("tutor.chat_interface", chat_id=chat_id))
 
 
+@bp.route("/stream/<int:chat_id>")
+@async_view
+@with_llm()
+async def chat_stream(llm: LLM, chat_id: int) -> Response:
+    ''' Generate the tutor's response to a chat that is waiting for one, streamed as Server-Sent Events.
+
+    Events: 'delta' for each piece of the response text, then 'done' once
+    the response has been saved.  If the chat is not waiting for a response,
+    'done' is sent immediately.
+    '''
+    async def generate() -> AsyncIterator[str]:
+        auth = get_auth()
+        try:
+            chat, topic, _, context_string = get_chat(chat_id)
+        except (ChatNotFoundError, AccessDeniedError):
+            yield sse_event('done')
+            return
+
+        if not _is_pending(chat) or auth.user_id != _get_chat_owner(chat_id):
+            yield sse_event('done')
+            return
+
+        assert auth.user_id is not None
+        if not await _claim_pending_chat(chat_id, auth.user_id):
+            # another request is responding (or has just responded)
+            yield sse_event('done')
+            return
+
+        stream = await llm.stream_completion(messages=_expand_chat(topic, context_string, chat), tag=CallTag('tutor', chat_id=chat_id))
+        try:
+            async for delta in iter_async(stream):
+                yield sse_event('delta', delta)
+        finally:
+            # Save whatever we have, even if the client disconnected or an error occurred
+            response_txt: str | None
+            if stream.response is not None:
+                response_txt = stream.text
+            elif stream.text:
+                response_txt = stream.text + "\n\n[interrupted]"
+            else:
+                response_txt = None  # nothing received; leave the chat waiting for a response
+
+            # A non-streamed round (e.g., from a form post) may have responded to this chat in the meantime.
+            current_chat, _, _, _ = get_chat(chat_id)
+            if response_txt is not None and len(current_chat) == len(chat):
+                current_chat.append({
+                    'role': 'assistant',
+                    'content': response_txt,
+                })
+                await _release_chat(chat_id, current_chat)
+            else:
+                await _release_chat(chat_id, None)
+
+        yield sse_event('done')
+
+    return sse_response(generate())
+
+
 # ### Admin routes ###
 bp_admin = Blueprint('admin_tutor', __name__, url_prefix='/tutor', template_folder='templates')
 
@@ -300,11 +426,7 @@ def tutor_admin(chat_id : int|None = None) -> str:
             chats.id AS id,
             users.display_name AS user,
             chats.topic AS topic,
-            (
-                SELECT COUNT(*)
-                FROM json_each(chats.chat_json)
-                WHERE json_extract(json_each.value, '$.role')='user'
-            ) as "user messages"
+            chats.user_message_count AS "user messages"
         FROM chats
         JOIN users ON chats.user_id=users.id
         ORDER BY chats.id DESC
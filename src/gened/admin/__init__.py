@@ -8,7 +8,10 @@ from gened.auth import admin_required
 
 from . import (  # noqa: F401 -- Importing these modules registers routes
     consumers,
+    db_status,
     download,
+    llm_status,
+    llm_usage,
     main,
     pruning,
 )
@@ -15,6 +15,7 @@ from werkzeug.wrappers.response import Response
 from gened.db import get_db
 from gened.llm import get_models
 from gened.lti import reload_consumers
+from gened.rate_limiter import key_limits_from_form
 
 from .component_registry import register_blueprint
 
@@ -73,10 +74,15 @@ def consumer_update() -> Response:
 
     consumer_id = request.form.get("consumer_id", type=int)
 
+    # rate limits: blank (or invalid) -> NULL, to use the default
+    rate_limits, limits_invalid = key_limits_from_form(request.form)
+    if limits_invalid:
+        flash("Rate limits must be positive whole numbers; invalid limits were set to the default.", "warning")
+
     if consumer_id is None:
         # Adding a new consumer
-        cur = db.execute("INSERT INTO consumers (lti_consumer, lti_secret, llm_api_key, model_id) VALUES (?, ?, ?, ?)",
-                         [request.form['lti_consumer'], request.form['lti_secret'], request.form['llm_api_key'], request.form['model_id']])
+        cur = db.execute("INSERT INTO consumers (lti_consumer, lti_secret, llm_api_key, model_id, llm_max_inflight, llm_rpm, llm_tpm) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         [request.form['lti_consumer'], request.form['lti_secret'], request.form['llm_api_key'], request.form['model_id'], *rate_limits])
         consumer_id = cur.lastrowid
         db.commit()
         flash(f"Consumer {request.form['lti_consumer']} created.")
@@ -99,6 +105,7 @@ def consumer_update() -> Response:
             db.execute("UPDATE consumers SET llm_api_key=? WHERE id=?", [request.form['llm_api_key'], consumer_id])
         if request.form.get('model_id', ''):
             db.execute("UPDATE consumers SET model_id=? WHERE id=?", [request.form['model_id'], consumer_id])
+        db.execute("UPDATE consumers SET llm_max_inflight=?, llm_rpm=?, llm_tpm=? WHERE id=?", [*rate_limits, consumer_id])
         db.commit()
         flash("Consumer updated.")
 
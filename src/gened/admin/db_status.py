@@ -0,0 +1,30 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from flask import Blueprint, render_template, request
+
+from gened.db import get_db_pool_stats
+from gened.db_writer import get_writer_stats
+from gened.sql_stats import get_slow_statements, get_sql_stats
+
+from .component_registry import register_blueprint, register_navbar_item
+
+bp = Blueprint('admin_db', __name__, url_prefix='/db', template_folder='templates')
+
+register_blueprint(bp)
+register_navbar_item("admin_db.db_status_view", "Database")
+
+
+@bp.route("/")
+def db_status_view() -> str:
+    # Note: all of these are specific to the worker process handling this request.
+    # (`flask sql-stats` shows statement stats merged from all processes.)
+    limit = request.args.get('limit', 50, type=int)
+    return render_template(
+        "admin_db_status.html",
+        pool_stats=get_db_pool_stats(),
+        writer_stats=get_writer_stats(),
+        statements=get_sql_stats()[:limit],
+        slow_statements=get_slow_statements(),
+    )
@@ -0,0 +1,36 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from flask import Blueprint, render_template
+
+from gened.circuit_breaker import get_breaker_stats
+from gened.client_pool import get_pool_stats
+from gened.llm import get_coalesced_count
+from gened.llm_cache import get_cache_stats
+from gened.rate_limiter import get_limiter_stats
+
+from .component_registry import register_blueprint, register_navbar_item
+
+bp = Blueprint('admin_llm', __name__, url_prefix='/llm', template_folder='templates')
+
+register_blueprint(bp)
+register_navbar_item("admin_llm.llm_status_view", "LLM Status")
+
+
+@bp.route("/")
+def llm_status_view() -> str:
+    # Note: all of these are specific to the worker process handling this request.
+    pool_stats = get_pool_stats()
+    cache_stats = get_cache_stats()  # (except the number of entries, which is for the whole cache)
+    coalesced_count = get_coalesced_count()
+    limiter_stats = get_limiter_stats()
+    breaker_stats = get_breaker_stats()
+    return render_template(
+        "admin_llm_status.html",
+        pool_stats=pool_stats,
+        cache_stats=cache_stats,
+        coalesced_count=coalesced_count,
+        limiter_stats=limiter_stats,
+        breaker_stats=breaker_stats,
+    )
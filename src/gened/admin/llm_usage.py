@@ -0,0 +1,92 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from sqlite3 import Row
+
+from flask import Blueprint, render_template, request
+
+from gened.app_data import ChartData
+from gened.db import get_db
+
+from .component_registry import register_blueprint, register_navbar_item
+
+bp = Blueprint('admin_llm_usage', __name__, url_prefix='/llm_usage', template_folder='templates')
+
+register_blueprint(bp)
+register_navbar_item("admin_llm_usage.llm_usage_view", "LLM Usage")
+
+# Ways to group llm_calls: name -> (grouping key, display label, join needed for the label)
+_GROUPINGS = {
+    'day': ("date(llm_calls.call_time)", "date(llm_calls.call_time)", ""),
+    'model': ("llm_calls.provider || '/' || llm_calls.model", "llm_calls.provider || '/' || llm_calls.model", ""),
+    'consumer': ("llm_calls.consumer_id", "consumers.lti_consumer", "LEFT JOIN consumers ON consumers.id=llm_calls.consumer_id"),
+    'class': ("llm_calls.class_id", "classes.name", "LEFT JOIN classes ON classes.id=llm_calls.class_id"),
+}
+
+
+def get_call_stats(group: str, days: int) -> list[Row]:
+    """Get stats for LLM calls in the past `days` days, grouped as specified (one of the keys of _GROUPINGS).
+
+    Latency percentiles (nearest-rank) are computed over calls without errors.
+    """
+    key, label, join = _GROUPINGS[group]
+    db = get_db()
+    return db.execute(f"""
+        WITH calls AS (
+            SELECT
+                {key} AS grp,
+                {label} AS label,
+                llm_calls.*,
+                ROW_NUMBER() OVER (PARTITION BY {key}, llm_calls.error IS NULL ORDER BY llm_calls.latency_ms) AS latency_rank,
+                COUNT(*) OVER (PARTITION BY {key}, llm_calls.error IS NULL) AS n
+            FROM llm_calls
+            {join}
+            WHERE llm_calls.call_time >= datetime('now', ?)
+        )
+        SELECT
+            grp,
+            MAX(label) AS label,
+            COUNT(*) AS calls,
+            SUM(error IS NOT NULL) AS errors,
+            MIN(CASE WHEN error IS NULL AND latency_rank >= 0.50 * n THEN latency_ms END) AS p50,
+            MIN(CASE WHEN error IS NULL AND latency_rank >= 0.95 * n THEN latency_ms END) AS p95,
+            MIN(CASE WHEN error IS NULL AND latency_rank >= 0.99 * n THEN latency_ms END) AS p99,
+            AVG(queue_ms) AS avg_queue_ms,
+            COALESCE(SUM(prompt_tokens), 0) AS prompt_tokens,
+            COALESCE(SUM(completion_tokens), 0) AS completion_tokens,
+            SUM(retries) AS retries
+        FROM calls
+        GROUP BY grp
+        ORDER BY {"grp" if group == 'day' else "calls DESC"}
+    """, [f"-{days} days"]).fetchall()  # noqa: S608 -- key, label, and join are constants from _GROUPINGS
+
+
+def _make_charts(daily: list[Row]) -> list[ChartData]:
+    labels: list[str | int | float] = [row['label'] for row in daily]
+    latency = ChartData(
+        labels=labels,
+        series={
+            'p50 latency (s)': [(row['p50'] or 0) / 1000 for row in daily],
+            'p95 latency (s)': [(row['p95'] or 0) / 1000 for row in daily],
+            'p99 latency (s)': [(row['p99'] or 0) / 1000 for row in daily],
+        },
+        colors=['#3273dc', '#ffb70f', '#f14668'],
+    )
+    tokens = ChartData(
+        labels=labels,
+        series={
+            'prompt tokens': [row['prompt_tokens'] for row in daily],
+            'completion tokens': [row['completion_tokens'] for row in daily],
+        },
+        colors=['#00d1b2', '#3273dc'],
+    )
+    return [latency, tokens]
+
+
+@bp.route("/")
+def llm_usage_view() -> str:
+    days = request.args.get('days', 30, type=int)
+    daily = get_call_stats('day', days)
+    tables = {group: get_call_stats(group, days) for group in ('model', 'consumer', 'class')}
+    return render_template("admin_llm_usage.html", days=days, charts=_make_charts(daily), tables=tables)
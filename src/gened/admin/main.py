@@ -17,11 +17,16 @@ from werkzeug.wrappers.response import Response
 from gened.app_data import (
     DataSource,
     Filters,
+    PageCursor,
+    TableQuery,
+    fetch_page,
     get_admin_charts,
     get_registered_data_sources,
+    query_rows,
+    set_table_page,
+    table_page_response,
 )
-from gened.csv import csv_response
-from gened.db import get_db
+from gened.csv import export_response
 from gened.tables import Action, Col, DataTable, NumCol, UserCol
 
 from .component_registry import register_blueprint
@@ -31,86 +36,128 @@ bp = Blueprint('admin_main', __name__, url_prefix='/', template_folder='template
 register_blueprint(bp)
 
 
-def get_consumers(_: Filters | None, limit: int=-1, offset: int=0) -> Cursor:
-    db = get_db()
-    return db.execute("""
+def _consumer_join(filters: Filters) -> str:
+    """The join to use from roles to their classes' consumers: a consumer filter
+    only matches rows where these joins succeed, and inner joins let the planner
+    start from the consumer rather than scanning every role.
+    """
+    return "JOIN" if any(f.spec.name == 'consumer' for f in filters) else "LEFT JOIN"
+
+
+def get_consumers(_: Filters | None, limit: int=-1, offset: int=0, before_id: int | None=None, table_query: TableQuery | None=None) -> Cursor:
+    assert before_id is None  # ordered by recent queries, so not registered for keyset pagination
+    sql = """
         SELECT
             consumers.id AS id,
             consumers.lti_consumer AS consumer,
             models.shortname AS model,
-            COUNT(DISTINCT classes.id) AS "#classes",
-            --COUNT(DISTINCT roles.id) AS "#users",
-            COUNT(queries.id) AS "#queries",
-            SUM(CASE WHEN queries.query_time > date('now', '-7 days') THEN 1 ELSE 0 END) AS "1wk"
+            (SELECT COUNT(*) FROM classes_lti WHERE classes_lti.lti_consumer_id=consumers.id) AS "#classes",
+            COALESCE(usage.queries, 0) AS "#queries",
+            COALESCE(usage.recent, 0) AS "1wk"
         FROM consumers
         LEFT JOIN models ON models.id=consumers.model_id
-        LEFT JOIN classes_lti ON classes_lti.lti_consumer_id=consumers.id
-        LEFT JOIN classes ON classes.id=classes_lti.class_id
-        LEFT JOIN roles ON roles.class_id=classes.id
-        LEFT JOIN queries ON queries.role_id=roles.id
-        GROUP BY consumers.id
-        ORDER BY "1wk" DESC, consumers.id DESC
-        LIMIT ?
-        OFFSET ?
-    """, [limit, offset])
-
-
-def get_classes(filters: Filters, limit: int=-1, offset: int=0) -> Cursor:
-    db = get_db()
+        LEFT JOIN (
+            SELECT
+                consumer_id,
+                SUM(queries) AS queries,
+                SUM(CASE WHEN day >= date('now', '-7 days') THEN queries ELSE 0 END) AS recent
+            FROM usage_consumer_daily
+            GROUP BY consumer_id
+        ) AS usage ON usage.consumer_id=consumers.id
+    """
+    return query_rows(sql, [], order_by='"1wk" DESC, id DESC', limit=limit, offset=offset, table_query=table_query)
+
+
+def get_classes(filters: Filters, limit: int=-1, offset: int=0, before_id: int | None=None, table_query: TableQuery | None=None) -> Cursor:
+    assert before_id is None  # ordered by recent queries, so not registered for keyset pagination
     where_clause, where_params = filters.make_where(['consumer'])
-    return db.execute(f"""
+    sql = f"""
         SELECT
             classes.id AS id,
             classes.name AS name,
             COALESCE(consumers.lti_consumer, class_owner.display_name) AS owner,
             models.shortname AS model,
-            COUNT(DISTINCT roles.id) AS "#users",
-            COUNT(queries.id) AS "#queries",
-            SUM(CASE WHEN queries.query_time > date('now', '-7 days') THEN 1 ELSE 0 END) AS "1wk"
+            (SELECT COUNT(*) FROM roles WHERE roles.class_id=classes.id) AS "#users",
+            COALESCE(usage.queries, 0) AS "#queries",
+            COALESCE(usage.recent, 0) AS "1wk"
         FROM classes
         LEFT JOIN classes_user ON classes.id=classes_user.class_id
         LEFT JOIN users AS class_owner ON classes_user.creator_user_id=class_owner.id
         LEFT JOIN models ON models.id=classes_user.model_id
         LEFT JOIN classes_lti ON classes.id=classes_lti.class_id
         LEFT JOIN consumers ON consumers.id=classes_lti.lti_consumer_id
-        LEFT JOIN roles ON roles.class_id=classes.id
-        LEFT JOIN queries ON queries.role_id=roles.id
+        LEFT JOIN (
+            SELECT
+                class_id,
+                SUM(queries) AS queries,
+                SUM(CASE WHEN day >= date('now', '-7 days') THEN queries ELSE 0 END) AS recent
+            FROM usage_class_daily
+            GROUP BY class_id
+        ) AS usage ON usage.class_id=classes.id
         WHERE {where_clause}
-        GROUP BY classes.id
-        ORDER BY "1wk" DESC, classes.id DESC
-        LIMIT ?
-        OFFSET ?
-    """, [*where_params, limit, offset])
+    """
+    return query_rows(sql, where_params, order_by='"1wk" DESC, id DESC', limit=limit, offset=offset, table_query=table_query)
 
 
-def get_users(filters: Filters, limit: int=-1, offset: int=0) -> Cursor:
-    db = get_db()
+def get_users(filters: Filters, limit: int=-1, offset: int=0, before_id: int | None=None, table_query: TableQuery | None=None) -> Cursor:
+    assert before_id is None  # ordered by recent queries, so not registered for keyset pagination
     where_clause, where_params = filters.make_where(['consumer', 'class'])
-    return db.execute(f"""
+    if where_params:
+        # Filtered to a class or consumer: count each user's queries in the matching roles
+        lti_join = _consumer_join(filters)
+        sql = f"""
+            SELECT
+                users.id AS id,
+                json_array(users.display_name, auth_providers.name, users.display_extra) AS user,
+                COALESCE(SUM(usage.queries), 0) AS "#queries",
+                COALESCE(SUM(usage.recent), 0) AS "1wk",
+                users.query_tokens AS tokens
+            FROM users
+            LEFT JOIN auth_providers ON auth_providers.id=users.auth_provider
+            JOIN roles ON roles.user_id=users.id
+            {lti_join} classes ON roles.class_id=classes.id
+            {lti_join} classes_lti ON classes.id=classes_lti.class_id
+            {lti_join} consumers ON consumers.id=classes_lti.lti_consumer_id
+            LEFT JOIN (
+                SELECT
+                    role_id,
+                    SUM(queries) AS queries,
+                    SUM(CASE WHEN day >= date('now', '-7 days') THEN queries ELSE 0 END) AS recent
+                FROM usage_role_daily
+                GROUP BY role_id
+            ) AS usage ON usage.role_id=roles.id
+            WHERE {where_clause}
+            GROUP BY users.id
+        """
+        return query_rows(sql, where_params, order_by='"1wk" DESC, id DESC', limit=limit, offset=offset, table_query=table_query)
+
+    sql = """
         SELECT
             users.id AS id,
             json_array(users.display_name, auth_providers.name, users.display_extra) AS user,
-            COUNT(queries.id) AS "#queries",
-            SUM(CASE WHEN queries.query_time > date('now', '-7 days') THEN 1 ELSE 0 END) AS "1wk",
+            COALESCE(usage.queries, 0) AS "#queries",
+            COALESCE(usage.recent, 0) AS "1wk",
             users.query_tokens AS tokens
         FROM users
         LEFT JOIN auth_providers ON auth_providers.id=users.auth_provider
-        LEFT JOIN roles ON roles.user_id=users.id
-        LEFT JOIN classes ON roles.class_id=classes.id
-        LEFT JOIN classes_lti ON classes.id=classes_lti.class_id
-        LEFT JOIN consumers ON consumers.id=classes_lti.lti_consumer_id
-        LEFT JOIN queries ON queries.role_id=roles.id OR (queries.role_id IS NULL AND queries.user_id=users.id)
-        WHERE {where_clause}
-        GROUP BY users.id
-        ORDER BY "1wk" DESC, users.id DESC
-        LIMIT ?
-        OFFSET ?
-    """, [*where_params, limit, offset])
-
-def get_roles(filters: Filters, limit: int=-1, offset: int=0) -> Cursor:
-    db = get_db()
+        LEFT JOIN (
+            SELECT
+                user_id,
+                SUM(queries) AS queries,
+                SUM(CASE WHEN day >= date('now', '-7 days') THEN queries ELSE 0 END) AS recent
+            FROM usage_user_daily
+            GROUP BY user_id
+        ) AS usage ON usage.user_id=users.id
+    """
+    return query_rows(sql, [], order_by='"1wk" DESC, id DESC', limit=limit, offset=offset, table_query=table_query)
+
+def get_roles(filters: Filters, limit: int=-1, offset: int=0, before_id: int | None=None, table_query: TableQuery | None=None) -> Cursor:
     where_clause, where_params = filters.make_where(['consumer', 'class', 'user'])
-    return db.execute(f"""
+    if before_id is not None:
+        where_clause += " AND roles.id < ?"
+        where_params.append(before_id)
+    lti_join = _consumer_join(filters)
+    sql = f"""
         SELECT
             roles.id AS id,
             json_array(users.display_name, auth_providers.name, users.display_extra) AS user,
@@ -120,16 +167,14 @@ def get_roles(filters: Filters, limit: int=-1, offset: int=0) -> Cursor:
         FROM roles
         LEFT JOIN users ON users.id=roles.user_id
         LEFT JOIN auth_providers ON users.auth_provider=auth_providers.id
-        LEFT JOIN classes ON roles.class_id=classes.id
-        LEFT JOIN classes_lti ON classes.id=classes_lti.class_id
+        {lti_join} classes ON roles.class_id=classes.id
+        {lti_join} classes_lti ON classes.id=classes_lti.class_id
         LEFT JOIN classes_user ON classes.id=classes_user.class_id
         LEFT JOIN users AS class_owner ON classes_user.creator_user_id=class_owner.id
-        LEFT JOIN consumers ON consumers.id=classes_lti.lti_consumer_id
+        {lti_join} consumers ON consumers.id=classes_lti.lti_consumer_id
         WHERE {where_clause}
-        ORDER BY roles.id DESC
-        LIMIT ?
-        OFFSET ?
-    """, [*where_params, limit, offset])
+    """
+    return query_rows(sql, where_params, order_by="id DESC", limit=limit, offset=offset, table_query=table_query)
 
 
 def get_data_sources(filters: Filters) -> dict[str, DataSource]:
@@ -165,9 +210,9 @@ def get_data_sources(filters: Filters) -> dict[str, DataSource]:
     )
 
     built_ins = {
-        'consumers': DataSource('consumers', get_consumers, consumers_table),
-        'classes': DataSource('classes', get_classes, classes_table),
-        'users': DataSource('users', get_users, users_table),
+        'consumers': DataSource('consumers', get_consumers, consumers_table, keyset=False),
+        'classes': DataSource('classes', get_classes, classes_table, keyset=False),
+        'users': DataSource('users', get_users, users_table, keyset=False),
         'roles': DataSource('roles', get_roles, roles_table),
     }
 
@@ -179,12 +224,24 @@ def get_data_sources(filters: Filters) -> dict[str, DataSource]:
 @bp.route("/api/<string:name>/")
 @bp.route("/api/<string:name>/<string:kind>")
 def get_data(name: str, kind: str='json') -> str | Response:
-    if kind not in ['json', 'csv']:
+    """ Get rows from a data source, as a CSV or NDJSON export or as a page of JSON.
+
+    JSON is returned as {"data": [rows], "next": cursor}, where cursor is an
+    opaque token to pass as the 'cursor' argument to get the next page (or
+    null after the last page).  Exports are streamed from the database.
+    """
+    if kind not in ['json', 'csv', 'ndjson']:
         return abort(404)
 
     filters = Filters.from_args()
     limit = int(request.args.get('limit', -1))
-    offset = int(request.args.get('offset', 0))
+    try:
+        if 'cursor' in request.args:
+            cursor = PageCursor.decode(request.args['cursor'])
+        else:
+            cursor = PageCursor(offset=int(request.args.get('offset', 0)))
+    except ValueError:
+        return abort(400)
 
     all_data_sources = get_data_sources(filters)
 
@@ -192,14 +249,26 @@ def get_data(name: str, kind: str='json') -> str | Response:
         return abort(404)
 
     source = all_data_sources[name]
+
+    if kind in ('csv', 'ndjson'):
+        rows = source.function(filters, limit=limit, offset=cursor.offset, before_id=cursor.before_id)
+        return export_response('admin_export', name, rows, 'csv' if kind == 'csv' else 'ndjson')
+
     table = source.table
-    table.data = source.function(filters, limit=limit, offset=offset).fetchall()
+    table.data, next_cursor = fetch_page(source, filters, limit=limit, cursor=cursor)
+    return jsonify({'data': table.table_data, 'next': next_cursor.encode() if next_cursor else None})
 
-    if kind == 'json':
-        return jsonify(table.table_data)
-    if kind == 'csv':
-        return csv_response('admin_export', name, table.data)
-    return ''
+
+@bp.route("/api/<string:name>/page")
+def get_page(name: str) -> Response:
+    """ Get a page of rows for a server-side table (see table_page_response()). """
+    filters = Filters.from_args()
+    all_data_sources = get_data_sources(filters)
+
+    if name not in all_data_sources:
+        return abort(404)
+
+    return table_page_response(all_data_sources[name], filters)
 
 
 @bp.route("/")
@@ -210,17 +279,13 @@ def main() -> str:
     for generate_chart in get_admin_charts():
         charts.extend(generate_chart(filters))
 
-    init_rows = 20  # number of rows to send in the page for each table (remainder will load asynchronously)
-
     all_data_sources = get_data_sources(filters)
     tables = []
 
     for name, source in all_data_sources.items():
         table = source.table
-        table.data = source.function(filters, limit=init_rows).fetchall()
+        set_table_page(table, source, filters, url_for('.get_page', name=name, **request.args))  # type: ignore[arg-type]
         table.csv_link = url_for('.get_data', name=name, kind='csv', **request.args)  # type: ignore[arg-type]
-        limit = 1000 if name == 'queries' else 50000
-        table.ajax_url = url_for('.get_data', name=name, kind='json', offset=init_rows, limit=limit-init_rows, **request.args)  # type: ignore[arg-type]
 
         tables.append(table)
 
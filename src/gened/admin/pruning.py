@@ -2,6 +2,9 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-only
 
+import threading
+import time
+from datetime import date, datetime, timezone
 from sqlite3 import Row
 
 from flask import (
@@ -35,20 +38,67 @@ def get_candidates() -> tuple[list[Row], int]:
                 json_array(display_name, auth_provider, display_extra) AS user,
                 created,
                 last_query_time AS "last query",
-                last_instructor_query_time AS "last class query",
-                MAX(IFNULL(created, ""), IFNULL(last_query_time, ""), IFNULL(last_instructor_query_time, "")) AS "last activity",
-                CAST(JULIANDAY(DATE('now')) - JULIANDAY(MAX(IFNULL(created, ""), IFNULL(last_query_time, ""), IFNULL(last_instructor_query_time, ""))) AS INTEGER) AS "days since",
+                last_instructor_activity AS "last class query",
+                last_activity AS "last activity",
+                CAST(JULIANDAY(DATE('now')) - JULIANDAY(last_activity) AS INTEGER) AS "days since",
                 delete_status = 'whitelisted' AS "whitelist?"
             FROM user_activity
-            WHERE "last activity" < DATE('now', ?)
+            WHERE last_activity < DATE('now', ?)
         """, [f"-{retention_time_days} days"]).fetchall()
 
     num_candidates = sum(not row['whitelist?'] for row in g.pruning_candidates)
+    _candidate_count.set(num_candidates)
     return g.pruning_candidates, num_candidates
 
 
+class _CandidateCount:
+    """The number of pruning candidates, cached for the navbar link.
+
+    Candidates change only as days pass (keyed by date) or when users are
+    whitelisted or deleted (invalidated by those views), apart from a
+    candidate becoming active again, so a cached count expires after
+    _COUNT_TTL seconds to pick that up (and changes made in other processes).
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._value: tuple[date, float, int] | None = None  # (date, time computed, count)
+
+    def get(self) -> int:
+        with self._lock:
+            value = self._value
+        if value is not None and value[0] == _today() and time.monotonic() - value[1] < _COUNT_TTL:
+            return value[2]
+        db = get_db()
+        retention_time_days = current_app.config['RETENTION_TIME_DAYS']
+        count = db.execute("""
+            SELECT COUNT(*)
+            FROM user_activity
+            WHERE last_activity < DATE('now', ?)
+              AND delete_status != 'whitelisted'
+        """, [f"-{retention_time_days} days"]).fetchone()[0]
+        assert isinstance(count, int)
+        self.set(count)
+        return count
+
+    def set(self, count: int) -> None:
+        with self._lock:
+            self._value = (_today(), time.monotonic(), count)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._value = None
+
+
+_COUNT_TTL = 10*60
+
+
+def _today() -> date:
+    return datetime.now(timezone.utc).date()  # matching DATE('now') in SQLite
+_candidate_count = _CandidateCount()
+
+
 def render_link() -> Markup:
-    _, num_candidates = get_candidates()
+    num_candidates = _candidate_count.get()
     if num_candidates:
         #return Markup("Pruning<span style='font-size: 50%'>🔴</span>")
         return Markup(f"Pruning <span style='font-size: 50%;' class='tag is-rounded is-danger px-1 py-0 ml-1'>{num_candidates}</span>")
@@ -88,6 +138,7 @@ def set_whitelist(user_id: int, bool_whitelist: int) -> str:
     db.execute("UPDATE users SET delete_status=? WHERE id=?", [
 new_status, user_id])
     db.commit()
+    _candidate_count.invalidate()
     return "okay"
 
 
@@ -101,6 +152,7 @@ def prune_users() -> Response:
 
     for user_id in user_ids:
         delete_user_data(user_id)
+    _candidate_count.invalidate()
 
     flash(f'Successfully deleted {len(user_ids)} user(s)', 'success')
     return redirect(url_for('.pruning_view'))
@@ -2,15 +2,19 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-only
 
-from collections.abc import Iterator
+import base64
+import binascii
+import json
+from collections.abc import Iterator, Sequence
 from copy import deepcopy
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
 from sqlite3 import Cursor, Row
-from typing import Final, Protocol
+from typing import Any, Final, Protocol
 from urllib.parse import urlencode
 
-from flask import request
+from flask import abort, jsonify, request
 from typing_extensions import Self  # for 3.10
+from werkzeug.wrappers.response import Response
 
 from gened.tables import DataTable
 
@@ -131,8 +135,109 @@ class ChartGenerator(Protocol):
     def __call__(self, filters: Filters) -> list[ChartData]:
         ...
 
+class InvalidSortError(ValueError):
+    def __init__(self, sort: str | None, direction: str) -> None:
+        super().__init__(f"Invalid sort: {sort} {direction}")
+
+@dataclass(frozen=True)
+class TableQuery:
+    """ The sorting and searching requested for a page of a server-side
+    table, applied to a data function's rows by query_rows().
+    """
+    columns: tuple[str, ...] = ()  # the table's visible columns, which may be sorted and searched
+    sort: str | None = None
+    desc: bool = False
+    search: str = ''
+    count: bool = False  # return only the number of matching rows, as a single 'total' column
+
+    @classmethod
+    def from_args(cls, table: DataTable) -> Self:
+        """ Read the sort column ('sort'), direction ('dir': 'asc' or 'desc'),
+        and search text ('search') requested for a table.  Raises
+        InvalidSortError (a ValueError) for a column not shown in the table or
+        an invalid direction.
+        """
+        columns = tuple(col.name for col in table.columns if not col.hidden)
+        sort = request.args.get('sort') or None
+        direction = request.args.get('dir', 'asc')
+        if (sort is not None and sort not in columns) or direction not in ('asc', 'desc'):
+            raise InvalidSortError(sort, direction)
+        return cls(columns=columns, sort=sort, desc=(direction == 'desc'), search=request.args.get('search', '').strip())
+
+    def where(self) -> tuple[str, list[str]]:
+        """ A WHERE clause matching rows with the search text in any column. """
+        if not self.search or not self.columns:
+            return "1", []
+        pattern = "%" + self.search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        return (
+            "(" + " OR ".join(f"{_quote(col)} LIKE ? ESCAPE '\\'" for col in self.columns) + ")",
+            [pattern] * len(self.columns),
+        )
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def query_rows(sql: str, params: Sequence[Any], *, order_by: str, limit: int=-1, offset: int=0, table_query: TableQuery | None=None) -> Cursor:
+    """ Run a data function's SELECT (without ORDER BY or LIMIT), returning a
+    page of its rows in order_by order (which must refer to columns by their
+    names in the results).  With a table_query, the rows are searched and
+    sorted as it requests (with order_by breaking ties), or counted.
+    """
+    db = get_db()
+    if table_query is None or not (table_query.sort or table_query.search or table_query.count):
+        return db.execute(f"{sql} ORDER BY {order_by} LIMIT ? OFFSET ?", [*params, limit, offset])
+
+    where_clause, where_params = table_query.where()
+    if table_query.count:
+        return db.execute(f"SELECT COUNT(*) AS total FROM ({sql}) WHERE {where_clause}", [*params, *where_params])  # noqa: S608 -- built from the data function's SQL and column names checked by TableQuery.from_args()
+
+    if table_query.sort:
+        order_by = f"{_quote(table_query.sort)} {'DESC' if table_query.desc else 'ASC'}, {order_by}"
+    return db.execute(f"""
+        SELECT * FROM ({sql})
+        WHERE {where_clause}
+        ORDER BY {order_by}
+        LIMIT ?
+        OFFSET ?
+    """, [*params, *where_params, limit, offset])  # noqa: S608 -- built from the data function's SQL and column names checked by TableQuery.from_args()
+
+
+def class_joins(filters: Filters, role_id: str) -> str:
+    """ The joins from a data function's role_id column (e.g., 'queries.role_id')
+    to the role, its class, and the class's LTI consumer (if any), for filtering
+    by 'class' or 'consumer'.  Those filters only match rows where the joins
+    succeed, so they are inner joins then, letting the planner start from the
+    class or consumer and reach its rows through indexes on class_id and
+    role_id instead of scanning every row.
+    """
+    names = {f.spec.name for f in filters}
+    if not names & {'class', 'consumer'}:
+        return f"""
+            LEFT JOIN roles ON UNLIKELY({role_id}=roles.id)  -- UNLIKELY() to help query planner in older sqlite versions
+            LEFT JOIN classes ON UNLIKELY(roles.class_id=classes.id)
+            LEFT JOIN classes_lti ON classes.id=classes_lti.class_id
+            LEFT JOIN consumers ON consumers.id=classes_lti.lti_consumer_id
+        """
+    lti_join = "JOIN" if 'consumer' in names else "LEFT JOIN"
+    return f"""
+        JOIN roles ON {role_id}=roles.id
+        JOIN classes ON roles.class_id=classes.id
+        {lti_join} classes_lti ON classes.id=classes_lti.class_id
+        {lti_join} consumers ON consumers.id=classes_lti.lti_consumer_id
+    """
+
+
 class DataFunction(Protocol):
-    def __call__(self, filters: Filters, /, limit: int=-1, offset: int=0) -> Cursor:
+    """ Fetch rows (with an 'id' column) matching the filters, ordered by id
+    descending unless the source is registered with keyset=False.  Given
+    before_id, only rows with id < before_id are returned (keyset pagination:
+    the next page after a row with that id, which is never given for a
+    keyset=False source).  Given a table_query, rows are instead searched,
+    sorted, or counted as it requests (see query_rows()).
+    """
+    def __call__(self, filters: Filters, /, limit: int=-1, offset: int=0, before_id: int | None=None, table_query: TableQuery | None=None) -> Cursor:
         ...
 
 @dataclass(frozen=True)
@@ -140,6 +245,87 @@ class DataSource:
     name: str
     function: DataFunction
     table: DataTable
+    keyset: bool = True  # rows are ordered by id descending, so pages can be fetched with before_id
+
+
+class InvalidCursorError(ValueError):
+    def __init__(self, token: str) -> None:
+        super().__init__(f"Invalid cursor: {token}")
+
+
+@dataclass(frozen=True)
+class PageCursor:
+    """ The position of a page of a data source: after a row id (keyset
+    pagination), or at an offset (for sources not ordered by id).  Passed to
+    and from clients as an opaque token.
+    """
+    before_id: int | None = None
+    offset: int = 0
+
+    def encode(self) -> str:
+        data = {'b': self.before_id} if self.before_id is not None else {'o': self.offset}
+        return base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode().rstrip('=')
+
+    @classmethod
+    def decode(cls, token: str) -> Self:
+        """ Raises InvalidCursorError (a ValueError) for an invalid token. """
+        try:
+            data = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise InvalidCursorError(token) from e
+        if isinstance(data, dict) and isinstance(data.get('b'), int):
+            return cls(before_id=data['b'])
+        if isinstance(data, dict) and isinstance(data.get('o'), int) and data['o'] >= 0:
+            return cls(offset=data['o'])
+        raise InvalidCursorError(token)
+
+
+def fetch_page(source: DataSource, filters: Filters, limit: int=-1, cursor: PageCursor | None=None) -> tuple[list[Row], PageCursor | None]:
+    """ Fetch a page of rows from a data source, starting at the given cursor
+    (or the first row).  Returns the rows and a cursor for the next page
+    (None if this is the last page).
+    """
+    cursor = cursor or PageCursor()
+    rows = source.function(filters, limit=limit, offset=cursor.offset, before_id=cursor.before_id).fetchall()
+    if limit < 0 or len(rows) < limit:
+        return rows, None
+    if source.keyset:
+        return rows, PageCursor(before_id=rows[-1]['id'])
+    return rows, PageCursor(offset=cursor.offset + len(rows))
+
+def fetch_table_page(source: DataSource, filters: Filters, table_query: TableQuery, limit: int, offset: int=0) -> tuple[list[Row], int]:
+    """ Fetch a page of rows for a server-side table, searched and sorted as
+    requested, along with the total number of rows matching the search.
+    """
+    rows = source.function(filters, limit=limit, offset=offset, table_query=table_query).fetchall()
+    if offset == 0 and len(rows) < limit:
+        return rows, len(rows)
+    count_row = source.function(filters, table_query=replace(table_query, count=True)).fetchone()
+    return rows, count_row['total']
+
+
+def set_table_page(table: DataTable, source: DataSource, filters: Filters, page_url: str) -> None:
+    """ Set up a table to be paged from the server: fill it with its first
+    page of rows and its total, and set the URL for its other pages.
+    """
+    table.data, table.total = fetch_table_page(source, filters, TableQuery.from_args(table), limit=table.page_size)
+    table.page_url = page_url
+
+
+def table_page_response(source: DataSource, filters: Filters) -> Response:
+    """ Respond to a server-side table's request for a page of rows (with
+    'sort', 'dir', 'search', 'offset', and 'limit' arguments).
+    """
+    table = source.table
+    try:
+        table_query = TableQuery.from_args(table)
+    except ValueError:
+        return abort(400)
+    limit = request.args.get('limit', table.page_size, type=int)
+    offset = request.args.get('offset', 0, type=int)
+    table.data, total = fetch_table_page(source, filters, table_query, limit=limit, offset=offset)
+    return jsonify({'data': table.table_data, 'total': total})
+
 
 @dataclass
 class AppDataConfig:
@@ -158,8 +344,8 @@ def register_admin_chart(generator_func: ChartGenerator) -> None:
 def get_admin_charts() -> list[ChartGenerator]:
     return _appdata.admin_chart_generators
 
-def register_data(name: str, data_func: DataFunction, data_table: DataTable) -> None:
-    data_source = DataSource(name, data_func, data_table)
+def register_data(name: str, data_func: DataFunction, data_table: DataTable, *, keyset: bool=True) -> None:
+    data_source = DataSource(name, data_func, data_table, keyset)
     if name in _appdata.data_source_map:
         # don't allow overwriting the same name
         # but this may occur in tests or other situations that re-use the module across applications...
@@ -167,13 +353,17 @@ def register_data(name: str, data_func: DataFunction, data_table: DataTable) ->
 
     _appdata.data_source_map[name] = data_source
 
+class UnknownDataSourceError(RuntimeError):
+    def __init__(self, name: str) -> None:
+        super().__init__(f"Invalid data source name: {name}")
+
 def get_registered_data_sources() -> dict[str, DataSource]:
     return deepcopy(_appdata.data_source_map)
 
 def get_registered_data_source(name: str) -> DataSource:
     source = _appdata.data_source_map.get(name)
     if not source:
-        raise RuntimeError(f"Invalid data source name: {name}")
+        raise UnknownDataSourceError(name)
     return deepcopy(source)
 
 
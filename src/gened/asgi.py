@@ -0,0 +1,312 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""ASGI serving, with LLM-heavy views running natively on one event loop.
+
+Under WSGI, each request holds a thread for as long as it waits on the LLM,
+so concurrency is capped at threads x processes even though the work is
+almost entirely waiting.  An app wrapped in ASGIApp can be served by any
+ASGI server (e.g., `uvicorn --factory codehelp:create_asgi_app`), and:
+
+  - Views marked with @async_view run as tasks on the server's event loop.
+    A request waiting on the LLM holds no thread (and no database connection;
+    see async_runner.run_async()), so one process can have thousands of LLM
+    requests in flight.
+  - All other views run as usual in a pool of threads (like a WSGI server).
+
+Async views run with a normal Flask request context, so auth, sessions,
+get_db(), and templates work as in any view.  Their sync work (queries,
+rendering) runs on the event loop, though, so it should be quick.
+
+An async view is written as an `async def` view function that awaits API
+calls with run_async() / iter_async() (not run_sync() / iter_sync(), which
+would block the loop) and marked with @async_view, placed just below the
+route decorator(s).  Served with WSGI, it runs to completion in the
+request's thread (see async_runner.run_local()), so the same view works in
+both modes.
+"""
+
+import asyncio
+import contextvars
+import inspect
+import io
+import sys
+import threading
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from typing import Any, ParamSpec
+
+from flask import Flask, request_started
+from werkzeug.wrappers import Response
+
+from .async_runner import get_loop, run_local, use_loop
+from .db_writer import flush_writes_async
+
+# ASGI types (see https://asgi.readthedocs.io/)
+Scope = dict[str, Any]
+Message = dict[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+
+P = ParamSpec('P')
+
+_ASYNC_IMPL = '__gened_async_view__'
+
+# Set while a request is handled natively on the event loop
+_serving_natively: contextvars.ContextVar[bool] = contextvars.ContextVar('gened_serving_natively', default=False)
+
+
+def async_view(f: Callable[P, Any]) -> Callable[P, Any]:
+    """Mark a view (decorated with any other view decorators) as an async view.
+
+    Served by ASGIApp, the view is awaited on the event loop.  Otherwise
+    (WSGI), it is run to completion in the request's thread.
+
+    (Typed with Any, as the decorated view returns either a coroutine or,
+    from a decorator such as login_required, a response.)
+    """
+    @wraps(f)
+    def run_in_thread(*args: P.args, **kwargs: P.kwargs) -> Any:
+        rv = f(*args, **kwargs)
+        if inspect.iscoroutine(rv):
+            rv = run_local(rv)
+        return rv
+
+    setattr(run_in_thread, _ASYNC_IMPL, f)
+    return run_in_thread
+
+
+def serving_natively() -> bool:
+    """Whether the current request is being handled natively on the event loop (i.e., by an async view under ASGIApp)."""
+    return _serving_natively.get()
+
+
+def _make_environ(scope: Scope, body: bytes) -> dict[str, Any]:
+    """Make a WSGI environ for an ASGI HTTP request (following PEP 3333)."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ: dict[str, Any] = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'REMOTE_ADDR': client[0],
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for raw_name, raw_value in scope['headers']:
+        name = raw_name.decode('latin-1').upper().replace('-', '_')
+        value = raw_value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f"HTTP_{name}"
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    # the whole body has been read (e.g., a chunked request has no Content-Length)
+    environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
+
+
+def _encode_headers(headers: Iterable[tuple[str, str]]) -> list[tuple[bytes, bytes]]:
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+
+async def _watch_disconnect(receive: Receive, disconnected: asyncio.Event) -> None:
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            disconnected.set()
+            return
+
+
+class ASGIApp:
+    """An ASGI application serving a Flask app (see the module docstring)."""
+    def __init__(self, app: Flask, *, threads: int = 32) -> None:
+        """
+        Args:
+            app: The Flask application.
+            threads: Size of the thread pool running views that are not async views.
+        """
+        self.app = app
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix="gened-asgi")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        loop = asyncio.get_running_loop()
+        if get_loop() is not loop:
+            use_loop(loop)
+
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return  # websockets are not supported
+
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            chunks.append(message.get('body', b''))
+            more_body = message.get('more_body', False)
+        environ = _make_environ(scope, b"".join(chunks))
+
+        disconnected = asyncio.Event()
+        watcher = asyncio.create_task(_watch_disconnect(receive, disconnected))
+        try:
+            if self._is_async_view(environ):
+                await self._handle_async(environ, send, disconnected)
+            else:
+                await self._handle_wsgi(environ, send, disconnected)
+        finally:
+            watcher.cancel()
+
+    async def _lifespan(self, receive: Receive, send: Send) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self._executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _is_async_view(self, environ: dict[str, Any]) -> bool:
+        try:
+            endpoint, _ = self.app.url_map.bind_to_environ(environ).match()
+        except Exception:  # noqa: BLE001 -- any routing exception (404, 405, redirect) is handled by the WSGI app
+            return False
+        view = self.app.view_functions.get(str(endpoint))
+        return hasattr(view, _ASYNC_IMPL)
+
+    async def _handle_async(self, environ: dict[str, Any], send: Send, disconnected: asyncio.Event) -> None:
+        """Handle a request with an async view, as Flask.wsgi_app() would, but awaiting the view."""
+        app = self.app
+        token = _serving_natively.set(True)
+        ctx = app.request_context(environ)
+        error: BaseException | None = None
+        try:
+            try:
+                ctx.push()
+                try:
+                    request_started.send(app, _async_wrapper=app.ensure_sync)
+                    rv = app.preprocess_request()
+                    if rv is None:
+                        req = ctx.request
+                        if req.routing_exception is not None:
+                            app.raise_routing_exception(req)
+                        assert req.url_rule is not None
+                        view = getattr(app.view_functions[req.url_rule.endpoint], _ASYNC_IMPL)
+                        rv = view(**(req.view_args or {}))
+                        if inspect.isawaitable(rv):
+                            rv = await rv
+                except Exception as e:  # noqa: BLE001 -- as in Flask.full_dispatch_request()
+                    rv = app.handle_user_exception(e)
+                response = app.finalize_request(rv)
+            except Exception as e:  # noqa: BLE001 -- as in Flask.wsgi_app()
+                error = e
+                response = app.handle_exception(e)
+            await self._send_response(response, send, disconnected)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            # Await the request's queued writes here, as the teardown's flush_writes() would block the loop.
+            try:
+                await flush_writes_async()
+            except Exception:
+                app.logger.exception("Queued database write failed.")
+            if app.should_ignore_error(error):
+                error = None
+            ctx.pop(error)
+            _serving_natively.reset(token)
+
+    async def _send_response(self, response: Response, send: Send, disconnected: asyncio.Event) -> None:
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': _encode_headers(response.headers.items()),
+        })
+        body = response.response
+        try:
+            if isinstance(body, AsyncIterator):
+                # a streamed response (e.g., see sse.sse_response())
+                try:
+                    async for chunk in body:
+                        if disconnected.is_set():
+                            break
+                        data = chunk.encode() if isinstance(chunk, str) else chunk
+                        await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+                finally:
+                    aclose = getattr(body, 'aclose', None)
+                    if aclose is not None:
+                        await aclose()
+                await send({'type': 'http.response.body', 'body': b''})
+            else:
+                await send({'type': 'http.response.body', 'body': response.get_data()})
+        finally:
+            response.close()
+
+    def _run_wsgi(self, environ: dict[str, Any], put: Callable[[str, Any], None], stop: threading.Event) -> None:
+        """Run the WSGI app, passing its response to `put` as ('start', (status, headers)), ('body', data)..., ('end', None).
+
+        The whole response is produced in this one thread, as the app's
+        iterable may use thread-bound resources (e.g., the database connection).
+        """
+        def start_response(status: str, headers: list[tuple[str, str]], exc_info: Any = None) -> Callable[[bytes], None]:  # noqa: ARG001 (exc_info: headers are never sent before start_response)
+            put('start', (int(status.split(maxsplit=1)[0]), headers))
+            return lambda data: put('body', data)
+
+        try:
+            result = self.app(environ, start_response)
+            try:
+                for chunk in result:
+                    if stop.is_set():
+                        break
+                    if chunk:
+                        put('body', chunk)
+            finally:
+                close = getattr(result, 'close', None)
+                if close is not None:
+                    close()
+        finally:
+            put('end', None)
+
+    async def _handle_wsgi(self, environ: dict[str, Any], send: Send, disconnected: asyncio.Event) -> None:
+        """Handle a request with the WSGI app in a thread, sending the response as it is produced."""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue[tuple[str, Any]] = asyncio.Queue()
+        stop = threading.Event()
+
+        def put(kind: str, item: Any) -> None:
+            loop.call_soon_threadsafe(queue.put_nowait, (kind, item))
+
+        future = loop.run_in_executor(self._executor, self._run_wsgi, environ, put, stop)
+        started = False
+        try:
+            while True:
+                kind, item = await queue.get()
+                if kind == 'end':
+                    break
+                if kind == 'start':
+                    status, headers = item
+                    await send({'type': 'http.response.start', 'status': status, 'headers': _encode_headers(headers)})
+                    started = True
+                elif disconnected.is_set():
+                    stop.set()
+                else:
+                    await send({'type': 'http.response.body', 'body': item, 'more_body': True})
+            if not started:  # the app raised before starting a response
+                await send({'type': 'http.response.start', 'status': 500, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            stop.set()
+            await future
@@ -0,0 +1,276 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""Run coroutines from synchronous (WSGI) code on a long-lived event loop.
+
+Each worker process gets one event loop, running forever in a dedicated daemon
+thread.  Sync code (e.g., a Flask view) submits a coroutine with run_sync()
+and blocks until it completes or times out.  Compared to asyncio.run() per
+request, this avoids creating and tearing down a loop for every call, and it
+lets loop-bound resources like pooled API client connections (client_pool.py)
+be reused across requests.
+
+The coroutine runs in a copy of the caller's context, so Flask's current_app,
+g, etc. are available to it.  It runs in a different thread, though, so it
+must not use the caller's database connection.
+
+iter_sync() does the same for an async iterable (e.g., a streamed LLM
+completion), yielding its items to sync code as they are produced.
+
+Async code (e.g., an async view; see asgi.py) uses run_async() and
+iter_async() instead, which await the coroutine without blocking a thread.
+When serving with ASGI, the server's event loop is used as the background
+loop (see use_loop()), so views and API calls all run on that one loop.
+"""
+
+import asyncio
+import concurrent.futures
+import contextlib
+import os
+import threading
+from collections.abc import AsyncIterable, AsyncIterator, Awaitable, Coroutine, Iterator
+from dataclasses import dataclass
+from typing import Any, TypeVar
+
+from flask import current_app, has_app_context
+
+from .db import close_db
+
+T = TypeVar('T')
+
+
+class LoopReentryError(RuntimeError):
+    def __init__(self) -> None:
+        super().__init__("run_sync() called on the event loop it would wait for; use run_async().")
+
+
+class AsyncTimeoutError(TimeoutError):
+    def __init__(self, timeout: float | None) -> None:
+        super().__init__(f"Coroutine did not complete within {timeout} seconds.")
+
+
+@dataclass
+class _LoopThread:
+    loop: asyncio.AbstractEventLoop
+    thread: threading.Thread
+    pid: int  # the process that started the thread; a forked child needs its own
+    adopted: bool = False  # a loop run by someone else (see use_loop())
+
+    @classmethod
+    def start(cls) -> '_LoopThread':
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, name="gened-event-loop", daemon=True)
+        thread.start()
+        return cls(loop, thread, os.getpid())
+
+    @property
+    def alive(self) -> bool:
+        if self.adopted and not self.loop.is_running():
+            return False  # e.g., the server has shut down
+        return self.pid == os.getpid() and self.thread.is_alive()
+
+
+class _Runner:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._loop_thread: _LoopThread | None = None
+
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop_thread is None or not self._loop_thread.alive:
+                self._loop_thread = _LoopThread.start()
+            return self._loop_thread.loop
+
+    def use_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        with self._lock:
+            self._loop_thread = _LoopThread(loop, threading.current_thread(), os.getpid(), adopted=True)
+
+
+_runner = _Runner()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Get this process's background event loop, starting it if needed."""
+    return _runner.get_loop()
+
+
+def use_loop(loop: asyncio.AbstractEventLoop) -> None:
+    """Use the given loop, running in the current thread, as this process's background event loop.
+
+    An ASGI server calls this (via asgi.py) with its own loop, so async views
+    await API calls directly rather than handing them to another thread.
+    """
+    _runner.use_loop(loop)
+
+
+def _on_loop(loop: asyncio.AbstractEventLoop) -> bool:
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
+
+
+def run_sync(coro: Coroutine[Any, Any, T], *, timeout: float | None = None) -> T:
+    """Run a coroutine on the background event loop and wait for its result.
+
+    Args:
+        coro: The coroutine to run.
+        timeout: Max seconds to wait.  If None, uses the ASYNC_TIMEOUT app
+                 config value when in an app context (else waits indefinitely).
+
+    Raises:
+        AsyncTimeoutError (a TimeoutError) if the timeout expires (the coroutine is cancelled).
+        Any exception raised by the coroutine.
+    """
+    if timeout is None and has_app_context():
+        timeout = current_app.config.get('ASYNC_TIMEOUT')
+
+    loop = get_loop()
+    if _on_loop(loop):
+        coro.close()
+        raise LoopReentryError
+
+    # run_coroutine_threadsafe() creates the task in a copy of the current context.
+    future = asyncio.run_coroutine_threadsafe(coro, loop)
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:  # not the builtin TimeoutError in Python 3.10
+        if future.done():
+            raise  # raised by the coroutine itself
+        future.cancel()
+        raise AsyncTimeoutError(timeout) from None
+
+
+_END = object()
+
+
+def iter_sync(aiterable: AsyncIterable[T], *, timeout: float | None = None) -> Iterator[T]:
+    """Iterate over an async iterable from sync code via the background event loop.
+
+    Each item is produced by a run_sync() call, so `timeout` (as in run_sync())
+    applies to the wait for each item, not to the iteration as a whole.  If
+    the caller stops iterating early (break, exception, generator closed), the
+    async iterator is closed on the loop so its cleanup code runs.
+    """
+    aiterator = aiterable.__aiter__()
+
+    async def next_item() -> Any:
+        try:
+            return await aiterator.__anext__()
+        except StopAsyncIteration:
+            return _END
+
+    finished = False
+    try:
+        while True:
+            item = run_sync(next_item(), timeout=timeout)
+            if item is _END:
+                finished = True
+                return
+            yield item
+    finally:
+        aclose = getattr(aiterator, 'aclose', None)
+        if not finished and aclose is not None:
+            # may still be running if a timed-out __anext__() is being cancelled
+            with contextlib.suppress(RuntimeError):
+                run_sync(aclose(), timeout=timeout)
+
+
+async def run_async(coro: Coroutine[Any, Any, T], *, timeout: float | None = None) -> T:
+    """Run a coroutine on the background event loop and await its result, from async code.
+
+    Like run_sync(), but the caller's event loop is free to run other tasks
+    while waiting.  If the caller is running on the background loop itself
+    (as views do when served with ASGI), the coroutine is simply awaited,
+    and the request's database connection is closed first so that waiting
+    requests don't each hold one open (get_db() reopens it when next used).
+
+    Raises:
+        AsyncTimeoutError (a TimeoutError) if the timeout expires (the coroutine is cancelled).
+        Any exception raised by the coroutine.
+    """
+    if timeout is None and has_app_context():
+        timeout = current_app.config.get('ASYNC_TIMEOUT')
+
+    loop = get_loop()
+    if _on_loop(loop):
+        if has_app_context():
+            close_db()
+        awaitable: Awaitable[T] = coro
+    else:
+        awaitable = asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:  # not the builtin TimeoutError in Python 3.10
+        raise AsyncTimeoutError(timeout) from None
+
+
+async def iter_async(aiterable: AsyncIterable[T], *, timeout: float | None = None) -> AsyncIterator[T]:
+    """Iterate over an async iterable via the background event loop, from async code.
+
+    The async equivalent of iter_sync(): each item is produced by a
+    run_async() call, and the iterator is closed if the caller stops early.
+    """
+    aiterator = aiterable.__aiter__()
+
+    async def next_item() -> Any:
+        try:
+            return await aiterator.__anext__()
+        except StopAsyncIteration:
+            return _END
+
+    finished = False
+    try:
+        while True:
+            item = await run_async(next_item(), timeout=timeout)
+            if item is _END:
+                finished = True
+                return
+            yield item
+    finally:
+        aclose = getattr(aiterator, 'aclose', None)
+        if not finished and aclose is not None:
+            with contextlib.suppress(RuntimeError):
+                await run_async(aclose(), timeout=timeout)
+
+
+_local = threading.local()
+
+
+def run_local(coro: Coroutine[Any, Any, T]) -> T:
+    """Run a coroutine to completion on the current thread's own event loop (created on first use).
+
+    This runs async code from sync code in the same thread, with the current
+    context, so it may use the thread's database connection (unlike
+    run_sync()).  Used to run async views in a WSGI worker thread (see asgi.py).
+    """
+    loop = getattr(_local, 'loop', None)
+    if loop is None or loop.is_closed():
+        loop = _local.loop = asyncio.new_event_loop()
+    return loop.run_until_complete(coro)
+
+
+def iter_local(aiterable: AsyncIterable[T]) -> Iterator[T]:
+    """Iterate over an async iterable from sync code, as in run_local()."""
+    aiterator = aiterable.__aiter__()
+
+    async def next_item() -> Any:
+        try:
+            return await aiterator.__anext__()
+        except StopAsyncIteration:
+            return _END
+
+    finished = False
+    try:
+        while True:
+            item = run_local(next_item())
+            if item is _END:
+                finished = True
+                return
+            yield item
+    finally:
+        aclose = getattr(aiterator, 'aclose', None)
+        if not finished and aclose is not None:
+            run_local(aclose())
@@ -23,19 +23,43 @@ from . import (
     classes,
     data_deletion,
     db,
+    db_writer,
     demo,
     docs,
     experiments,  # noqa: F401 -- importing the module registers an admin component
     filters,
+    index_advisor,
     instructor,
+    jobs,
     lti,
     migrate,
+    mock_llm,
     oauth,
     profile,
+    response_storage,
+    sql_stats,
     tz,
+    usage,
 )
 
 
+def _init_modules(app: Flask) -> None:
+    ''' Initialize the modules with setup needs beyond their blueprints (commands, teardowns, extensions, etc.). '''
+    db.init_app(app)
+    db_writer.init_app(app)
+    docs.init_app(app, url_prefix='/docs')
+    filters.init_app(app)
+    index_advisor.init_app(app)
+    jobs.init_app(app)
+    migrate.init_app(app)
+    mock_llm.init_app(app)
+    oauth.init_app(app)
+    response_storage.init_app(app)
+    sql_stats.init_app(app)
+    tz.init_app(app)
+    usage.init_app(app)
+
+
 def create_app_base(import_name: str, app_config: dict[str, Any], instance_path: Path | None) -> flask.app.Flask:
     ''' Create a base Gen-Ed application.
     Args:
@@ -121,6 +145,68 @@ def create_app_base(import_name: str, app_config: dict[str, Any], instance_path:
         DEFAULT_TOKENS=20,
         # Default data retention length (prune user data with no activity for this period of time)
         RETENTION_TIME_DAYS=2*365,  # 2 years
+        # Pooled LLM API clients, shared by all requests in a worker process (see client_pool.py)
+        LLM_CLIENT_POOL_MAX=32,  # max number of distinct provider/URL/API key clients kept
+        LLM_CLIENT_IDLE_TIMEOUT=10*60,  # seconds before an unused client is closed
+        LLM_CLIENT_KEEPALIVE=60,  # seconds an idle connection is kept open for reuse
+        # SQLite connections (see db.py)
+        DB_POOL_SIZE=8,  # idle connections kept for reuse per worker process (0 for a new connection per app context)
+        DB_PRAGMAS={  # applied to each new connection
+            'journal_mode': 'wal',  # readers and the writer don't block each other (persists in the database file)
+            'synchronous': 'normal',  # with WAL, commits are durable except on power loss, and much faster than 'full'
+            'busy_timeout': 5000,  # milliseconds to wait for a lock before failing with 'database is locked'
+            'cache_size': -16000,  # page cache per connection (negative: in KiB, so 16 MB)
+            'mmap_size': 256*1024*1024,  # read through memory-mapped I/O, up to 256 MB of the database file
+        },
+        # Queued database writes (see db_writer.py)
+        DB_WRITER=True,  # apply queued writes in a writer thread, with group commits (False to commit each immediately)
+        DB_WRITE_BATCH_MAX=100,  # max writes per commit
+        DB_WRITE_MAX_DELAY=0.002,  # max seconds a commit waits for more writes to join its batch
+        # SQL statement stats (see sql_stats.py)
+        SQL_SLOW_THRESHOLD=0.1,  # seconds; slower statements are kept in the slow statement log
+        SQL_SLOW_LOG_SIZE=100,  # recent slow statements kept per worker process
+        SQL_STATS_DUMP_INTERVAL=60,  # seconds between snapshots written for `flask sql-stats` (None to disable)
+        # Store only the used fields of LLM responses in queries.response_json, with the full responses compressed in a side table (see response_storage.py)
+        COMPACT_RESPONSES=True,
+        # Max seconds a request waits on a coroutine run on the background event loop (see async_runner.py)
+        ASYNC_TIMEOUT=5*60,
+        # Stream LLM responses to the browser as they are generated (Server-Sent Events) rather than waiting for the complete response
+        STREAMING_RESPONSES=False,
+        # Generate responses to queries in background jobs, with the response page waiting for completion (unless streaming)
+        BACKGROUND_QUERIES=False,
+        # Background jobs (see jobs.py)
+        JOB_WORKERS=4,  # worker threads per process (0 to only run jobs with `flask run-jobs`)
+        JOB_MAX_ATTEMPTS=3,  # attempts before a job that raises is marked failed
+        JOB_LEASE_SECONDS=5*60,  # seconds before a running job is assumed lost (e.g., in a restart) and run again
+        JOB_POLL_INTERVAL=1.0,  # seconds between checks for new jobs when idle
+        # Cache of LLM responses for classes that enable it (see llm_cache.py)
+        LLM_CACHE_DATABASE=str(Path(app.instance_path) / 'llm_cache.db'),
+        LLM_CACHE_TTL=24*60*60,  # seconds a cached response may be reused
+        LLM_CACHE_MAX_ENTRIES=10_000,  # least-recently used responses are evicted beyond this
+        # Default rate limits per LLM API key, for the system key and any class/consumer that doesn't set its own (see rate_limiter.py)
+        LLM_KEY_MAX_INFLIGHT=32,  # max concurrent API calls per key per worker process (None for no limit)
+        LLM_KEY_RPM=None,  # requests per minute per key per worker process (None for no limit)
+        LLM_KEY_TPM=None,  # tokens per minute per key per worker process (None for no limit)
+        LLM_ADMISSION_MAX_WAIT=30,  # max seconds a request waits for admission before failing
+        # Retries of transient LLM API errors (see retry.py)
+        LLM_RETRY_MAX_ATTEMPTS=3,  # total attempts, including the first
+        LLM_RETRY_BASE_DELAY=0.5,  # seconds before the first retry (doubled for each retry, with jitter)
+        LLM_RETRY_MAX_DELAY=8,  # max seconds between retries (before jitter)
+        LLM_REQUEST_DEADLINE=90,  # max seconds for a completion, including all retries
+        LLM_HEDGING=False,  # send a second request if the first is slower than the recent p95 latency
+        # Circuit breakers per provider/key (see circuit_breaker.py)
+        LLM_BREAKER_FAILURES=5,  # consecutive failures that open the breaker
+        LLM_BREAKER_ERROR_RATE=0.5,  # error rate over recent calls that opens the breaker
+        LLM_BREAKER_COOLDOWN=30,  # seconds an open breaker fails fast before probing the provider again
+        # Mock LLM provider, for load testing (see mock_llm.py)
+        MOCK_LLM=False,  # if True, all LLM requests use the mock provider
+        LLM_MOCK_URL=None,  # base URL of a mock server (`flask mock-llm-server`); None to mock in-process
+        LLM_MOCK_LATENCY='fixed',  # distribution of time to first token: 'fixed', 'normal', or 'longtail'
+        LLM_MOCK_LATENCY_MEAN=2.0,  # mean seconds to first token
+        LLM_MOCK_TOKENS_PER_SECOND=50,
+        LLM_MOCK_RESPONSE_TOKENS=200,
+        LLM_MOCK_ERROR_RATE=0.0,  # fraction of mock requests that fail
+        LLM_MOCK_ERROR_STATUS=503,  # HTTP status of failed mock requests
 
         PYLTI_CONFIG={
             # will be loaded from the consumers table in the database
@@ -205,12 +291,7 @@ def create_app_base(import_name: str, app_config: dict[str, Any], instance_path:
     app.register_blueprint(profile.bp, url_prefix='/profile')
 
     # Initialize modules with other setup needs
-    db.init_app(app)
-    docs.init_app(app, url_prefix='/docs')
-    filters.init_app(app)
-    migrate.init_app(app)
-    oauth.init_app(app)
-    tz.init_app(app)
+    _init_modules(app)
 
     # Inject auth data into template contexts
     @app.context_processor
@@ -0,0 +1,224 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""Circuit breakers for LLM API calls, one per (provider, base_url, api_key).
+
+When a provider is down, every request would otherwise wait for its full
+timeout (and retries) before failing, tying up a worker thread the whole time
+and starving requests for pages that don't use the LLM at all.  A breaker
+watches the outcomes of calls made with its key:
+
+  - closed: calls are made normally.  After `failure_threshold` consecutive
+    failures, or an error rate of at least `error_rate` over the last
+    `window` calls (once at least `min_calls` are recorded), it opens.
+  - open: calls fail immediately with CircuitOpenError.  After `cooldown`
+    seconds, it becomes half-open.
+  - half-open: a single probe call is let through (others still fail fast).
+    If it succeeds, the breaker closes; if it fails, it opens again.
+
+Only failures that indicate the provider is unhealthy count (timeouts,
+connection errors, rate limits, and 5xx errors -- see retry.is_retryable()).
+Other errors, like a bad API key, are the caller's problem and count as the
+provider responding.
+
+Breakers are shared by all threads in a worker process.
+"""
+
+import threading
+import time
+from collections import deque
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from enum import Enum
+
+import openai
+from flask import current_app
+
+from .client_pool import ClientKey
+from .retry import is_retryable
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class BreakerState(Enum):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+
+@dataclass(frozen=True)
+class BreakerConfig:
+    failure_threshold: int = 5  # consecutive failures
+    error_rate: float = 0.5     # fraction of failures within the window
+    window: int = 20            # number of recent calls used for the error rate
+    min_calls: int = 10         # calls required in the window before the error rate is used
+    cooldown: float = 30        # seconds open before a probe call is allowed
+
+    @classmethod
+    def from_app_config(cls) -> 'BreakerConfig':
+        config = current_app.config
+        return cls(
+            failure_threshold=config['LLM_BREAKER_FAILURES'],
+            error_rate=config['LLM_BREAKER_ERROR_RATE'],
+            cooldown=config['LLM_BREAKER_COOLDOWN'],
+        )
+
+
+@dataclass(frozen=True)
+class BreakerStats:
+    provider: str
+    key_suffix: str
+    state: BreakerState
+    consecutive_failures: int
+    error_rate: float
+    opened_count: int
+    fast_failures: int
+    seconds_in_state: float
+
+
+class CircuitBreaker:
+    def __init__(self, config: BreakerConfig) -> None:
+        self.config = config
+        self.state = BreakerState.CLOSED
+        self._changed = time.monotonic()
+        self._outcomes: deque[bool] = deque(maxlen=config.window)  # True for a failure
+        self._consecutive_failures = 0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.opened_count = 0
+        self.fast_failures = 0
+
+    def _set_state(self, state: BreakerState) -> None:
+        self.state = state
+        self._changed = time.monotonic()
+        self._probing = False
+        if state == BreakerState.OPEN:
+            self.opened_count += 1
+        elif state == BreakerState.CLOSED:
+            self._outcomes.clear()
+            self._consecutive_failures = 0
+
+    def _error_rate(self) -> float:
+        return sum(self._outcomes) / len(self._outcomes) if self._outcomes else 0.0
+
+    def before_call(self) -> None:
+        """Check whether a call may be made now.  Raises CircuitOpenError if not."""
+        with self._lock:
+            if self.state == BreakerState.OPEN and time.monotonic() - self._changed >= self.config.cooldown:
+                self._set_state(BreakerState.HALF_OPEN)
+            if self.state == BreakerState.CLOSED:
+                return
+            if self.state == BreakerState.HALF_OPEN and not self._probing:
+                self._probing = True  # this call is the probe
+                return
+            self.fast_failures += 1
+            raise CircuitOpenError
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state == BreakerState.HALF_OPEN:
+                self._set_state(BreakerState.CLOSED)
+                current_app.logger.info("LLM circuit breaker closed: probe call succeeded.")
+                return
+            self._outcomes.append(False)
+            self._consecutive_failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            if self.state == BreakerState.HALF_OPEN:
+                self._set_state(BreakerState.OPEN)
+                current_app.logger.warning("LLM circuit breaker reopened: probe call failed.")
+                return
+            if self.state == BreakerState.OPEN:
+                return  # a call made before the breaker opened
+            self._outcomes.append(True)
+            self._consecutive_failures += 1
+            if (self._consecutive_failures >= self.config.failure_threshold
+                    or (len(self._outcomes) >= self.config.min_calls and self._error_rate() >= self.config.error_rate)):
+                self._set_state(BreakerState.OPEN)
+                current_app.logger.warning(f"LLM circuit breaker opened: {self._consecutive_failures} consecutive failures, {self._error_rate():.0%} recent error rate.")
+
+    def release(self) -> None:
+        """End a call whose outcome says nothing about the provider's health (e.g., it was cancelled)."""
+        with self._lock:
+            if self.state == BreakerState.HALF_OPEN:
+                self._probing = False  # let another call probe
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        """Make a call within the context, recording its outcome.
+
+        Raises CircuitOpenError immediately if the breaker does not allow the call.
+        """
+        self.before_call()
+        try:
+            yield
+        except openai.APIError as e:
+            if is_retryable(e):
+                self.record_failure()
+            else:
+                self.record_success()  # the provider responded
+            raise
+        except BaseException:
+            self.release()
+            raise
+        self.record_success()
+
+    def stats(self) -> tuple[BreakerState, int, float, float]:
+        with self._lock:
+            return self.state, self._consecutive_failures, self._error_rate(), time.monotonic() - self._changed
+
+
+class _Registry:
+    def __init__(self) -> None:
+        self._breakers: dict[ClientKey, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: ClientKey, config: BreakerConfig) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None or breaker.config != config:
+                breaker = self._breakers[key] = CircuitBreaker(config)
+            return breaker
+
+    def clear(self) -> None:
+        with self._lock:
+            self._breakers.clear()
+
+    def stats(self) -> list[BreakerStats]:
+        with self._lock:
+            items = list(self._breakers.items())
+        stats = []
+        for key, breaker in items:
+            state, consecutive_failures, error_rate, seconds_in_state = breaker.stats()
+            stats.append(BreakerStats(
+                provider=key[0],
+                key_suffix=key[2][-4:],
+                state=state,
+                consecutive_failures=consecutive_failures,
+                error_rate=error_rate,
+                opened_count=breaker.opened_count,
+                fast_failures=breaker.fast_failures,
+                seconds_in_state=seconds_in_state,
+            ))
+        return stats
+
+
+_registry = _Registry()
+
+
+def get_breaker(key: ClientKey) -> CircuitBreaker:
+    return _registry.get(key, BreakerConfig.from_app_config())
+
+
+def reset_breakers() -> None:
+    """Close all breakers by discarding them (e.g., to isolate tests from each other)."""
+    _registry.clear()
+
+
+def get_breaker_stats() -> list[BreakerStats]:
+    return _registry.stats()
@@ -2,7 +2,6 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-only
 
-import asyncio
 import datetime as dt
 from collections.abc import Callable
 
@@ -15,9 +14,13 @@ from flask import (
 )
 from werkzeug.wrappers.response import Response
 
+from .asgi import async_view
+from .async_runner import run_async
 from .auth import get_auth_class, instructor_required
 from .db import get_db
 from .llm import LLM, get_models, with_llm
+from .llm_telemetry import CallTag
+from .rate_limiter import key_limits_from_form
 from .redir import safe_redirect
 from .tz import date_is_past
 
@@ -50,7 +53,7 @@ def config_form() -> str:
     class_id = cur_class.class_id
 
     class_row = db.execute("""
-        SELECT classes.id, classes.enabled, classes_user.link_ident, classes_user.link_reg_expires, classes_user.link_anon_login, classes_user.llm_api_key, classes_user.model_id
+        SELECT classes.id, classes.enabled, classes.llm_cache_enabled, classes_user.link_ident, classes_user.link_reg_expires, classes_user.link_anon_login, classes_user.llm_api_key, classes_user.model_id, classes_user.llm_max_inflight, classes_user.llm_rpm, classes_user.llm_tpm
         FROM classes
         LEFT JOIN classes_user
           ON classes.id = classes_user.class_id
@@ -101,7 +104,8 @@ def save_config() -> Response:
             db.execute("UPDATE classes_user SET link_reg_expires=?, link_anon_login=? WHERE class_id=?", [new_date, class_link_anon_login, class_id])
 
         class_enabled = 1 if 'class_enabled' in request.form else 0
-        db.execute("UPDATE classes SET enabled=? WHERE id=?", [class_enabled, class_id])
+        llm_cache_enabled = 1 if 'llm_cache_enabled' in request.form else 0
+        db.execute("UPDATE classes SET enabled=?, llm_cache_enabled=? WHERE id=?", [class_enabled, llm_cache_enabled, class_id])
         db.commit()
         flash("Class access configuration updated.", "success")
 
@@ -109,6 +113,11 @@ def save_config() -> Response:
         if 'llm_api_key' in request.form:
             db.execute("UPDATE classes_user SET llm_api_key=? WHERE class_id=?", [request.form['llm_api_key'], class_id])
         db.execute("UPDATE classes_user SET model_id=? WHERE class_id=?", [request.form['model_id'], class_id])
+        # rate limits: blank (or invalid) -> NULL, to use the default
+        rate_limits, limits_invalid = key_limits_from_form(request.form)
+        if limits_invalid:
+            flash("Rate limits must be positive whole numbers; invalid limits were set to the default.", "warning")
+        db.execute("UPDATE classes_user SET llm_max_inflight=?, llm_rpm=?, llm_tpm=? WHERE class_id=?", [*rate_limits, class_id])
         db.commit()
         flash("Class language model configuration updated.", "success")
 
@@ -116,9 +125,10 @@ def save_config() -> Response:
 
 
 @bp.route("/test_llm")
+@async_view
 @with_llm()
-def test_llm(llm: LLM) -> str:
-    response, response_txt = asyncio.run(llm.get_completion(prompt="Please write 'OK'"))
+async def test_llm(llm: LLM) -> str:
+    response, response_txt = await run_async(llm.get_completion(prompt="Please write 'OK'", tag=CallTag('test')))
 
     if 'error' in response:
         return f"<b>Error:</b><br>{response_txt}"
@@ -30,6 +30,7 @@ from werkzeug.wrappers.response import Response
 
 from .auth import get_auth, login_required, set_session_auth_class
 from .db import get_db
+from .db_writer import queue_write
 from .redir import safe_redirect_next
 from .tz import date_is_past
 
@@ -182,8 +183,7 @@ def switch_class(class_id: int | None) -> bool:
 
     set_session_auth_class(class_id)
     # record as user's latest active class
-    db.execute("UPDATE users SET last_class_id=? WHERE users.id=?", [class_id, user_id])
-    db.commit()
+    queue_write(lambda conn: conn.execute("UPDATE users SET last_class_id=? WHERE users.id=?", [class_id, user_id]))
     return True
 
 
@@ -0,0 +1,183 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""A process-wide registry of pooled LLM API clients.
+
+Creating an openai.AsyncOpenAI client also creates an httpx connection pool,
+so creating one per request means a fresh TCP+TLS handshake for every
+completion.  Instead, clients are shared across requests, keyed by (provider,
+base_url, api_key), and their connections are kept alive for reuse.
+
+httpx connections are bound to the event loop on which they were opened, so a
+pooled client is only reused by code running on that same loop.  A client
+requested from a different loop is replaced (counted as a miss).
+
+Clients are leased with `async with pool.lease(...)`.  A client that is evicted
+(idle, over capacity, or replaced) while leased is closed once the last lease
+on it is released.
+"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import AsyncIterator
+from contextlib import AbstractAsyncContextManager, asynccontextmanager
+from dataclasses import dataclass, field
+
+import httpx
+import openai
+from flask import current_app
+
+from .mock_llm import MockLLMConfig, MockTransport
+
+ClientKey = tuple[str, str | None, str]  # (provider, base_url, api_key)
+
+
+@dataclass(frozen=True)
+class PoolConfig:
+    max_clients: int = 32           # max number of distinct clients kept in the pool
+    idle_timeout: float = 10*60     # seconds before an unused client is evicted and closed
+    keepalive_expiry: float = 60    # seconds an idle connection is held open for reuse
+    max_connections: int = 100      # per client
+    max_keepalive_connections: int = 20  # per client
+
+    @classmethod
+    def from_app_config(cls) -> 'PoolConfig':
+        config = current_app.config
+        return cls(
+            max_clients=config.get('LLM_CLIENT_POOL_MAX', cls.max_clients),
+            idle_timeout=config.get('LLM_CLIENT_IDLE_TIMEOUT', cls.idle_timeout),
+            keepalive_expiry=config.get('LLM_CLIENT_KEEPALIVE', cls.keepalive_expiry),
+        )
+
+
+@dataclass(frozen=True)
+class PoolStats:
+    size: int
+    hits: int
+    misses: int
+    evictions: int
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+@dataclass
+class _PoolEntry:
+    client: openai.AsyncOpenAI
+    loop: asyncio.AbstractEventLoop
+    last_used: float = field(default_factory=time.monotonic)
+    in_use: int = 0
+    evicted: bool = False
+
+
+class ClientPool:
+    def __init__(self) -> None:
+        self._entries: OrderedDict[ClientKey, _PoolEntry] = OrderedDict()  # ordered least- to most-recently used
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def _make_client(key: ClientKey, config: PoolConfig) -> openai.AsyncOpenAI:
+        provider, base_url, api_key = key
+        # the mock provider without a mock server URL is answered in-process (see mock_llm.py)
+        transport = MockTransport(MockLLMConfig.from_app_config()) if provider == 'mock' and base_url is None else None
+        http_client = openai.DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.max_keepalive_connections,
+                keepalive_expiry=config.keepalive_expiry,
+            ),
+            transport=transport,
+        )
+        # max_retries=0: retries are handled by retry.py, with a policy and deadline across all attempts
+        return openai.AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+
+    def _evict(self, key: ClientKey) -> _PoolEntry:
+        """Remove an entry from the pool.  Must be called with the lock held."""
+        entry = self._entries.pop(key)
+        entry.evicted = True
+        self._evictions += 1
+        return entry
+
+    def _sweep(self, config: PoolConfig) -> list[_PoolEntry]:
+        """Evict stale, idle, and over-capacity entries.  Must be called with the lock held.
+
+        Returns the evicted entries that are not in use and can be closed now.
+        """
+        now = time.monotonic()
+        evicted = [
+            self._evict(key)
+            for key, entry in list(self._entries.items())
+            if entry.loop.is_closed() or (entry.in_use == 0 and now - entry.last_used > config.idle_timeout)
+        ]
+        while len(self._entries) > config.max_clients:
+            oldest_key = next(iter(self._entries))
+            evicted.append(self._evict(oldest_key))
+        return [entry for entry in evicted if entry.in_use == 0]
+
+    @staticmethod
+    async def _close(entry: _PoolEntry) -> None:
+        if entry.loop is asyncio.get_running_loop():
+            await entry.client.close()
+        elif entry.loop.is_running():
+            asyncio.run_coroutine_threadsafe(entry.client.close(), entry.loop)
+        # otherwise, the client's loop is gone, and its connections went with it
+
+    @asynccontextmanager
+    async def lease(self, key: ClientKey, config: PoolConfig) -> AsyncIterator[openai.AsyncOpenAI]:
+        """Lease a client for the given key, creating one if needed."""
+        loop = asyncio.get_running_loop()
+
+        to_close: list[_PoolEntry] = []
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.loop is loop:
+                self._hits += 1
+                self._entries.move_to_end(key)
+            else:
+                self._misses += 1
+                if entry is not None:
+                    # bound to a different loop: replace it (closed now or on release)
+                    old_entry = self._evict(key)
+                    if old_entry.in_use == 0:
+                        to_close.append(old_entry)
+                entry = _PoolEntry(self._make_client(key, config), loop)
+                self._entries[key] = entry
+            entry.in_use += 1
+            to_close.extend(self._sweep(config))
+
+        for old_entry in to_close:
+            await self._close(old_entry)
+
+        try:
+            yield entry.client
+        finally:
+            with self._lock:
+                entry.in_use -= 1
+                entry.last_used = time.monotonic()
+                close_now = entry.evicted and entry.in_use == 0
+            if close_now:
+                await self._close(entry)
+
+    def stats(self) -> PoolStats:
+        with self._lock:
+            return PoolStats(size=len(self._entries), hits=self._hits, misses=self._misses, evictions=self._evictions)
+
+
+_pool = ClientPool()
+
+
+def lease_client(key: ClientKey) -> AbstractAsyncContextManager[openai.AsyncOpenAI]:
+    """Lease a client from the process-wide pool, configured from the current app."""
+    return _pool.lease(key, PoolConfig.from_app_config())
+
+
+def get_pool_stats() -> PoolStats:
+    return _pool.stats()
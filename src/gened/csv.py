@@ -2,29 +2,82 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-only
 
+""" Export rows as CSV or NDJSON (one JSON object per line) file downloads.
+
+Exports are streamed: rows are read from the cursor in batches and written
+to the response as they are read, so memory use does not grow with the
+number of rows exported.  The request context (and so its database
+connection) is kept open until the response has been sent.
+"""
+
 import csv
 import datetime as dt
 import io
-from sqlite3 import Row
+import json
+from collections.abc import Iterator
+from sqlite3 import Cursor, Row
+from typing import Any, Literal
 
-from flask import flash, make_response, render_template
+from flask import flash, render_template, stream_with_context
 from werkzeug.wrappers.response import Response
 
+ExportFormat = Literal['csv', 'ndjson']
+
+_BATCH_ROWS = 500  # rows read from the cursor (and written to the response) at a time
+
+_MIMETYPES: dict[ExportFormat, str] = {
+    'csv': "text/csv",
+    'ndjson': "application/x-ndjson",
+}
+
+
+def _batches(first: Row, cursor: Cursor) -> Iterator[list[Row]]:
+    yield [first]
+    while rows := cursor.fetchmany(_BATCH_ROWS):
+        yield rows
+
+
+def _csv_chunks(columns: list[str], batches: Iterator[list[Row]]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)  # column headers
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _json_default(value: Any) -> str:
+    if isinstance(value, dt.date | dt.datetime):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return value.decode(errors='replace')
+    return str(value)
+
+
+def _ndjson_chunks(columns: list[str], batches: Iterator[list[Row]]) -> Iterator[str]:
+    for rows in batches:
+        yield "".join(
+            json.dumps(dict(zip(columns, row, strict=True)), default=_json_default) + "\n"
+            for row in rows
+        )
+
 
-def csv_response(file_name: str, kind: str, table: list[Row]) -> str | Response:
-    if not table:
+def export_response(file_name: str, kind: str, cursor: Cursor, fmt: ExportFormat = 'csv') -> str | Response:
+    """ Stream the rows of a cursor as a file download in the given format. """
+    first = cursor.fetchone()
+    if first is None:
         flash("There are no rows to export yet.", "warning")
         return render_template("error.html")
 
-    stringio = io.StringIO()
-    writer = csv.writer(stringio)
-    writer.writerow(table[0].keys())  # column headers
-    writer.writerows(table)
+    columns = [col[0] for col in cursor.description]
+    make_chunks = _csv_chunks if fmt == 'csv' else _ndjson_chunks
+    chunks = make_chunks(columns, _batches(first, cursor))
 
-    output = make_response(stringio.getvalue())
+    output = Response(stream_with_context(chunks), mimetype=_MIMETYPES[fmt])
     file_name = file_name.replace(" ","-")
     timestamp = dt.datetime.now().strftime("%Y%m%d")
-    output.headers["Content-Disposition"] = f"attachment; filename={timestamp}_{file_name}_{kind}.csv"
-    output.headers["Content-type"] = "text/csv"
+    output.headers["Content-Disposition"] = f"attachment; filename={timestamp}_{file_name}_{kind}.{fmt}"
 
     return output
@@ -3,15 +3,19 @@
 # SPDX-License-Identifier: AGPL-3.0-only
 
 import errno
+import os
 import secrets
 import sqlite3
 import string
+import threading
 import time
 from collections.abc import Callable
+from dataclasses import dataclass
 from datetime import date, datetime
 from getpass import getpass
 from importlib import resources
 from pathlib import Path
+from typing import Any
 
 import click
 import pyrage
@@ -19,6 +23,8 @@ from flask import current_app, g
 from flask.app import Flask
 from werkzeug.security import generate_password_hash
 
+from .sql_stats import StatementStats, add_rows, record_statement
+
 AUTH_PROVIDER_LOCAL = 1
 
 
@@ -47,7 +53,76 @@ sqlite3.register_converter("date", convert_date)
 sqlite3.register_converter("datetime", convert_datetime)
 
 
-class TimingConnection(sqlite3.Connection):
+class InstrumentedCursor(sqlite3.Cursor):
+    """A Cursor subclass that adds the rows it fetches (and the time taken) to its statement's stats."""
+    _stats: StatementStats | None = None
+
+    def _fetched(self, rows: int, start: float) -> None:
+        if self._stats is not None:
+            add_rows(self._stats, rows, time.perf_counter() - start)
+
+    def fetchone(self) -> Any:
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(row is not None, start)
+        return row
+
+    def fetchmany(self, *args, **kwargs) -> list[Any]:  # type: ignore[no-untyped-def]
+        start = time.perf_counter()
+        rows = super().fetchmany(*args, **kwargs)
+        self._fetched(len(rows), start)
+        return rows
+
+    def fetchall(self) -> list[Any]:
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(len(rows), start)
+        return rows
+
+    def __next__(self) -> Any:
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(0, start)
+            raise
+        self._fetched(1, start)
+        return row
+
+
+class Connection(sqlite3.Connection):
+    """A Connection subclass that records stats for every statement (see sql_stats.py).
+
+    It also notes whether it has run a script: a script (e.g., a schema or
+    migration) may change the connection's state (e.g., with PRAGMA
+    foreign_keys), so such a connection is not reused by the ConnectionPool.
+    """
+    ran_script = False
+
+    def execute(self, sql: str, *args, **kwargs) -> sqlite3.Cursor:  # type: ignore[no-untyped-def]
+        cursor = self.cursor(InstrumentedCursor)
+        start = time.perf_counter()
+        cursor.execute(sql, *args, **kwargs)
+        stats = record_statement(sql, time.perf_counter() - start, args[0] if args else ())
+        if cursor.description is None:
+            add_rows(stats, max(cursor.rowcount, 0), 0.0)  # rows changed
+        else:
+            cursor._stats = stats  # noqa: SLF001 -- rows are counted as they are fetched
+        return cursor
+
+    def executemany(self, sql: str, *args, **kwargs) -> sqlite3.Cursor:  # type: ignore[no-untyped-def]
+        start = time.perf_counter()
+        cursor = super().executemany(sql, *args, **kwargs)
+        stats = record_statement(sql, time.perf_counter() - start)
+        add_rows(stats, max(cursor.rowcount, 0), 0.0)
+        return cursor
+
+    def executescript(self, *args, **kwargs) -> sqlite3.Cursor:  # type: ignore[no-untyped-def]
+        self.ran_script = True
+        return super().executescript(*args, **kwargs)
+
+
+class TimingConnection(Connection):
     """A Connection subclass that logs query execution times when in debug mode."""
     def execute(self, sql: str, *args, **kwargs) -> sqlite3.Cursor:  # type: ignore[no-untyped-def]
         start = time.perf_counter()
@@ -69,15 +144,145 @@ class TimingConnection(sqlite3.Connection):
 
 
 
+@dataclass(frozen=True)
+class DBPoolStats:
+    idle: int      # connections in the pool, ready for reuse
+    in_use: int    # connections currently held by app contexts
+    hits: int      # connections reused from the pool
+    misses: int    # new connections opened
+    discards: int  # connections closed on release (pool full, or unpooled)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+def _apply_pragmas(conn: sqlite3.Connection, pragmas: dict[str, str | int]) -> None:
+    for name, value in pragmas.items():
+        # PRAGMA does not accept bound parameters, so check that both are plain tokens
+        assert name.isidentifier(), f"Invalid pragma name: {name!r}"
+        assert isinstance(value, int) or value.isalnum(), f"Invalid value for pragma {name}: {value!r}"
+        conn.execute(f"PRAGMA {name}={value}")
+
+
+def connect(app: Flask, path: str | None = None) -> sqlite3.Connection:
+    """Open a new connection to the app's database (or the given path), configured with DB_PRAGMAS.
+
+    Most code should use get_db() instead.
+    """
+    connection_class = TimingConnection if app.debug else Connection
+    conn = sqlite3.connect(
+        path or app.config['DATABASE'],
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        factory=connection_class,
+        check_same_thread=False,  # pooled connections may be reused by any thread
+    )
+    conn.row_factory = sqlite3.Row
+    _apply_pragmas(conn, app.config['DB_PRAGMAS'])
+    return conn
+
+
+class ConnectionPool:
+    """A per-process pool of database connections, shared by all threads of an app.
+
+    Opening a connection is cheap, but a new connection starts with an empty
+    page cache and must re-read and parse the schema on its first query.  A
+    connection released at the end of an app context is kept (up to
+    DB_POOL_SIZE of them) for the next context to use, with any uncommitted
+    transaction rolled back.  A connection is only ever used by one app
+    context (and so one thread) at a time.  A connection that has run a script
+    is closed rather than reused (see Connection).
+
+    Each new connection is configured with the pragmas in DB_PRAGMAS.
+    """
+    def __init__(self, app: Flask) -> None:
+        self._app = app
+        self._idle: list[tuple[str, sqlite3.Connection]] = []  # (database path, connection), most recently used last
+        self._lock = threading.Lock()
+        self._pid = os.getpid()  # connections must not be shared with a forked child process
+        self._in_use = 0
+        self._hits = 0
+        self._misses = 0
+        self._discards = 0
+
+    def acquire(self) -> sqlite3.Connection:
+        path = self._app.config['DATABASE']
+        with self._lock:
+            if self._pid != os.getpid():
+                # forked: abandon (without closing) the parent's connections
+                self._idle = []
+                self._in_use = 0
+                self._pid = os.getpid()
+            self._in_use += 1
+            while self._idle:
+                conn_path, conn = self._idle.pop()
+                if conn_path == path:
+                    self._hits += 1
+                    return conn
+                conn.close()  # the database path has changed (e.g., in tests)
+            self._misses += 1
+        try:
+            return connect(self._app, path)
+        except Exception:
+            with self._lock:
+                self._in_use -= 1
+            raise
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        reusable = not getattr(conn, 'ran_script', False)
+        try:
+            if conn.in_transaction:
+                conn.rollback()  # don't carry one context's uncommitted changes into another
+        except sqlite3.Error:
+            reusable = False  # e.g., closed by its user
+        with self._lock:
+            self._in_use -= 1
+            keep = reusable and len(self._idle) < self._app.config['DB_POOL_SIZE']
+            if keep:
+                self._idle.append((self._app.config['DATABASE'], conn))
+            else:
+                self._discards += 1
+        if not keep:
+            conn.close()
+
+    def close_all(self) -> None:
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for _, conn in idle:
+            conn.close()
+
+    def stats(self) -> DBPoolStats:
+        with self._lock:
+            return DBPoolStats(
+                idle=len(self._idle),
+                in_use=self._in_use,
+                hits=self._hits,
+                misses=self._misses,
+                discards=self._discards,
+            )
+
+
+def _get_pool(app: Flask) -> ConnectionPool:
+    pool = app.extensions['gened_db_pool']
+    assert isinstance(pool, ConnectionPool)
+    return pool
+
+
+def get_db_pool_stats() -> DBPoolStats:
+    """Get statistics for the current app's connection pool (in this worker process)."""
+    return _get_pool(current_app).stats()
+
+
+def close_db_pool(app: Flask) -> None:
+    """Close the app's pooled connections (e.g., before removing the database)."""
+    _get_pool(app).close_all()
+
+
 def get_db() -> sqlite3.Connection:
     if 'db' not in g:
-        connection_class = TimingConnection if current_app.debug else sqlite3.Connection
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES,
-            factory=connection_class
-        )
-        g.db.row_factory = sqlite3.Row
+        g.db = _get_pool(current_app).acquire()
 
     assert isinstance(g.db, sqlite3.Connection)
     return g.db
@@ -129,7 +334,7 @@ def close_db(e: BaseException | None = None) -> None:  # noqa: ARG001 - unused f
     db = g.pop('db', None)
 
     if db is not None:
-        db.close()
+        _get_pool(current_app).release(db)
 
 
 # Functions to be called at the end of init_db().
@@ -224,6 +429,7 @@ def setpassword_command(username: str) -> None:
 
 
 def init_app(app: Flask) -> None:
+    app.extensions['gened_db_pool'] = ConnectionPool(app)
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
     app.cli.add_command(newuser_command)
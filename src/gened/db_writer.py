@@ -0,0 +1,268 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""A single writer thread applying database writes in group commits.
+
+Each commit is an fsync, and each takes SQLite's write lock.  When many
+request threads each commit their own small writes, they queue for the lock
+(failing with 'database is locked' after busy_timeout) and each pays for its
+own fsync.  Writes submitted with queue_write() are instead applied by one
+writer thread on its own connection, which takes all of the writes waiting
+(up to DB_WRITE_BATCH_MAX), applies each in its own savepoint, and commits
+them together.  A batch waits at most DB_WRITE_MAX_DELAY seconds for more
+writes to join it, bounding the latency added to any write.
+
+  - A write is a function that is given a connection and returns a result.
+    It runs in the writer thread, so it should use the values it needs
+    (e.g., a user id) rather than reading them from the request, and it must
+    not commit.
+  - queue_write() returns a Future with the write's result, set once its
+    batch is committed.  write() waits for that, for callers that need the
+    result (e.g., a new row's id) or to read the write back.  Otherwise,
+    all of a context's writes are waited for (and so durable) when the
+    context ends, e.g. before a request's response is complete.
+  - Code running on an event loop (e.g., an async view served natively by
+    ASGIApp) uses write_async() and flush_writes_async() instead, which
+    await the writes rather than blocking the loop.
+  - A write that raises is rolled back (to its savepoint) without affecting
+    the rest of its batch, and its Future raises the exception.
+
+With DB_WRITER=False, each write is applied and committed immediately on the
+context's own connection (get_db()).
+"""
+
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, TypeVar
+
+from flask import Flask, current_app, g
+
+from .db import connect, get_db
+
+T = TypeVar('T')
+
+Write = Callable[[sqlite3.Connection], Any]
+
+_STOP = object()  # queued to stop the writer thread
+
+# Max seconds a context waits for its queued writes when it ends
+_FLUSH_TIMEOUT = 60
+
+
+@dataclass(frozen=True)
+class WriterStats:
+    writes: int   # writes applied (committed or failed)
+    batches: int  # commits
+    failed: int   # writes that raised, or whose commit failed
+    queued: int   # writes waiting for the writer
+
+    @property
+    def mean_batch(self) -> float:
+        return self.writes / self.batches if self.batches else 0.0
+
+
+class DBWriter:
+    """A writer thread for an app's database (see the module docstring)."""
+    def __init__(self, app: Flask) -> None:
+        self._app = app
+        self._queue: queue.SimpleQueue[tuple[Write, Future[Any]] | object] = queue.SimpleQueue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._writes = 0
+        self._batches = 0
+        self._failed = 0
+
+    def submit(self, fn: Write) -> 'Future[Any]':
+        future: Future[Any] = Future()
+        self._start()
+        self._queue.put((fn, future))
+        return future
+
+    def _start(self) -> None:
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # forked: the parent's thread and queue don't exist here
+                self._queue = queue.SimpleQueue()
+                self._thread = None
+                self._pid = os.getpid()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the writer thread, after applying all writes queued before the call."""
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                return
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> WriterStats:
+        return WriterStats(writes=self._writes, batches=self._batches, failed=self._failed, queued=self._queue.qsize())
+
+    def _next_batch(self) -> tuple[list[tuple[Write, 'Future[Any]']], bool]:
+        """Wait for a write, then gather any others that are waiting or arrive within DB_WRITE_MAX_DELAY.
+
+        Returns the batch and whether the writer should stop after it.
+        """
+        config = self._app.config
+        batch: list[tuple[Write, Future[Any]]] = []
+        item = self._queue.get()
+        deadline = time.monotonic() + config['DB_WRITE_MAX_DELAY']
+        while item is not _STOP:
+            assert isinstance(item, tuple)
+            batch.append(item)
+            if len(batch) >= config['DB_WRITE_BATCH_MAX']:
+                break
+            try:
+                item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+        return batch, item is _STOP
+
+    def _apply(self, conn: sqlite3.Connection, batch: list[tuple[Write, 'Future[Any]']]) -> None:
+        """Apply a batch of writes in one transaction, resolving their Futures once it is committed."""
+        results: list[tuple[Future[Any], Any, BaseException | None]] = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, future in batch:
+                conn.execute("SAVEPOINT write")
+                try:
+                    result = fn(conn)
+                except Exception as e:  # noqa: BLE001 -- passed to the write's Future
+                    conn.execute("ROLLBACK TO write")
+                    results.append((future, None, e))
+                else:
+                    results.append((future, result, None))
+                conn.execute("RELEASE write")
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            # the batch as a whole failed (e.g., the commit)
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            self._app.logger.exception("Database write batch failed.")
+            results = [(future, None, e) for _, future in batch]
+
+        self._batches += 1
+        for future, result, error in results:
+            self._writes += 1
+            if error is None:
+                future.set_result(result)
+            else:
+                self._failed += 1
+                future.set_exception(error)
+
+    def _run(self) -> None:
+        with self._app.app_context():
+            conn = connect(self._app)
+            conn.isolation_level = None  # transactions are managed explicitly, in _apply()
+            try:
+                stop = False
+                while not stop:
+                    batch, stop = self._next_batch()
+                    if batch:
+                        self._apply(conn, batch)
+            finally:
+                conn.close()
+
+
+def _get_writer(app: Flask) -> DBWriter:
+    writer = app.extensions['gened_db_writer']
+    assert isinstance(writer, DBWriter)
+    return writer
+
+
+def queue_write(fn: Callable[[sqlite3.Connection], T]) -> 'Future[T]':
+    """Queue a write, returning a Future for its result once committed.
+
+    The current context waits for the write when it ends (see flush_writes()).
+    """
+    if not current_app.config['DB_WRITER']:
+        future: Future[T] = Future()
+        db = get_db()
+        try:
+            result = fn(db)
+            db.commit()
+            future.set_result(result)
+        except Exception as e:  # noqa: BLE001 -- passed to the Future
+            db.rollback()
+            future.set_exception(e)
+        return future
+
+    if 'db' in g and g.db.in_transaction:
+        # Commit this context's own pending changes, as a commit here would
+        # have before the writer existed.  (Otherwise, they would hold the
+        # write lock, and the writer would wait for it.)
+        g.db.commit()
+
+    future = _get_writer(current_app).submit(fn)
+    g.setdefault('pending_writes', []).append(future)
+    return future
+
+
+def write(fn: Callable[[sqlite3.Connection], T]) -> T:
+    """Queue a write and wait for it to be committed, returning its result (or raising its exception)."""
+    return queue_write(fn).result()
+
+
+async def write_async(fn: Callable[[sqlite3.Connection], T]) -> T:
+    """Queue a write and await its commit, returning its result (or raising its exception)."""
+    return await asyncio.wrap_future(queue_write(fn))
+
+
+def flush_writes() -> None:
+    """Wait for all writes queued in the current context to be committed.
+
+    Raises the exception of the first write that failed, if any.
+    """
+    pending: list[Future[Any]] = g.pop('pending_writes', [])
+    errors = [e for e in (future.exception(_FLUSH_TIMEOUT) for future in pending) if e is not None]
+    if errors:
+        raise errors[0]
+
+
+async def flush_writes_async() -> None:
+    """Await all writes queued in the current context, as flush_writes() waits for them."""
+    pending: list[Future[Any]] = g.pop('pending_writes', [])
+    if not pending:
+        return
+    waiting = [asyncio.wrap_future(future) for future in pending]
+    done, _ = await asyncio.wait(waiting, timeout=_FLUSH_TIMEOUT)
+    errors = [e for e in (future.exception() for future in waiting if future in done) if e is not None]
+    if len(done) < len(waiting):
+        errors.append(TimeoutError("Timed out waiting for queued database writes."))
+    if errors:
+        raise errors[0]
+
+
+def get_writer_stats() -> WriterStats:
+    """Get statistics for the current app's writer (in this worker process)."""
+    return _get_writer(current_app).stats()
+
+
+def stop_writer(app: Flask) -> None:
+    _get_writer(app).stop()
+
+
+def _flush_on_teardown(e: BaseException | None = None) -> None:  # noqa: ARG001 - unused function argument
+    try:
+        flush_writes()
+    except Exception:
+        current_app.logger.exception("Queued database write failed.")
+
+
+def init_app(app: Flask) -> None:
+    app.extensions['gened_db_writer'] = DBWriter(app)
+    app.teardown_appcontext(_flush_on_teardown)
@@ -0,0 +1,240 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""Index suggestions from the recorded SQL workload.
+
+`flask index-advisor` takes the statement shapes recorded by sql_stats.py
+(merged from all processes' snapshots, most total time first), runs EXPLAIN
+QUERY PLAN for each, and flags the plan steps that do work proportional to
+a table's size: full scans of a table, temporary B-trees built for ORDER BY,
+GROUP BY, or DISTINCT, and automatic indexes built for a single statement.
+
+For each flagged statement, it tries candidate indexes built from the
+columns the statement reads from each table (equality-constrained columns
+first, then range or ordering columns, then any others to make the index
+covering) and proposes the one that removes the most flagged steps.
+
+All planning is done on an empty in-memory copy of the database's schema and
+statistics (sqlite_stat1, if ANALYZE has been run), so the database itself
+is never changed or locked, and candidate indexes cost nothing to build.
+Because a shape has its values replaced by ?, the statements are planned
+with NULL parameters; this can change a plan only where SQLite would use
+the values themselves (e.g., with sqlite_stat4).
+"""
+
+import re
+import sqlite3
+from dataclasses import dataclass, field
+
+import click
+from flask import Flask, current_app
+
+from .db import get_db
+from .sql_stats import StatementStats, load_snapshots
+
+_MAX_INDEX_COLUMNS = 6  # candidates are only made covering up to this many columns
+
+_PLANNED_STATEMENTS = ('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT')
+
+_SCAN_RE = re.compile(r"^SCAN (\w+)")
+_COLUMN = r"(?:(\w+)\.)?(\w+)"
+_EQ_RE = re.compile(rf"{_COLUMN}\s*(?:==?|\bIN\b|\bIS\b)|(?<![<>!])==?\s*{_COLUMN}", re.IGNORECASE)
+_RANGE_RE = re.compile(rf"{_COLUMN}\s*(?:[<>]=?|\bBETWEEN\b)|[<>]=?\s*{_COLUMN}", re.IGNORECASE)
+_ORDER_RE = re.compile(r"\b(?:ORDER|GROUP) BY\s+(.*?)(?=\bLIMIT\b|\bHAVING\b|\bORDER BY\b|\)|$)", re.IGNORECASE | re.DOTALL)
+_QUOTED_RE = re.compile(r'"[^"]*"|`[^`]*`|\[[^\]]*\]')
+_ALIAS_RE = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+AS)?\s+(\w+)", re.IGNORECASE)
+
+
+@dataclass
+class Advice:
+    stats: StatementStats
+    plan: list[str] = field(default_factory=list)
+    problems: list[str] = field(default_factory=list)  # flagged plan steps
+    proposal: str | None = None  # a CREATE INDEX statement that removes some of them
+    error: str | None = None  # if the statement could not be planned
+
+
+def _scratch_copy(db: sqlite3.Connection) -> sqlite3.Connection:
+    """An empty in-memory database with the same schema and statistics as db."""
+    scratch = sqlite3.connect(":memory:", isolation_level=None)
+    objects = db.execute("""
+        SELECT type, sql FROM sqlite_schema
+        WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'
+        ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 WHEN 'view' THEN 2 ELSE 3 END
+    """).fetchall()
+    for obj in objects:
+        try:
+            scratch.execute(obj[1])
+        except sqlite3.Error:
+            if obj[0] == 'table':
+                raise
+            # e.g., an index on a function this connection lacks; planning without it is the best we can do
+
+    has_stats = db.execute("SELECT 1 FROM sqlite_schema WHERE name='sqlite_stat1'").fetchone()
+    if has_stats:
+        scratch.execute("ANALYZE")  # creates sqlite_stat1
+        scratch.execute("DELETE FROM sqlite_stat1")
+        scratch.executemany("INSERT INTO sqlite_stat1 VALUES (?, ?, ?)", [tuple(row) for row in db.execute("SELECT tbl, idx, stat FROM sqlite_stat1")])
+        scratch.execute("ANALYZE sqlite_schema")  # reload the statistics
+    return scratch
+
+
+def _plannable(shape: str) -> str:
+    """Turn a statement shape back into SQL that can be prepared (one value per collapsed list)."""
+    return shape.replace(", ...", "")
+
+
+class _Planner:
+    def __init__(self, scratch: sqlite3.Connection) -> None:
+        self._db = scratch
+        self._reads: set[tuple[str, str]] = set()
+        self._db.set_authorizer(self._authorize)
+        self._tables = {row[0] for row in scratch.execute("SELECT name FROM sqlite_schema WHERE type='table'")}
+        self._columns = {
+            table: [row[0] for row in scratch.execute("SELECT name FROM pragma_table_xinfo(?)", [table])]
+            for table in self._tables
+        }
+        # the rowid (an INTEGER PRIMARY KEY) is part of every index already
+        self._rowid = {table: self._rowid_column(table) for table in self._tables}
+
+    def _rowid_column(self, table: str) -> str | None:
+        pks = self._db.execute("SELECT name, type FROM pragma_table_info(?) WHERE pk", [table]).fetchall()
+        return pks[0][0] if len(pks) == 1 and pks[0][1].upper() == 'INTEGER' else None
+
+    def _authorize(self, action: int, arg1: str | None, arg2: str | None, _db_name: str | None, _trigger: str | None) -> int:
+        if action == sqlite3.SQLITE_READ and arg1 and arg2:
+            self._reads.add((arg1, arg2))
+        return sqlite3.SQLITE_OK
+
+    def explain(self, sql: str) -> list[str]:
+        """The detail lines of sql's query plan; also notes the columns it reads."""
+        self._reads = set()
+        num_params = _QUOTED_RE.sub("", sql).count("?")  # not counting any ? in a quoted name, like "active?"
+        rows = self._db.execute(f"EXPLAIN QUERY PLAN {sql}", [None] * num_params).fetchall()
+        return [row[3] for row in rows]
+
+    def problems(self, sql: str, plan: list[str]) -> list[str]:
+        aliases = {alias: table for table, alias in _ALIAS_RE.findall(sql) if table in self._tables}
+        flagged = []
+        for detail in plan:
+            scan = _SCAN_RE.match(detail)
+            if (scan and aliases.get(scan[1], scan[1]) in self._tables) or "TEMP B-TREE" in detail or "AUTOMATIC" in detail:
+                flagged.append(detail)
+        return flagged
+
+    def _referenced(self, pattern: re.Pattern[str], text: str, table: str, aliases: dict[str, str]) -> list[str]:
+        """Columns of table matched by pattern in text, in order of appearance."""
+        found = []
+        for match in pattern.finditer(text):
+            groups = match.groups()
+            for qualifier, column in zip(groups[::2], groups[1::2], strict=True):
+                if column is None or column not in self._columns[table]:
+                    continue
+                if qualifier is not None and aliases.get(qualifier, qualifier) != table:
+                    continue
+                if column not in found:
+                    found.append(column)
+        return found
+
+    def candidates(self, sql: str) -> list[tuple[str, list[str]]]:
+        """Candidate indexes (table, columns) for a statement just explain()ed, from the columns it reads."""
+        aliases = {alias: table for table, alias in _ALIAS_RE.findall(sql) if table in self._tables}
+        order_text = " ".join(_ORDER_RE.findall(sql))
+        candidates: list[tuple[str, list[str]]] = []
+        for table in sorted({table for table, _ in self._reads if table in self._tables}):
+            read = [column for t, column in sorted(self._reads) if t == table and column != self._rowid[table]]
+            eq = [c for c in self._referenced(_EQ_RE, sql, table, aliases) if c in read]
+            ranged = [c for c in self._referenced(_RANGE_RE, sql, table, aliases) if c in read and c not in eq]
+            ordered = [c for c in self._referenced(re.compile(_COLUMN), order_text, table, aliases) if c in read and c not in eq]
+            for key in (eq + ordered, eq + ranged, eq):
+                if not key:
+                    continue
+                covering = key + [c for c in read if c not in key]
+                for columns in (covering, key):
+                    if len(columns) <= _MAX_INDEX_COLUMNS and (table, columns) not in candidates:
+                        candidates.append((table, columns))
+        return candidates
+
+    def try_index(self, sql: str, table: str, columns: list[str]) -> list[str]:
+        """The flagged steps of sql's plan with an index on table(columns) added."""
+        self._db.execute("SAVEPOINT candidate")
+        try:
+            self._db.execute(f"CREATE INDEX advisor_candidate ON {table}({', '.join(columns)})")
+            return self.problems(sql, self.explain(sql))
+        finally:
+            self._db.execute("ROLLBACK TO candidate")
+            self._db.execute("RELEASE candidate")
+
+
+def _index_statement(table: str, columns: list[str]) -> str:
+    return f"CREATE INDEX {table}_by_{'_'.join(columns)} ON {table}({', '.join(columns)});"
+
+
+def advise(planner: _Planner, stats: StatementStats) -> Advice:
+    advice = Advice(stats)
+    sql = _plannable(stats.shape)
+    try:
+        advice.plan = planner.explain(sql)
+        candidates = planner.candidates(sql)
+    except sqlite3.Error as e:
+        advice.error = str(e)
+        return advice
+    advice.problems = planner.problems(sql, advice.plan)
+    if not advice.problems:
+        return advice
+
+    best: tuple[int, int] | None = None  # (flagged steps remaining, columns)
+    for table, columns in candidates:
+        remaining = len(planner.try_index(sql, table, columns))
+        score = (remaining, len(columns))
+        if remaining < len(advice.problems) and (best is None or score < best):
+            best = score
+            advice.proposal = _index_statement(table, columns)
+    return advice
+
+
+def advise_workload(statements: list[StatementStats]) -> list[Advice]:
+    """Plan each recorded statement against the current database's schema, with any proposed index."""
+    scratch = _scratch_copy(get_db())
+    try:
+        planner = _Planner(scratch)
+        return [advise(planner, stats) for stats in statements if stats.shape.upper().startswith(_PLANNED_STATEMENTS)]
+    finally:
+        scratch.close()
+
+
+@click.command('index-advisor')
+@click.option('--limit', default=30, help="Number of statements to examine, most total time first.")
+@click.option('--all', 'show_all', is_flag=True, help="Also show statements with no flagged plan steps.")
+def index_advisor_command(*, limit: int, show_all: bool) -> None:
+    """Flag full scans and temp B-trees in the plans of recorded statements and propose indexes for them."""
+    stats, _ = load_snapshots(current_app)
+    if not stats:
+        click.echo("No recorded statements; see `flask sql-stats`.")
+        return
+
+    results = advise_workload(stats[:limit])
+    for advice in results:
+        if not (advice.problems or advice.error or show_all):
+            continue
+        s = advice.stats
+        click.echo(f"{s.calls:8d} calls {s.total_time*1000:10.1f} ms  {s.shape}")
+        if advice.error:
+            click.echo(f"    could not plan: {advice.error}")
+        for detail in advice.plan:
+            flag = "!" if detail in advice.problems else " "
+            click.echo(f"  {flag} {detail}")
+        if advice.proposal:
+            click.echo(f"    proposed: {advice.proposal}")
+        click.echo()
+
+    proposals = list(dict.fromkeys(advice.proposal for advice in results if advice.proposal))
+    flagged = sum(1 for advice in results if advice.problems)
+    click.echo(f"{flagged} of {len(results)} statements have flagged plan steps; {len(proposals)} indexes proposed.")
+    for proposal in proposals:
+        click.echo(proposal)
+
+
+def init_app(app: Flask) -> None:
+    app.cli.add_command(index_advisor_command)
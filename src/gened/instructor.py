@@ -13,7 +13,7 @@ All routes in this blueprint require instructor privileges.
 For general class operations available to all users, see classes.py.
 """
 
-from sqlite3 import Row
+from sqlite3 import Cursor
 
 from flask import (
     Blueprint,
@@ -26,10 +26,18 @@ from flask import (
 )
 from werkzeug.wrappers.response import Response
 
-from .app_data import Filters, get_registered_data_source
+from .app_data import (
+    DataSource,
+    Filters,
+    TableQuery,
+    get_registered_data_source,
+    query_rows,
+    set_table_page,
+    table_page_response,
+)
 from .auth import get_auth_class, instructor_required
 from .classes import switch_class
-from .csv import csv_response
+from .csv import ExportFormat, export_response
 from .data_deletion import delete_class_data
 from .db import get_db
 from .redir import safe_redirect
@@ -43,7 +51,7 @@ def before_request() -> None:
     """ Apply decorator to protect all instructor blueprint endpoints. """
 
 
-def _get_class_queries(user_id: int | None = None) -> list[Row]:
+def _class_filters(user_id: int | None = None) -> Filters:
     cur_class = get_auth_class()
     class_id = cur_class.class_id
 
@@ -53,50 +61,53 @@ def _get_class_queries(user_id: int | None = None) -> list[Row]:
     if user_id is not None:
         filters.add('user', user_id)
 
-    get_queries = get_registered_data_source('queries').function
-    queries = get_queries(filters).fetchall()
+    return filters
 
-    return queries
+
+def _get_class_queries(user_id: int | None = None) -> Cursor:
+    get_queries = get_registered_data_source('queries').function
+    return get_queries(_class_filters(user_id))
 
 
-def _get_class_users(*, for_export: bool = False) -> list[Row]:
+def _get_class_users(_: Filters | None = None, limit: int = -1, offset: int = 0, before_id: int | None = None, table_query: TableQuery | None = None, *, for_export: bool = False) -> Cursor:
+    """ A DataFunction for the users in the current class (see _users_source()). """
+    assert before_id is None  # ordered by name, so not used with keyset pagination
     cur_class = get_auth_class()
     class_id = cur_class.class_id
 
-    db = get_db()
-
-    users = db.execute(f"""
+    sql = f"""
         SELECT
             {'roles.id AS role_id,' if not for_export else ''}
             users.id AS id,
             json_array(users.display_name, auth_providers.name, users.display_extra) AS user,
-            COUNT(queries.id) AS "#queries",
-            SUM(CASE WHEN queries.query_time > date('now', '-7 days') THEN 1 ELSE 0 END) AS "1wk",
+            (SELECT COALESCE(SUM(queries), 0) FROM usage_role_daily WHERE role_id=roles.id) AS "#queries",
+            (SELECT COALESCE(SUM(queries), 0) FROM usage_role_daily WHERE role_id=roles.id AND day >= date('now', '-7 days')) AS "1wk",
             roles.active AS "active?",
             roles.role = "instructor" AS "instructor?"
         FROM users
         LEFT JOIN auth_providers ON users.auth_provider=auth_providers.id
         JOIN roles ON roles.user_id=users.id
-        LEFT JOIN queries ON queries.role_id=roles.id
         WHERE roles.class_id=?
-        GROUP BY users.id
-        ORDER BY users.display_name
-    """, [class_id]).fetchall()
+    """
+    return query_rows(sql, [class_id], order_by='"user", id', limit=limit, offset=offset, table_query=table_query)
 
-    return users
 
-
-@bp.route("/")
-def main() -> str | Response:
-    users = _get_class_users()
+def _users_source() -> DataSource:
     users_table = DataTable(
         name='users',
         columns=[NumCol('role_id', hidden=True), NumCol('id', hidden=True), UserCol('user'), NumCol('#queries'), NumCol('1wk'), BoolCol('active?', url=url_for('.set_role_active')), BoolCol('instructor?', url=url_for('.set_role_instructor'))],
         link_col=1,
         link_template='?user=${value}',
         csv_link=url_for('instructor.get_csv', kind='users'),
-        data=users,
     )
+    return DataSource('users', _get_class_users, users_table, keyset=False)
+
+
+@bp.route("/")
+def main() -> str | Response:
+    users_source = _users_source()
+    users_table = users_source.table
+    set_table_page(users_table, users_source, Filters(), url_for('.get_page', kind='users'))
 
     sel_user_name = None
     sel_user_id = request.args.get('user', type=int)
@@ -106,15 +117,28 @@ def main() -> str | Response:
         if sel_user_row:
             sel_user_name = sel_user_row['display_name']
 
-    queries_table = get_registered_data_source('queries').table
-    queries_table.data = _get_class_queries(sel_user_id)
+    queries_source = get_registered_data_source('queries')
+    queries_table = queries_source.table
+    set_table_page(queries_table, queries_source, _class_filters(sel_user_id), url_for('.get_page', kind='queries', user=sel_user_id))
     queries_table.csv_link = url_for('instructor.get_csv', kind='queries')
 
     return render_template("instructor_view.html", users=users_table, queries=queries_table, user=sel_user_name)
 
 
+@bp.route("/page/<string:kind>")
+def get_page(kind: str) -> Response:
+    """ Get a page of rows for one of the (server-side) tables in the instructor view. """
+    if kind == 'queries':
+        return table_page_response(get_registered_data_source('queries'), _class_filters(request.args.get('user', type=int)))
+    elif kind == 'users':
+        return table_page_response(_users_source(), Filters())
+    else:
+        return abort(404)
+
+
 @bp.route("/csv/<string:kind>")
-def get_csv(kind: str) -> str | Response:
+@bp.route("/export/<string:kind>/<any(csv, ndjson):fmt>")
+def get_csv(kind: str, fmt: ExportFormat = 'csv') -> str | Response:
     if kind not in ('queries', 'users'):
         return abort(404)
 
@@ -122,11 +146,11 @@ def get_csv(kind: str) -> str | Response:
     class_name = cur_class.class_name
 
     if kind == "queries":
-        table = _get_class_queries()
+        rows = _get_class_queries()
     elif kind == "users":
-        table = _get_class_users(for_export=True)
+        rows = _get_class_users(for_export=True)
 
-    return csv_response(class_name, kind, table)
+    return export_response(class_name, kind, rows, fmt)
 
 
 @bp.route("/role/set_active", methods=["POST"])  # just for url_for in the Javascript code
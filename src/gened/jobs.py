@@ -0,0 +1,262 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""A durable queue of background jobs, stored in the jobs table.
+
+Work that would otherwise hold a request's thread for a long time (e.g., a
+series of LLM calls) can be enqueued as a job and run by a pool of worker
+threads, letting the request return immediately.
+
+  - Handlers are registered by kind with register_job_handler() and are
+    called with the job's payload (a JSON-serializable dict) within an app
+    context.  Handlers should be idempotent, as a job may be run more than once.
+  - Jobs are claimed atomically, so any number of worker threads and
+    processes can share the queue.  A claimed job holds a lease for
+    JOB_LEASE_SECONDS, renewed while its handler runs; if its worker dies
+    (e.g., the server restarts), the lease expires and the job is run again.
+  - A job whose handler raises is retried, up to JOB_MAX_ATTEMPTS attempts,
+    then marked 'failed' with the error.  Completed jobs are deleted.
+
+Each worker process starts JOB_WORKERS worker threads when it first enqueues
+a job or, on its first request, finds jobs waiting (e.g., left from before a
+restart).  Jobs can also be run by a separate process with `flask run-jobs`
+(with JOB_WORKERS=0, so that web processes only enqueue jobs).
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections.abc import Callable
+from typing import Any
+
+import click
+from flask import Flask, current_app
+
+from .db import connect, get_db
+from .db_writer import flush_writes, write
+
+JobHandler = Callable[[dict[str, Any]], None]
+
+_handlers: dict[str, JobHandler] = {}
+
+
+def register_job_handler(kind: str, handler: JobHandler) -> None:
+    _handlers[kind] = handler
+
+
+def enqueue_job(kind: str, payload: dict[str, Any], *, ref: str | None = None) -> int:
+    """Add a job to the queue, returning its id.
+
+    `ref` identifies what the job is for (e.g., 'query:123'), for get_job_status().
+    """
+    assert kind in _handlers, f"No job handler registered for {kind}"
+
+    def insert_job(db: sqlite3.Connection) -> int:
+        cur = db.execute("INSERT INTO jobs (kind, ref, payload) VALUES (?, ?, ?)", [kind, ref, json.dumps(payload)])
+        assert cur.lastrowid is not None
+        return cur.lastrowid
+
+    job_id = write(insert_job)
+
+    pool = _get_pool(current_app)
+    pool.start()
+    pool.wake()
+
+    return job_id
+
+
+def get_job_status(ref: str) -> str | None:
+    """Get the status of the most recent job with the given ref: 'queued', 'running', or 'failed'.
+
+    Returns None if there is no such job (or it has completed).
+    """
+    row = get_db().execute("SELECT status FROM jobs WHERE ref=? ORDER BY id DESC LIMIT 1", [ref]).fetchone()
+    return row['status'] if row else None
+
+
+def _claim_job() -> tuple[int, str, dict[str, Any], int] | None:
+    """Claim the oldest job that is queued or whose lease has expired.
+
+    Returns (id, kind, payload, attempts), or None if no job is waiting.
+    """
+    lease = f"+{current_app.config['JOB_LEASE_SECONDS']} seconds"
+    rows = write(lambda db: db.execute("""
+        UPDATE jobs
+        SET status='running', attempts=attempts+1, started=CURRENT_TIMESTAMP, lease_expires=datetime('now', ?)
+        WHERE id = (
+            SELECT id FROM jobs
+            WHERE status='queued' OR (status='running' AND lease_expires < CURRENT_TIMESTAMP)
+            ORDER BY id
+            LIMIT 1
+        )
+        RETURNING id, kind, payload, attempts
+    """, [lease]).fetchall())
+    if not rows:
+        return None
+    row = rows[0]
+    return row['id'], row['kind'], json.loads(row['payload']), row['attempts']
+
+
+class _LeaseRenewer:
+    """Renews a running job's lease every third of JOB_LEASE_SECONDS until stopped.
+
+    Uses its own connection, as the worker's connection is in use by the
+    handler (and the writer may be busy with the handler's writes).
+    """
+    def __init__(self, job_id: int, attempts: int) -> None:
+        self._job_id = job_id
+        self._attempts = attempts
+        self._app: Flask = current_app._get_current_object()  # type: ignore[attr-defined]  # noqa: SLF001 -- as documented by Flask, for use in another thread
+        self._lease_seconds = current_app.config['JOB_LEASE_SECONDS']
+        self._logger = current_app.logger
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"job-lease-{job_id}", daemon=True)
+
+    def __enter__(self) -> None:
+        self._thread.start()
+
+    def __exit__(self, *_exc: object) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        conn = connect(self._app)
+        try:
+            while not self._stop.wait(self._lease_seconds / 3):
+                cur = conn.execute(
+                    "UPDATE jobs SET lease_expires=datetime('now', ?) WHERE id=? AND attempts=? AND status='running'",
+                    [f"+{self._lease_seconds} seconds", self._job_id, self._attempts]
+                )
+                conn.commit()
+                if cur.rowcount == 0:
+                    return  # the job was reclaimed by another worker
+        except sqlite3.Error as e:
+            self._logger.warning(f"Failed to renew the lease of job {self._job_id}: {e}")
+        finally:
+            conn.close()
+
+
+def run_next_job() -> bool:
+    """Claim and run the next waiting job, if any.  Returns True if a job was run."""
+    job = _claim_job()
+    if job is None:
+        return False
+    job_id, kind, payload, attempts = job
+
+    try:
+        with _LeaseRenewer(job_id, attempts):
+            _handlers[kind](payload)
+            flush_writes()  # the job is complete once its writes are committed
+    except Exception as e:
+        current_app.logger.exception(f"Job {job_id} ({kind}) failed on attempt {attempts}.")
+        failed = attempts >= current_app.config['JOB_MAX_ATTEMPTS']
+        get_db().rollback()  # discard any uncommitted changes made by the handler
+        status, error = 'failed' if failed else 'queued', repr(e)
+        # (matching attempts, so a job reclaimed by another worker after a lost lease is left to that worker)
+        write(lambda db: db.execute(
+            "UPDATE jobs SET status=?, error=?, lease_expires=NULL WHERE id=? AND attempts=?",
+            [status, error, job_id, attempts]
+        ))
+    else:
+        write(lambda db: db.execute("DELETE FROM jobs WHERE id=? AND attempts=?", [job_id, attempts]))
+    return True
+
+
+class JobWorkerPool:
+    """Worker threads running jobs for an app."""
+    def __init__(self, app: Flask) -> None:
+        self._app = app
+        self._threads: list[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._checked = False
+
+    def start(self, workers: int | None = None) -> None:
+        """Start the worker threads (JOB_WORKERS of them, by default), if not already started."""
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            if workers is None:
+                workers = self._app.config['JOB_WORKERS']
+            self._stop.clear()
+            self._threads = [
+                threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+                for i in range(workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def start_if_waiting(self) -> None:
+        """Start the workers if there are jobs waiting to be run.  Only checks the first time it is called."""
+        if self._checked or not self._app.config['JOB_WORKERS']:
+            return
+        self._checked = True
+        try:
+            waiting = get_db().execute("SELECT 1 FROM jobs WHERE status IN ('queued', 'running') LIMIT 1").fetchone()
+        except sqlite3.OperationalError:
+            return  # e.g., the database has not been migrated yet
+        if waiting:
+            self.start()
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def stop(self) -> None:
+        with self._lock:
+            self._stop.set()
+            self._wake.set()
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                with self._app.app_context():
+                    ran = run_next_job()
+            except Exception:
+                self._app.logger.exception("Error in job worker.")
+                ran = False
+            if not ran:
+                self._wake.wait(self._app.config['JOB_POLL_INTERVAL'])
+                self._wake.clear()
+
+
+def _get_pool(app: Flask) -> JobWorkerPool:
+    pool = app.extensions['gened_jobs']
+    assert isinstance(pool, JobWorkerPool)
+    return pool
+
+
+def stop_workers(app: Flask) -> None:
+    _get_pool(app).stop()
+
+
+@click.command('run-jobs')
+@click.option('--workers', default=4, help="Number of worker threads.")
+def run_jobs_command(workers: int) -> None:
+    """Run background jobs until interrupted."""
+    pool = _get_pool(current_app)
+    pool.start(workers)
+    click.echo(f"Running jobs with {workers} worker threads.  Press Ctrl-C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        click.echo("Stopping workers (after their current jobs)...")
+        pool.stop()
+
+
+def init_app(app: Flask) -> None:
+    app.extensions['gened_jobs'] = pool = JobWorkerPool(app)
+    app.cli.add_command(run_jobs_command)
+
+    @app.before_request
+    def start_job_workers() -> None:
+        # resume any jobs left waiting, e.g. by a restart
+        pool.start_if_waiting()
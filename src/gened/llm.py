@@ -2,7 +2,9 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-only
 
-from collections.abc import Callable
+import asyncio
+import threading
+from collections.abc import Awaitable, Callable
 from dataclasses import dataclass, field
 from functools import wraps
 from sqlite3 import Row
@@ -12,29 +14,77 @@ from flask import current_app, flash, render_template
 
 from .auth import get_auth
 from .db import get_db
-from .openai_client import OpenAIChatMessage, OpenAIClient
-
-LLMProvider: TypeAlias = Literal['google', 'openai']
+from .db_writer import queue_write
+from .llm_cache import cache_get, cache_put, make_cache_key
+from .llm_telemetry import CallTag, LLMCallRecord, record_llm_call
+from .openai_client import CompletionStream, OpenAIChatMessage, OpenAIClient
+from .rate_limiter import KeyLimits
+from .retry import CallStats
+
+LLMProvider: TypeAlias = Literal['google', 'openai', 'mock']
 ChatMessage: TypeAlias = OpenAIChatMessage
 
 
-def _get_client(provider: LLMProvider, model: str, api_key: str) -> OpenAIClient:
+def _get_client(provider: LLMProvider, model: str, api_key: str, limits: KeyLimits | None = None) -> OpenAIClient:
     """Create and configure an OpenAI-compatible client for the given provider.
 
     Args:
         provider: The LLM provider to use
         model: The model identifier
         api_key: The API key for authentication
+        limits: Rate limits applied to all requests using this API key
 
     Returns:
-        A configured OpenAIClient instance using the appropriate base URL for the provider
+        A configured OpenAIClient instance using the appropriate base URL for the provider.
+        The client is lightweight; its API connections are pooled process-wide (see client_pool.py).
     """
     match provider:
         case 'google':
             # https://ai.google.dev/gemini-api/docs/openai
-            return OpenAIClient(model, api_key, base_url="https://generativelanguage.googleapis.com/v1beta/openai/")
+            return OpenAIClient(model, api_key, base_url="https://generativelanguage.googleapis.com/v1beta/openai/", provider=provider, limits=limits)
         case 'openai':
-            return OpenAIClient(model, api_key)
+            return OpenAIClient(model, api_key, provider=provider, limits=limits)
+        case 'mock':
+            # see mock_llm.py
+            return OpenAIClient(model, api_key, base_url=current_app.config['LLM_MOCK_URL'], provider=provider, limits=limits)
+
+
+CompletionResult: TypeAlias = tuple[dict[str, str], str]
+
+
+class _SingleFlight:
+    """Coalesces concurrent identical completion requests into one API call.
+
+    The first request for a given key starts the call, and any identical
+    requests made while it is in flight await the same result.  Completions
+    run on a single background event loop per process (see async_runner.py),
+    so this covers all requests handled by a worker process.
+    """
+    def __init__(self) -> None:
+        self._inflight: dict[tuple[asyncio.AbstractEventLoop, str], asyncio.Future[CompletionResult]] = {}
+        self._lock = threading.Lock()  # only guards the counter; _inflight is only used from its event loop
+        self.coalesced = 0
+
+    async def run(self, key: str, call: Callable[[], Awaitable[CompletionResult]]) -> CompletionResult:
+        loop_key = (asyncio.get_running_loop(), key)
+        future = self._inflight.get(loop_key)
+        if future is not None:
+            with self._lock:
+                self.coalesced += 1
+        else:
+            future = asyncio.ensure_future(call())
+            self._inflight[loop_key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(loop_key, None))
+        # shield: one request being cancelled (e.g., timing out) must not cancel the call for the others
+        return await asyncio.shield(future)
+
+
+_single_flight = _SingleFlight()
+
+
+def get_coalesced_count() -> int:
+    """Number of completion requests in this process that shared another request's API call."""
+    return _single_flight.coalesced
 
 
 @dataclass
@@ -44,18 +94,86 @@ class LLM:
     model: str
     api_key: str
     tokens_remaining: int | None = None  # None if current user is not using tokens
+    cache_scope: str | None = None  # if set, responses are cached and shared within this scope (see llm_cache.py)
+    limits: KeyLimits | None = None  # rate limits for the API key (see rate_limiter.py); None for no limits
+    class_id: int | None = None  # the class and LTI consumer (if any) the LLM is used for, recorded with each API call
+    consumer_id: int | None = None
     _client: OpenAIClient | None = field(default=None, init=False, repr=False)  # Instantiated only when needed
 
-    async def get_completion(self, prompt: str | None = None, messages: list[OpenAIChatMessage] | None = None, extra_args: dict[str, Any] | None = None) -> tuple[dict[str, str], str]:
+    async def get_completion(self, prompt: str | None = None, messages: list[OpenAIChatMessage] | None = None, extra_args: dict[str, Any] | None = None, *, tag: CallTag | None = None) -> CompletionResult:
         """Get a completion from the language model.
 
         The client is lazily instantiated on first use.
 
-        Delegates to OpenAIClient.get_completion() (see openai_client.py)
+        Delegates to OpenAIClient.get_completion() (see openai_client.py),
+        unless caching is enabled and the response is in the cache.
+        Concurrent identical requests using the same API key share one call.
+        Each API call is recorded in llm_calls, along with `tag` (see llm_telemetry.py).
         """
+        cache_key = None
+        if self.cache_scope is not None:
+            cache_key = self._request_key(self.cache_scope, prompt, messages, extra_args)
+            cached = await cache_get(cache_key)
+            if cached is not None:
+                return cached
+
+        async def call() -> CompletionResult:
+            stats = CallStats()
+            response, text = await self._get_client().get_completion(prompt, messages, extra_args, stats=stats)
+            self._record_call(tag, response, stats, streamed=False)
+            if cache_key is not None:
+                cache_put(cache_key, response, text)
+            return response, text
+
+        flight_key = self._request_key(f"key:{self.api_key}", prompt, messages, extra_args)
+        return await _single_flight.run(flight_key, call)
+
+    async def stream_completion(self, prompt: str | None = None, messages: list[OpenAIChatMessage] | None = None, extra_args: dict[str, Any] | None = None, *, tag: CallTag | None = None) -> CompletionStream:
+        """Start a streamed completion from the language model.
+
+        Delegates to OpenAIClient.stream_completion() (see openai_client.py),
+        unless caching is enabled and the response is in the cache, in
+        which case the cached text is streamed all at once.
+        The API call is recorded in llm_calls, along with `tag` (see llm_telemetry.py).
+        """
+        cache_key = None
+        if self.cache_scope is not None:
+            cache_key = self._request_key(self.cache_scope, prompt, messages, extra_args)
+            cached = await cache_get(cache_key)
+            if cached is not None:
+                return self._get_client().completed_stream(*cached)
+
+        stream = self._get_client().stream_completion(prompt, messages, extra_args)
+
+        def on_complete(response: dict[str, Any], text: str) -> None:
+            self._record_call(tag, response, stream.stats, streamed=True)
+            if cache_key is not None:
+                cache_put(cache_key, response, text)
+
+        stream.on_complete = on_complete
+        return stream
+
+    def _record_call(self, tag: CallTag | None, response: dict[str, Any], stats: CallStats, *, streamed: bool) -> None:
+        record_llm_call(LLMCallRecord(
+            provider=self.provider,
+            model=self.model,
+            tag=tag,
+            class_id=self.class_id,
+            consumer_id=self.consumer_id,
+            streamed=streamed,
+            response=response,
+            stats=stats,
+        ))
+
+    def _request_key(self, scope: str, prompt: str | None, messages: list[OpenAIChatMessage] | None, extra_args: dict[str, Any] | None) -> str:
+        if messages is None:
+            messages = [{"role": "user", "content": prompt or ""}]  # equivalent to the prompt (as in OpenAIClient)
+        return make_cache_key(scope, f"{self.provider}/{self.model}", messages, extra_args or {})
+
+    def _get_client(self) -> OpenAIClient:
         if self._client is None:
-            self._client = _get_client(self.provider, self.model, self.api_key)
-        return await self._client.get_completion(prompt, messages, extra_args)
+            self._client = _get_client(self.provider, self.model, self.api_key, self.limits)
+        return self._client
 
 
 class ClassDisabledError(Exception):
@@ -67,7 +185,76 @@ class NoKeyFoundError(Exception):
 class NoTokensError(Exception):
     pass
 
-def _get_llm(*, use_system_key: bool, spend_token: bool) -> LLM:
+
+def _get_class_llm(class_id: int, provider: LLMProvider) -> LLM:
+    """Get an LLM using the given class's model and API key.
+
+    Raises ClassDisabledError or NoKeyFoundError if the class can't use an LLM.
+    """
+    db = get_db()
+    class_row = db.execute("""
+        SELECT
+            classes.enabled,
+            classes.llm_cache_enabled,
+            consumers.id AS consumer_id,
+            COALESCE(consumers.llm_api_key, classes_user.llm_api_key) AS llm_api_key,
+            COALESCE(consumers.model_id, classes_user.model_id) AS _model_id,
+            COALESCE(consumers.llm_max_inflight, classes_user.llm_max_inflight) AS llm_max_inflight,
+            COALESCE(consumers.llm_rpm, classes_user.llm_rpm) AS llm_rpm,
+            COALESCE(consumers.llm_tpm, classes_user.llm_tpm) AS llm_tpm,
+            models.model
+        FROM classes
+        LEFT JOIN classes_lti
+          ON classes.id = classes_lti.class_id
+        LEFT JOIN consumers
+          ON classes_lti.lti_consumer_id = consumers.id
+        LEFT JOIN classes_user
+          ON classes.id = classes_user.class_id
+        LEFT JOIN models
+          ON models.id = _model_id
+        WHERE classes.id = ?
+    """, [class_id]).fetchone()
+
+    if not class_row['enabled']:
+        raise ClassDisabledError
+
+    if not class_row['llm_api_key']:
+        raise NoKeyFoundError
+
+    return LLM(
+        provider=provider,
+        api_key=class_row['llm_api_key'],
+        model=class_row['model'],
+        cache_scope=f"class:{class_id}" if class_row['llm_cache_enabled'] else None,
+        limits=KeyLimits.from_app_config(
+            max_inflight=class_row['llm_max_inflight'],
+            rpm=class_row['llm_rpm'],
+            tpm=class_row['llm_tpm'],
+        ),
+        class_id=class_id,
+        consumer_id=class_row['consumer_id'],
+    )
+
+
+def get_job_llm(class_id: int | None) -> LLM:
+    """Get an LLM for work done outside of a request (e.g., in a background job; see jobs.py).
+
+    The work must have been authorized by a request that got an LLM from
+    with_llm(): pass that LLM's class_id to use the same class's model and key
+    or None to use the system key and model.  No tokens are checked or spent.
+    """
+    provider: LLMProvider = 'mock' if current_app.config['MOCK_LLM'] else 'openai'
+    if class_id is not None:
+        return _get_class_llm(class_id, provider)
+    return LLM(
+        provider=provider,
+        api_key=current_app.config["OPENAI_API_KEY"],
+        model=current_app.config["SYSTEM_MODEL"],
+        limits=KeyLimits.from_app_config(),
+    )
+
+
+def _get_llm(*, use_system_key: bool, spend_token: bool, check_tokens: bool = True) -> LLM:
     ''' Get an LLM object configured based on the arguments and the current
     context (user and class).
 
@@ -79,9 +266,10 @@ def _get_llm(*, use_system_key: bool, spend_token: bool) -> LLM:
          c) If there is a current class but it is disabled or has no key, raise an error.
       3) If the user is a local-auth user, the system API key and model is used.
       4) Otherwise, we use tokens and the system API key / model.
-           If spend_token is True, the user must have 1 or more tokens remaining.
+           Unless check_tokens is False, the user must have 1 or more tokens remaining.
              If they have 0 tokens, raise an error.
-             Otherwise, their token count is decremented.
+           If spend_token is True, their token count is decremented.
+    If MOCK_LLM is set, the LLM uses the mock provider (see mock_llm.py).
 
     Returns:
       LLM object.
@@ -90,6 +278,8 @@ def _get_llm(*, use_system_key: bool, spend_token: bool) -> LLM:
     '''
     db = get_db()
 
+    provider: LLMProvider = 'mock' if current_app.config['MOCK_LLM'] else 'openai'
+
     def make_system_client(tokens_remaining: int | None = None) -> LLM:
         """ Factory function to initialize a default client (using the system key)
             only if/when needed.
@@ -97,10 +287,11 @@ def _get_llm(*, use_system_key: bool, spend_token: bool) -> LLM:
         system_key = current_app.config["OPENAI_API_KEY"]
         system_model = current_app.config["SYSTEM_MODEL"]
         return LLM(
-            provider='openai',
+            provider=provider,
             api_key=system_key,
             model=system_model,
             tokens_remaining=tokens_remaining,
+            limits=KeyLimits.from_app_config(),
         )
 
     if use_system_key:
@@ -108,37 +299,9 @@ def _get_llm(*, use_system_key: bool, spend_token: bool) -> LLM:
 
     auth = get_auth()
 
-    # Get class data, if there is an active class
+    # Use the class's LLM, if there is an active class
     if auth.cur_class is not None:
-        class_row = db.execute("""
-            SELECT
-                classes.enabled,
-                COALESCE(consumers.llm_api_key, classes_user.llm_api_key) AS llm_api_key,
-                COALESCE(consumers.model_id, classes_user.model_id) AS _model_id,
-                models.model
-            FROM classes
-            LEFT JOIN classes_lti
-              ON classes.id = classes_lti.class_id
-            LEFT JOIN consumers
-              ON classes_lti.lti_consumer_id = consumers.id
-            LEFT JOIN classes_user
-              ON classes.id = classes_user.class_id
-            LEFT JOIN models
-              ON models.id = _model_id
-            WHERE classes.id = ?
-        """, [auth.cur_class.class_id]).fetchone()
-
-        if not class_row['enabled']:
-            raise ClassDisabledError
-
-        if not class_row['llm_api_key']:
-            raise NoKeyFoundError
-
-        return LLM(
-            provider='openai',
-            api_key=class_row['llm_api_key'],
-            model=class_row['model'],
-        )
+        return _get_class_llm(auth.cur_class.class_id, provider)
 
     # Get user data for tokens, auth_provider
     user_row = db.execute("""
@@ -156,13 +319,13 @@ def _get_llm(*, use_system_key: bool, spend_token: bool) -> LLM:
 
     tokens = user_row['query_tokens']
 
-    if tokens == 0:
+    if check_tokens and tokens == 0:
         raise NoTokensError
 
     if spend_token:
         # user.tokens > 0, so decrement it and use the system key
-        db.execute("UPDATE users SET query_tokens=query_tokens-1 WHERE id=?", [auth.user_id])
-        db.commit()
+        user_id = auth.user_id
+        queue_write(lambda conn: conn.execute("UPDATE users SET query_tokens=query_tokens-1 WHERE id=?", [user_id]))
         tokens -= 1
 
     return make_system_client(tokens_remaining = tokens)
@@ -173,7 +336,7 @@ P = ParamSpec('P')
 R = TypeVar('R')
 
 
-def with_llm(*, use_system_key: bool = False, spend_token: bool = False) -> Callable[[Callable[P, R]], Callable[P, str | R]]:
+def with_llm(*, use_system_key: bool = False, spend_token: bool = False, check_tokens: bool = True) -> Callable[[Callable[P, R]], Callable[P, str | R]]:
     '''Decorate a view function that requires an LLM and API key.
 
     Assigns an 'llm' named argument.
@@ -188,12 +351,15 @@ def with_llm(*, use_system_key: bool = False, spend_token: bool = False) -> Call
       spend_token:    If True *and* the user is using tokens, then check
                       that they have tokens remaining and decrement their
                       tokens.
+      check_tokens:   If False, a user using tokens is not required to have
+                      any remaining (e.g., to complete a request for which a
+                      token was already spent).
     '''
     def decorator(f: Callable[P, R]) -> Callable[P, str | R]:
         @wraps(f)
         def decorated_function(*args: P.args, **kwargs: P.kwargs) -> str | R:
             try:
-                llm = _get_llm(use_system_key=use_system_key, spend_token=spend_token)
+                llm = _get_llm(use_system_key=use_system_key, spend_token=spend_token, check_tokens=check_tokens)
             except ClassDisabledError:
                 flash("Error: The current class is archived or disabled.")
                 return render_template("error.html")
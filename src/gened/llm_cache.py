@@ -0,0 +1,150 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""An exact-match cache of LLM responses, stored in its own SQLite database.
+
+Classes may opt in to caching (classes.llm_cache_enabled), in which case a
+completion requested with exactly the same model, messages, and completion
+arguments as an earlier one in the same class reuses the earlier response
+rather than calling the API again.  Error responses are never cached.
+
+Entries expire after LLM_CACHE_TTL seconds, and the least-recently used
+entries are evicted to keep at most LLM_CACHE_MAX_ENTRIES.  The cache is kept
+separate from the main database so it never holds up (or is held up by)
+application writes, and it can be deleted at any time.
+
+All access to the cache goes through one thread, so lookups and insertions
+never block the event loop that runs LLM calls (see async_runner.py), and a
+lookup always sees every insertion made before it.
+"""
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from typing import Any
+
+from flask import current_app
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key            TEXT PRIMARY KEY,
+    response_json  TEXT NOT NULL,
+    response_text  TEXT NOT NULL,
+    created        REAL NOT NULL,
+    last_used      REAL NOT NULL,
+    hits           INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS llm_cache_by_last_used ON llm_cache(last_used);
+"""
+
+# Evict expired and excess entries once per this many insertions
+_EVICT_INTERVAL = 100
+
+
+@dataclass(frozen=True)
+class CacheStats:
+    hits: int
+    misses: int
+    entries: int
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class LLMCache:
+    def __init__(self) -> None:
+        self._local = threading.local()  # one connection per thread per database file
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._inserts = 0
+
+    def _get_db(self, path: str) -> sqlite3.Connection:
+        if not hasattr(self._local, 'conns'):
+            self._local.conns = {}
+        conns: dict[str, sqlite3.Connection] = self._local.conns
+        if path not in conns:
+            conn = sqlite3.connect(path, timeout=5, isolation_level=None)  # autocommit
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            conns[path] = conn
+        return conns[path]
+
+    def get(self, path: str, key: str, *, ttl: float) -> tuple[dict[str, Any], str] | None:
+        db = self._get_db(path)
+        now = time.time()
+        row = db.execute("SELECT response_json, response_text FROM llm_cache WHERE key=? AND created > ?", [key, now - ttl]).fetchone()
+        with self._lock:
+            if row is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+        db.execute("UPDATE llm_cache SET last_used=?, hits=hits+1 WHERE key=?", [now, key])
+        return json.loads(row[0]), row[1]
+
+    def put(self, path: str, key: str, response: dict[str, Any], text: str, *, ttl: float, max_entries: int) -> None:
+        db = self._get_db(path)
+        now = time.time()
+        db.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, response_json, response_text, created, last_used) VALUES (?, ?, ?, ?, ?)",
+            [key, json.dumps(response), text, now, now]
+        )
+        with self._lock:
+            self._inserts += 1
+            evict_now = self._inserts % _EVICT_INTERVAL == 0
+        if evict_now:
+            self.evict(path, ttl=ttl, max_entries=max_entries)
+
+    def evict(self, path: str, *, ttl: float, max_entries: int) -> None:
+        """Remove expired entries and then least-recently used entries over max_entries."""
+        db = self._get_db(path)
+        db.execute("DELETE FROM llm_cache WHERE created <= ?", [time.time() - ttl])
+        db.execute("""
+            DELETE FROM llm_cache WHERE key IN (
+                SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+            )
+        """, [max_entries])
+
+    def stats(self, path: str) -> CacheStats:
+        entries = self._get_db(path).execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        with self._lock:
+            return CacheStats(hits=self._hits, misses=self._misses, entries=entries)
+
+
+_cache = LLMCache()
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-cache")
+
+
+def make_cache_key(scope: str, model: str, messages: Any, completion_args: dict[str, Any]) -> str:
+    """Hash everything that determines a completion (plus a scope, e.g. the class) into a cache key."""
+    data = json.dumps([scope, model, messages, completion_args], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+async def cache_get(key: str) -> tuple[dict[str, Any], str] | None:
+    """Get a cached (response, text) pair, or None if not cached (or expired)."""
+    config = current_app.config
+    lookup = partial(_cache.get, config['LLM_CACHE_DATABASE'], key, ttl=config['LLM_CACHE_TTL'])
+    return await asyncio.get_running_loop().run_in_executor(_executor, lookup)
+
+
+def cache_put(key: str, response: dict[str, Any], text: str) -> None:
+    """Store a response in the cache, without waiting for it to be stored.  Error responses are not stored."""
+    if 'error' in response:
+        return
+    config = current_app.config
+    _executor.submit(_cache.put, config['LLM_CACHE_DATABASE'], key, response, text, ttl=config['LLM_CACHE_TTL'], max_entries=config['LLM_CACHE_MAX_ENTRIES'])
+
+
+def get_cache_stats() -> CacheStats:
+    return _executor.submit(_cache.stats, current_app.config['LLM_CACHE_DATABASE']).result()
@@ -0,0 +1,86 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""Per-call telemetry for LLM API calls, recorded in the llm_calls table.
+
+One row is written for each upstream API call (not for cache hits or for
+requests that share another request's call), with its timing, token usage,
+finish reason, retries, and error (if any), linked to the class and consumer
+it was made for and, via a CallTag, to the purpose of the call and the query
+or chat it was made for.
+
+Rows are queued for the database writer (see db_writer.py), so recording a
+call doesn't wait for a commit; each is committed by the end of the request
+(or job) that made the call.
+"""
+
+import logging
+import sqlite3
+from dataclasses import dataclass
+from typing import Any
+
+from flask import current_app
+
+from .db_writer import queue_write
+from .retry import CallStats
+
+
+@dataclass(frozen=True)
+class CallTag:
+    kind: str  # the purpose of the call, e.g. 'main', 'sufficient', 'cleanup', 'topics', 'tutor'
+    query_id: int | None = None
+    chat_id: int | None = None
+
+
+@dataclass(frozen=True)
+class LLMCallRecord:
+    provider: str
+    model: str
+    tag: CallTag | None
+    class_id: int | None
+    consumer_id: int | None
+    streamed: bool
+    response: dict[str, Any]
+    stats: CallStats
+
+
+def _insert_call(db: sqlite3.Connection, row: list[Any], logger: logging.Logger) -> None:
+    try:
+        db.execute("""
+            INSERT INTO llm_calls (
+                provider, model, kind, query_id, chat_id, class_id, consumer_id, streamed,
+                latency_ms, queue_ms, prompt_tokens, completion_tokens, finish_reason, retries, hedges, error
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, row)
+    except sqlite3.Error as e:
+        # logged here, so a failure never fails the request or job whose writes include it
+        logger.warning(f"Failed to record LLM call telemetry: {e}")
+
+
+def record_llm_call(record: LLMCallRecord) -> None:
+    """Queue a row to be written to llm_calls for the given call.  Failures are logged, never raised."""
+    response = record.response
+    usage = response.get('usage') or {}
+    choices = response.get('choices') or [{}]
+    tag = record.tag
+    row = [
+        record.provider,
+        record.model,
+        tag.kind if tag else None,
+        tag.query_id if tag else None,
+        tag.chat_id if tag else None,
+        record.class_id,
+        record.consumer_id,
+        record.streamed,
+        round(record.stats.elapsed * 1000),
+        round(record.stats.queue_time * 1000),
+        usage.get('prompt_tokens'),
+        usage.get('completion_tokens'),
+        choices[0].get('finish_reason'),
+        record.stats.retries,
+        record.stats.hedges,
+        response.get('error'),
+    ]
+    logger = current_app.logger
+    queue_write(lambda db: _insert_call(db, row, logger))
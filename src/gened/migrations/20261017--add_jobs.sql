@@ -0,0 +1,23 @@
+-- SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+--
+-- SPDX-License-Identifier: AGPL-3.0-only
+
+BEGIN;
+
+-- Durable queue of background jobs (see jobs.py)
+CREATE TABLE jobs (
+    id             INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind           TEXT NOT NULL,  -- selects the handler that runs the job
+    ref            TEXT,  -- what the job is for, e.g. 'query:123'
+    payload        TEXT NOT NULL,  -- JSON
+    status         TEXT NOT NULL CHECK (status IN ('queued', 'running', 'failed')) DEFAULT 'queued',  -- completed jobs are deleted
+    attempts       INTEGER NOT NULL DEFAULT 0,
+    error          TEXT,  -- from the most recent failed attempt
+    created        DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    started        DATETIME,
+    lease_expires  DATETIME  -- a running job is run again if its lease expires (e.g., its worker died)
+);
+CREATE INDEX jobs_by_status ON jobs(status, id);
+CREATE INDEX jobs_by_ref ON jobs(ref);
+
+COMMIT;
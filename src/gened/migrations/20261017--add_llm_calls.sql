@@ -0,0 +1,30 @@
+-- SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+--
+-- SPDX-License-Identifier: AGPL-3.0-only
+
+BEGIN;
+
+-- Telemetry: one row per LLM API call (see llm_telemetry.py)
+CREATE TABLE llm_calls (
+    id                 INTEGER PRIMARY KEY AUTOINCREMENT,
+    call_time          DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    provider           TEXT NOT NULL,
+    model              TEXT NOT NULL,
+    kind               TEXT,
+    query_id           INTEGER,
+    chat_id            INTEGER,
+    class_id           INTEGER,
+    consumer_id        INTEGER,
+    streamed           BOOLEAN NOT NULL CHECK (streamed IN (0,1)),
+    latency_ms         INTEGER NOT NULL,
+    queue_ms           INTEGER NOT NULL,
+    prompt_tokens      INTEGER,
+    completion_tokens  INTEGER,
+    finish_reason      TEXT,
+    retries            INTEGER NOT NULL DEFAULT 0,
+    hedges             INTEGER NOT NULL DEFAULT 0,
+    error              TEXT
+);
+CREATE INDEX llm_calls_by_time ON llm_calls(call_time);
+
+COMMIT;
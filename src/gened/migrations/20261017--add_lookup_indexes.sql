@@ -0,0 +1,15 @@
+-- SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+--
+-- SPDX-License-Identifier: AGPL-3.0-only
+
+BEGIN;
+
+-- Lookups by username at login, by user for a user's roles (on every request), and by creator for a user's classes
+DROP INDEX IF EXISTS auth_local_by_username;
+CREATE INDEX auth_local_by_username ON auth_local(username);
+DROP INDEX IF EXISTS classes_user_by_creator;
+CREATE INDEX classes_user_by_creator ON classes_user(creator_user_id);
+DROP INDEX IF EXISTS roles_by_user;
+CREATE INDEX roles_by_user ON roles(user_id, active);
+
+COMMIT;
@@ -0,0 +1,16 @@
+-- SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+--
+-- SPDX-License-Identifier: AGPL-3.0-only
+
+BEGIN;
+
+-- Full LLM responses for the app's queries, zlib-compressed JSON, when
+-- queries.response_json only holds the fields that are used (see response_storage.py)
+-- Existing rows are rewritten, in batches, by `flask compact-responses`.
+CREATE TABLE query_raw_responses (
+    query_id  INTEGER PRIMARY KEY,
+    raw       BLOB NOT NULL,
+    FOREIGN KEY(query_id) REFERENCES queries(id) ON DELETE CASCADE
+);
+
+COMMIT;
@@ -0,0 +1,43 @@
+-- SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+--
+-- SPDX-License-Identifier: AGPL-3.0-only
+
+BEGIN;
+
+-- Daily usage rollups per user, role, class, and consumer (see usage.py)
+-- Maintained by triggers in the app's schema, so aggregate views read these
+-- rather than counting the app's queries table.
+CREATE TABLE usage_user_daily (
+    user_id       INTEGER NOT NULL,
+    day           DATE NOT NULL,
+    queries       INTEGER NOT NULL DEFAULT 0,
+    errors        INTEGER NOT NULL DEFAULT 0,
+    insufficient  INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day)
+) WITHOUT ROWID;
+CREATE TABLE usage_role_daily (
+    role_id       INTEGER NOT NULL,
+    day           DATE NOT NULL,
+    queries       INTEGER NOT NULL DEFAULT 0,
+    errors        INTEGER NOT NULL DEFAULT 0,
+    insufficient  INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (role_id, day)
+) WITHOUT ROWID;
+CREATE TABLE usage_class_daily (
+    class_id      INTEGER NOT NULL,
+    day           DATE NOT NULL,
+    queries       INTEGER NOT NULL DEFAULT 0,
+    errors        INTEGER NOT NULL DEFAULT 0,
+    insufficient  INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (class_id, day)
+) WITHOUT ROWID;
+CREATE TABLE usage_consumer_daily (
+    consumer_id   INTEGER NOT NULL,
+    day           DATE NOT NULL,
+    queries       INTEGER NOT NULL DEFAULT 0,
+    errors        INTEGER NOT NULL DEFAULT 0,
+    insufficient  INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (consumer_id, day)
+) WITHOUT ROWID;
+
+COMMIT;
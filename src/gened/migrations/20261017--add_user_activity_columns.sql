@@ -0,0 +1,35 @@
+-- SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+--
+-- SPDX-License-Identifier: AGPL-3.0-only
+
+BEGIN;
+
+ALTER TABLE users ADD COLUMN
+    last_query_time DATETIME;  -- most recent query by this user (maintained by the app's triggers)
+ALTER TABLE users ADD COLUMN
+    last_instructor_activity DATETIME;  -- most recent query in any class this user instructs (maintained by the app's triggers)
+
+DROP INDEX IF EXISTS roles_by_class;
+CREATE INDEX roles_by_class ON roles(class_id, role);
+
+-- View for user activity tracking
+DROP VIEW IF EXISTS user_activity;
+CREATE VIEW user_activity AS
+SELECT
+    users.id,
+    users.display_name,
+    users.display_extra,
+    auth_providers.name AS auth_provider,
+    users.delete_status,
+    users.created,
+    users.last_query_time,
+    users.last_instructor_activity,
+    MAX(IFNULL(users.created, ''), IFNULL(users.last_query_time, ''), IFNULL(users.last_instructor_activity, '')) AS last_activity
+FROM users
+LEFT JOIN auth_providers ON auth_providers.id=users.auth_provider
+WHERE NOT users.is_admin
+  AND users.id != -1
+  AND users.delete_status != 'deleted'
+;
+
+COMMIT;
@@ -0,0 +1,10 @@
+-- SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+--
+-- SPDX-License-Identifier: AGPL-3.0-only
+
+BEGIN;
+
+ALTER TABLE classes ADD COLUMN
+    llm_cache_enabled BOOLEAN NOT NULL CHECK (llm_cache_enabled IN (0,1)) DEFAULT 0;  -- reuse responses to identical LLM requests within the class
+
+COMMIT;
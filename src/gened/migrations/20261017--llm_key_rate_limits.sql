@@ -0,0 +1,16 @@
+-- SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+--
+-- SPDX-License-Identifier: AGPL-3.0-only
+
+BEGIN;
+
+-- rate limits for llm_api_key (NULL: use the application default)
+ALTER TABLE consumers ADD COLUMN llm_max_inflight INTEGER CHECK (llm_max_inflight > 0);
+ALTER TABLE consumers ADD COLUMN llm_rpm INTEGER CHECK (llm_rpm > 0);
+ALTER TABLE consumers ADD COLUMN llm_tpm INTEGER CHECK (llm_tpm > 0);
+
+ALTER TABLE classes_user ADD COLUMN llm_max_inflight INTEGER CHECK (llm_max_inflight > 0);
+ALTER TABLE classes_user ADD COLUMN llm_rpm INTEGER CHECK (llm_rpm > 0);
+ALTER TABLE classes_user ADD COLUMN llm_tpm INTEGER CHECK (llm_tpm > 0);
+
+COMMIT;
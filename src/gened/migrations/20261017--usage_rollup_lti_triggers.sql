@@ -0,0 +1,37 @@
+-- SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+--
+-- SPDX-License-Identifier: AGPL-3.0-only
+
+BEGIN;
+
+-- A class's usage counts toward its LTI consumer's rollup while it is linked
+-- to that consumer, so linking or unlinking a class moves its counts.
+CREATE TRIGGER classes_lti_usage_insert AFTER INSERT ON classes_lti
+BEGIN
+    INSERT INTO usage_consumer_daily (consumer_id, day, queries, errors, insufficient)
+        SELECT NEW.lti_consumer_id, day, queries, errors, insufficient FROM usage_class_daily WHERE class_id=NEW.class_id
+        ON CONFLICT (consumer_id, day) DO UPDATE SET queries=queries+excluded.queries, errors=errors+excluded.errors, insufficient=insufficient+excluded.insufficient;
+END;
+CREATE TRIGGER classes_lti_usage_delete AFTER DELETE ON classes_lti
+BEGIN
+    UPDATE usage_consumer_daily SET queries=usage_consumer_daily.queries-cls.queries, errors=usage_consumer_daily.errors-cls.errors, insufficient=usage_consumer_daily.insufficient-cls.insufficient
+        FROM (SELECT * FROM usage_class_daily WHERE class_id=OLD.class_id) AS cls WHERE usage_consumer_daily.consumer_id=OLD.lti_consumer_id AND usage_consumer_daily.day=cls.day;
+END;
+CREATE TRIGGER classes_lti_usage_update AFTER UPDATE OF class_id, lti_consumer_id ON classes_lti
+BEGIN
+    UPDATE usage_consumer_daily SET queries=usage_consumer_daily.queries-cls.queries, errors=usage_consumer_daily.errors-cls.errors, insufficient=usage_consumer_daily.insufficient-cls.insufficient
+        FROM (SELECT * FROM usage_class_daily WHERE class_id=OLD.class_id) AS cls WHERE usage_consumer_daily.consumer_id=OLD.lti_consumer_id AND usage_consumer_daily.day=cls.day;
+    INSERT INTO usage_consumer_daily (consumer_id, day, queries, errors, insufficient)
+        SELECT NEW.lti_consumer_id, day, queries, errors, insufficient FROM usage_class_daily WHERE class_id=NEW.class_id
+        ON CONFLICT (consumer_id, day) DO UPDATE SET queries=queries+excluded.queries, errors=errors+excluded.errors, insufficient=insufficient+excluded.insufficient;
+END;
+
+-- Correct consumer rollups left stale by classes linked or unlinked before now
+DELETE FROM usage_consumer_daily;
+INSERT INTO usage_consumer_daily (consumer_id, day, queries, errors, insufficient)
+    SELECT classes_lti.lti_consumer_id, usage_class_daily.day, SUM(usage_class_daily.queries), SUM(usage_class_daily.errors), SUM(usage_class_daily.insufficient)
+    FROM usage_class_daily
+    JOIN classes_lti ON classes_lti.class_id=usage_class_daily.class_id
+    GROUP BY classes_lti.lti_consumer_id, usage_class_daily.day;
+
+COMMIT;
@@ -0,0 +1,203 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""A mock LLM provider, for load testing without calling (or paying for) a real API.
+
+The mock serves OpenAI-compatible chat completions (streamed or not) with
+simulated timing and, optionally, injected errors:
+  - Time to the first token is drawn from a latency distribution: 'fixed',
+    'normal', or 'longtail' (lognormal), with the given mean.
+  - Response tokens are then generated at a fixed rate.
+  - A fraction of requests fail with the given HTTP status.
+
+It can be used in two ways, both of which exercise the full client stack
+(client pool, rate limiter, retries, the openai SDK, and httpx):
+  - In-process, via the 'mock' provider (see llm._get_client()): requests are
+    answered by an httpx transport without any network I/O.  Set MOCK_LLM to
+    use it for all LLM requests.
+  - As a stand-in server (`flask mock-llm-server`) at an OpenAI-compatible URL.
+    Set LLM_MOCK_URL to point the 'mock' provider at it (e.g., to load test
+    with the mock running on another machine).
+
+Mock behavior is configured with the LLM_MOCK_* config keys.
+"""
+
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+from collections.abc import AsyncIterator, Iterator
+from dataclasses import dataclass
+from typing import Any, Literal
+
+import click
+import httpx
+from flask import Flask, Response, current_app, request
+from werkzeug.serving import run_simple
+
+LatencyDistribution = Literal['fixed', 'normal', 'longtail']
+
+
+@dataclass(frozen=True)
+class MockLLMConfig:
+    latency: LatencyDistribution = 'fixed'
+    latency_mean: float = 2.0        # mean seconds to the first token
+    tokens_per_second: float = 50    # rate at which response tokens are generated
+    response_tokens: int = 200       # tokens in each response (capped by the request's max_tokens)
+    error_rate: float = 0.0          # fraction of requests that fail
+    error_status: int = 503          # HTTP status of failed requests
+
+    @classmethod
+    def from_app_config(cls) -> 'MockLLMConfig':
+        config = current_app.config
+        return cls(
+            latency=config['LLM_MOCK_LATENCY'],
+            latency_mean=config['LLM_MOCK_LATENCY_MEAN'],
+            tokens_per_second=config['LLM_MOCK_TOKENS_PER_SECOND'],
+            response_tokens=config['LLM_MOCK_RESPONSE_TOKENS'],
+            error_rate=config['LLM_MOCK_ERROR_RATE'],
+            error_status=config['LLM_MOCK_ERROR_STATUS'],
+        )
+
+    def first_token_delay(self) -> float:
+        match self.latency:
+            case 'fixed':
+                return self.latency_mean
+            case 'normal':
+                return max(0.0, random.gauss(self.latency_mean, self.latency_mean / 4))
+            case 'longtail':
+                # lognormal with the given mean; sigma=1 puts p99 at ~6x the median
+                sigma = 1.0
+                return random.lognormvariate(math.log(self.latency_mean) - sigma**2 / 2, sigma) if self.latency_mean > 0 else 0.0
+
+
+@dataclass(frozen=True)
+class MockResponse:
+    """A response as a status, headers, and body pieces, each sent after a delay (in seconds)."""
+    status: int
+    headers: dict[str, str]
+    pieces: list[tuple[float, bytes]]
+
+
+# Tokens per streamed chunk
+_CHUNK_TOKENS = 5
+
+
+def _error_response(status: int, delay: float) -> MockResponse:
+    body = {'error': {'message': f"Mock error (status {status})", 'type': 'mock_error', 'code': None}}
+    headers = {'content-type': 'application/json'}
+    if status == 429:  # noqa: PLR2004 (rate limit status)
+        headers['retry-after'] = '1'
+    return MockResponse(status, headers, [(delay, json.dumps(body).encode())])
+
+
+def make_response(config: MockLLMConfig, body: dict[str, Any]) -> MockResponse:
+    """Make a mock response to a chat completion request with the given (JSON) body."""
+    delay = config.first_token_delay()
+    if random.random() < config.error_rate:
+        return _error_response(config.error_status, delay)
+
+    model = body.get('model', 'mock')
+    max_tokens = body.get('max_tokens') or config.response_tokens
+    n_tokens = min(config.response_tokens, max_tokens)
+    prompt_tokens = sum(len(str(message.get('content', ''))) for message in body.get('messages', [])) // 4
+    usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': n_tokens, 'total_tokens': prompt_tokens + n_tokens}
+    finish_reason = 'length' if n_tokens < config.response_tokens else 'stop'
+    if (body.get('response_format') or {}).get('type') == 'json_object':
+        words = ["{}"]
+    else:
+        words = ["mock"] * n_tokens
+    completion_id = f"mock-{uuid.uuid4().hex}"
+    created = int(time.time())
+    token_time = 1 / config.tokens_per_second
+
+    if not body.get('stream'):
+        completion = {
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': created,
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'finish_reason': finish_reason,
+                'message': {'role': 'assistant', 'content': " ".join(words)},
+            }],
+            'usage': usage,
+        }
+        return MockResponse(200, {'content-type': 'application/json'}, [(delay + n_tokens * token_time, json.dumps(completion).encode())])
+
+    def chunk(delta: dict[str, str], finish: str | None = None, chunk_usage: dict[str, int] | None = None) -> bytes:
+        data = {
+            'id': completion_id,
+            'object': 'chat.completion.chunk',
+            'created': created,
+            'model': model,
+            'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish}] if delta or finish else [],
+            'usage': chunk_usage,
+        }
+        return f"data: {json.dumps(data)}\n\n".encode()
+
+    pieces = [(delay, chunk({'role': 'assistant', 'content': ""}))]
+    for i in range(0, len(words), _CHUNK_TOKENS):
+        content = " ".join(words[i:i+_CHUNK_TOKENS]) + " "
+        pieces.append((len(words[i:i+_CHUNK_TOKENS]) * token_time, chunk({'content': content})))
+    pieces.append((0.0, chunk({}, finish_reason)))
+    if (body.get('stream_options') or {}).get('include_usage'):
+        pieces.append((0.0, chunk({}, chunk_usage=usage)))
+    pieces.append((0.0, b"data: [DONE]\n\n"))
+    return MockResponse(200, {'content-type': 'text/event-stream'}, pieces)
+
+
+class MockTransport(httpx.AsyncBaseTransport):
+    """An httpx transport that answers chat completion requests with mock responses, in-process."""
+    def __init__(self, config: MockLLMConfig) -> None:
+        self._config = config
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if not request.url.path.endswith("/chat/completions"):
+            return httpx.Response(404, json={'error': {'message': "Not found", 'type': 'mock_error'}})
+        body = json.loads(await request.aread())
+        response = make_response(self._config, body)
+
+        async def stream() -> AsyncIterator[bytes]:
+            for delay, piece in response.pieces:
+                await asyncio.sleep(delay)
+                yield piece
+
+        return httpx.Response(response.status, headers=response.headers, content=stream())
+
+
+def create_server_app(config: MockLLMConfig) -> Flask:
+    """Create a WSGI app serving mock chat completions at an OpenAI-compatible URL (/v1/chat/completions)."""
+    server = Flask(__name__)
+
+    @server.post("/v1/chat/completions")
+    def chat_completions() -> Response:
+        response = make_response(config, request.get_json())
+
+        def generate() -> Iterator[bytes]:
+            for delay, piece in response.pieces:
+                time.sleep(delay)
+                yield piece
+
+        return Response(generate(), status=response.status, headers=response.headers)
+
+    return server
+
+
+@click.command('mock-llm-server')
+@click.option('--host', default='127.0.0.1', help="Interface to listen on.")
+@click.option('--port', default=8001, help="Port to listen on.")
+def mock_server_command(host: str, port: int) -> None:
+    """Run a mock OpenAI-compatible LLM server (configured by the app's LLM_MOCK_* settings)."""
+    config = MockLLMConfig.from_app_config()
+    click.echo(f"Mock LLM server: {config}")
+    click.echo(f"Set LLM_MOCK_URL=http://{host}:{port}/v1 to use it.")
+    run_simple(host, port, create_server_app(config), threaded=True)
+
+
+def init_app(app: Flask) -> None:
+    app.cli.add_command(mock_server_command)
@@ -1,35 +1,143 @@
+import time
+from collections.abc import AsyncIterator, Callable
+from contextlib import AsyncExitStack
 from typing import Any, TypeAlias
 
 import openai
 from flask import current_app
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from .circuit_breaker import CircuitBreaker, CircuitOpenError, get_breaker
+from .client_pool import ClientKey, lease_client
+from .rate_limiter import (
+    Admission,
+    AdmissionTimeoutError,
+    KeyLimits,
+    admit,
+    estimate_tokens,
+)
+from .retry import (
+    CallStats,
+    DeadlineExceededError,
+    RetryPolicy,
+    call_with_retry,
+    latencies,
+)
 
 OpenAIChatMessage: TypeAlias = openai.types.chat.ChatCompletionMessageParam
 
 
+def _error_response(e: openai.APIError) -> tuple[dict[str, Any], str]:
+    """Log an API error and convert it to an error response dict and a user-friendly error message."""
+    common_error_text = "Error ({error_type}).  Something went wrong with this query.  The error has been logged, and we'll work on it.  For now, please try again."
+    err_str = str(e)
+
+    if isinstance(e, openai.APITimeoutError):
+        response_txt = "Error (APITimeoutError).  The system timed out producing the response.  Please try again."
+        current_app.logger.error(f"OpenAI Timeout: {e}")
+    elif isinstance(e, openai.RateLimitError):
+        if "exceeded your current quota" in err_str:
+            response_txt = "Error (RateLimitError).  The API key for this class has exceeded its current quota (https://platform.openai.com/docs/guides/rate-limits/usage-tiers).  The instructor should check their API plan and billing details.  Possibly the key is in the free tier, which does not cover the models used here."
+        else:
+            response_txt = "Error (RateLimitError).  The system is receiving too many requests right now.  Please try again in one minute."
+        current_app.logger.error(f"OpenAI RateLimitError: {e}")
+    elif isinstance(e, openai.AuthenticationError):
+        response_txt = "Error (AuthenticationError).  The API key set by the instructor for this class is invalid.  The instructor needs to provide a valid API key for this application to work."
+        current_app.logger.error(f"OpenAI AuthenticationError: {e}")
+    elif isinstance(e, openai.BadRequestError):
+        if "maximum context length" in err_str:
+            response_txt = "Error (BadRequestError).  Your query is too long for the model to process.  Please reduce the length of your input."
+        else:
+            response_txt = common_error_text.format(error_type='BadRequestError')
+        current_app.logger.error(f"OpenAI BadRequestError: {e}")
+    else:
+        response_txt = common_error_text.format(error_type='APIError')
+        current_app.logger.error(f"Exception (OpenAI {type(e).__name__}, but I don't handle that specifically yet): {e}")
+
+    return {'error': err_str}, response_txt
+
+
+def _admission_timeout_response() -> tuple[dict[str, Any], str]:
+    current_app.logger.warning("LLM request not admitted by rate limiter within its max wait.")
+    response_txt = "Error (Busy).  The system is receiving too many requests right now.  Please try again in one minute."
+    return {'error': 'AdmissionTimeoutError'}, response_txt
+
+
+def _deadline_response() -> tuple[dict[str, Any], str]:
+    current_app.logger.error("LLM request deadline exceeded.")
+    response_txt = "Error (APITimeoutError).  The system timed out producing the response.  Please try again."
+    return {'error': 'DeadlineExceededError'}, response_txt
+
+
+def _circuit_open_response() -> tuple[dict[str, Any], str]:
+    current_app.logger.warning("LLM request failed fast: circuit breaker is open.")
+    response_txt = "Error (Unavailable).  The AI service is not responding right now.  Please try again in a few minutes."
+    return {'error': 'CircuitOpenError'}, response_txt
+
+
+# Errors with which a call may fail without a response, each turned into an error response by _failed_call_response()
+_CALL_ERRORS = (openai.APIError, AdmissionTimeoutError, CircuitOpenError, DeadlineExceededError)
+
+
+def _failed_call_response(e: Exception, breaker: CircuitBreaker) -> tuple[dict[str, Any], str]:
+    if isinstance(e, openai.APIError):
+        return _error_response(e)
+    if isinstance(e, AdmissionTimeoutError):
+        return _admission_timeout_response()
+    if isinstance(e, CircuitOpenError):
+        return _circuit_open_response()
+    breaker.record_failure()  # a deadline exceeded (no attempt failed, but none completed in time)
+    return _deadline_response()
+
+
 class OpenAIClient:
     """Client for interacting with OpenAI or compatible API endpoints."""
 
-    def __init__(self, model: str, api_key: str, *, base_url: str | None = None):
+    def __init__(self, model: str, api_key: str, *, base_url: str | None = None, provider: str = 'openai', limits: KeyLimits | None = None):
         """Initialize an OpenAI client.
 
+        The underlying openai.AsyncOpenAI client (and its connection pool) is
+        leased from a process-wide pool for each completion, so connections are
+        reused across requests that share a provider, base URL, and API key.
+
         Args:
             model: The model identifier to use for completions
             api_key: The API key for authentication
             base_url: Optional base URL for non-OpenAI providers
+            provider: Name of the provider, used to key the client pool
+            limits: Rate limits for this API key (see rate_limiter.py), or None for no limits
         """
-        if base_url:
-            self._client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url)
-        else:
-            self._client = openai.AsyncOpenAI(api_key=api_key)
+        self._pool_key: ClientKey = (provider, base_url or None, api_key)
+        self._provider = provider
         self._model = model
+        self._limits = limits
+        self._latency_key = f"{provider}/{model}"
+
+    @staticmethod
+    def _make_messages(prompt: str | None, messages: list[OpenAIChatMessage] | None) -> list[OpenAIChatMessage]:
+        if messages is None:
+            assert prompt is not None
+            messages = [{"role": "user", "content": prompt}]
+        return messages
 
-    async def get_completion(self, prompt: str | None = None, messages: list[OpenAIChatMessage] | None = None, extra_args: dict[str, Any] | None = None) -> tuple[dict[str, str], str]:
+    @staticmethod
+    def _completion_args(extra_args: dict[str, Any] | None) -> dict[str, Any]:
+        completion_args: dict[str, Any] = {
+            'temperature': 0.25,
+            'max_tokens': 1000,
+        }
+        if extra_args:
+            completion_args |= extra_args
+        return completion_args
+
+    async def get_completion(self, prompt: str | None = None, messages: list[OpenAIChatMessage] | None = None, extra_args: dict[str, Any] | None = None, *, stats: CallStats | None = None) -> tuple[dict[str, str], str]:
         """Get a completion from the LLM.
 
         Args:
             prompt: A single prompt string (converted to a message if provided)
             messages: A list of chat messages in OpenAI format
             (Only one of prompt or messages should be provided)
+            stats: If given, filled in with stats for the request (timing, retries, etc.)
 
         Returns:
             A tuple containing:
@@ -40,59 +148,192 @@ class OpenAIClient:
             If an error occurs, the dict will contain an 'error' key with the error details,
             and the text will contain a user-friendly error message.
         """
-        common_error_text = "Error ({error_type}).  Something went wrong with this query.  The error has been logged, and we'll work on it.  For now, please try again."
-        completion_args: dict[str, Any] = {
-            'temperature': 0.25,
-            'max_tokens': 1000,
-        }
-        if extra_args:
-            completion_args |= extra_args
+        completion_args = self._completion_args(extra_args)
+        messages = self._make_messages(prompt, messages)
 
-        try:
-            if messages is None:
-                assert prompt is not None
-                messages = [{"role": "user", "content": prompt}]
+        tokens = estimate_tokens(messages, completion_args['max_tokens'])
+        policy = RetryPolicy.from_app_config()
+        if stats is None:
+            stats = CallStats()
+        call_start = time.monotonic()
+        hedge_after = latencies.percentile(self._latency_key, 0.95) if policy.hedge else None
+        breaker = get_breaker(self._pool_key)
 
-            response = await self._client.chat.completions.create(
-                model=self._model,
-                messages=messages,
-                **completion_args
-            )
+        async def attempt() -> ChatCompletion:
+            # Each attempt (retry or hedge) passes through the circuit breaker and is admitted separately,
+            # so it counts against the key's rate limits.
+            with breaker.guard():
+                queue_start = time.monotonic()
+                async with admit(self._pool_key, self._limits, tokens) as admission, lease_client(self._pool_key) as client:
+                    start = time.monotonic()
+                    stats.queue_time += start - queue_start
+                    response: ChatCompletion = await client.chat.completions.create(
+                        model=self._model,
+                        messages=messages,
+                        **completion_args
+                    )
+                    latencies.record(self._latency_key, time.monotonic() - start)
+                    if response.usage:
+                        admission.used_tokens = response.usage.total_tokens
+            return response
 
+        try:
+            response = await call_with_retry(attempt, policy, stats, hedge_after=hedge_after)
+        except _CALL_ERRORS as e:
+            response_dict, response_txt = _failed_call_response(e, breaker)
+        else:
             choice = response.choices[0]
             response_txt = choice.message.content or ""
 
             if choice.finish_reason == "length":  # "length" if max_tokens reached
                 response_txt += "\n\n[error: maximum length exceeded]"
 
-            return response.model_dump(), response_txt.strip()
-
-        except openai.APITimeoutError as e:
-            err_str = str(e)
-            response_txt = "Error (APITimeoutError).  The system timed out producing the response.  Please try again."
-            current_app.logger.error(f"OpenAI Timeout: {e}")
-        except openai.RateLimitError as e:
-            err_str = str(e)
-            if "exceeded your current quota" in err_str:
-                response_txt = "Error (RateLimitError).  The API key for this class has exceeded its current quota (https://platform.openai.com/docs/guides/rate-limits/usage-tiers).  The instructor should check their API plan and billing details.  Possibly the key is in the free tier, which does not cover the models used here."
-            else:
-                response_txt = "Error (RateLimitError).  The system is receiving too many requests right now.  Please try again in one minute."
-            current_app.logger.error(f"OpenAI RateLimitError: {e}")
-        except openai.AuthenticationError as e:
-            err_str = str(e)
-            response_txt = "Error (AuthenticationError).  The API key set by the instructor for this class is invalid.  The instructor needs to provide a valid API key for this application to work."
-            current_app.logger.error(f"OpenAI AuthenticationError: {e}")
-        except openai.BadRequestError as e:
-            err_str = str(e)
-            if "maximum context length" in err_str:
-                response_txt = "Error (BadRequestError).  Your query is too long for the model to process.  Please reduce the length of your input."
-            else:
-                response_txt = common_error_text.format(error_type='BadRequestError')
-            current_app.logger.error(f"OpenAI BadRequestError: {e}")
+            response_dict, response_txt = response.model_dump(), response_txt.strip()
+
+        stats.elapsed = time.monotonic() - call_start
+        return response_dict, response_txt
+
+    def stream_completion(self, prompt: str | None = None, messages: list[OpenAIChatMessage] | None = None, extra_args: dict[str, Any] | None = None) -> 'CompletionStream':
+        """Start a streamed completion from the LLM.
+
+        Arguments are as for get_completion().  See CompletionStream for usage.
+        """
+        completion_args = self._completion_args(extra_args)
+        if self._provider == 'openai':
+            completion_args['stream_options'] = {'include_usage': True}  # to get usage stats in the final chunk
+        messages = self._make_messages(prompt, messages)
+        return CompletionStream(self._pool_key, self._model, messages, completion_args, limits=self._limits)
+
+    def completed_stream(self, response: dict[str, Any], text: str) -> 'CompletionStream':
+        """Make a stream that yields an already-complete response's text all at once (e.g., from a cache)."""
+        return _CompletedStream(self._pool_key, self._model, response, text)
+
+
+class CompletionStream:
+    """A completion streamed from the LLM as it is generated.
+
+    Iterate over it (`async for`) to receive the response text in pieces as
+    they are generated.  Once iteration completes, `response` and `text` hold
+    the same values that OpenAIClient.get_completion() would have returned.
+    If iteration stops early, `response` is None and `text` holds the text
+    received so far.
+
+    If set, `on_complete` is called with the response and text once iteration
+    completes.  `stats` holds stats for the request (timing, retries, etc.).
+    """
+    def __init__(self, pool_key: ClientKey, model: str, messages: list[OpenAIChatMessage], completion_args: dict[str, Any], *, limits: KeyLimits | None = None):
+        self._pool_key = pool_key
+        self._model = model
+        self._limits = limits
+        self._messages = messages
+        self._completion_args = completion_args
+        self.response: dict[str, Any] | None = None
+        self.text = ""
+        self.on_complete: Callable[[dict[str, Any], str], None] | None = None
+        self.stats = CallStats()
+        self._started = 0.0
+
+    async def _open_stream(self, breaker: CircuitBreaker) -> tuple[AsyncExitStack, Admission, openai.AsyncStream[ChatCompletionChunk]]:
+        """Open the stream, with retries, returning it with its admission and an exit stack holding them.
+
+        Only opening the stream is retried (not hedged): once text has been yielded, it can't be taken back.
+        """
+        tokens = estimate_tokens(self._messages, self._completion_args['max_tokens'])
+        stats = self.stats
+
+        async def attempt() -> tuple[AsyncExitStack, Admission, openai.AsyncStream[ChatCompletionChunk]]:
+            # Each attempt passes through the circuit breaker and is admitted separately, as in
+            # get_completion().  The successful attempt's breaker guard, admission, and client are
+            # returned in an exit stack, to be held until the stream is finished, so the breaker
+            # records the outcome of the whole stream (including a failure partway through).
+            async with AsyncExitStack() as stack:
+                stack.enter_context(breaker.guard())
+                queue_start = time.monotonic()
+                admission = await stack.enter_async_context(admit(self._pool_key, self._limits, tokens))
+                api_client = await stack.enter_async_context(lease_client(self._pool_key))
+                stats.queue_time += time.monotonic() - queue_start
+                stream: openai.AsyncStream[ChatCompletionChunk] = await api_client.chat.completions.create(
+                    model=self._model,
+                    messages=self._messages,
+                    stream=True,
+                    **self._completion_args
+                )
+                return stack.pop_all(), admission, stream
+
+        return await call_with_retry(attempt, RetryPolicy.from_app_config(), stats)
+
+    def _assemble_response(self, last_chunk: ChatCompletionChunk | None, finish_reason: str | None) -> dict[str, Any]:
+        """Assemble a response dict in the same format as a non-streamed ChatCompletion.model_dump()."""
+        return {
+            'id': last_chunk.id if last_chunk else None,
+            'model': last_chunk.model if last_chunk else self._model,
+            'created': last_chunk.created if last_chunk else None,
+            'object': 'chat.completion',
+            'choices': [{
+                'index': 0,
+                'finish_reason': finish_reason,
+                'message': {'role': 'assistant', 'content': self.text.strip()},
+            }],
+            'usage': last_chunk.usage.model_dump() if last_chunk and last_chunk.usage else None,
+        }
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        finish_reason = None
+        last_chunk = None
+        stats = self.stats
+        self._started = time.monotonic()
+        breaker = get_breaker(self._pool_key)
+
+        try:
+            held, admission, stream = await self._open_stream(breaker)
+        except _CALL_ERRORS as e:
+            self._completed(*_failed_call_response(e, breaker), stats)
+            return
+
+        try:
+            async with held:
+                try:
+                    async for chunk in stream:
+                        last_chunk = chunk
+                        if not chunk.choices:
+                            continue  # e.g., the final usage chunk
+                        choice = chunk.choices[0]
+                        finish_reason = choice.finish_reason or finish_reason
+                        if choice.delta.content:
+                            self.text += choice.delta.content
+                            yield choice.delta.content
+                finally:
+                    await stream.close()
+                if last_chunk and last_chunk.usage:
+                    admission.used_tokens = last_chunk.usage.total_tokens
         except openai.APIError as e:
-            err_str = str(e)
-            response_txt = common_error_text.format(error_type='APIError')
-            current_app.logger.error(f"Exception (OpenAI {type(e).__name__}, but I don't handle that specifically yet): {e}")
+            # failed partway through (recorded by the breaker's guard, in `held`)
+            self._completed(*_error_response(e), stats)
+            return
+
+        if finish_reason == "length":  # "length" if max_tokens reached
+            length_error = "\n\n[error: maximum length exceeded]"
+            self.text += length_error
+            yield length_error
+
+        self._completed(self._assemble_response(last_chunk, finish_reason), self.text.strip(), stats)
+
+    def _completed(self, response: dict[str, Any], text: str, stats: CallStats | None = None) -> None:
+        if stats is not None:
+            stats.elapsed = time.monotonic() - self._started
+        self.response = response
+        self.text = text
+        if self.on_complete is not None:
+            self.on_complete(self.response, self.text)
+
 
-        return {'error': err_str}, response_txt
+class _CompletedStream(CompletionStream):
+    """A CompletionStream for a response that is already complete (e.g., from a cache)."""
+    def __init__(self, pool_key: ClientKey, model: str, response: dict[str, Any], text: str):
+        super().__init__(pool_key, model, [], {})
+        self._response = response
+        self._text = text
 
+    async def __aiter__(self) -> AsyncIterator[str]:
+        yield self._text
+        self._completed(self._response, self._text)
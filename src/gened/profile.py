@@ -15,9 +15,15 @@ from flask import (
 )
 from werkzeug.wrappers.response import Response
 
-from .app_data import get_registered_data_source, get_user_data
+from .app_data import (
+    DataSource,
+    Filters,
+    get_registered_data_source,
+    set_table_page,
+    table_page_response,
+)
 from .auth import generate_anon_username, get_auth, login_required
-from .csv import csv_response
+from .csv import ExportFormat, export_response
 from .data_deletion import delete_user_data
 from .db import get_db
 from .redir import safe_redirect
@@ -39,10 +45,9 @@ def main() -> str:
         SELECT
             users.*,
             auth_providers.name AS provider_name,
-            COUNT(queries.id) AS num_queries,
-            SUM(CASE WHEN queries.query_time > date('now', '-7 days') THEN 1 ELSE 0 END) AS num_recent_queries
+            (SELECT COALESCE(SUM(queries), 0) FROM usage_user_daily WHERE user_id=users.id) AS num_queries,
+            (SELECT COALESCE(SUM(queries), 0) FROM usage_user_daily WHERE user_id=users.id AND day >= date('now', '-7 days')) AS num_recent_queries
         FROM users
-        LEFT JOIN queries ON queries.user_id=users.id
         LEFT JOIN auth_providers ON auth_providers.id=users.auth_provider
         WHERE users.id=?
     """, [user_id]).fetchone()
@@ -95,24 +100,46 @@ def main() -> str:
 
 @bp.route("/data/")
 def view_data() -> str:
-    table = get_registered_data_source('queries').table
-    table.data = get_user_data(kind='queries', limit=-1)  # -1 = no limit
+    source = _user_queries_source()
+    table = source.table
+    set_table_page(table, source, _user_filters(), url_for(".get_data_page"))
     table.csv_link = url_for(".get_csv", kind="queries")
-    table.hide('user')  # it's just the current user's data; no need to list them in every row
 
     return render_template("profile_view_data.html", queries=table)
 
 
+@bp.route("/data/page")
+def get_data_page() -> Response:
+    """ Get a page of rows for the (server-side) queries table in view_data(). """
+    return table_page_response(_user_queries_source(), _user_filters())
+
+
+def _user_queries_source() -> DataSource:
+    source = get_registered_data_source('queries')
+    source.table.hide('user')  # it's just the current user's data; no need to list them in every row
+    return source
+
+
+def _user_filters() -> Filters:
+    auth = get_auth()
+    assert auth.user_id is not None
+
+    filters = Filters()
+    filters.add('user', auth.user_id)
+    return filters
+
+
 @bp.route("/data/csv/<string:kind>")
-def get_csv(kind: str) -> str | Response:
+@bp.route("/data/export/<string:kind>/<any(csv, ndjson):fmt>")
+def get_csv(kind: str, fmt: ExportFormat = 'csv') -> str | Response:
     if kind not in ('queries'):
         return abort(404)
 
     auth = get_auth()
     assert auth.user
 
-    queries = get_user_data(kind='queries', limit=-1)  # -1 = no limit
-    return csv_response(auth.user.display_name, kind, queries)
+    get_queries = get_registered_data_source('queries').function
+    return export_response(auth.user.display_name, kind, get_queries(_user_filters()), fmt)
 
 
 @bp.route("/delete_data", methods=['POST'])
@@ -0,0 +1,273 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""Per-API-key admission control for LLM API calls.
+
+Many requests can share one API key (e.g., every class under an LTI consumer,
+or every user of the system key), and a burst of them can exceed the
+provider's rate limits.  Rather than sending them all and failing some with a
+RateLimitError, each API call must first be admitted by its key's limiter,
+which enforces:
+  - a maximum number of calls in flight at once,
+  - a requests-per-minute token bucket, and
+  - a tokens-per-minute token bucket (charged with an estimate up front and
+    corrected with the actual usage when the call completes).
+
+Requests that cannot be admitted immediately wait in FIFO order, up to a
+maximum wait, after which AdmissionTimeoutError is raised.
+
+Limiters live on the event loop that runs the API calls (see async_runner.py),
+so the limits apply per worker process.
+"""
+
+import asyncio
+import threading
+import time
+from collections.abc import AsyncIterator, Iterable, Mapping
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any
+
+from flask import current_app
+
+from .client_pool import ClientKey
+
+
+class AdmissionTimeoutError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class KeyLimits:
+    max_inflight: int | None = None  # None (or <= 0) for no limit
+    rpm: int | None = None           # requests per minute; None (or <= 0) for no limit
+    tpm: int | None = None           # tokens per minute; None (or <= 0) for no limit
+    max_wait: float = 30             # seconds a request may wait to be admitted
+
+    @classmethod
+    def from_app_config(cls, *, max_inflight: int | None = None, rpm: int | None = None, tpm: int | None = None) -> 'KeyLimits':
+        """Get limits from the given values, using the app's configured defaults for any that are None."""
+        config = current_app.config
+        return cls(
+            max_inflight=max_inflight if max_inflight is not None else config['LLM_KEY_MAX_INFLIGHT'],
+            rpm=rpm if rpm is not None else config['LLM_KEY_RPM'],
+            tpm=tpm if tpm is not None else config['LLM_KEY_TPM'],
+            max_wait=config['LLM_ADMISSION_MAX_WAIT'],
+        )
+
+
+def key_limits_from_form(form: Mapping[str, str]) -> tuple[list[int | None], bool]:
+    """Read an API key's rate limits (llm_max_inflight, llm_rpm, llm_tpm) from a config form.
+
+    Each is a positive integer, or None (left blank or invalid) to use the
+    application default.  Also returns whether any value was invalid.
+    """
+    values = [form.get(name, '').strip() for name in ('llm_max_inflight', 'llm_rpm', 'llm_tpm')]
+    limits = [int(value) if value.isdecimal() and int(value) > 0 else None for value in values]
+    invalid = any(value and limit is None for value, limit in zip(values, limits, strict=True))
+    return limits, invalid
+
+
+def estimate_tokens(messages: Iterable[Any], max_tokens: int) -> int:
+    """Roughly estimate the tokens a completion will use: ~4 characters per prompt token, plus max_tokens."""
+    prompt_chars = sum(len(str(message.get('content', ''))) for message in messages)
+    return prompt_chars // 4 + max_tokens
+
+
+class _TokenBucket:
+    """A bucket refilled at per_minute per minute, up to per_minute.  Does not limit anything if per_minute <= 0."""
+    def __init__(self, per_minute: int) -> None:
+        self.per_minute = per_minute
+        self._level = float(per_minute)
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._level = min(self.per_minute, self._level + (now - self._updated) * self.per_minute / 60)
+        self._updated = now
+
+    def wait_time(self, amount: int) -> float:
+        """Seconds until `amount` can be taken (0 if it can be taken now)."""
+        if self.per_minute <= 0:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.per_minute)  # anything larger could never be admitted
+        return max(0.0, (amount - self._level) * 60 / self.per_minute)
+
+    def take(self, amount: int) -> None:
+        self._refill()
+        self._level -= amount  # may go negative, which delays later requests accordingly
+
+    def give(self, amount: int) -> None:
+        self._refill()
+        self._level = min(self.per_minute, self._level + amount)
+
+    def set_rate(self, per_minute: int) -> None:
+        """Change the rate, keeping the current level (up to the new capacity)."""
+        if per_minute == self.per_minute:
+            return
+        self._refill()
+        self.per_minute = per_minute
+        self._level = min(self._level, per_minute)
+
+
+@dataclass
+class Admission:
+    estimated_tokens: int
+    used_tokens: int | None = None  # set by the caller once known, to correct the estimate
+
+
+@dataclass(frozen=True)
+class LimiterStats:
+    key_suffix: str
+    inflight: int
+    waiting: int
+    admitted: int
+    timeouts: int
+
+
+class KeyLimiter:
+    def __init__(self) -> None:
+        self._queue_lock = asyncio.Lock()  # FIFO: only the request at the head of the queue waits for capacity
+        self._slots = asyncio.Condition()
+        self._requests: _TokenBucket | None = None
+        self._tokens: _TokenBucket | None = None
+        self.inflight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.timeouts = 0
+
+    def _update_buckets(self, limits: KeyLimits) -> tuple[_TokenBucket | None, _TokenBucket | None]:
+        """Get the (requests, tokens) buckets that apply to a request with the given limits.
+
+        Requests with different limits can share a key (e.g., classes sharing
+        an instructor's key), so a bucket is kept (not refilled or dropped)
+        when a request has a different limit or none: a new rate keeps the
+        bucket's level, and a request with no limit simply isn't charged.
+        """
+        if limits.rpm is not None and limits.rpm > 0:
+            if self._requests is None:
+                self._requests = _TokenBucket(limits.rpm)
+            self._requests.set_rate(limits.rpm)
+            requests = self._requests
+        else:
+            requests = None
+        if limits.tpm is not None and limits.tpm > 0:
+            if self._tokens is None:
+                self._tokens = _TokenBucket(limits.tpm)
+            self._tokens.set_rate(limits.tpm)
+            tokens = self._tokens
+        else:
+            tokens = None
+        return requests, tokens
+
+    async def _acquire(self, limits: KeyLimits, tokens: int, deadline: float) -> None:
+        async with self._queue_lock:
+            requests_bucket, tokens_bucket = self._update_buckets(limits)
+            while (wait := max(
+                requests_bucket.wait_time(1) if requests_bucket else 0.0,
+                tokens_bucket.wait_time(tokens) if tokens_bucket else 0.0,
+            )) > 0:
+                if time.monotonic() + wait > deadline:
+                    raise AdmissionTimeoutError
+                await asyncio.sleep(wait)
+            if requests_bucket:
+                requests_bucket.take(1)
+            if tokens_bucket:
+                tokens_bucket.take(tokens)
+
+            try:
+                async with self._slots:
+                    await self._slots.wait_for(lambda: limits.max_inflight is None or limits.max_inflight <= 0 or self.inflight < limits.max_inflight)
+                    self.inflight += 1
+            except asyncio.CancelledError:
+                # timed out waiting for a slot: return what was taken from the buckets
+                if requests_bucket:
+                    requests_bucket.give(1)
+                if tokens_bucket:
+                    tokens_bucket.give(tokens)
+                raise
+
+    async def _release(self, limits: KeyLimits, admission: Admission) -> None:
+        async with self._slots:
+            self.inflight -= 1
+            self._slots.notify()
+        charged = limits.tpm is not None and limits.tpm > 0
+        if self._tokens and charged and admission.used_tokens is not None:
+            # correct the estimate
+            correction = admission.used_tokens - admission.estimated_tokens
+            if correction > 0:
+                self._tokens.take(correction)
+            else:
+                self._tokens.give(-correction)
+
+    @asynccontextmanager
+    async def admit(self, limits: KeyLimits, tokens: int) -> AsyncIterator[Admission]:
+        """Wait to be admitted, then hold an in-flight slot for the duration of the context.
+
+        Raises AdmissionTimeoutError if not admitted within limits.max_wait seconds.
+        """
+        deadline = time.monotonic() + limits.max_wait
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._acquire(limits, tokens, deadline), limits.max_wait)
+        except (asyncio.TimeoutError, AdmissionTimeoutError):  # asyncio.TimeoutError is not the builtin TimeoutError in Python 3.10
+            self.timeouts += 1
+            raise AdmissionTimeoutError from None
+        finally:
+            self.waiting -= 1
+        self.admitted += 1
+
+        admission = Admission(estimated_tokens=tokens)
+        try:
+            yield admission
+        finally:
+            await self._release(limits, admission)
+
+
+class _Registry:
+    def __init__(self) -> None:
+        self._limiters: dict[tuple[asyncio.AbstractEventLoop, ClientKey], KeyLimiter] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: ClientKey) -> KeyLimiter:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            # drop limiters for loops that no longer exist
+            for loop_key in [k for k in self._limiters if k[0].is_closed()]:
+                del self._limiters[loop_key]
+            return self._limiters.setdefault((loop, key), KeyLimiter())
+
+    def stats(self) -> list[LimiterStats]:
+        with self._lock:
+            items = list(self._limiters.items())
+        return [
+            LimiterStats(
+                key_suffix=key[2][-4:],
+                inflight=limiter.inflight,
+                waiting=limiter.waiting,
+                admitted=limiter.admitted,
+                timeouts=limiter.timeouts,
+            )
+            for (_loop, key), limiter in items
+        ]
+
+
+_registry = _Registry()
+
+
+@asynccontextmanager
+async def admit(key: ClientKey, limits: KeyLimits | None, tokens: int) -> AsyncIterator[Admission]:
+    """Wait for admission to make an API call with the given key (see KeyLimiter.admit()).
+    With no limits, admits immediately.
+    """
+    if limits is None:
+        yield Admission(estimated_tokens=tokens)
+        return
+    async with _registry.get(key).admit(limits, tokens) as admission:
+        yield admission
+
+
+def get_limiter_stats() -> list[LimiterStats]:
+    return _registry.stats()
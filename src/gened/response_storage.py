@@ -0,0 +1,190 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""Compact storage of LLM responses for queries.
+
+Each response recorded for a query is a full ChatCompletion.model_dump() (or
+an error dict), with ids, usage details, a system fingerprint, and so on,
+often several times larger than the response text.  With
+COMPACT_RESPONSES=True, queries.response_json holds only the fields that are
+used (see compact_response()), and the full responses are kept, compressed
+with zlib, in the query_raw_responses table.
+
+Rows recorded before this (or with COMPACT_RESPONSES=False) can be rewritten
+in batches with `flask compact-responses`, which reports the space
+reclaimed.
+"""
+
+import json
+import sqlite3
+import zlib
+from dataclasses import dataclass
+from typing import Any
+
+import click
+from flask import Flask, current_app
+
+from .db import get_db
+
+_USAGE_FIELDS = ('prompt_tokens', 'completion_tokens', 'total_tokens')
+
+
+def compact_response(response: dict[str, Any]) -> dict[str, Any]:
+    """Keep only the fields of a response that are used: any error, plus the model, finish reason, and token counts."""
+    compact: dict[str, Any] = {}
+    if 'error' in response:
+        compact['error'] = response['error']
+    if response.get('model'):
+        compact['model'] = response['model']
+    choices = response.get('choices') or []
+    if choices and isinstance(choices[0], dict) and choices[0].get('finish_reason'):
+        compact['finish_reason'] = choices[0]['finish_reason']
+    usage = response.get('usage')
+    if isinstance(usage, dict):
+        compact['usage'] = {field: usage.get(field) for field in _USAGE_FIELDS}
+    return compact
+
+
+def compress_responses(responses: list[dict[str, Any]]) -> bytes:
+    return zlib.compress(json.dumps(responses, separators=(',', ':')).encode())
+
+
+def decompress_responses(raw: bytes) -> list[dict[str, Any]]:
+    responses = json.loads(zlib.decompress(raw))
+    assert isinstance(responses, list)
+    return responses
+
+
+def _compacted(responses: list[dict[str, Any]]) -> tuple[str, bytes | None]:
+    """The response_json to store for a list of responses and, if that drops anything, the compressed full responses."""
+    compact = [compact_response(response) for response in responses]
+    if compact == responses:
+        return json.dumps(responses), None
+    return json.dumps(compact), compress_responses(responses)
+
+
+def save_responses(db: sqlite3.Connection, query_id: int, responses: list[dict[str, Any]], texts: dict[str, str]) -> None:
+    """Store the responses (and response texts) for a query.  Does not commit."""
+    if current_app.config['COMPACT_RESPONSES']:
+        response_json, raw = _compacted(responses)
+    else:
+        response_json, raw = json.dumps(responses), None
+
+    db.execute("UPDATE queries SET response_json=?, response_text=? WHERE id=?", [response_json, json.dumps(texts), query_id])
+    if raw is not None:
+        db.execute("INSERT OR REPLACE INTO query_raw_responses (query_id, raw) VALUES (?, ?)", [query_id, raw])
+    else:
+        # drop any full responses kept from an earlier recording (e.g., of a retried query)
+        db.execute("DELETE FROM query_raw_responses WHERE query_id=?", [query_id])
+
+
+def get_raw_responses(query_id: int) -> list[dict[str, Any]] | None:
+    """Get the full responses recorded for a query (None if it has none)."""
+    db = get_db()
+    row = db.execute("SELECT raw FROM query_raw_responses WHERE query_id=?", [query_id]).fetchone()
+    if row is not None:
+        return decompress_responses(row['raw'])
+    row = db.execute("SELECT response_json FROM queries WHERE id=?", [query_id]).fetchone()
+    if row is None or row['response_json'] is None:
+        return None
+    responses = json.loads(row['response_json'])
+    assert isinstance(responses, list)
+    return responses
+
+
+@dataclass(frozen=True)
+class CompactionReport:
+    scanned: int          # rows with a response_json
+    rewritten: int        # rows compacted
+    json_before: int      # bytes of response_json in the rewritten rows, before
+    json_after: int       # ... and after
+    raw_bytes: int        # bytes of compressed full responses added to query_raw_responses
+    free_pages: int       # pages on the database's freelist afterward (returned to the filesystem by VACUUM)
+    page_size: int
+
+    @property
+    def reclaimed(self) -> int:
+        """Net bytes saved: the shrinkage of response_json less the compressed copies stored."""
+        return self.json_before - self.json_after - self.raw_bytes
+
+
+def compact_stored_responses(batch_size: int = 500) -> CompactionReport:
+    """Rewrite each query's response_json in compact form, moving the full responses to query_raw_responses.
+
+    Works through the queries in id order, committing after each batch, so
+    other writers are only held up for one batch at a time.  Rows already
+    compacted, or that would not change, are left as they are.
+    """
+    db = get_db()
+    scanned = rewritten = json_before = json_after = raw_bytes = 0
+    last_id = -1
+    while True:
+        rows = db.execute("""
+            SELECT id, response_json
+            FROM queries
+            WHERE id > ?
+              AND response_json IS NOT NULL
+              AND id NOT IN (SELECT query_id FROM query_raw_responses)
+            ORDER BY id
+            LIMIT ?
+        """, [last_id, batch_size]).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1]['id']
+        scanned += len(rows)
+
+        updates = []
+        raws = []
+        for row in rows:
+            try:
+                responses = json.loads(row['response_json'])
+            except json.JSONDecodeError:
+                continue
+            if not isinstance(responses, list) or not all(isinstance(response, dict) for response in responses):
+                continue
+            response_json, raw = _compacted(responses)
+            if raw is None:
+                continue
+            updates.append((response_json, row['id']))
+            raws.append((row['id'], raw))
+            json_before += len(row['response_json'].encode())
+            json_after += len(response_json.encode())
+            raw_bytes += len(raw)
+
+        if updates:
+            db.executemany("UPDATE queries SET response_json=? WHERE id=?", updates)
+            db.executemany("INSERT INTO query_raw_responses (query_id, raw) VALUES (?, ?)", raws)
+            db.commit()
+            rewritten += len(updates)
+
+    return CompactionReport(
+        scanned=scanned,
+        rewritten=rewritten,
+        json_before=json_before,
+        json_after=json_after,
+        raw_bytes=raw_bytes,
+        free_pages=db.execute("PRAGMA freelist_count").fetchone()[0],
+        page_size=db.execute("PRAGMA page_size").fetchone()[0],
+    )
+
+
+def _mb(num_bytes: int) -> str:
+    return f"{num_bytes / 1e6:.1f} MB"
+
+
+@click.command('compact-responses')
+@click.option('--batch-size', default=500, help="Rows rewritten per transaction.")
+def compact_responses_command(batch_size: int) -> None:
+    """Move the full LLM responses of existing queries to query_raw_responses, compressed."""
+    report = compact_stored_responses(batch_size)
+    click.echo(f"Compacted {report.rewritten} of {report.scanned} queries with responses.")
+    if report.rewritten:
+        click.echo(f"  response_json:         {_mb(report.json_before)} -> {_mb(report.json_after)}")
+        click.echo(f"  compressed raw copies: {_mb(report.raw_bytes)}")
+        click.echo(f"  reclaimed:             {_mb(report.reclaimed)} ({report.reclaimed / report.json_before:.0%})")
+    click.echo(f"Free pages in the database file: {report.free_pages} ({_mb(report.free_pages * report.page_size)}); run VACUUM to return them to the filesystem.")
+
+
+def init_app(app: Flask) -> None:
+    app.cli.add_command(compact_responses_command)
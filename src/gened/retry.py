@@ -0,0 +1,187 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""Retries and hedging for LLM API calls.
+
+Transient errors (timeouts, connection errors, rate limits, and 5xx server
+errors) are retried with exponential backoff and full jitter, waiting at least
+as long as any retry-after header asks, until the policy's max attempts or the
+overall per-request deadline is reached.
+
+Optionally, a call can be hedged: if it has not completed by the p95 latency
+of recent successful calls to the same model, a second identical call is
+started, and whichever completes first is used.
+"""
+
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import TypeVar
+
+import openai
+from flask import current_app
+
+T = TypeVar('T')
+
+
+class DeadlineExceededError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int = 3
+    base_delay: float = 0.5   # seconds; doubled for each retry, before jitter
+    max_delay: float = 8      # seconds; max backoff before jitter
+    deadline: float = 90      # seconds for the whole request, including all retries
+    hedge: bool = False       # fire a second call if the first is slower than p95
+
+    @classmethod
+    def from_app_config(cls) -> 'RetryPolicy':
+        config = current_app.config
+        return cls(
+            max_attempts=config['LLM_RETRY_MAX_ATTEMPTS'],
+            base_delay=config['LLM_RETRY_BASE_DELAY'],
+            max_delay=config['LLM_RETRY_MAX_DELAY'],
+            deadline=config['LLM_REQUEST_DEADLINE'],
+            hedge=config['LLM_HEDGING'],
+        )
+
+    def backoff(self, retry: int) -> float:
+        """Delay before the given retry (1 for the first), with full jitter."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (retry - 1)))
+
+
+@dataclass
+class CallStats:
+    """Stats for one completion request, filled in by the OpenAIClient making it."""
+    retries: int = 0
+    hedges: int = 0
+    queue_time: float = 0.0  # seconds waiting for admission by the rate limiter (summed over attempts)
+    elapsed: float = 0.0     # seconds for the whole request, including queueing and retries
+
+
+_SERVER_ERROR = 500
+
+
+def is_retryable(e: openai.APIError) -> bool:
+    if isinstance(e, openai.RateLimitError):
+        # a quota error will not resolve itself
+        return "exceeded your current quota" not in str(e)
+    if isinstance(e, openai.APIConnectionError):  # includes APITimeoutError
+        return True
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code in (408, 409) or e.status_code >= _SERVER_ERROR
+    return False
+
+
+def get_retry_after(e: openai.APIError) -> float | None:
+    """Get the delay (in seconds) requested by a response's retry-after headers, if any."""
+    if not isinstance(e, openai.APIStatusError):
+        return None
+    headers = e.response.headers
+    try:
+        if 'retry-after-ms' in headers:
+            return float(headers['retry-after-ms']) / 1000
+        if 'retry-after' in headers:
+            value = headers['retry-after']
+            try:
+                return float(value)
+            except ValueError:
+                retry_time = parsedate_to_datetime(value)  # may also be an HTTP date
+                return max(0.0, retry_time.timestamp() - time.time())
+    except (ValueError, TypeError):
+        pass
+    return None
+
+
+class LatencyTracker:
+    """Tracks recent successful call latencies per model, to set the hedging delay."""
+    def __init__(self, window: int = 200, min_samples: int = 20) -> None:
+        self._window = window
+        self._min_samples = min_samples
+        self._latencies: dict[str, deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, key: str, seconds: float) -> None:
+        with self._lock:
+            self._latencies.setdefault(key, deque(maxlen=self._window)).append(seconds)
+
+    def percentile(self, key: str, q: float) -> float | None:
+        """Get the q-th quantile (0-1) of recent latencies, or None if there are too few samples."""
+        with self._lock:
+            samples = sorted(self._latencies.get(key, ()))
+        if len(samples) < self._min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+latencies = LatencyTracker()
+
+
+async def _hedged(call: Callable[[], Awaitable[T]], hedge_after: float, stats: CallStats) -> T:
+    first = asyncio.ensure_future(call())
+    tasks = [first]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+        if not done:
+            stats.hedges += 1
+            tasks.append(asyncio.ensure_future(call()))
+
+        pending = set(tasks)
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+            if not pending:
+                # all failed: raise the first call's error
+                error = first.exception()
+                assert error is not None
+                raise error
+    finally:
+        for task in tasks:
+            task.cancel()  # no effect if already done
+
+
+async def call_with_retry(call: Callable[[], Awaitable[T]], policy: RetryPolicy, stats: CallStats, *, hedge_after: float | None = None) -> T:
+    """Make a call, retrying transient API errors according to the policy.
+
+    Args:
+        call: Makes a new attempt at the call each time it is called.
+        policy: The retry policy.
+        stats: Updated with the number of retries and hedges made.
+        hedge_after: If given, hedge each attempt after this many seconds.
+
+    Raises:
+        DeadlineExceededError if the policy's deadline passes before a call succeeds.
+        The last attempt's openai.APIError if the error is not retryable or retries are exhausted.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + policy.deadline
+    attempts = 0
+    while True:
+        attempts += 1
+        attempt = _hedged(call, hedge_after, stats) if hedge_after is not None else call()
+        try:
+            return await asyncio.wait_for(attempt, deadline - loop.time())
+        except asyncio.TimeoutError:  # not the builtin TimeoutError in Python 3.10
+            raise DeadlineExceededError from None
+        except openai.APIError as e:
+            if not is_retryable(e) or attempts >= policy.max_attempts:
+                raise
+            delay = policy.backoff(attempts)
+            retry_after = get_retry_after(e)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            if loop.time() + delay >= deadline:
+                raise
+            stats.retries += 1
+            current_app.logger.info(f"Retrying LLM API call in {delay:.2f}s after {type(e).__name__}")
+            await asyncio.sleep(delay)
@@ -22,6 +22,12 @@ DROP TABLE IF EXISTS migrations;
 DROP TABLE IF EXISTS models;
 DROP TABLE IF EXISTS experiments;
 DROP TABLE IF EXISTS experiment_class;
+DROP TABLE IF EXISTS llm_calls;
+DROP TABLE IF EXISTS usage_user_daily;
+DROP TABLE IF EXISTS usage_role_daily;
+DROP TABLE IF EXISTS usage_class_daily;
+DROP TABLE IF EXISTS usage_consumer_daily;
+DROP TABLE IF EXISTS query_raw_responses;
 
 PRAGMA foreign_keys = ON;  -- back on for good
 
@@ -32,6 +38,9 @@ CREATE TABLE consumers (
     lti_secret    TEXT,
     llm_api_key   TEXT,
     model_id      INTEGER NOT NULL,
+    llm_max_inflight  INTEGER CHECK (llm_max_inflight > 0),  -- rate limits for llm_api_key (NULL: use the application default)
+    llm_rpm           INTEGER CHECK (llm_rpm > 0),
+    llm_tpm           INTEGER CHECK (llm_tpm > 0),
     created       DATETIME DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY(model_id) REFERENCES models(id)
 );
@@ -66,6 +75,8 @@ CREATE TABLE users (
     query_tokens  INTEGER NOT NULL DEFAULT 0,  -- number of tokens left for making queries - 0 means cut off
     created       DATETIME DEFAULT CURRENT_TIMESTAMP,
     delete_status TEXT CHECK (delete_status IN ('', 'deleted', 'whitelisted')) DEFAULT '',
+    last_query_time           DATETIME,  -- most recent query by this user (maintained by the app's triggers)
+    last_instructor_activity  DATETIME,  -- most recent query in any class this user instructs (maintained by the app's triggers)
     FOREIGN KEY(auth_provider) REFERENCES auth_providers(id)
 );
 -- user row to link for deleted roles
@@ -79,6 +90,8 @@ CREATE TABLE auth_local (
     created       DATETIME DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY(user_id) REFERENCES users(id)
 );
+DROP INDEX IF EXISTS auth_local_by_username;
+CREATE INDEX auth_local_by_username ON auth_local(username);
 
 CREATE TABLE auth_external (
     user_id       INTEGER PRIMARY KEY,
@@ -99,6 +112,7 @@ CREATE TABLE classes (
     id       INTEGER PRIMARY KEY AUTOINCREMENT,
     name     TEXT NOT NULL,
     enabled  BOOLEAN NOT NULL CHECK (enabled IN (0,1)) DEFAULT 1,
+    llm_cache_enabled  BOOLEAN NOT NULL CHECK (llm_cache_enabled IN (0,1)) DEFAULT 0,  -- reuse responses to identical LLM requests within the class
     created  DATETIME DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -122,6 +136,9 @@ CREATE TABLE classes_user (
     link_ident       TEXT NOT NULL UNIQUE,  -- random (unguessable) identifier used in access/registration link for this class
     link_reg_expires DATE NOT NULL,  -- registration active for the class link if this date is in the future (anywhere on Earth)
     link_anon_login  BOOLEAN NOT NULL CHECK (link_anon_login IN (0,1)) DEFAULT 0,  -- access link will cause new users to register anonymously
+    llm_max_inflight INTEGER CHECK (llm_max_inflight > 0),  -- rate limits for llm_api_key (NULL: use the application default)
+    llm_rpm          INTEGER CHECK (llm_rpm > 0),
+    llm_tpm          INTEGER CHECK (llm_tpm > 0),
     creator_user_id  INTEGER NOT NULL,  -- references users.id
     created          DATETIME DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY(class_id) REFERENCES classes(id),
@@ -130,6 +147,8 @@ CREATE TABLE classes_user (
 );
 DROP INDEX IF EXISTS classes_user_by_link_ident;
 CREATE UNIQUE INDEX  classes_user_by_link_ident ON classes_user(link_ident);
+DROP INDEX IF EXISTS classes_user_by_creator;
+CREATE INDEX classes_user_by_creator ON classes_user(creator_user_id);
 
 -- Roles for users in classes
 CREATE TABLE roles (
@@ -143,6 +162,10 @@ CREATE TABLE roles (
 );
 DROP INDEX IF EXISTS roles_user_class_unique;
 CREATE UNIQUE INDEX  roles_user_class_unique ON roles(user_id, class_id) WHERE user_id != -1;  -- not unique for deleted users
+DROP INDEX IF EXISTS roles_by_class;
+CREATE INDEX roles_by_class ON roles(class_id, role);
+DROP INDEX IF EXISTS roles_by_user;
+CREATE INDEX roles_by_user ON roles(user_id, active);  -- roles_user_class_unique is partial, so it can't serve a lookup by user_id alone
 
 -- Store/manage demonstration links
 CREATE TABLE demo_links (
@@ -198,6 +221,116 @@ CREATE INDEX exp_crs_experiment_idx ON experiment_class(experiment_id);
 DROP INDEX IF EXISTS exp_crs_class_idx;
 CREATE INDEX exp_crs_class_idx ON experiment_class(class_id);
 
+-- Telemetry: one row per LLM API call (see llm_telemetry.py)
+-- (query_id and chat_id refer to app-specific tables, and none of the ids are
+-- foreign keys, so telemetry is kept when the rows it refers to are deleted.)
+CREATE TABLE llm_calls (
+    id                 INTEGER PRIMARY KEY AUTOINCREMENT,
+    call_time          DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    provider           TEXT NOT NULL,
+    model              TEXT NOT NULL,
+    kind               TEXT,  -- the purpose of the call: 'main', 'sufficient', 'cleanup', 'topics', 'tutor', etc.
+    query_id           INTEGER,
+    chat_id            INTEGER,
+    class_id           INTEGER,
+    consumer_id        INTEGER,
+    streamed           BOOLEAN NOT NULL CHECK (streamed IN (0,1)),
+    latency_ms         INTEGER NOT NULL,  -- wall-clock time for the whole call, including queueing and retries
+    queue_ms           INTEGER NOT NULL,  -- time waiting for admission by the API key's rate limiter
+    prompt_tokens      INTEGER,
+    completion_tokens  INTEGER,
+    finish_reason      TEXT,
+    retries            INTEGER NOT NULL DEFAULT 0,
+    hedges             INTEGER NOT NULL DEFAULT 0,
+    error              TEXT
+);
+DROP INDEX IF EXISTS llm_calls_by_time;
+CREATE INDEX llm_calls_by_time ON llm_calls(call_time);
+
+-- Durable queue of background jobs (see jobs.py)
+CREATE TABLE jobs (
+    id             INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind           TEXT NOT NULL,  -- selects the handler that runs the job
+    ref            TEXT,  -- what the job is for, e.g. 'query:123'
+    payload        TEXT NOT NULL,  -- JSON
+    status         TEXT NOT NULL CHECK (status IN ('queued', 'running', 'failed')) DEFAULT 'queued',  -- completed jobs are deleted
+    attempts       INTEGER NOT NULL DEFAULT 0,
+    error          TEXT,  -- from the most recent failed attempt
+    created        DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    started        DATETIME,
+    lease_expires  DATETIME  -- a running job is run again if its lease expires (e.g., its worker died)
+);
+DROP INDEX IF EXISTS jobs_by_status;
+CREATE INDEX jobs_by_status ON jobs(status, id);
+DROP INDEX IF EXISTS jobs_by_ref;
+CREATE INDEX jobs_by_ref ON jobs(ref);
+
+-- Daily usage rollups per user, role, class, and consumer (see usage.py)
+-- Maintained by triggers in the app's schema, so aggregate views read these
+-- rather than counting the app's queries table.
+CREATE TABLE usage_user_daily (
+    user_id       INTEGER NOT NULL,
+    day           DATE NOT NULL,
+    queries       INTEGER NOT NULL DEFAULT 0,
+    errors        INTEGER NOT NULL DEFAULT 0,
+    insufficient  INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day)
+) WITHOUT ROWID;
+CREATE TABLE usage_role_daily (
+    role_id       INTEGER NOT NULL,
+    day           DATE NOT NULL,
+    queries       INTEGER NOT NULL DEFAULT 0,
+    errors        INTEGER NOT NULL DEFAULT 0,
+    insufficient  INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (role_id, day)
+) WITHOUT ROWID;
+CREATE TABLE usage_class_daily (
+    class_id      INTEGER NOT NULL,
+    day           DATE NOT NULL,
+    queries       INTEGER NOT NULL DEFAULT 0,
+    errors        INTEGER NOT NULL DEFAULT 0,
+    insufficient  INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (class_id, day)
+) WITHOUT ROWID;
+CREATE TABLE usage_consumer_daily (
+    consumer_id   INTEGER NOT NULL,
+    day           DATE NOT NULL,
+    queries       INTEGER NOT NULL DEFAULT 0,
+    errors        INTEGER NOT NULL DEFAULT 0,
+    insufficient  INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (consumer_id, day)
+) WITHOUT ROWID;
+
+-- A class's usage counts toward its LTI consumer's rollup while it is linked
+-- to that consumer, so linking or unlinking a class moves its counts.
+CREATE TRIGGER classes_lti_usage_insert AFTER INSERT ON classes_lti
+BEGIN
+    INSERT INTO usage_consumer_daily (consumer_id, day, queries, errors, insufficient)
+        SELECT NEW.lti_consumer_id, day, queries, errors, insufficient FROM usage_class_daily WHERE class_id=NEW.class_id
+        ON CONFLICT (consumer_id, day) DO UPDATE SET queries=queries+excluded.queries, errors=errors+excluded.errors, insufficient=insufficient+excluded.insufficient;
+END;
+CREATE TRIGGER classes_lti_usage_delete AFTER DELETE ON classes_lti
+BEGIN
+    UPDATE usage_consumer_daily SET queries=usage_consumer_daily.queries-cls.queries, errors=usage_consumer_daily.errors-cls.errors, insufficient=usage_consumer_daily.insufficient-cls.insufficient
+        FROM (SELECT * FROM usage_class_daily WHERE class_id=OLD.class_id) AS cls WHERE usage_consumer_daily.consumer_id=OLD.lti_consumer_id AND usage_consumer_daily.day=cls.day;
+END;
+CREATE TRIGGER classes_lti_usage_update AFTER UPDATE OF class_id, lti_consumer_id ON classes_lti
+BEGIN
+    UPDATE usage_consumer_daily SET queries=usage_consumer_daily.queries-cls.queries, errors=usage_consumer_daily.errors-cls.errors, insufficient=usage_consumer_daily.insufficient-cls.insufficient
+        FROM (SELECT * FROM usage_class_daily WHERE class_id=OLD.class_id) AS cls WHERE usage_consumer_daily.consumer_id=OLD.lti_consumer_id AND usage_consumer_daily.day=cls.day;
+    INSERT INTO usage_consumer_daily (consumer_id, day, queries, errors, insufficient)
+        SELECT NEW.lti_consumer_id, day, queries, errors, insufficient FROM usage_class_daily WHERE class_id=NEW.class_id
+        ON CONFLICT (consumer_id, day) DO UPDATE SET queries=queries+excluded.queries, errors=errors+excluded.errors, insufficient=insufficient+excluded.insufficient;
+END;
+
+-- Full LLM responses for the app's queries, zlib-compressed JSON, when
+-- queries.response_json only holds the fields that are used (see response_storage.py)
+CREATE TABLE query_raw_responses (
+    query_id  INTEGER PRIMARY KEY,
+    raw       BLOB NOT NULL,
+    FOREIGN KEY(query_id) REFERENCES queries(id) ON DELETE CASCADE
+);
+
 -- View for user activity tracking
 DROP VIEW IF EXISTS user_activity;
 CREATE VIEW user_activity AS
@@ -208,19 +341,9 @@ SELECT
     auth_providers.name AS auth_provider,
     users.delete_status,
     users.created,
-    (
-        SELECT MAX(q.query_time)
-        FROM queries q
-        WHERE q.user_id = users.id
-    ) as last_query_time,
-    (
-        SELECT MAX(q.query_time)
-        FROM roles r_inst
-        JOIN roles r_student ON r_student.class_id=r_inst.class_id
-        JOIN queries q ON q.role_id=r_student.id
-        WHERE r_inst.user_id = users.id
-          AND r_inst.role = 'instructor'
-    ) as last_instructor_query_time
+    users.last_query_time,
+    users.last_instructor_activity,
+    MAX(IFNULL(users.created, ''), IFNULL(users.last_query_time, ''), IFNULL(users.last_instructor_activity, '')) AS last_activity
 FROM users
 LEFT JOIN auth_providers ON auth_providers.id=users.auth_provider
 WHERE NOT users.is_admin
@@ -0,0 +1,330 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""Always-on statistics for SQL statements, aggregated by statement shape.
+
+Every statement run with execute() or executemany() on a gened.db.Connection
+is recorded under its normalized text (its "shape": literals replaced with
+?, lists of values collapsed, and whitespace and comments removed), so that
+the same query with different values or formatting is counted together.
+For each shape, this keeps the number of calls, total and max time, p95
+time (over recent calls), and rows returned (or changed, for a write).
+
+A statement's time covers execute(), which runs it to its first row, plus
+the time spent fetching its remaining rows.  Statements slower than
+SQL_SLOW_THRESHOLD are also kept in a log of recent slow statements, with
+the shapes (types, not values) of their bound parameters.
+
+Stats are per worker process.  Each process periodically writes a snapshot
+to the instance folder (every SQL_STATS_DUMP_INTERVAL seconds, on a
+request), and `flask sql-stats` merges and prints them.  Snapshots not
+updated for several dump intervals are from processes that have exited, and
+they are deleted as other processes write theirs.  An admin page
+shows the live stats for the process handling the request.
+"""
+
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import deque
+from collections.abc import Iterable, Mapping, Sequence
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+
+import click
+from flask import Flask, current_app
+from werkzeug.wrappers.response import Response
+
+_SAMPLES = 256  # recent times kept per shape, for the p95
+
+
+@dataclass
+class StatementStats:
+    shape: str
+    calls: int = 0
+    total_time: float = 0.0  # seconds
+    max_time: float = 0.0
+    rows: int = 0
+    samples: deque[float] = field(default_factory=lambda: deque(maxlen=_SAMPLES))
+
+    @property
+    def mean_time(self) -> float:
+        return self.total_time / self.calls if self.calls else 0.0
+
+    @property
+    def p95_time(self) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[max(0, math.ceil(len(ordered) * 0.95) - 1)]
+
+    def merge(self, other: 'StatementStats') -> None:
+        self.calls += other.calls
+        self.total_time += other.total_time
+        self.max_time = max(self.max_time, other.max_time)
+        self.rows += other.rows
+        self.samples.extend(other.samples)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'shape': self.shape,
+            'calls': self.calls,
+            'total_time': self.total_time,
+            'max_time': self.max_time,
+            'rows': self.rows,
+            'samples': list(self.samples),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> 'StatementStats':
+        return cls(
+            shape=data['shape'],
+            calls=data['calls'],
+            total_time=data['total_time'],
+            max_time=data['max_time'],
+            rows=data['rows'],
+            samples=deque(data['samples'], maxlen=_SAMPLES),
+        )
+
+
+@dataclass(frozen=True)
+class SlowStatement:
+    time: str  # ISO 8601, UTC
+    shape: str
+    elapsed: float  # seconds (execute() only)
+    params: str  # the shapes of the bound parameters
+
+
+class _Recorder:
+    """The stats for this process."""
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._stats: dict[str, StatementStats] = {}
+        self.slow: deque[SlowStatement] = deque(maxlen=100)
+        self.slow_threshold = 0.1
+
+    def record(self, sql: str, elapsed: float, params: Any = ()) -> StatementStats:
+        shape = normalize_sql(sql)
+        with self._lock:
+            stats = self._stats.get(shape)
+            if stats is None:
+                stats = self._stats[shape] = StatementStats(shape)
+            stats.calls += 1
+            stats.total_time += elapsed
+            stats.max_time = max(stats.max_time, elapsed)
+            stats.samples.append(elapsed)
+        if elapsed >= self.slow_threshold:
+            timestamp = datetime.now(timezone.utc).isoformat(timespec='seconds')
+            self.slow.append(SlowStatement(timestamp, shape, elapsed, param_shapes(params)))
+        return stats
+
+    def add_rows(self, stats: StatementStats, rows: int, elapsed: float) -> None:
+        with self._lock:
+            stats.rows += rows
+            stats.total_time += elapsed
+
+    def snapshot(self) -> list[StatementStats]:
+        with self._lock:
+            return [StatementStats.from_dict(stats.to_dict()) for stats in self._stats.values()]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats = {}
+            self.slow.clear()
+
+
+_recorder = _Recorder()
+record_statement = _recorder.record
+add_rows = _recorder.add_rows
+
+
+_COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?:e[+-]?\d+)?\b", re.IGNORECASE)
+_NAMED_PARAM_RE = re.compile(r"[:@$]\w+")
+_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_VALUES_RE = re.compile(r"(\(\?(?:, \.\.\.)?\))(?:\s*,\s*\1)+")
+_SPACE_RE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def normalize_sql(sql: str) -> str:
+    """Normalize a statement to its shape: the statement with any values replaced by ?.
+
+    >>> normalize_sql("SELECT * FROM users  WHERE id IN (1, 2, 3) AND name='x' -- comment")
+    'SELECT * FROM users WHERE id IN (?, ...) AND name=?'
+    """
+    shape = _COMMENT_RE.sub(" ", sql)
+    shape = _STRING_RE.sub("?", shape)
+    shape = _NUMBER_RE.sub("?", shape)
+    shape = _NAMED_PARAM_RE.sub("?", shape)
+    shape = _SPACE_RE.sub(" ", shape).strip()
+    shape = _LIST_RE.sub("(?, ...)", shape)
+    return _VALUES_RE.sub(r"\1, ...", shape)
+
+
+def _value_shape(value: Any) -> str:
+    if isinstance(value, str | bytes):
+        return f"{type(value).__name__}({len(value)})"
+    return type(value).__name__
+
+
+def param_shapes(params: Any) -> str:
+    """Describe bound parameters by their types (and lengths, for strings), without their values."""
+    if isinstance(params, Mapping):
+        return "{" + ", ".join(f"{name}: {_value_shape(value)}" for name, value in params.items()) + "}"
+    if isinstance(params, Sequence) and not isinstance(params, str | bytes):
+        return "[" + ", ".join(_value_shape(value) for value in params) + "]"
+    return "[]"
+
+
+def get_sql_stats() -> list[StatementStats]:
+    """Get a copy of this process's stats, most total time first."""
+    return sorted(_recorder.snapshot(), key=lambda stats: stats.total_time, reverse=True)
+
+
+def get_slow_statements() -> list[SlowStatement]:
+    """Get this process's recent slow statements, most recent first."""
+    return list(reversed(_recorder.slow))
+
+
+def reset_sql_stats() -> None:
+    _recorder.reset()
+
+
+# ### Snapshots, for `flask sql-stats` ###
+
+def _snapshot_dir(app: Flask) -> Path:
+    return Path(app.instance_path) / 'sql_stats'
+
+
+# A snapshot not updated in this many dump intervals is from a process that has exited.
+_STALE_INTERVALS = 5
+
+
+class _Dumper:
+    def __init__(self) -> None:
+        self.last_dump = time.monotonic()
+
+    def maybe_dump(self, app: Flask) -> None:
+        interval = app.config['SQL_STATS_DUMP_INTERVAL']
+        if interval is None or time.monotonic() - self.last_dump < interval:
+            return
+        self.last_dump = time.monotonic()
+        dump_snapshot(app)
+
+
+_dumper = _Dumper()
+
+
+def dump_snapshot(app: Flask) -> None:
+    """Write this process's stats to its snapshot file."""
+    snapshot_dir = _snapshot_dir(app)
+    snapshot_dir.mkdir(exist_ok=True)
+    data = {
+        'pid': os.getpid(),
+        'updated': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'statements': [stats.to_dict() for stats in _recorder.snapshot()],
+        'slow': [slow.__dict__ for slow in _recorder.slow],
+    }
+    tmp_path = snapshot_dir / f"{os.getpid()}.json.tmp"
+    tmp_path.write_text(json.dumps(data))
+    tmp_path.replace(snapshot_dir / f"{os.getpid()}.json")
+
+    interval = app.config['SQL_STATS_DUMP_INTERVAL']
+    if interval is not None:
+        _delete_stale_snapshots(snapshot_dir, time.time() - _STALE_INTERVALS * interval)
+
+
+def _delete_stale_snapshots(snapshot_dir: Path, cutoff: float) -> None:
+    """Delete snapshots last written before `cutoff` (a timestamp)."""
+    for path in snapshot_dir.glob("*.json"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except FileNotFoundError:
+            pass  # deleted by another process
+
+
+def load_snapshots(app: Flask) -> tuple[list[StatementStats], list[SlowStatement]]:
+    """Merge the snapshots written by all processes, returning (stats, slow statements) as from get_sql_stats() and get_slow_statements()."""
+    merged: dict[str, StatementStats] = {}
+    slow: list[SlowStatement] = []
+    for path in sorted(_snapshot_dir(app).glob("*.json")):
+        data = json.loads(path.read_text())
+        for item in data['statements']:
+            stats = StatementStats.from_dict(item)
+            if stats.shape in merged:
+                merged[stats.shape].merge(stats)
+            else:
+                merged[stats.shape] = stats
+        slow.extend(SlowStatement(**item) for item in data['slow'])
+    return (
+        sorted(merged.values(), key=lambda stats: stats.total_time, reverse=True),
+        sorted(slow, key=lambda item: item.time, reverse=True),
+    )
+
+
+def format_stats(stats: Iterable[StatementStats]) -> str:
+    lines = [f"{'calls':>8} {'total ms':>10} {'mean ms':>8} {'p95 ms':>8} {'max ms':>8} {'rows':>8}  statement"]
+    lines.extend(
+        f"{s.calls:8d} {s.total_time*1000:10.1f} {s.mean_time*1000:8.2f} {s.p95_time*1000:8.2f} {s.max_time*1000:8.2f} {s.rows:8d}  {s.shape}"
+        for s in stats
+    )
+    return "\n".join(lines)
+
+
+_SORT_KEYS = {
+    'total': lambda s: s.total_time,
+    'calls': lambda s: s.calls,
+    'mean': lambda s: s.mean_time,
+    'p95': lambda s: s.p95_time,
+    'max': lambda s: s.max_time,
+    'rows': lambda s: s.rows,
+}
+
+
+@click.command('sql-stats')
+@click.option('--sort', type=click.Choice(list(_SORT_KEYS)), default='total', help="Order statements by this column.")
+@click.option('--limit', default=30, help="Number of statements to show.")
+@click.option('--slow', is_flag=True, help="Show recent slow statements instead.")
+@click.option('--json', 'as_json', is_flag=True, help="Output all stats as JSON.")
+@click.option('--reset', is_flag=True, help="Delete all snapshots.")
+def sql_stats_command(*, sort: str, limit: int, slow: bool, as_json: bool, reset: bool) -> None:
+    """Show SQL statement stats, merged from the snapshots written by all server processes."""
+    if reset:
+        for path in _snapshot_dir(current_app).glob("*.json"):
+            path.unlink()
+        click.echo("Deleted SQL stats snapshots.")
+        return
+
+    stats, slow_statements = load_snapshots(current_app)
+    if as_json:
+        click.echo(json.dumps({
+            'statements': [{k: v for k, v in s.to_dict().items() if k != 'samples'} | {'p95_time': s.p95_time} for s in stats],
+            'slow': [item.__dict__ for item in slow_statements],
+        }, indent=2))
+    elif slow:
+        for item in slow_statements[:limit]:
+            click.echo(f"{item.time}  {item.elapsed*1000:8.1f} ms  {item.shape}  {item.params}")
+    else:
+        stats.sort(key=_SORT_KEYS[sort], reverse=True)
+        click.echo(format_stats(stats[:limit]))
+
+
+def init_app(app: Flask) -> None:
+    _recorder.slow_threshold = app.config['SQL_SLOW_THRESHOLD']
+    _recorder.slow = deque(_recorder.slow, maxlen=app.config['SQL_SLOW_LOG_SIZE'])
+    app.cli.add_command(sql_stats_command)
+
+    @app.after_request
+    def dump_sql_stats(response: Response) -> Response:
+        _dumper.maybe_dump(app)
+        return response
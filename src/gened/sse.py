@@ -0,0 +1,45 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""Server-Sent Events (SSE) responses, for streaming LLM output to the browser.
+
+Event data is JSON-encoded, so it is always a single line regardless of the
+content, and a client should JSON.parse() each event's data.
+"""
+
+import json
+from collections.abc import AsyncIterator, Iterator
+from typing import Any
+
+from flask import Response, stream_with_context
+
+from .asgi import serving_natively
+from .async_runner import iter_local
+
+
+def sse_event(event: str, data: Any = None) -> str:
+    """Format a single named event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_response(events: Iterator[str] | AsyncIterator[str]) -> Response:
+    """Make a streamed response from an iterator of formatted events.
+
+    The iterator runs with the current request context available, and it is
+    closed (raising GeneratorExit in a generator) if the client disconnects.
+    An async iterator (from an async view; see asgi.py) is iterated on the
+    event loop when served with ASGI, and in the request's thread otherwise.
+    """
+    if isinstance(events, AsyncIterator):
+        body: Any = events if serving_natively() else stream_with_context(iter_local(events))
+    else:
+        body = stream_with_context(events)
+    return Response(
+        body,
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',  # disable response buffering in nginx
+        },
+    )
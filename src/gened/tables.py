@@ -95,6 +95,11 @@ class DataTable:
     csv_link: str | None = None
     ajax_url: str | None = None
     data: list[Row] | None = None
+    # Server-side mode: data holds only the current page, and the client
+    # requests other pages (sorted and searched) from page_url.
+    page_url: str | None = None
+    page_size: int = 10
+    total: int | None = None  # number of rows in all pages
 
     def hide(self, col_name: str) -> None:
         self.columns = [
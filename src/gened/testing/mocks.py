@@ -5,11 +5,14 @@
 import asyncio
 import datetime
 import time
-from collections.abc import Awaitable, Callable
+from collections.abc import AsyncIterator, Awaitable, Callable
 from typing import Any
 
-from openai.types.chat import ChatCompletionMessage
+from openai.types.chat import ChatCompletionChunk, ChatCompletionMessage
 from openai.types.chat.chat_completion import ChatCompletion, Choice
+from openai.types.chat.chat_completion_chunk import Choice as ChunkChoice
+from openai.types.chat.chat_completion_chunk import ChoiceDelta
+from openai.types.completion_usage import CompletionUsage
 
 
 def _create_dummy_completion() -> ChatCompletion:
@@ -28,8 +31,40 @@ def _create_dummy_completion() -> ChatCompletion:
             )
         ],
         created=int(datetime.datetime.now().timestamp()),
+        usage=CompletionUsage(prompt_tokens=100, completion_tokens=500, total_tokens=600),
     )
 
+class MockAsyncStream:
+    """Stands in for an openai.AsyncStream of chunks of the dummy completion."""
+    def __init__(self, delay: float) -> None:
+        self._delay = delay
+        self.closed = False
+
+    async def __aiter__(self) -> AsyncIterator[ChatCompletionChunk]:
+        completion = _create_dummy_completion()
+        content = completion.choices[0].message.content
+        assert content is not None
+        pieces = [content[i:i+100] for i in range(0, len(content), 100)]
+        for i, piece in enumerate(pieces):
+            await asyncio.sleep(self._delay / len(pieces))
+            yield ChatCompletionChunk(
+                id=completion.id,
+                model=completion.model,
+                object="chat.completion.chunk",
+                created=completion.created,
+                choices=[
+                    ChunkChoice(
+                        index=0,
+                        delta=ChoiceDelta(content=piece, role="assistant" if i == 0 else None),
+                        finish_reason="stop" if i == len(pieces) - 1 else None,
+                    )
+                ],
+            )
+
+    async def close(self) -> None:
+        self.closed = True
+
+
 def mock_completion(delay: float = 0.0) -> Callable[..., ChatCompletion]:
     def mock(*args: Any, **kwargs: Any) -> ChatCompletion:
         time.sleep(delay)
@@ -37,8 +72,10 @@ def mock_completion(delay: float = 0.0) -> Callable[..., ChatCompletion]:
     return mock
 
 
-def mock_async_completion(delay: float = 0.0) -> Callable[..., Awaitable[ChatCompletion]]:
-    async def mock(*args: Any, **kwargs: Any) -> ChatCompletion:
+def mock_async_completion(delay: float = 0.0) -> Callable[..., Awaitable[ChatCompletion | MockAsyncStream]]:
+    async def mock(*args: Any, **kwargs: Any) -> ChatCompletion | MockAsyncStream:
+        if kwargs.get('stream'):
+            return MockAsyncStream(delay)
         await asyncio.sleep(delay)
         return _create_dummy_completion()
     return mock
@@ -0,0 +1,119 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""Daily usage rollups per user, role, class, and consumer.
+
+Admin, instructor, and profile pages show query counts (in total and over
+the past week) for many users or classes at once.  Counting them from the
+app's queries table takes time proportional to the total number of queries
+ever made, so those counts are instead read from rollup tables holding one
+row per user (or role, class, or consumer) per day:
+
+    usage_{user,role,class,consumer}_daily(<id>, day, queries, errors, insufficient)
+
+The app defines a `usage_events` view with one row per query (its id,
+user_id, role_id, class_id, consumer_id, day, and error and insufficient
+flags), plus triggers on its queries table that keep the rollups up to date
+as queries are inserted, updated, and deleted (see codehelp/schema.sql).
+Triggers on classes_lti (in schema_common.sql) move a class's counts to or
+from its consumer's rollup as the class is linked to or unlinked from it.
+
+The rollups can be checked against the view, and rebuilt from it, with
+`flask usage-rollups check` and `flask usage-rollups rebuild` (e.g., after
+changing what the view counts).
+"""
+
+from dataclasses import dataclass
+
+import click
+from flask import Flask
+
+from .db import get_db
+
+# Rollup tables and the usage_events column each is keyed on
+ROLLUPS = {
+    'usage_user_daily': 'user_id',
+    'usage_role_daily': 'role_id',
+    'usage_class_daily': 'class_id',
+    'usage_consumer_daily': 'consumer_id',
+}
+
+
+def _expected_sql(table: str) -> str:
+    """SQL computing the rows a rollup table should contain from usage_events."""
+    key = ROLLUPS[table]
+    return f"""
+        SELECT {key}, day, COUNT(*) AS queries, SUM(error) AS errors, SUM(insufficient) AS insufficient
+        FROM usage_events
+        WHERE {key} IS NOT NULL
+        GROUP BY {key}, day
+    """  # noqa: S608 -- table and column names are constants
+
+
+@dataclass(frozen=True)
+class RollupCheck:
+    table: str
+    rows: int        # rows in the rollup (not counting emptied rows)
+    mismatched: int  # (id, day) buckets that are missing, extra, or have the wrong counts
+
+
+def rebuild_usage_rollups() -> None:
+    """Recompute all rollup tables from the usage_events view, in one transaction."""
+    db = get_db()
+    for table, key in ROLLUPS.items():
+        db.execute(f"DELETE FROM {table}")  # noqa: S608 -- table name is a constant
+        db.execute(f"INSERT INTO {table} ({key}, day, queries, errors, insufficient) {_expected_sql(table)}")
+    db.commit()
+
+
+def check_usage_rollups() -> list[RollupCheck]:
+    """Compare each rollup table to the counts computed from the usage_events view."""
+    db = get_db()
+    results = []
+    for table, key in ROLLUPS.items():
+        stored = f"""
+            SELECT {key}, day, queries, errors, insufficient
+            FROM {table}
+            WHERE queries != 0 OR errors != 0 OR insufficient != 0
+        """  # noqa: S608 -- table and column names are constants
+        expected = _expected_sql(table)
+        row = db.execute(f"""
+            SELECT
+                (SELECT COUNT(*) FROM ({stored})) AS num_rows,
+                (SELECT COUNT(*) FROM (
+                    SELECT {key}, day FROM ({stored} EXCEPT {expected})
+                    UNION
+                    SELECT {key}, day FROM ({expected} EXCEPT {stored})
+                )) AS mismatched
+        """).fetchone()  # noqa: S608 -- built from constant SQL
+        results.append(RollupCheck(table=table, rows=row['num_rows'], mismatched=row['mismatched']))
+    return results
+
+
+@click.group('usage-rollups')
+def usage_rollups_command() -> None:
+    """Check or rebuild the daily usage rollup tables."""
+
+
+@usage_rollups_command.command('check')
+def check_command() -> None:
+    """Compare the rollups to counts computed from all queries."""
+    results = check_usage_rollups()
+    for result in results:
+        status = click.style("ok", fg='green') if result.mismatched == 0 else click.style(f"{result.mismatched} mismatched", fg='red')
+        click.echo(f"{result.table:>22}: {result.rows:8d} rows  {status}")
+    if any(result.mismatched for result in results):
+        click.echo("Run `flask usage-rollups rebuild` to recompute them.")
+        raise SystemExit(1)
+
+
+@usage_rollups_command.command('rebuild')
+def rebuild_command() -> None:
+    """Recompute the rollups from all queries (e.g., to backfill them)."""
+    rebuild_usage_rollups()
+    click.echo("Rebuilt usage rollups.")
+
+
+def init_app(app: Flask) -> None:
+    app.cli.add_command(usage_rollups_command)
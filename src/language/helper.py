@@ -22,9 +22,12 @@ from markupsafe import Markup
 from werkzeug.wrappers.response import Response
 
 from gened.app_data import DataAccessError, get_query, get_user_data
+from gened.async_runner import run_sync
 from gened.auth import class_enabled_required, get_auth, login_required
 from gened.db import get_db
 from gened.llm import LLM, with_llm
+from gened.llm_telemetry import CallTag
+from gened.response_storage import save_responses
 
 from . import prompts
 
@@ -122,7 +125,7 @@ def help_view(query_id: int) -> Response | str:
     return render_template("help_view.html", query=query_row, marked_up=marked_up, responses=responses, history=history)
 
 
-async def run_query_prompts(llm: LLM, writing: str) -> tuple[list[dict[str, str]], dict[str, str]]:
+async def run_query_prompts(llm: LLM, writing: str, *, query_id: int | None = None) -> tuple[list[dict[str, str]], dict[str, str]]:
     ''' Run the given query through the LLM.
 
     Returns a tuple containing:
@@ -136,6 +139,7 @@ async def run_query_prompts(llm: LLM, writing: str) -> tuple[list[dict[str, str]
                 'max_tokens': 4000,
                 'response_format': {'type': 'json_object'},
             },
+            tag=CallTag('main', query_id=query_id),
         )
     )
 
@@ -155,7 +159,7 @@ async def run_query_prompts(llm: LLM, writing: str) -> tuple[list[dict[str, str]
 def run_query(llm: LLM, writing: str) -> int:
     query_id = record_query(writing)
 
-    responses, texts = asyncio.run(run_query_prompts(llm, writing))
+    responses, texts = run_sync(run_query_prompts(llm, writing, query_id=query_id))
 
     record_response(query_id, responses, texts)
 
@@ -181,10 +185,7 @@ def record_query(writing: str) -> int:
 def record_response(query_id: int, responses: list[dict[str, str]], texts: dict[str, str]) -> None:
     db = get_db()
 
-    db.execute(
-        "UPDATE queries SET response_json=?, response_text=? WHERE id=?",
-        [json.dumps(responses), json.dumps(texts), query_id]
-    )
+    save_responses(db, query_id, responses, texts)
     db.commit()
 
 
@@ -0,0 +1,15 @@
+-- SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+--
+-- SPDX-License-Identifier: AGPL-3.0-only
+
+BEGIN;
+
+-- A user's queries, a class's queries (via roles), and queries in a time range
+DROP INDEX IF EXISTS queries_by_user;
+CREATE INDEX queries_by_user ON queries(user_id);
+DROP INDEX IF EXISTS queries_by_role;
+CREATE INDEX queries_by_role ON queries(role_id);
+DROP INDEX IF EXISTS queries_by_time;
+CREATE INDEX queries_by_time ON queries(query_time);
+
+COMMIT;
@@ -6,15 +6,19 @@ from sqlite3 import Cursor
 
 from gened.app_data import (
     Filters,
+    TableQuery,
+    class_joins,
+    query_rows,
     register_data,
 )
-from gened.db import get_db
 from gened.tables import Col, DataTable, NumCol, ResponseCol, TimeCol, UserCol
 
 
-def get_queries(filters: Filters, limit: int=-1, offset: int=0) -> Cursor:
-    db = get_db()
+def get_queries(filters: Filters, limit: int=-1, offset: int=0, before_id: int | None=None, table_query: TableQuery | None=None) -> Cursor:
     where_clause, where_params = filters.make_where(['consumer', 'class', 'user', 'role', 'query'])
+    if before_id is not None:
+        where_clause += " AND queries.id < ?"
+        where_params.append(before_id)
     sql = f"""
         SELECT
             queries.id AS id,
@@ -27,17 +31,10 @@ def get_queries(filters: Filters, limit: int=-1, offset: int=0) -> Cursor:
         FROM queries
         JOIN users ON queries.user_id=users.id
         LEFT JOIN auth_providers ON users.auth_provider=auth_providers.id
-        LEFT JOIN roles ON UNLIKELY(queries.role_id=roles.id)  -- UNLIKELY() to help query planner in older sqlite versions
-        LEFT JOIN classes ON UNLIKELY(roles.class_id=classes.id)
-        LEFT JOIN classes_lti ON classes.id=classes_lti.class_id
-        LEFT JOIN consumers ON consumers.id=classes_lti.lti_consumer_id
+        {class_joins(filters, 'queries.role_id')}
         WHERE {where_clause}
-        ORDER BY queries.id DESC
-        LIMIT ?
-        OFFSET ?
     """
-    cur = db.execute(sql, [*where_params, limit, offset])
-    return cur
+    return query_rows(sql, where_params, order_by="id DESC", limit=limit, offset=offset, table_query=table_query)
 
 
 queries_table = DataTable(
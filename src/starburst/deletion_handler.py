@@ -13,9 +13,15 @@ class StarburstDeletionHandler(DeletionHandler):
         """Delete/Anonymize personal data for a user while preserving non-personal data for analysis."""
         db = get_db()
 
-        # Delete queries
+        # Delete queries, with their full LLM responses (see gened.response_storage)
         db.execute("""
-            DELETE queries
+            DELETE FROM query_raw_responses
+            WHERE query_id IN (
+                SELECT id FROM queries WHERE user_id = ?
+            )
+        """, [user_id])
+        db.execute("""
+            DELETE FROM queries
             WHERE user_id = ?
         """, [user_id])
 
@@ -25,7 +31,15 @@ class StarburstDeletionHandler(DeletionHandler):
         """Delete/Anonymize personal data for a class while preserving non-personal data for analysis."""
         db = get_db()
 
-        # Delete queries
+        # Delete queries, with their full LLM responses (see gened.response_storage)
+        db.execute("""
+            DELETE FROM query_raw_responses
+            WHERE query_id IN (
+                SELECT queries.id FROM queries
+                JOIN roles ON roles.id = queries.role_id
+                WHERE roles.class_id = ?
+            )
+        """, [class_id])
         db.execute("""
             DELETE FROM queries
             WHERE role_id IN (
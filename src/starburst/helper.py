@@ -18,9 +18,12 @@ from flask import (
 from werkzeug.wrappers.response import Response
 
 from gened.app_data import DataAccessError, get_query, get_user_data
+from gened.async_runner import run_sync
 from gened.auth import class_enabled_required, get_auth, login_required
 from gened.db import get_db
 from gened.llm import LLM, with_llm
+from gened.llm_telemetry import CallTag
+from gened.response_storage import save_responses
 
 from . import prompts
 
@@ -63,7 +66,7 @@ def help_view(query_id: int) -> Response | str:
     return render_template("help_view.html", query=query_row, responses=responses, history=history)
 
 
-async def run_query_prompts(llm: LLM, assignment: str, topics: str) -> tuple[list[dict[str, str]], dict[str, str]]:
+async def run_query_prompts(llm: LLM, assignment: str, topics: str, *, query_id: int | None = None) -> tuple[list[dict[str, str]], dict[str, str]]:
     ''' Run the given query against the coding help system of prompts.
 
     Returns a tuple containing:
@@ -73,6 +76,7 @@ async def run_query_prompts(llm: LLM, assignment: str, topics: str) -> tuple[lis
     task_main = asyncio.create_task(
         llm.get_completion(
             prompt=prompts.make_main_prompt(assignment, topics),
+            tag=CallTag('main', query_id=query_id),
         )
     )
 
@@ -92,7 +96,7 @@ async def run_query_prompts(llm: LLM, assignment: str, topics: str) -> tuple[lis
 def run_query(llm: LLM, assignment: str, topics: str) -> int:
     query_id = record_query(assignment, topics)
 
-    responses, texts = asyncio.run(run_query_prompts(llm, assignment, topics))
+    responses, texts = run_sync(run_query_prompts(llm, assignment, topics, query_id=query_id))
 
     record_response(query_id, responses, texts)
 
@@ -118,10 +122,7 @@ def record_query(assignment: str, topics: str) -> int:
 def record_response(query_id: int, responses: list[dict[str, str]], texts: dict[str, str]) -> None:
     db = get_db()
 
-    db.execute(
-        "UPDATE queries SET response_json=?, response_text=? WHERE id=?",
-        [json.dumps(responses), json.dumps(texts), query_id]
-    )
+    save_responses(db, query_id, responses, texts)
     db.commit()
 
 
@@ -20,3 +20,101 @@ CREATE TABLE queries (
     FOREIGN KEY(user_id) REFERENCES users(id),
     FOREIGN KEY(role_id) REFERENCES roles(id)
 );
+DROP INDEX IF EXISTS queries_by_user;
+CREATE INDEX queries_by_user ON queries(user_id);
+DROP INDEX IF EXISTS queries_by_role;
+CREATE INDEX queries_by_role ON queries(role_id);
+DROP INDEX IF EXISTS queries_by_time;
+CREATE INDEX queries_by_time ON queries(query_time);
+
+-- Usage of the app, one row per query, for the usage rollups (see gened/usage.py)
+DROP VIEW IF EXISTS usage_events;
+CREATE VIEW usage_events AS
+SELECT
+    queries.id,
+    queries.user_id,
+    queries.role_id,
+    roles.class_id,
+    classes_lti.lti_consumer_id AS consumer_id,
+    date(queries.query_time) AS day,
+    0 AS error,  -- errors and insufficient queries are not tracked in this app
+    0 AS insufficient
+FROM queries
+LEFT JOIN roles ON roles.id=queries.role_id
+LEFT JOIN classes_lti ON classes_lti.class_id=roles.class_id
+;
+
+-- Keep the usage rollups up to date: a query is added to them when inserted,
+-- removed before it is deleted, and removed and re-added around an update
+-- that may change how it is counted.
+CREATE TRIGGER queries_usage_insert AFTER INSERT ON queries
+BEGIN
+    INSERT INTO usage_user_daily (user_id, day, queries, errors, insufficient)
+        SELECT user_id, day, 1, error, insufficient FROM usage_events WHERE id=NEW.id
+        ON CONFLICT DO UPDATE SET queries=queries+1, errors=errors+excluded.errors, insufficient=insufficient+excluded.insufficient;
+    INSERT INTO usage_role_daily (role_id, day, queries, errors, insufficient)
+        SELECT role_id, day, 1, error, insufficient FROM usage_events WHERE id=NEW.id AND role_id IS NOT NULL
+        ON CONFLICT DO UPDATE SET queries=queries+1, errors=errors+excluded.errors, insufficient=insufficient+excluded.insufficient;
+    INSERT INTO usage_class_daily (class_id, day, queries, errors, insufficient)
+        SELECT class_id, day, 1, error, insufficient FROM usage_events WHERE id=NEW.id AND class_id IS NOT NULL
+        ON CONFLICT DO UPDATE SET queries=queries+1, errors=errors+excluded.errors, insufficient=insufficient+excluded.insufficient;
+    INSERT INTO usage_consumer_daily (consumer_id, day, queries, errors, insufficient)
+        SELECT consumer_id, day, 1, error, insufficient FROM usage_events WHERE id=NEW.id AND consumer_id IS NOT NULL
+        ON CONFLICT DO UPDATE SET queries=queries+1, errors=errors+excluded.errors, insufficient=insufficient+excluded.insufficient;
+END;
+
+CREATE TRIGGER queries_usage_delete BEFORE DELETE ON queries
+BEGIN
+    UPDATE usage_user_daily SET queries=queries-1, errors=errors-ev.error, insufficient=usage_user_daily.insufficient-ev.insufficient
+        FROM (SELECT * FROM usage_events WHERE id=OLD.id) AS ev WHERE usage_user_daily.user_id=ev.user_id AND usage_user_daily.day=ev.day;
+    UPDATE usage_role_daily SET queries=queries-1, errors=errors-ev.error, insufficient=usage_role_daily.insufficient-ev.insufficient
+        FROM (SELECT * FROM usage_events WHERE id=OLD.id) AS ev WHERE usage_role_daily.role_id=ev.role_id AND usage_role_daily.day=ev.day;
+    UPDATE usage_class_daily SET queries=queries-1, errors=errors-ev.error, insufficient=usage_class_daily.insufficient-ev.insufficient
+        FROM (SELECT * FROM usage_events WHERE id=OLD.id) AS ev WHERE usage_class_daily.class_id=ev.class_id AND usage_class_daily.day=ev.day;
+    UPDATE usage_consumer_daily SET queries=queries-1, errors=errors-ev.error, insufficient=usage_consumer_daily.insufficient-ev.insufficient
+        FROM (SELECT * FROM usage_events WHERE id=OLD.id) AS ev WHERE usage_consumer_daily.consumer_id=ev.consumer_id AND usage_consumer_daily.day=ev.day;
+END;
+
+CREATE TRIGGER queries_usage_update_before BEFORE UPDATE OF query_time, user_id, role_id, response_json, response_text ON queries
+BEGIN
+    UPDATE usage_user_daily SET queries=queries-1, errors=errors-ev.error, insufficient=usage_user_daily.insufficient-ev.insufficient
+        FROM (SELECT * FROM usage_events WHERE id=OLD.id) AS ev WHERE usage_user_daily.user_id=ev.user_id AND usage_user_daily.day=ev.day;
+    UPDATE usage_role_daily SET queries=queries-1, errors=errors-ev.error, insufficient=usage_role_daily.insufficient-ev.insufficient
+        FROM (SELECT * FROM usage_events WHERE id=OLD.id) AS ev WHERE usage_role_daily.role_id=ev.role_id AND usage_role_daily.day=ev.day;
+    UPDATE usage_class_daily SET queries=queries-1, errors=errors-ev.error, insufficient=usage_class_daily.insufficient-ev.insufficient
+        FROM (SELECT * FROM usage_events WHERE id=OLD.id) AS ev WHERE usage_class_daily.class_id=ev.class_id AND usage_class_daily.day=ev.day;
+    UPDATE usage_consumer_daily SET queries=queries-1, errors=errors-ev.error, insufficient=usage_consumer_daily.insufficient-ev.insufficient
+        FROM (SELECT * FROM usage_events WHERE id=OLD.id) AS ev WHERE usage_consumer_daily.consumer_id=ev.consumer_id AND usage_consumer_daily.day=ev.day;
+END;
+
+CREATE TRIGGER queries_usage_update_after AFTER UPDATE OF query_time, user_id, role_id, response_json, response_text ON queries
+BEGIN
+    INSERT INTO usage_user_daily (user_id, day, queries, errors, insufficient)
+        SELECT user_id, day, 1, error, insufficient FROM usage_events WHERE id=NEW.id
+        ON CONFLICT DO UPDATE SET queries=queries+1, errors=errors+excluded.errors, insufficient=insufficient+excluded.insufficient;
+    INSERT INTO usage_role_daily (role_id, day, queries, errors, insufficient)
+        SELECT role_id, day, 1, error, insufficient FROM usage_events WHERE id=NEW.id AND role_id IS NOT NULL
+        ON CONFLICT DO UPDATE SET queries=queries+1, errors=errors+excluded.errors, insufficient=insufficient+excluded.insufficient;
+    INSERT INTO usage_class_daily (class_id, day, queries, errors, insufficient)
+        SELECT class_id, day, 1, error, insufficient FROM usage_events WHERE id=NEW.id AND class_id IS NOT NULL
+        ON CONFLICT DO UPDATE SET queries=queries+1, errors=errors+excluded.errors, insufficient=insufficient+excluded.insufficient;
+    INSERT INTO usage_consumer_daily (consumer_id, day, queries, errors, insufficient)
+        SELECT consumer_id, day, 1, error, insufficient FROM usage_events WHERE id=NEW.id AND consumer_id IS NOT NULL
+        ON CONFLICT DO UPDATE SET queries=queries+1, errors=errors+excluded.errors, insufficient=insufficient+excluded.insufficient;
+END;
+
+-- Keep users' last activity times up to date (see the user_activity view)
+CREATE TRIGGER queries_activity_insert AFTER INSERT ON queries
+BEGIN
+    UPDATE users SET last_query_time=NEW.query_time
+        WHERE id=NEW.user_id AND (last_query_time IS NULL OR last_query_time < NEW.query_time);
+    UPDATE users SET last_instructor_activity=NEW.query_time
+        WHERE id IN (
+            SELECT r_inst.user_id
+            FROM roles AS r_student
+            JOIN roles AS r_inst ON r_inst.class_id=r_student.class_id
+            WHERE r_student.id=NEW.role_id
+              AND r_inst.role='instructor'
+        )
+        AND (last_instructor_activity IS NULL OR last_instructor_activity < NEW.query_time);
+END;
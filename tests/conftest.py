@@ -11,7 +11,10 @@ import pytest
 from dotenv import find_dotenv, load_dotenv
 
 import codehelp
-from gened.db import get_db, init_db
+from gened.circuit_breaker import reset_breakers
+from gened.db import close_db_pool, get_db, init_db
+from gened.db_writer import stop_writer
+from gened.jobs import stop_workers
 from gened.lti import reload_consumers
 from gened.testing.mocks import mock_async_completion, mock_completion
 
@@ -62,7 +65,12 @@ def app(monkeypatch, request):
             get_db().executescript(_test_data_sql)
             reload_consumers()  # reload consumers from now-initialized DB
 
+        reset_breakers()  # don't carry failures from one test's API calls into the next
+
         yield app
+        stop_workers(app)  # before the database is removed
+        stop_writer(app)
+        close_db_pool(app)
         # Directory cleanup happens automatically when the context manager exits
 
 
@@ -0,0 +1,137 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import pytest
+
+from gened.app_data import InvalidCursorError, PageCursor
+
+
+@pytest.mark.parametrize('cursor', [PageCursor(before_id=42), PageCursor(offset=0), PageCursor(offset=1000)])
+def test_cursor_roundtrip(cursor):
+    token = cursor.encode()
+    assert '=' not in token
+    assert PageCursor.decode(token) == cursor
+
+
+@pytest.mark.parametrize('token', ['', 'x', 'bm90IGpzb24', 'eyJvIjotMX0', 'eyJiIjoiMSJ9', 'WzFd'])
+def test_cursor_invalid(token):
+    # '', 'x', 'not json', {"o":-1}, {"b":"1"}, [1]
+    with pytest.raises(InvalidCursorError, match="Invalid cursor"):
+        PageCursor.decode(token)
+
+
+def get_pages(client, name, limit):
+    """Page through a data source's JSON API, returning each page's rows and the tokens used."""
+    pages = []
+    tokens = []
+    url = f'/admin/api/{name}/?limit={limit}'
+    while True:
+        response = client.get(url)
+        assert response.status_code == 200
+        page = response.get_json()
+        pages.append(page['data'])
+        if page['next'] is None:
+            return pages, tokens
+        tokens.append(PageCursor.decode(page['next']))
+        url = f'/admin/api/{name}/?limit={limit}&cursor={page["next"]}'
+
+
+def test_keyset_pages(client, auth):
+    auth.login('testadmin', 'testadminpassword')
+    all_rows = client.get('/admin/api/queries/').get_json()['data']
+    assert all_rows
+
+    pages, tokens = get_pages(client, 'queries', 3)
+    assert all(token.before_id is not None for token in tokens)
+    assert [row for page in pages for row in page] == all_rows
+
+    # the same pages as with offsets
+    for i, page in enumerate(pages):
+        response = client.get(f'/admin/api/queries/?limit=3&offset={i*3}')
+        assert response.get_json()['data'] == page
+
+
+def test_offset_pages(client, auth):
+    auth.login('testadmin', 'testadminpassword')
+    all_rows = client.get('/admin/api/classes/').get_json()['data']
+    assert len(all_rows) > 2
+
+    pages, tokens = get_pages(client, 'classes', 2)
+    assert tokens
+    assert all(token.before_id is None for token in tokens)
+    assert [row for page in pages for row in page] == all_rows
+
+
+def test_invalid_cursor(client, auth):
+    auth.login('testadmin', 'testadminpassword')
+    response = client.get('/admin/api/queries/?limit=3&cursor=x')
+    assert response.status_code == 400
+
+
+def test_table_page(client, auth):
+    auth.login('testadmin', 'testadminpassword')
+    page = client.get('/admin/api/queries/page?limit=3').get_json()
+    assert [row['id'] for row in page['data']] == [100, 9, 8]
+    all_rows = client.get('/admin/api/queries/').get_json()['data']
+    assert page['total'] == len(all_rows)
+
+    page = client.get('/admin/api/queries/page?limit=3&offset=3').get_json()
+    assert page['data'] == all_rows[3:6]
+
+
+def test_table_page_sort_search(client, auth):
+    auth.login('testadmin', 'testadminpassword')
+    page = client.get('/admin/api/queries/page?sort=code&dir=asc&search=code1').get_json()
+    # code1 (ids 1 and 5, newest first), then code10 and code11
+    assert [row['id'] for row in page['data']] == [5, 1, 8, 9]
+    assert page['total'] == 4
+
+    page = client.get('/admin/api/queries/page?sort=code&dir=desc&search=code1&limit=2').get_json()
+    assert [row['id'] for row in page['data']] == [9, 8]
+    assert page['total'] == 4
+
+    # LIKE wildcards in the search are matched literally
+    page = client.get('/admin/api/queries/page?search=code_').get_json()
+    assert page == {'data': [], 'total': 0}
+
+
+@pytest.mark.parametrize('args', ['sort=bogus', 'sort=code&dir=up', 'sort=user_id'])
+def test_table_page_invalid(client, auth, args):
+    auth.login('testadmin', 'testadminpassword')
+    response = client.get(f'/admin/api/queries/page?{args}')
+    assert response.status_code == 400
+
+
+def test_admin_main_first_pages(client, auth):
+    auth.login('testadmin', 'testadminpassword')
+    response = client.get('/admin/')
+    assert response.status_code == 200
+    assert b'/admin/api/queries/page' in response.data
+    assert b'"total": 10' in response.data
+
+
+def test_instructor_pages(client, auth):
+    auth.login()  # as testuser, instructor in class 2
+    client.get('/classes/switch/2')
+
+    page = client.get('/instructor/page/users?sort=user&dir=desc').get_json()
+    users = [row['user'] for row in page['data']]
+    assert users == sorted(users, reverse=True)
+    assert page['total'] == len(users)
+
+    page = client.get('/instructor/page/queries?user=11').get_json()
+    assert [row['id'] for row in page['data']] == [9, 8]
+
+    response = client.get('/instructor/page/other')
+    assert response.status_code == 404
+
+
+def test_profile_data_page(client, auth):
+    auth.login()  # as testuser, with queries 8 and 9
+    page = client.get('/profile/data/page?search=error10').get_json()
+    assert [row['id'] for row in page['data']] == [8]
+    assert page['total'] == 1
+
+    page = client.get('/profile/data/page?sort=time&dir=asc').get_json()
+    assert {row['id'] for row in page['data']} == {8, 9}
@@ -0,0 +1,131 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import asyncio
+import time
+from urllib.parse import urlencode
+
+import openai
+import pytest
+
+from gened.asgi import ASGIApp
+from gened.async_runner import LoopReentryError, run_sync
+from gened.testing.mocks import _create_dummy_completion, mock_async_completion
+
+DUMMY_TEXT = (_create_dummy_completion().choices[0].message.content or "").strip()
+
+
+async def asgi_request(asgi_app, method, path, *, data=None, cookie=None):
+    """Make a request of an ASGI app, returning (status, headers, body)."""
+    body = urlencode(data).encode() if data else b""
+    headers = [(b"host", b"localhost")]
+    if cookie:
+        headers.append((b"cookie", cookie.encode()))
+    if data:
+        headers.append((b"content-type", b"application/x-www-form-urlencoded"))
+    scope = {
+        'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http',
+        'path': path, 'root_path': '', 'query_string': b"", 'headers': headers,
+    }
+    received = False
+
+    async def receive():
+        nonlocal received
+        if received:
+            await asyncio.Event().wait()  # the client never disconnects
+        received = True
+        return {'type': 'http.request', 'body': body}
+
+    response = {'body': b""}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+            response['headers'] = {name.decode(): value.decode() for name, value in message['headers']}
+        else:
+            response['body'] += message.get('body', b"")
+
+    await asgi_app(scope, receive, send)
+    return response['status'], response['headers'], response['body'].decode()
+
+
+def request(asgi_app, method, path, **kwargs):
+    # run on the background event loop, as if it were the ASGI server's
+    return run_sync(asgi_request(asgi_app, method, path, **kwargs))
+
+
+@pytest.fixture
+def asgi(app):
+    return ASGIApp(app, threads=4)
+
+
+@pytest.fixture
+def cookie(asgi):
+    # logging in is a regular (not async) view, handled in a thread
+    status, headers, _ = request(asgi, 'POST', '/auth/local_login', data={'username': 'testuser', 'password': 'testpassword', 'next': ''})
+    assert status == 302
+    return headers['set-cookie'].split(';', 1)[0]
+
+
+def test_help_request(asgi, cookie):
+    status, headers, _ = request(asgi, 'POST', '/help/request', data={'code': 'code', 'error': 'error', 'issue': 'issue'}, cookie=cookie)
+    assert status == 302
+    view_url = headers['location']
+
+    status, _, body = request(asgi, 'GET', view_url, cookie=cookie)
+    assert status == 200
+    assert DUMMY_TEXT in body
+
+
+def test_help_stream(app, asgi, cookie):
+    app.config['STREAMING_RESPONSES'] = True
+    _, headers, _ = request(asgi, 'POST', '/help/request', data={'code': 'code', 'error': 'error', 'issue': 'issue'}, cookie=cookie)
+    query_id = int(headers['location'].rsplit('/', 1)[1])
+
+    status, headers, body = request(asgi, 'GET', f"/help/stream/{query_id}", cookie=cookie)
+    assert status == 200
+    assert headers['content-type'].startswith('text/event-stream')
+    assert "event: delta" in body
+    assert body.endswith("event: done\ndata: null\n\n")
+
+    _, _, body = request(asgi, 'GET', f"/help/view/{query_id}", cookie=cookie)
+    assert DUMMY_TEXT in body
+
+
+def test_auth_required(asgi):
+    # an async view still runs its auth decorators
+    status, headers, _ = request(asgi, 'POST', '/help/request', data={'code': 'code', 'error': 'error', 'issue': 'issue'})
+    assert status == 302
+    assert "/auth/login" in headers['location']
+
+    status, _, _ = request(asgi, 'GET', '/no/such/page')
+    assert status == 404
+
+
+def test_concurrent_requests(asgi, cookie, monkeypatch):
+    delay = 0.5
+    monkeypatch.setattr(openai.resources.chat.AsyncCompletions, "create", mock_async_completion(delay))
+    count = 40  # 10x the ASGIApp's threads
+
+    async def many():
+        return await asyncio.gather(*(
+            asgi_request(asgi, 'POST', '/help/request', data={'code': 'code', 'error': 'error', 'issue': f"issue {i}"}, cookie=cookie)
+            for i in range(count)
+        ))
+
+    start = time.perf_counter()
+    responses = run_sync(many())
+    elapsed = time.perf_counter() - start
+
+    assert [status for status, _, _ in responses] == [302] * count
+    assert len({headers['location'] for _, headers, _ in responses}) == count
+    assert elapsed < delay * 8  # waiting concurrently, not four at a time in threads
+
+
+def test_run_sync_on_loop(app):
+    async def nested():
+        return run_sync(asyncio.sleep(0))
+
+    with app.app_context(), pytest.raises(LoopReentryError, match="run_async"):
+        run_sync(nested())
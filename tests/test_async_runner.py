@@ -0,0 +1,80 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import asyncio
+import threading
+
+import pytest
+from flask import current_app
+
+from gened.async_runner import AsyncTimeoutError, get_loop, iter_sync, run_sync
+
+
+def test_runs_on_persistent_loop():
+    async def get_running_loop():
+        return asyncio.get_running_loop(), threading.current_thread()
+
+    loop1, thread1 = run_sync(get_running_loop())
+    loop2, thread2 = run_sync(get_running_loop())
+    assert loop1 is loop2 is get_loop()
+    assert thread1 is thread2
+    assert thread1 is not threading.current_thread()
+
+
+def test_app_context_available(app):
+    async def get_app_name():
+        return current_app.name
+
+    with app.app_context():
+        assert run_sync(get_app_name()) == app.name
+
+
+def test_exception_propagates():
+    async def fail():
+        raise ValueError("oops")
+
+    with pytest.raises(ValueError, match="oops"):
+        run_sync(fail())
+
+
+def test_timeout_cancels():
+    cancelled = threading.Event()
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    with pytest.raises(AsyncTimeoutError, match="did not complete"):
+        run_sync(slow(), timeout=0.05)
+    assert cancelled.wait(1)
+
+
+def test_iter_sync():
+    async def count(n):
+        for i in range(n):
+            await asyncio.sleep(0)
+            yield i
+
+    assert list(iter_sync(count(5))) == [0, 1, 2, 3, 4]
+
+
+def test_iter_sync_early_exit_closes():
+    closed = threading.Event()
+
+    async def forever():
+        try:
+            i = 0
+            while True:
+                yield i
+                i += 1
+        finally:
+            closed.set()
+
+    for i in iter_sync(forever()):
+        if i == 3:
+            break
+    assert closed.is_set()
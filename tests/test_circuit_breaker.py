@@ -0,0 +1,161 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import httpx
+import openai
+import pytest
+
+from gened.async_runner import run_sync
+from gened.circuit_breaker import BreakerConfig, BreakerState, CircuitBreaker, CircuitOpenError
+from gened.openai_client import OpenAIClient
+from gened.rate_limiter import KeyLimits, get_limiter_stats
+
+
+def server_error():
+    response = httpx.Response(503, request=httpx.Request('POST', 'http://test'))
+    return openai.InternalServerError("unavailable", response=response, body=None)
+
+
+def auth_error():
+    response = httpx.Response(401, request=httpx.Request('POST', 'http://test'))
+    return openai.AuthenticationError("invalid key", response=response, body=None)
+
+
+def fail(breaker, error):
+    with pytest.raises(type(error)), breaker.guard():
+        raise error
+
+
+def test_opens_after_consecutive_failures(app):
+    breaker = CircuitBreaker(BreakerConfig(failure_threshold=3, cooldown=60))
+    with app.app_context():
+        for _ in range(3):
+            fail(breaker, server_error())
+        assert breaker.state == BreakerState.OPEN
+        with pytest.raises(CircuitOpenError), breaker.guard():
+            pytest.fail("call made while open")
+    assert breaker.fast_failures == 1
+
+
+def test_opens_on_error_rate(app):
+    breaker = CircuitBreaker(BreakerConfig(failure_threshold=100, error_rate=0.5, window=10, min_calls=10))
+    with app.app_context():
+        for _ in range(5):
+            with breaker.guard():
+                pass
+            fail(breaker, server_error())
+        assert breaker.state == BreakerState.OPEN
+
+
+def test_client_errors_not_counted(app):
+    breaker = CircuitBreaker(BreakerConfig(failure_threshold=2))
+    with app.app_context():
+        for _ in range(5):
+            fail(breaker, auth_error())
+    assert breaker.state == BreakerState.CLOSED
+
+
+def test_half_open_probe(app):
+    breaker = CircuitBreaker(BreakerConfig(failure_threshold=1, cooldown=0))
+    with app.app_context():
+        fail(breaker, server_error())
+        assert breaker.state == BreakerState.OPEN
+
+        # after the cooldown, one probe is allowed through at a time
+        with breaker.guard():
+            assert breaker.state == BreakerState.HALF_OPEN
+            with pytest.raises(CircuitOpenError), breaker.guard():
+                pass
+        assert breaker.state == BreakerState.CLOSED
+
+        fail(breaker, server_error())
+        assert breaker.opened_count == 2
+
+        # a failed probe reopens the breaker
+        fail(breaker, server_error())
+        assert breaker.state == BreakerState.OPEN
+    assert breaker.opened_count == 3
+
+
+def test_client_fails_fast(app, monkeypatch):
+    calls = []
+
+    async def failing_mock(*args, **kwargs):
+        calls.append(kwargs)
+        raise server_error()
+
+    monkeypatch.setattr(openai.resources.chat.AsyncCompletions, "create", failing_mock)
+    app.config['LLM_RETRY_MAX_ATTEMPTS'] = 1
+    app.config['LLM_BREAKER_FAILURES'] = 2
+
+    client = OpenAIClient("model", "breaker-test-key")
+    with app.app_context():
+        for _ in range(2):
+            response, text = run_sync(client.get_completion(prompt="prompt"))
+            assert response['error'].startswith("unavailable")
+        response, text = run_sync(client.get_completion(prompt="prompt"))
+    assert len(calls) == 2
+    assert response['error'] == 'CircuitOpenError'
+    assert text.startswith("Error (Unavailable)")
+
+
+def test_stream_fails_fast(app, monkeypatch):
+    calls = []
+
+    async def failing_mock(*args, **kwargs):
+        calls.append(kwargs)
+        raise server_error()
+
+    monkeypatch.setattr(openai.resources.chat.AsyncCompletions, "create", failing_mock)
+    app.config['LLM_RETRY_MAX_ATTEMPTS'] = 1
+    app.config['LLM_BREAKER_FAILURES'] = 2
+
+    client = OpenAIClient("model", "breaker-stream-key-k4w2", limits=KeyLimits(max_inflight=1))
+
+    async def stream():
+        completion = client.stream_completion(prompt="prompt")
+        _ = [delta async for delta in completion]
+        return completion.response
+
+    with app.app_context():
+        for _ in range(2):
+            run_sync(stream())
+        response = run_sync(stream())
+    assert len(calls) == 2
+    assert response['error'] == 'CircuitOpenError'
+    # not admitted (so not charged against the key's limits) while the breaker is open
+    [stats] = [s for s in get_limiter_stats() if s.key_suffix == "k4w2"]
+    assert stats.admitted == 2
+
+
+class FailingStream:
+    """A stream that fails partway through."""
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        raise server_error()
+
+    async def close(self):
+        pass
+
+
+def test_stream_failure_counted(app, monkeypatch):
+    async def mock(*args, **kwargs):
+        return FailingStream()
+
+    monkeypatch.setattr(openai.resources.chat.AsyncCompletions, "create", mock)
+    app.config['LLM_BREAKER_FAILURES'] = 2
+
+    client = OpenAIClient("model", "breaker-midstream-key")
+
+    async def stream():
+        completion = client.stream_completion(prompt="prompt")
+        _ = [delta async for delta in completion]
+        return completion.response
+
+    with app.app_context():
+        responses = [run_sync(stream()) for _ in range(3)]
+    assert responses[0]['error'].startswith("unavailable")
+    assert responses[2]['error'] == 'CircuitOpenError'
@@ -0,0 +1,68 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import asyncio
+
+from gened.client_pool import ClientPool, PoolConfig
+
+
+def test_reuse_on_same_loop():
+    pool = ClientPool()
+    config = PoolConfig()
+
+    async def lease_twice():
+        async with pool.lease(('openai', None, 'key1'), config) as client1:
+            pass
+        async with pool.lease(('openai', None, 'key1'), config) as client2:
+            pass
+        return client1, client2
+
+    client1, client2 = asyncio.run(lease_twice())
+    assert client1 is client2
+    stats = pool.stats()
+    assert (stats.hits, stats.misses, stats.size) == (1, 1, 1)
+
+
+def test_replaced_on_new_loop():
+    pool = ClientPool()
+    config = PoolConfig()
+
+    async def lease():
+        async with pool.lease(('openai', None, 'key1'), config) as client:
+            return client
+
+    client1 = asyncio.run(lease())
+    client2 = asyncio.run(lease())
+    assert client1 is not client2
+    stats = pool.stats()
+    assert (stats.hits, stats.misses, stats.evictions, stats.size) == (0, 2, 1, 1)
+
+
+def test_capacity_and_idle_eviction():
+    pool = ClientPool()
+
+    async def lease_keys(keys, config):
+        for key in keys:
+            async with pool.lease(('openai', None, key), config):
+                pass
+
+    async def run():
+        await lease_keys(['a', 'b', 'c'], PoolConfig(max_clients=2))
+        assert pool.stats().size == 2
+        assert pool.stats().evictions == 1
+        # everything idle for longer than a negative timeout is evicted on the next lease
+        await lease_keys(['d'], PoolConfig(idle_timeout=-1))
+
+    asyncio.run(run())
+    stats = pool.stats()
+    assert stats.size == 1
+    assert stats.evictions == 3
+
+
+def test_admin_status_page(client, auth):
+    auth.login('testadmin', 'testadminpassword')
+    client.post('/help/request', data={'code': 'code', 'error': 'error', 'issue': 'issue'})
+    response = client.get('/admin/llm/')
+    assert response.status_code == 200
+    assert "API Client Pool" in response.text
@@ -2,6 +2,12 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-only
 
+import sqlite3
+
+import pytest
+
+from gened.db import get_db
+
 
 def test_create_consumer(client, auth):
     auth.login('testadmin', 'testadminpassword')
@@ -40,6 +46,23 @@ def test_edit_consumer(client, auth):
     assert b"Consumer updated." in response.data
 
 
+def test_consumer_rate_limits(app, client, auth):
+    auth.login('testadmin', 'testadminpassword')
+    response = client.post(
+        '/admin/consumer/update',
+        data={'consumer_id': 1, 'llm_api_key': 'key', 'model_id': 1, 'llm_max_inflight': '0', 'llm_rpm': '60', 'llm_tpm': '-1'},
+        follow_redirects=True
+    )
+    assert b"Rate limits must be positive whole numbers" in response.data
+
+    with app.app_context():
+        row = get_db().execute("SELECT llm_max_inflight, llm_rpm, llm_tpm FROM consumers WHERE id=1").fetchone()
+        assert tuple(row) == (None, 60, None)
+
+        with pytest.raises(sqlite3.IntegrityError):
+            get_db().execute("UPDATE consumers SET llm_rpm=0 WHERE id=1")
+
+
 def test_delete_consumer_with_dependencies(client, auth):
     auth.login('testadmin', 'testadminpassword')
     response = client.post(
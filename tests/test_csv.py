@@ -0,0 +1,74 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import csv
+import io
+import json
+
+import pytest
+
+import gened.csv
+
+
+def test_admin_csv(client, auth):
+    auth.login('testadmin', 'testadminpassword')
+    response = client.get('/admin/api/queries/csv')
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == 'text/csv'
+    assert response.headers['Content-Disposition'].endswith('_admin_export_queries.csv')
+
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert rows[0][:3] == ['id', 'user', 'time']
+    assert [int(row[0]) for row in rows[1:]] == [100, 9, 8, 7, 6, 5, 4, 3, 2, 1]
+
+
+def test_admin_ndjson(client, auth):
+    auth.login('testadmin', 'testadminpassword')
+    response = client.get('/admin/api/queries/ndjson?limit=3')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.headers['Content-Disposition'].endswith('_admin_export_queries.ndjson')
+
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [row['id'] for row in rows] == [100, 9, 8]
+    assert rows[1]['code'] == 'code11'
+    assert isinstance(rows[1]['time'], str)
+
+
+def test_export_batches(monkeypatch, client, auth):
+    monkeypatch.setattr(gened.csv, '_BATCH_ROWS', 3)
+    auth.login('testadmin', 'testadminpassword')
+    response = client.get('/admin/api/queries/csv')
+    # header and first row, then batches of 3 rows
+    chunks = [chunk for chunk in response.response if chunk]
+    assert len(chunks) == 4
+    assert b"".join(chunks).count(b"\n") == 11
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'ndjson'])
+def test_instructor_export(client, auth, fmt):
+    auth.login()  # as testuser, instructor in class 2
+    client.get('/classes/switch/2')
+    response = client.get(f'/instructor/export/users/{fmt}')
+    assert response.status_code == 200
+    assert b'testuser' in response.data
+    assert b'role_id' not in response.data
+
+
+def test_profile_export(client, auth):
+    auth.login()  # as testuser, with queries 8 and 9
+    response = client.get('/profile/data/export/queries/ndjson')
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [row['id'] for row in rows] == [9, 8]
+
+    response = client.get('/profile/data/csv/queries')
+    assert response.mimetype == 'text/csv'
+
+
+def test_export_empty(client, auth):
+    auth.login('testadmin', 'testadminpassword')
+    response = client.get('/admin/api/queries/csv?user=12')  # testadmin has no queries
+    assert response.status_code == 200
+    assert b"There are no rows to export yet." in response.data
@@ -6,7 +6,7 @@ import sqlite3
 
 import pytest
 
-from gened.db import get_db
+from gened.db import close_db_pool, get_db, get_db_pool_stats
 
 
 def test_get_close_db(app):
@@ -14,12 +14,73 @@ def test_get_close_db(app):
         db = get_db()
         assert db is get_db()
 
+    # returned to the pool, and reused by the next context
+    with app.app_context():
+        assert get_db() is db
+
+
+def test_get_close_db_unpooled(app):
+    app.config['DB_POOL_SIZE'] = 0
+    with app.app_context():
+        db = get_db()
+        assert db is get_db()
+
     with pytest.raises(sqlite3.ProgrammingError) as e:
         db.execute('SELECT 1')
 
     assert 'closed' in str(e.value)
 
 
+def test_pool_pragmas(app):
+    with app.app_context():
+        db = get_db()
+        assert db.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+        assert db.execute("PRAGMA busy_timeout").fetchone()[0] == app.config['DB_PRAGMAS']['busy_timeout']
+        assert db.execute("PRAGMA cache_size").fetchone()[0] == app.config['DB_PRAGMAS']['cache_size']
+
+
+def test_pool_rollback(app):
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO experiments(name, description) VALUES('uncommitted', '')")
+
+    with app.app_context():
+        db = get_db()
+        assert not db.in_transaction
+        assert db.execute("SELECT COUNT(*) FROM experiments WHERE name='uncommitted'").fetchone()[0] == 0
+
+
+def test_pool_size_and_stats(app):
+    app.config['DB_POOL_SIZE'] = 1
+    close_db_pool(app)
+    with app.app_context():
+        before = get_db_pool_stats()
+        get_db()
+        with app.app_context():  # a second context, holding a second connection
+            get_db()
+            assert get_db_pool_stats().in_use == 2
+
+    with app.app_context():
+        get_db()
+        after = get_db_pool_stats()
+
+    assert after.in_use == 1
+    assert after.idle == 0
+    assert after.misses - before.misses == 2
+    assert after.discards - before.discards == 1  # the pool only keeps one
+    assert after.hits - before.hits == 1
+
+
+def test_script_connection_not_reused(app):
+    with app.app_context():
+        db = get_db()
+        db.executescript("PRAGMA foreign_keys = ON;")
+
+    with app.app_context():
+        assert get_db() is not db
+        assert get_db().execute("PRAGMA foreign_keys").fetchone()[0] == 0
+
+
 def test_init_db_command(runner, monkeypatch):
     class Recorder:
         called = False
@@ -0,0 +1,129 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import asyncio
+import threading
+
+import pytest
+
+from gened.db import get_db
+from gened.db_writer import flush_writes, flush_writes_async, get_writer_stats, queue_write, write, write_async
+
+
+def insert_experiment(name):
+    def insert(db):
+        cur = db.execute("INSERT INTO experiments(name, description) VALUES(?, '')", [name])
+        return cur.lastrowid
+    return insert
+
+
+def fail(db):
+    raise RuntimeError("oops")
+
+
+def experiment_names():
+    return {row['name'] for row in get_db().execute("SELECT name FROM experiments")}
+
+
+def test_write(app):
+    with app.app_context():
+        row_id = write(insert_experiment("written"))
+        # committed, so visible on this context's own connection
+        row = get_db().execute("SELECT name FROM experiments WHERE id=?", [row_id]).fetchone()
+        assert row['name'] == "written"
+
+
+def test_queued_writes_flushed(app):
+    with app.app_context():
+        futures = [queue_write(insert_experiment(f"queued{i}")) for i in range(5)]
+
+    # the context waited for its writes as it ended
+    assert all(future.done() for future in futures)
+    with app.app_context():
+        assert {f"queued{i}" for i in range(5)} <= experiment_names()
+
+
+def test_group_commit(app):
+    app.config['DB_WRITE_MAX_DELAY'] = 0.5
+    with app.app_context():
+        write(insert_experiment("start"))  # start the writer
+        before = get_writer_stats()
+
+        threads = [threading.Thread(target=lambda i=i: write_in_context(app, f"thread{i}")) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        after = get_writer_stats()
+        assert after.writes - before.writes == 10
+        assert after.batches - before.batches < 10
+        assert {f"thread{i}" for i in range(10)} <= experiment_names()
+
+
+def write_in_context(app, name):
+    with app.app_context():
+        write(insert_experiment(name))
+
+
+def test_failed_write_isolated(app):
+    app.config['DB_WRITE_MAX_DELAY'] = 0.5  # so all three are in one batch
+    with app.app_context():
+        good1 = queue_write(insert_experiment("good1"))
+        bad = queue_write(fail)
+        good2 = queue_write(insert_experiment("good2"))
+        with pytest.raises(RuntimeError, match="oops"):
+            flush_writes()
+
+        assert good1.result() and good2.result()
+        assert isinstance(bad.exception(), RuntimeError)
+        assert {"good1", "good2"} <= experiment_names()
+
+
+def test_async_writes(app):
+    app.config['DB_WRITE_MAX_DELAY'] = 0.5  # long enough to see the loop running while a write waits
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.01)
+
+    async def run():
+        ticker = asyncio.create_task(tick())
+        row_id = await write_async(insert_experiment("awaited"))
+        queue_write(insert_experiment("queued"))
+        queue_write(fail)
+        with pytest.raises(RuntimeError, match="oops"):
+            await flush_writes_async()
+        ticker.cancel()
+        return row_id
+
+    with app.app_context():
+        assert asyncio.run(run())
+        assert ticks > 10  # the loop ran while the writes were awaited
+        assert {"awaited", "queued"} <= experiment_names()
+
+
+def test_pending_transaction_committed(app):
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO experiments(name, description) VALUES('direct', '')")
+        assert db.in_transaction
+        # would wait on this connection's write lock if it were not committed first
+        write(insert_experiment("queued"))
+        assert not db.in_transaction
+        assert {"direct", "queued"} <= experiment_names()
+
+
+def test_writer_disabled(app):
+    app.config['DB_WRITER'] = False
+    with app.app_context():
+        future = queue_write(insert_experiment("direct"))
+        assert future.done()
+        assert "direct" in experiment_names()
+        with pytest.raises(RuntimeError, match="oops"):
+            write(fail)
+        assert get_writer_stats().writes == 0
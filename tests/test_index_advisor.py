@@ -0,0 +1,90 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import pytest
+
+from gened.db import get_db
+from gened.index_advisor import advise_workload
+from gened.sql_stats import StatementStats, dump_snapshot, reset_sql_stats
+
+
+@pytest.fixture(autouse=True)
+def _reset_stats():
+    reset_sql_stats()
+
+
+def advise(*shapes):
+    return advise_workload([StatementStats(shape) for shape in shapes])
+
+
+def test_full_scan(app):
+    with app.app_context():
+        [advice] = advise("SELECT id FROM users WHERE display_name=?")
+        assert advice.problems == ["SCAN users"]
+        assert advice.proposal == "CREATE INDEX users_by_display_name ON users(display_name);"
+        assert advice.error is None
+
+
+def test_temp_btree(app):
+    with app.app_context():
+        [advice] = advise("SELECT * FROM users AS u WHERE u.auth_provider=? ORDER BY u.display_name")
+        assert "USE TEMP B-TREE FOR ORDER BY" in advice.problems
+        assert advice.proposal is not None
+        assert "ON users(auth_provider, display_name" in advice.proposal
+
+
+@pytest.mark.parametrize('shape', [
+    "SELECT context_name FROM queries WHERE queries.user_id=? ORDER BY id DESC LIMIT ?",
+    "SELECT roles.id, classes.name FROM roles JOIN classes ON classes.id=roles.class_id WHERE roles.user_id=? AND roles.active=?",
+    "SELECT * FROM auth_local JOIN users ON auth_local.user_id=users.id WHERE username=?",
+])
+def test_indexed(app, shape):
+    with app.app_context():
+        [advice] = advise(shape)
+        assert advice.plan
+        assert advice.problems == []
+        assert advice.proposal is None
+
+
+def test_shapes(app):
+    with app.app_context():
+        # collapsed lists, a ? in a quoted name, and a statement that can't be planned
+        ok, quoted, bad = advise(
+            "SELECT id FROM users WHERE id IN (?, ...) AND created > date(?, ...)",
+            'SELECT id, is_admin AS "admin?" FROM users WHERE id=?',
+            "SELECT * FROM no_such_table",
+        )
+        assert ok.error is None
+        assert ok.plan
+        assert quoted.error is None
+        assert "no such table" in bad.error
+
+        # only statements that can have a query plan worth checking
+        assert advise("PRAGMA foreign_keys = ON", "BEGIN") == []
+
+
+def test_database_unchanged(app):
+    with app.app_context():
+        db = get_db()
+        schema = db.execute("SELECT * FROM sqlite_schema").fetchall()
+        advise("SELECT id FROM users WHERE display_name=?", "SELECT * FROM queries WHERE code=? ORDER BY issue")
+        assert db.execute("SELECT * FROM sqlite_schema").fetchall() == schema
+
+
+def test_command(app, runner):
+    with app.app_context():
+        result = runner.invoke(args=['index-advisor'])
+        assert "No recorded statements" in result.output
+
+        db = get_db()
+        reset_sql_stats()
+        db.execute("SELECT id FROM users WHERE display_name=?", ["x"]).fetchall()
+        db.execute("SELECT * FROM queries WHERE user_id=?", [11]).fetchall()
+        dump_snapshot(app)
+        result = runner.invoke(args=['index-advisor'])
+    assert result.exit_code == 0
+    assert "! SCAN users" in result.output
+    assert "proposed: CREATE INDEX users_by_display_name ON users(display_name);" in result.output
+    assert "SEARCH queries USING INDEX" not in result.output  # no flagged steps, so not shown
+    assert "1 of 2 statements have flagged plan steps; 1 indexes proposed." in result.output
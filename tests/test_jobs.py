@@ -0,0 +1,163 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import time
+
+import pytest
+
+from gened.db import get_db
+from gened.jobs import enqueue_job, get_job_status, register_job_handler, run_next_job
+from gened.testing.mocks import _create_dummy_completion
+
+DUMMY_TEXT = (_create_dummy_completion().choices[0].message.content or "").strip()
+
+calls = []
+
+
+def record_call(payload):
+    calls.append(payload)
+
+
+def fail(payload):
+    raise RuntimeError(payload['message'])
+
+
+register_job_handler('test_record', record_call)
+register_job_handler('test_fail', fail)
+
+
+@pytest.fixture
+def jobs_app(app):
+    app.config['JOB_WORKERS'] = 0  # run jobs explicitly with run_next_job()
+    calls.clear()
+    return app
+
+
+def test_run_job(jobs_app):
+    with jobs_app.app_context():
+        enqueue_job('test_record', {'n': 1}, ref="test:1")
+        enqueue_job('test_record', {'n': 2})
+        assert get_job_status("test:1") == 'queued'
+
+        assert run_next_job()
+        assert run_next_job()
+        assert not run_next_job()
+
+        assert get_job_status("test:1") is None  # completed jobs are deleted
+        assert get_db().execute("SELECT COUNT(*) FROM jobs").fetchone()[0] == 0
+    assert calls == [{'n': 1}, {'n': 2}]  # in order
+
+
+def test_failed_job_retried(jobs_app):
+    jobs_app.config['JOB_MAX_ATTEMPTS'] = 2
+    with jobs_app.app_context():
+        enqueue_job('test_fail', {'message': "oops"}, ref="test:fail")
+
+        assert run_next_job()
+        assert get_job_status("test:fail") == 'queued'
+        assert run_next_job()
+        assert get_job_status("test:fail") == 'failed'
+        assert not run_next_job()
+
+        row = get_db().execute("SELECT attempts, error FROM jobs").fetchone()
+    assert row['attempts'] == 2
+    assert "oops" in row['error']
+
+
+def test_expired_lease_reclaimed(jobs_app):
+    with jobs_app.app_context():
+        enqueue_job('test_record', {'n': 1}, ref="test:lost")
+        db = get_db()
+        # simulate a job claimed by a worker that died
+        db.execute("UPDATE jobs SET status='running', attempts=1, lease_expires=datetime('now', '+1 minute')")
+        db.commit()
+        assert not run_next_job()  # still leased
+
+        db.execute("UPDATE jobs SET lease_expires=datetime('now', '-1 minute')")
+        db.commit()
+        assert run_next_job()
+        assert get_job_status("test:lost") is None
+    assert calls == [{'n': 1}]
+
+
+def test_lease_renewed(jobs_app):
+    jobs_app.config['JOB_LEASE_SECONDS'] = 3  # renewed each second
+    leases = []
+
+    def get_lease(payload):
+        for _ in range(2):
+            leases.append(get_db().execute("SELECT lease_expires FROM jobs WHERE ref=?", [payload['ref']]).fetchone()[0])
+            time.sleep(1.2)
+
+    register_job_handler('test_lease', get_lease)
+    with jobs_app.app_context():
+        enqueue_job('test_lease', {'ref': "test:lease"}, ref="test:lease")
+        assert run_next_job()
+    assert leases[1] > leases[0]
+
+
+def test_reclaimed_job_kept(jobs_app):
+    def reclaim(payload):
+        # simulate the lease expiring and another worker claiming the job mid-run
+        db = get_db()
+        db.execute("UPDATE jobs SET attempts=attempts+1 WHERE ref=?", [payload['ref']])
+        db.commit()
+
+    register_job_handler('test_reclaim', reclaim)
+    with jobs_app.app_context():
+        enqueue_job('test_reclaim', {'ref': "test:reclaim"}, ref="test:reclaim")
+        assert run_next_job()
+        # left for the worker that reclaimed it, not deleted by the first
+        assert get_job_status("test:reclaim") == 'running'
+
+
+def test_background_query(jobs_app, client, auth):
+    jobs_app.config['BACKGROUND_QUERIES'] = True
+    auth.login()
+
+    response = client.post('/help/request', data={'code': 'code', 'error': 'error', 'issue': 'issue'})
+    assert response.status_code == 302
+    query_id = int(response.location.rsplit('/', 1)[1])
+
+    # the response is pending: the view waits for it
+    response = client.get(f"/help/view/{query_id}")
+    assert f"/help/status/{query_id}" in response.text
+    assert "an error occurred" not in response.text
+    assert client.get(f"/help/status/{query_id}").json == {'done': False}
+
+    with jobs_app.app_context():
+        assert run_next_job()
+
+    assert client.get(f"/help/status/{query_id}").json == {'done': True}
+    response = client.get(f"/help/view/{query_id}")
+    assert f"/help/status/{query_id}" not in response.text
+    assert DUMMY_TEXT in response.text
+
+    with jobs_app.app_context():
+        rows = get_db().execute("SELECT kind, query_id FROM llm_calls ORDER BY id").fetchall()
+    assert sorted(row['kind'] for row in rows) == ['main', 'sufficient']
+    assert all(row['query_id'] == query_id for row in rows)
+
+
+def test_background_query_workers(app, client, auth):
+    app.config['BACKGROUND_QUERIES'] = True
+    app.config['JOB_POLL_INTERVAL'] = 0.05
+    auth.login()
+
+    response = client.post('/help/request', data={'code': 'code', 'error': 'error', 'issue': 'issue'})
+    query_id = int(response.location.rsplit('/', 1)[1])
+
+    for _ in range(100):
+        if client.get(f"/help/status/{query_id}").json['done']:
+            break
+        time.sleep(0.05)
+    else:
+        pytest.fail("background query not completed")
+
+    assert DUMMY_TEXT in client.get(f"/help/view/{query_id}").text
+
+
+def test_status_access(jobs_app, client, auth):
+    auth.login()
+    assert client.get("/help/status/999").status_code == 400
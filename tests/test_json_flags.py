@@ -0,0 +1,94 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import json
+from importlib import resources
+
+from gened.db import get_db
+
+
+def flags_from_json(db):
+    return {
+        row['id']: (row['error'], row['insufficient'])
+        for row in db.execute("""
+            SELECT
+                id,
+                CASE WHEN json_valid(response_json) THEN json_extract(response_json, '$[0].error') IS NOT NULL ELSE 0 END AS error,
+                CASE WHEN json_valid(response_text) THEN json_extract(response_text, '$.insufficient') IS NOT NULL ELSE 0 END AS insufficient
+            FROM queries
+        """)
+    }
+
+
+def test_query_flags(app):
+    with app.app_context():
+        db = get_db()
+        db.execute("""UPDATE queries SET response_json='[{"error": "oops"}]' WHERE id=1""")
+        db.execute("""UPDATE queries SET response_text='{"insufficient": "more info"}' WHERE id=2""")
+        db.execute("UPDATE queries SET response_json='not json', response_text='not json' WHERE id=3")
+        flags = {row['id']: (row['has_error'], row['is_insufficient']) for row in db.execute("SELECT id, has_error, is_insufficient FROM queries")}
+        assert flags == flags_from_json(db)
+        assert flags[1][0] == 1
+        assert flags[2][1] == 1
+        assert flags[3] == (0, 0)
+
+
+def count_user_messages(db):
+    return {
+        row['id']: row['count']
+        for row in db.execute("""
+            SELECT id, (SELECT COUNT(*) FROM json_each(chat_json) WHERE json_extract(json_each.value, '$.role')='user') AS count
+            FROM chats
+        """)
+    }
+
+
+def test_user_message_count(app):
+    with app.app_context():
+        db = get_db()
+        chat = [{'role': 'user', 'content': 'a'}, {'role': 'assistant', 'content': 'b'}, {'role': 'user', 'content': 'c'}]
+        cur = db.execute("INSERT INTO chats (topic, chat_json, user_id) VALUES ('t', ?, 11)", [json.dumps(chat)])
+        chat_id = cur.lastrowid
+        chat.append({'role': 'user', 'content': 'd'})
+        db.execute("UPDATE chats SET chat_json=? WHERE id=1", [json.dumps(chat)])
+
+        counts = {row['id']: row['user_message_count'] for row in db.execute("SELECT id, user_message_count FROM chats")}
+        assert counts == count_user_messages(db)
+        assert counts[chat_id] == 2
+        assert counts[1] == 3
+
+
+def test_tutor_admin(client, auth):
+    auth.login('testadmin', 'testadminpassword')
+    response = client.get('/admin/tutor/')
+    assert response.status_code == 200
+    assert b'topic1' in response.data
+
+
+def test_migration(app):
+    with app.app_context():
+        db = get_db()
+        # back to the schema before the migration
+        db.executescript("""
+            DROP TRIGGER queries_usage_insert;
+            DROP TRIGGER queries_usage_delete;
+            DROP TRIGGER queries_usage_update_before;
+            DROP TRIGGER queries_usage_update_after;
+            DROP VIEW usage_events;
+            DROP INDEX queries_by_time_flags;
+            ALTER TABLE queries DROP COLUMN has_error;
+            ALTER TABLE queries DROP COLUMN is_insufficient;
+            DROP TRIGGER chats_user_messages_insert;
+            DROP TRIGGER chats_user_messages_update;
+            ALTER TABLE chats DROP COLUMN user_message_count;
+        """)
+        for name in ['20261017--codehelp--usage_rollup_triggers.sql', '20261018--codehelp--json_flag_columns.sql']:
+            db.executescript(resources.files('codehelp').joinpath('migrations', name).read_text(encoding='utf-8'))
+
+        assert db.execute("SELECT sql FROM sqlite_master WHERE name='usage_events'").fetchone()[0].count('json_extract') == 0
+        flags = {row['id']: (row['has_error'], row['is_insufficient']) for row in db.execute("SELECT id, has_error, is_insufficient FROM queries")}
+        assert flags == flags_from_json(db)
+        counts = {row['id']: row['user_message_count'] for row in db.execute("SELECT id, user_message_count FROM chats")}
+        assert counts == count_user_messages(db)
+        assert all(count > 0 for count in counts.values())
@@ -0,0 +1,61 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import asyncio
+
+import openai
+import pytest
+
+from gened.async_runner import run_sync
+from gened.llm import LLM, get_coalesced_count
+from gened.testing.mocks import mock_async_completion
+
+
+@pytest.fixture
+def api_calls(monkeypatch):
+    calls = []
+    mock = mock_async_completion(0.05)
+
+    async def counting_mock(*args, **kwargs):
+        calls.append(kwargs)
+        return await mock(*args, **kwargs)
+
+    monkeypatch.setattr(openai.resources.chat.AsyncCompletions, "create", counting_mock)
+    return calls
+
+
+def run_concurrently(app, *requests):
+    async def run_all():
+        return await asyncio.gather(*(llm.get_completion(prompt=prompt) for llm, prompt in requests))
+
+    with app.app_context():
+        return run_sync(run_all())
+
+
+def test_identical_requests_coalesced(app, api_calls):
+    llm = LLM(provider='openai', model='model', api_key='key')
+    coalesced_before = get_coalesced_count()
+
+    results = run_concurrently(app, (llm, "prompt"), (llm, "prompt"), (llm, "prompt"))
+
+    assert len(api_calls) == 1
+    assert results[0] == results[1] == results[2]
+    assert get_coalesced_count() - coalesced_before == 2
+
+
+@pytest.mark.parametrize(('llm1', 'llm2', 'prompt2'), [
+    (LLM(provider='openai', model='model', api_key='key'), LLM(provider='openai', model='model', api_key='key'), "other prompt"),
+    (LLM(provider='openai', model='model', api_key='key'), LLM(provider='openai', model='model', api_key='key2'), "prompt"),
+    (LLM(provider='openai', model='model', api_key='key'), LLM(provider='openai', model='model2', api_key='key'), "prompt"),
+])
+def test_different_requests_not_coalesced(app, api_calls, llm1, llm2, prompt2):
+    run_concurrently(app, (llm1, "prompt"), (llm2, prompt2))
+    assert len(api_calls) == 2
+
+
+def test_sequential_requests_not_coalesced(app, api_calls):
+    llm = LLM(provider='openai', model='model', api_key='key')
+    run_concurrently(app, (llm, "prompt"))
+    run_concurrently(app, (llm, "prompt"))
+    assert len(api_calls) == 2
@@ -0,0 +1,114 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import threading
+
+import openai
+
+import gened.llm_cache
+from gened.async_runner import run_sync
+from gened.db import get_db
+from gened.llm_cache import LLMCache, cache_get, cache_put, get_cache_stats, make_cache_key
+from gened.testing.mocks import mock_async_completion
+
+
+def test_get_put(tmp_path):
+    cache = LLMCache()
+    path = str(tmp_path / 'cache.db')
+
+    assert cache.get(path, 'key1', ttl=60) is None
+    cache.put(path, 'key1', {'id': 'x'}, "text", ttl=60, max_entries=10)
+    assert cache.get(path, 'key1', ttl=60) == ({'id': 'x'}, "text")
+    assert cache.get(path, 'key1', ttl=0) is None  # expired
+
+    stats = cache.stats(path)
+    assert (stats.hits, stats.misses, stats.entries) == (1, 2, 1)
+
+
+def test_lru_eviction(tmp_path):
+    cache = LLMCache()
+    path = str(tmp_path / 'cache.db')
+
+    for i in range(5):
+        cache.put(path, f'key{i}', {}, f"text{i}", ttl=60, max_entries=3)
+    cache.get(path, 'key0', ttl=60)  # now most recently used
+    cache.evict(path, ttl=60, max_entries=3)
+
+    assert cache.get(path, 'key0', ttl=60) is not None
+    assert cache.get(path, 'key1', ttl=60) is None
+    assert cache.get(path, 'key2', ttl=60) is None
+    assert cache.get(path, 'key4', ttl=60) is not None
+
+
+def test_key():
+    messages = [{'role': 'user', 'content': 'hello'}]
+    key = make_cache_key('class:1', 'model', messages, {})
+    assert key == make_cache_key('class:1', 'model', [{'content': 'hello', 'role': 'user'}], {})
+    assert key != make_cache_key('class:2', 'model', messages, {})
+    assert key != make_cache_key('class:1', 'model2', messages, {})
+    assert key != make_cache_key('class:1', 'model', messages, {'temperature': 0})
+
+
+def test_errors_not_cached(app):
+    with app.app_context():
+        cache_put('key', {'error': 'oops'}, "Error (oops).")
+        assert get_cache_stats().entries == 0
+
+
+def test_off_event_loop(app, monkeypatch):
+    threads = []
+    get = gened.llm_cache._cache.get
+
+    def recording_get(*args, **kwargs):
+        threads.append(threading.current_thread().name)
+        return get(*args, **kwargs)
+
+    monkeypatch.setattr(gened.llm_cache._cache, 'get', recording_get)
+    with app.app_context():
+        cache_put('key', {'id': 'x'}, "text")
+        assert run_sync(cache_get('key')) == ({'id': 'x'}, "text")  # sees the put made just before
+    assert threads[0].startswith("llm-cache")
+
+
+def test_class_cache(app, client, auth, monkeypatch):
+    calls = []
+    mock = mock_async_completion(0.0)
+
+    async def counting_mock(*args, **kwargs):
+        calls.append(kwargs)
+        return await mock(*args, **kwargs)
+
+    monkeypatch.setattr(openai.resources.chat.AsyncCompletions, "create", counting_mock)
+
+    auth.login()
+    client.get('/classes/switch/2')
+    query = {'code': 'same code', 'error': 'same error', 'issue': 'same issue'}
+
+    def make_queries():
+        query_ids = []
+        for _ in range(2):
+            response = client.post('/help/request', data=query)
+            query_ids.append(int(response.location.rsplit('/', 1)[1]))
+        return query_ids
+
+    # not enabled: every query calls the API
+    make_queries()
+    assert len(calls) == 4  # main + sufficient, twice
+
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE classes SET llm_cache_enabled=1 WHERE id=2")
+        db.commit()
+
+    calls.clear()
+    query_ids = make_queries()
+    assert len(calls) == 2  # only the first query's completions
+
+    with app.app_context():
+        db = get_db()
+        rows = db.execute("SELECT response_json, response_text FROM queries WHERE id IN (?, ?)", query_ids).fetchall()
+        # a cached response is recorded just like the original
+        assert rows[0]['response_json'] == rows[1]['response_json']
+        assert rows[0]['response_text'] == rows[1]['response_text']
+        assert get_cache_stats().entries == 2
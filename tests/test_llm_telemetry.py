@@ -0,0 +1,83 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from gened.admin.llm_usage import get_call_stats
+from gened.db import get_db
+
+
+def get_calls(app):
+    with app.app_context():
+        return get_db().execute("SELECT * FROM llm_calls ORDER BY id").fetchall()
+
+
+def test_help_request_calls(app, client, auth):
+    auth.login()
+    client.get('/classes/switch/2')
+    response = client.post('/help/request', data={'code': 'code', 'error': 'error', 'issue': 'issue'})
+    query_id = int(response.location.rsplit('/', 1)[1])
+
+    calls = get_calls(app)
+    assert sorted(call['kind'] for call in calls) == ['main', 'sufficient']
+    for call in calls:
+        assert call['query_id'] == query_id
+        assert call['class_id'] == 2
+        assert call['prompt_tokens'] == 100
+        assert call['completion_tokens'] == 500
+        assert call['finish_reason'] == 'stop'
+        assert call['error'] is None
+        assert not call['streamed']
+
+
+def test_tutor_calls(app, client, auth):
+    auth.login()
+    client.get('/classes/switch/2')
+    client.post('/tutor/message', data={'id': 1, 'message': 'new_user_msg'})
+
+    calls = get_calls(app)
+    assert len(calls) == 1
+    assert calls[0]['kind'] == 'tutor'
+    assert calls[0]['chat_id'] == 1
+
+
+def test_streamed_calls(app, client, auth):
+    app.config['STREAMING_RESPONSES'] = True
+    auth.login()
+    response = client.post('/help/request', data={'code': 'code', 'error': 'error', 'issue': 'issue'})
+    query_id = int(response.location.rsplit('/', 1)[1])
+    client.get(f"/help/stream/{query_id}").get_data()  # consume the stream
+
+    calls = get_calls(app)
+    assert {call['kind']: call['streamed'] for call in calls} == {'main': 1, 'sufficient': 0}
+
+
+def test_call_stats(app):
+    with app.app_context():
+        db = get_db()
+        for latency in range(1, 101):
+            db.execute(
+                "INSERT INTO llm_calls (provider, model, streamed, latency_ms, queue_ms, prompt_tokens, completion_tokens) VALUES ('openai', 'm1', 0, ?, 0, 10, 20)",
+                [latency],
+            )
+        db.execute("INSERT INTO llm_calls (provider, model, streamed, latency_ms, queue_ms, error) VALUES ('openai', 'm1', 0, 99999, 0, 'oops')")
+        db.commit()
+
+        rows = get_call_stats('model', 7)
+
+    assert len(rows) == 1
+    row = rows[0]
+    assert row['label'] == 'openai/m1'
+    assert row['calls'] == 101
+    assert row['errors'] == 1
+    # errors are excluded from latencies
+    assert (row['p50'], row['p95'], row['p99']) == (50, 95, 99)
+    assert row['prompt_tokens'] == 1000
+    assert row['completion_tokens'] == 2000
+
+
+def test_admin_usage_page(client, auth):
+    auth.login('testadmin', 'testadminpassword')
+    client.post('/help/request', data={'code': 'code', 'error': 'error', 'issue': 'issue'})
+    response = client.get('/admin/llm_usage/?days=7')
+    assert response.status_code == 200
+    assert "By model" in response.text
@@ -0,0 +1,73 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import httpx
+import pytest
+
+from codehelp.loadtest import LoadTestParams, Results, Sample, format_report, percentile, run_load_test, setup_users, summarize
+from gened.db import get_db
+
+
+def run(app, params, password="pw"):
+    with app.app_context():
+        usernames = setup_users(params, password)
+    return run_load_test(params, usernames, password, lambda: httpx.Client(transport=httpx.WSGITransport(app=app), base_url="http://localhost"))
+
+
+def test_setup_users_idempotent(app):
+    params = LoadTestParams(users=5, classes=2)
+    with app.app_context():
+        setup_users(params, "pw1")
+        setup_users(params, "pw2")
+        db = get_db()
+        assert db.execute("SELECT COUNT(*) FROM auth_local WHERE username LIKE '__LOADTEST_User_%'").fetchone()[0] == 5
+        classes = db.execute("SELECT classes.id, COUNT(roles.id) AS members FROM classes JOIN roles ON roles.class_id=classes.id WHERE classes.name LIKE '__LOADTEST_Class_%' GROUP BY classes.id").fetchall()
+        assert sorted(row['members'] for row in classes) == [2, 3]
+
+
+@pytest.mark.parametrize(('streaming', 'background'), [(False, False), (True, False), (False, True)])
+def test_sessions(app, streaming, background):
+    app.config['STREAMING_RESPONSES'] = streaming
+    app.config['BACKGROUND_QUERIES'] = background
+    app.config['JOB_POLL_INTERVAL'] = 0.05
+    params = LoadTestParams(users=2, classes=1, sessions=2, streaming=streaming, background=background)
+    results = run(app, params)
+
+    assert results.sessions == 4
+    assert results.failed_sessions == 0
+    summary = summarize(results)
+    assert summary['errors'] == 0
+    endpoints = summary['endpoints']
+    assert endpoints['login']['count'] == 2
+    assert endpoints['help_request']['count'] == 4
+    assert endpoints['tutor_view']['count'] == 8
+    assert ('help_stream' in endpoints) == streaming
+    assert ('help_status' in endpoints) == background
+    assert "tutor_message" in format_report(summary)
+
+    with app.app_context():
+        db = get_db()
+        assert db.execute("SELECT COUNT(*) FROM queries WHERE response_json IS NOT NULL").fetchone()[0] >= 4
+        assert db.execute("SELECT COUNT(*) FROM chats").fetchone()[0] >= 4
+
+
+def test_failed_login(app):
+    params = LoadTestParams(users=1, classes=1, sessions=1)
+    with app.app_context():
+        usernames = setup_users(params, "right")
+    results = run_load_test(params, usernames, "wrong", lambda: httpx.Client(transport=httpx.WSGITransport(app=app), base_url="http://localhost"))
+    assert results.sessions == 0
+    assert [sample.endpoint for sample in results.samples] == ['login']
+
+
+def test_summarize():
+    results = Results(elapsed=2.0)
+    for ms in range(1, 101):
+        results.add(Sample('help_view', ms / 1000, ok=True))
+    results.add(Sample('help_view', 5.0, ok=False))
+    stats = summarize(results)['endpoints']['help_view']
+    assert stats['count'] == 101
+    assert stats['errors'] == 1
+    assert (stats['p50_ms'], stats['p95_ms'], stats['p99_ms']) == (50, 95, 99)
+    assert percentile([1.0], 0.99) == 1.0
@@ -0,0 +1,115 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import json
+import statistics
+
+import pytest
+
+from gened.async_runner import run_sync
+from gened.db import get_db
+from gened.llm import LLM
+from gened.mock_llm import MockLLMConfig, create_server_app, make_response
+
+FAST = MockLLMConfig(latency_mean=0, tokens_per_second=100_000, response_tokens=20)
+
+
+@pytest.fixture
+def mock_app(app):
+    app.config['LLM_MOCK_LATENCY_MEAN'] = 0
+    app.config['LLM_MOCK_TOKENS_PER_SECOND'] = 100_000
+    app.config['LLM_MOCK_RESPONSE_TOKENS'] = 20
+    return app
+
+
+def test_make_response():
+    response = make_response(FAST, {'model': 'm', 'messages': [{'role': 'user', 'content': "x" * 400}]})
+    assert response.status == 200
+    completion = json.loads(b"".join(piece for _, piece in response.pieces))
+    assert completion['choices'][0]['message']['content'] == " ".join(["mock"] * 20)
+    assert completion['choices'][0]['finish_reason'] == 'stop'
+    assert completion['usage'] == {'prompt_tokens': 100, 'completion_tokens': 20, 'total_tokens': 120}
+
+    response = make_response(FAST, {'model': 'm', 'messages': [], 'max_tokens': 5})
+    completion = json.loads(b"".join(piece for _, piece in response.pieces))
+    assert completion['usage']['completion_tokens'] == 5
+    assert completion['choices'][0]['finish_reason'] == 'length'
+
+
+def test_streamed_timing():
+    config = MockLLMConfig(latency_mean=1.0, tokens_per_second=10, response_tokens=20)
+    response = make_response(config, {'model': 'm', 'messages': [], 'stream': True})
+    delays = [delay for delay, _ in response.pieces]
+    assert delays[0] == 1.0  # time to first token
+    assert sum(delays) == pytest.approx(3.0)  # plus 20 tokens at 10 per second
+    assert response.pieces[-1][1] == b"data: [DONE]\n\n"
+
+
+@pytest.mark.parametrize('latency', ['fixed', 'normal', 'longtail'])
+def test_latency_distributions(latency):
+    config = MockLLMConfig(latency=latency, latency_mean=2.0)
+    samples = [config.first_token_delay() for _ in range(20_000)]
+    assert min(samples) >= 0
+    assert statistics.mean(samples) == pytest.approx(2.0, rel=0.1)
+
+
+def test_error_injection():
+    response = make_response(MockLLMConfig(latency_mean=0, error_rate=1.0, error_status=429), {'messages': []})
+    assert response.status == 429
+    assert response.headers['retry-after'] == '1'
+
+
+@pytest.mark.use_real_openai
+def test_mock_provider(mock_app):
+    llm = LLM(provider='mock', model='model', api_key='mock-key')
+
+    async def stream():
+        completion = await llm.stream_completion(prompt="prompt")
+        return [delta async for delta in completion], completion.text
+
+    with mock_app.app_context():
+        response, text = run_sync(llm.get_completion(prompt="prompt"))
+        deltas, streamed_text = run_sync(stream())
+
+    assert text == " ".join(["mock"] * 20)
+    assert response['usage']['completion_tokens'] == 20
+    assert len(deltas) == 4
+    assert streamed_text == text
+
+
+@pytest.mark.use_real_openai
+def test_mock_provider_errors(mock_app):
+    mock_app.config['LLM_MOCK_ERROR_RATE'] = 1.0
+    mock_app.config['LLM_MOCK_ERROR_STATUS'] = 400
+    llm = LLM(provider='mock', model='model', api_key='mock-errors-key')
+
+    with mock_app.app_context():
+        response, text = run_sync(llm.get_completion(prompt="prompt"))
+
+    assert 'error' in response
+    assert text.startswith("Error (BadRequestError)")
+
+
+@pytest.mark.use_real_openai
+def test_mock_llm_config(mock_app, client, auth):
+    mock_app.config['MOCK_LLM'] = True
+    auth.login()
+    response = client.post('/help/request', data={'code': 'code', 'error': 'error', 'issue': 'issue'})
+    query_id = int(response.location.rsplit('/', 1)[1])
+
+    with mock_app.app_context():
+        row = get_db().execute("SELECT response_text FROM queries WHERE id=?", [query_id]).fetchone()
+    assert "mock mock" in json.loads(row['response_text'])['main']
+
+
+def test_server():
+    client = create_server_app(FAST).test_client()
+
+    response = client.post('/v1/chat/completions', json={'model': 'm', 'messages': []})
+    assert response.status_code == 200
+    assert response.json['choices'][0]['message']['content'].startswith("mock")
+
+    response = client.post('/v1/chat/completions', json={'model': 'm', 'messages': [], 'stream': True})
+    assert response.headers['content-type'] == 'text/event-stream'
+    assert response.text.endswith("data: [DONE]\n\n")
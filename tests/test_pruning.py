@@ -0,0 +1,46 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from gened.admin import pruning
+from gened.db import get_db
+
+
+def user_times(user_id):
+    row = get_db().execute("SELECT last_query_time, last_instructor_activity FROM users WHERE id=?", [user_id]).fetchone()
+    return row['last_query_time'], row['last_instructor_activity']
+
+
+def test_activity_maintained(app):
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO queries (issue, user_id, role_id, query_time) VALUES ('new', 21, 1, '2030-01-02 03:04:05')")
+        last_query, _ = user_times(21)
+        assert str(last_query) == '2030-01-02 03:04:05'
+        # ltiuser3 instructs class 1
+        _, last_instructor = user_times(23)
+        assert str(last_instructor) == '2030-01-02 03:04:05'
+        # an older query doesn't move them back
+        db.execute("INSERT INTO queries (issue, user_id, role_id, query_time) VALUES ('old', 21, 1, '2020-01-01 00:00:00')")
+        assert str(user_times(21)[0]) == '2030-01-02 03:04:05'
+
+
+def test_candidates(app, client, auth):
+    app.config['RETENTION_TIME_DAYS'] = 365
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE users SET created='2000-01-01', last_query_time=NULL, last_instructor_activity=NULL WHERE id IN (21, 22)")
+        db.execute("UPDATE users SET created='2000-01-01', last_query_time=CURRENT_TIMESTAMP WHERE id=23")
+        db.commit()
+    pruning._candidate_count.invalidate()
+
+    auth.login('testadmin', 'testadminpassword')
+    response = client.get('/admin/pruning/')
+    assert response.status_code == 200
+    assert "ltiuser1@domain.edu" in response.text
+    assert "ltiuser3@domain.edu" not in response.text  # recently active
+    assert pruning._candidate_count.get() == 2
+
+    client.post('/admin/pruning/set_whitelist/21/1')
+    with app.app_context():
+        assert pruning._candidate_count.get() == 1
@@ -0,0 +1,189 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+# Query plans of the hot statements, as SQLite would choose them for a large
+# database.  Filling the test database with enough rows takes minutes, so the
+# planner is instead given the statistics (sqlite_stat1) a large database
+# would have, which it reads in place of counting rows.  Every statement a
+# data function or auth/LLM lookup runs is recorded and EXPLAINed, and a plan
+# that reads all of queries, roles, or users where it needn't fails the test.
+
+import re
+import sqlite3
+
+import pytest
+from flask import session
+
+import gened.db
+from gened.admin.main import get_data_sources
+from gened.app_data import Filters, TableQuery
+from gened.auth import AUTH_SESSION_KEY, _get_auth_from_session
+from gened.db import get_db
+from gened.llm import _get_class_llm, _get_llm
+
+HOT_TABLES = ('queries', 'roles', 'users')
+
+# rows in a large deployment's tables; others get _DEFAULT_ROWS
+_TABLE_ROWS = {'queries': 5_000_000, 'roles': 300_000, 'users': 100_000, 'classes': 10_000}
+_DEFAULT_ROWS = 1000
+
+_SCAN_RE = re.compile(r"^SCAN (\w+)")
+_ALIAS_RE = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)\s+AS\s+(\w+)", re.IGNORECASE)
+
+
+def _write_large_stats(db):
+    """ Replace sqlite_stat1 with statistics for a database of _TABLE_ROWS rows.
+    Each index column narrows the rows by its referenced table's size for a
+    foreign key (e.g., roles per class), or by 10 otherwise.
+    """
+    db.execute("ANALYZE")  # creates sqlite_stat1
+    db.execute("DELETE FROM sqlite_stat1")
+    tables = [row[0] for row in db.execute("SELECT name FROM sqlite_schema WHERE type='table' AND name NOT LIKE 'sqlite_%'")]
+    for table in tables:
+        total = _TABLE_ROWS.get(table, _DEFAULT_ROWS)
+        db.execute("INSERT INTO sqlite_stat1 VALUES (?, NULL, ?)", [table, str(total)])
+        foreign_keys = {row['from']: row['table'] for row in db.execute("SELECT * FROM pragma_foreign_key_list(?)", [table])}
+        for index in db.execute("SELECT name, [unique] FROM pragma_index_list(?)", [table]).fetchall():
+            rows = total
+            per_key = []
+            for column in db.execute("SELECT name FROM pragma_index_info(?)", [index['name']]):
+                rows = max(1, rows // _TABLE_ROWS.get(foreign_keys.get(column['name'], ''), 10))
+                per_key.append(rows)
+            if index['unique']:
+                per_key[-1] = 1
+            db.execute("INSERT INTO sqlite_stat1 VALUES (?, ?, ?)", [table, index['name'], " ".join(map(str, [total, *per_key]))])
+    db.commit()
+
+
+@pytest.fixture
+def statements(app, monkeypatch):
+    """ Give the app's database large-database statistics, and return the list
+    to which each statement run from then on is appended as (sql, params).
+    """
+    with app.app_context():
+        _write_large_stats(get_db())
+
+    recorded = []
+    record_statement = gened.db.record_statement
+
+    def record(sql, elapsed, params=()):
+        recorded.append((sql, params))
+        return record_statement(sql, elapsed, params)
+
+    monkeypatch.setattr(gened.db, 'record_statement', record)
+    return recorded
+
+
+def explain(app, sql, params):
+    # A fresh connection, so the plan uses the statistics written above.
+    conn = sqlite3.connect(app.config['DATABASE'])
+    try:
+        return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+    finally:
+        conn.close()
+
+
+def scanned(sql, plan):
+    """ The hot tables read in full by a plan (by a table scan or a scan of a covering index). """
+    aliases = {alias: table for table, alias in _ALIAS_RE.findall(sql)}
+    scans = (_SCAN_RE.match(detail) for detail in plan)
+    return {aliases.get(scan[1], scan[1]) for scan in scans if scan} & set(HOT_TABLES)
+
+
+def assert_no_scans(app, recorded):
+    assert recorded
+    for sql, params in recorded:
+        plan = explain(app, sql, params)
+        assert not scanned(sql, plan), f"{plan}\n{sql}"
+
+
+# filters applied by each admin data source (see the make_where() calls in each data function)
+_SOURCE_FILTERS = {
+    'consumers': [],
+    'classes': ['consumer'],
+    'users': ['consumer', 'class'],
+    'roles': ['consumer', 'class', 'user'],
+    'queries': ['consumer', 'class', 'user', 'role', 'query'],
+}
+
+_FILTERED_SOURCES = [(name, filter_name) for name, filter_names in _SOURCE_FILTERS.items() for filter_name in filter_names]
+
+
+def _table_queries(source):
+    """ A data function's page, search, sort, and count forms (see query_rows()). """
+    columns = tuple(col.name for col in source.table.columns)
+    return [
+        None,
+        TableQuery(columns=columns, search='x'),
+        TableQuery(columns=columns, sort=columns[-1], desc=True),
+        TableQuery(columns=columns, search='x', count=True),
+    ]
+
+
+def test_all_sources_covered(app):
+    with app.test_request_context():
+        assert set(get_data_sources(Filters())) == set(_SOURCE_FILTERS)
+
+
+@pytest.mark.parametrize(('name', 'filter_name'), _FILTERED_SOURCES)
+def test_filtered_source(app, statements, name, filter_name):
+    with app.test_request_context():
+        source = get_data_sources(Filters())[name]
+        filters = Filters()
+        filters.add(filter_name, 1)
+        for table_query in _table_queries(source):
+            source.function(filters, limit=20, table_query=table_query).fetchall()
+        if source.keyset:
+            source.function(filters, limit=20, before_id=100).fetchall()
+    assert_no_scans(app, statements)
+
+
+@pytest.mark.parametrize('name', _SOURCE_FILTERS)
+def test_unfiltered_source(app, statements, name):
+    # An unfiltered page may read its own table in full (it lists all of it),
+    # but a keyset source must read just one page of it in id order.
+    with app.test_request_context():
+        source = get_data_sources(Filters())[name]
+        source.function(Filters(), limit=20).fetchall()
+        [(sql, params)] = statements
+        plan = explain(app, sql, params)
+        assert scanned(sql, plan) <= {name}, plan
+        if source.keyset:
+            assert "USE TEMP B-TREE FOR ORDER BY" not in plan
+
+            statements.clear()
+            source.function(Filters(), limit=20, before_id=100).fetchall()
+            [(sql, params)] = statements
+            assert any("rowid<?" in detail for detail in explain(app, sql, params))
+
+
+def test_instructor_view(app, statements, client, auth):
+    auth.login()  # as testuser, who created and is instructor in class id 2
+    client.get('/classes/switch/2')
+    statements.clear()
+
+    for url in ['/instructor/', '/instructor/?user=12', '/instructor/page/users?search=x', '/instructor/page/queries?user=12&sort=time&search=x']:
+        assert client.get(url).status_code == 200
+    assert_no_scans(app, statements)
+
+
+def test_profile_data(app, statements, client, auth):
+    auth.login()
+    statements.clear()
+
+    for url in ['/profile/data/', '/profile/data/page?sort=time&search=x']:
+        assert client.get(url).status_code == 200
+    assert_no_scans(app, statements)
+
+
+@pytest.mark.parametrize('class_id', [None, 1, 2])
+def test_auth_and_llm(app, statements, class_id):
+    with app.test_request_context():
+        session[AUTH_SESSION_KEY] = {'user_id': 23 if class_id == 1 else 11, 'class_id': class_id}
+        auth = _get_auth_from_session()
+        assert (auth.cur_class.class_id if auth.cur_class else None) == class_id
+        _get_llm(use_system_key=False, spend_token=False)
+        if class_id is not None:
+            _get_class_llm(class_id, 'mock')
+    assert_no_scans(app, statements)
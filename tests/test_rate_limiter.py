@@ -0,0 +1,144 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import asyncio
+
+import pytest
+
+from gened.async_runner import run_sync
+from gened.openai_client import OpenAIClient
+from gened.rate_limiter import AdmissionTimeoutError, KeyLimiter, KeyLimits, estimate_tokens, key_limits_from_form
+
+
+def test_max_inflight():
+    limiter = KeyLimiter()
+    limits = KeyLimits(max_inflight=2)
+    active = 0
+    max_active = 0
+
+    async def request():
+        nonlocal active, max_active
+        async with limiter.admit(limits, tokens=1):
+            active += 1
+            max_active = max(max_active, active)
+            await asyncio.sleep(0.02)
+            active -= 1
+
+    async def burst():
+        await asyncio.gather(*(request() for _ in range(6)))
+
+    asyncio.run(burst())
+    assert max_active == 2
+    assert limiter.admitted == 6
+    assert limiter.inflight == 0
+
+
+def test_inflight_wait_timeout():
+    limiter = KeyLimiter()
+    limits = KeyLimits(max_inflight=1, max_wait=0.05)
+
+    async def run():
+        async with limiter.admit(limits, tokens=1):
+            with pytest.raises(AdmissionTimeoutError):
+                async with limiter.admit(limits, tokens=1):
+                    pass
+        # the slot is free again
+        async with limiter.admit(limits, tokens=1):
+            pass
+
+    asyncio.run(run())
+    assert limiter.timeouts == 1
+    assert limiter.admitted == 2
+
+
+def test_rpm():
+    limiter = KeyLimiter()
+    limits = KeyLimits(rpm=2, max_wait=1)
+
+    async def run():
+        for _ in range(2):
+            async with limiter.admit(limits, tokens=1):
+                pass
+        # the next request would have to wait 30 seconds: fails without waiting for max_wait
+        with pytest.raises(AdmissionTimeoutError):
+            async with limiter.admit(limits, tokens=1):
+                pass
+
+    asyncio.run(asyncio.wait_for(run(), 0.5))
+
+
+def test_alternating_limits():
+    # e.g., two classes sharing an instructor's key, one with rpm=2 and one with no rpm limit
+    limiter = KeyLimiter()
+    limited = KeyLimits(rpm=2, max_wait=0.05)
+    unlimited = KeyLimits(max_wait=0.05)
+
+    async def admitted(limits):
+        try:
+            async with limiter.admit(limits, tokens=1):
+                return True
+        except AdmissionTimeoutError:
+            return False
+
+    async def run():
+        results = [(limits, await admitted(limits)) for limits in [limited, unlimited] * 5]
+        # a new rate keeps the key's (now empty) bucket, rather than starting a full one
+        results.append((limited, await admitted(KeyLimits(rpm=60, max_wait=0.05))))
+        return results
+
+    results = asyncio.run(run())
+    assert sum(ok for limits, ok in results if limits is limited) == 2
+    assert all(ok for limits, ok in results if limits is unlimited)
+
+
+def test_tpm_corrected_by_usage():
+    limiter = KeyLimiter()
+    limits = KeyLimits(tpm=1000, max_wait=0.05)
+
+    async def run():
+        async with limiter.admit(limits, tokens=800) as admission:
+            admission.used_tokens = 100
+        # the unused estimate was returned, so this fits
+        async with limiter.admit(limits, tokens=800) as admission:
+            admission.used_tokens = 800
+        with pytest.raises(AdmissionTimeoutError):
+            async with limiter.admit(limits, tokens=800):
+                pass
+
+    asyncio.run(run())
+
+
+def test_nonpositive_limits():
+    # e.g., stored before limits were validated: no limit, rather than an error or a stall
+    limiter = KeyLimiter()
+    limits = KeyLimits(max_inflight=0, rpm=0, tpm=-1, max_wait=0.05)
+
+    async def run():
+        for _ in range(3):
+            async with limiter.admit(limits, tokens=100):
+                pass
+
+    asyncio.run(run())
+    assert limiter.admitted == 3
+
+
+def test_key_limits_from_form():
+    assert key_limits_from_form({'llm_max_inflight': '4', 'llm_rpm': ' 60 ', 'llm_tpm': ''}) == ([4, 60, None], False)
+    assert key_limits_from_form({}) == ([None, None, None], False)
+    assert key_limits_from_form({'llm_max_inflight': '0', 'llm_rpm': '-5', 'llm_tpm': 'x'}) == ([None, None, None], True)
+
+
+def test_estimate_tokens():
+    assert estimate_tokens([{'role': 'user', 'content': "x" * 400}], 1000) == 1100
+
+
+def test_client_busy_error(app):
+    client = OpenAIClient("model", "busy-test-key", limits=KeyLimits(rpm=1, max_wait=0.05))
+
+    with app.app_context():
+        response, text = run_sync(client.get_completion(prompt="first"))
+        assert 'error' not in response
+        response, text = run_sync(client.get_completion(prompt="second"))
+        assert response['error'] == 'AdmissionTimeoutError'
+        assert text.startswith("Error (Busy)")
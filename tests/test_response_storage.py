@@ -0,0 +1,131 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import json
+
+from gened.db import get_db
+from gened.response_storage import (
+    compact_response,
+    compact_stored_responses,
+    compress_responses,
+    decompress_responses,
+    get_raw_responses,
+    save_responses,
+)
+
+FULL_RESPONSE = {
+    'id': 'chatcmpl-123',
+    'object': 'chat.completion',
+    'created': 1700000000,
+    'model': 'gpt-4o-mini',
+    'system_fingerprint': 'fp_abc',
+    'choices': [{
+        'index': 0,
+        'finish_reason': 'stop',
+        'logprobs': None,
+        'message': {'role': 'assistant', 'content': 'An answer ' * 50, 'refusal': None, 'tool_calls': None},
+    }],
+    'usage': {
+        'prompt_tokens': 100, 'completion_tokens': 50, 'total_tokens': 150,
+        'prompt_tokens_details': {'cached_tokens': 0}, 'completion_tokens_details': {'reasoning_tokens': 0},
+    },
+    'retries': 0,
+    'hedges': 0,
+}
+
+
+def test_compact_response():
+    assert compact_response(FULL_RESPONSE) == {
+        'model': 'gpt-4o-mini',
+        'finish_reason': 'stop',
+        'usage': {'prompt_tokens': 100, 'completion_tokens': 50, 'total_tokens': 150},
+    }
+    assert compact_response({'error': 'oops', 'retries': 2, 'hedges': 0}) == {'error': 'oops'}
+
+
+def test_compress_roundtrip():
+    raw = compress_responses([FULL_RESPONSE])
+    assert len(raw) < len(json.dumps([FULL_RESPONSE]))
+    assert decompress_responses(raw) == [FULL_RESPONSE]
+
+
+def test_recorded_query(app, client, auth):
+    auth.login()
+    client.get('/classes/switch/2')
+    response = client.post('/help/request', data={'code': 'code', 'error': 'error', 'issue': 'issue'})
+    query_id = int(response.location.rsplit('/', 1)[1])
+
+    with app.app_context():
+        row = get_db().execute("SELECT response_json FROM queries WHERE id=?", [query_id]).fetchone()
+        stored = json.loads(row['response_json'])
+        full = get_raw_responses(query_id)
+        assert full is not None
+        assert len(stored) == len(full)
+        assert stored == [compact_response(r) for r in full]
+        assert 'choices' in full[0]
+
+
+def test_recorded_query_not_compact(app, client, auth):
+    app.config['COMPACT_RESPONSES'] = False
+    auth.login()
+    client.get('/classes/switch/2')
+    response = client.post('/help/request', data={'code': 'code', 'error': 'error', 'issue': 'issue'})
+    query_id = int(response.location.rsplit('/', 1)[1])
+
+    with app.app_context():
+        db = get_db()
+        row = db.execute("SELECT response_json FROM queries WHERE id=?", [query_id]).fetchone()
+        assert 'choices' in json.loads(row['response_json'])[0]
+        assert db.execute("SELECT COUNT(*) FROM query_raw_responses").fetchone()[0] == 0
+        assert get_raw_responses(query_id) == json.loads(row['response_json'])
+
+
+def test_rerecorded_query(app):
+    with app.app_context():
+        db = get_db()
+        save_responses(db, 1, [FULL_RESPONSE], {'main': "answer"})
+        assert get_raw_responses(1) == [FULL_RESPONSE]
+
+        # recorded again with responses that have nothing to drop: the earlier full responses are removed
+        error = {'error': 'oops'}
+        save_responses(db, 1, [error], {'error': "oops"})
+        assert db.execute("SELECT COUNT(*) FROM query_raw_responses WHERE query_id=1").fetchone()[0] == 0
+        assert get_raw_responses(1) == [error]
+        db.commit()
+
+
+def test_compact_existing(app):
+    with app.app_context():
+        db = get_db()
+        full = json.dumps([FULL_RESPONSE, {'error': 'oops', 'retries': 0, 'hedges': 0}])
+        db.execute("UPDATE queries SET response_json=? WHERE id IN (1, 2, 3)", [full])
+        db.execute("UPDATE queries SET response_json='not json' WHERE id=4")
+        db.commit()
+        errors_before = db.execute("SELECT SUM(errors) FROM usage_user_daily").fetchone()[0]
+
+        report = compact_stored_responses(batch_size=2)
+        assert report.rewritten == 3
+        assert report.json_after < report.json_before
+        assert report.reclaimed > 0
+
+        row = db.execute("SELECT response_json FROM queries WHERE id=2").fetchone()
+        assert json.loads(row['response_json']) == [compact_response(FULL_RESPONSE), {'error': 'oops'}]
+        assert get_raw_responses(2) == json.loads(full)
+        assert db.execute("SELECT response_json FROM queries WHERE id=4").fetchone()[0] == 'not json'
+        # the rollups' error counts are unchanged
+        assert db.execute("SELECT SUM(errors) FROM usage_user_daily").fetchone()[0] == errors_before
+
+        # already compacted
+        assert compact_stored_responses().rewritten == 0
+
+
+def test_compact_command(app, runner):
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE queries SET response_json=? WHERE id=1", [json.dumps([FULL_RESPONSE])])
+        db.commit()
+        result = runner.invoke(args=['compact-responses', '--batch-size', '5'])
+    assert result.exit_code == 0
+    assert "Compacted 1 of" in result.output
+    assert "reclaimed:" in result.output
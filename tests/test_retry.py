@@ -0,0 +1,164 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from gened.async_runner import run_sync
+from gened.openai_client import OpenAIClient
+from gened.rate_limiter import KeyLimits, get_limiter_stats
+from gened.retry import (
+    CallStats,
+    DeadlineExceededError,
+    RetryPolicy,
+    call_with_retry,
+    get_retry_after,
+    is_retryable,
+)
+from gened.testing.mocks import mock_async_completion
+
+FAST_POLICY = RetryPolicy(max_attempts=3, base_delay=0.01, max_delay=0.01, deadline=5)
+
+
+def make_error(cls, status, headers=None, message="error"):
+    response = httpx.Response(status, request=httpx.Request('POST', 'http://test'), headers=headers)
+    return cls(message, response=response, body=None)
+
+
+def failing_then(errors, result="result", delay=0.0):
+    """Make a call that raises each of the given errors in turn, then returns result."""
+    calls = []
+
+    async def call():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        await asyncio.sleep(delay)
+        return result
+
+    return call, calls
+
+
+def test_is_retryable():
+    assert is_retryable(make_error(openai.RateLimitError, 429))
+    assert not is_retryable(make_error(openai.RateLimitError, 429, message="You exceeded your current quota"))
+    assert is_retryable(make_error(openai.InternalServerError, 503))
+    assert not is_retryable(make_error(openai.AuthenticationError, 401))
+    assert not is_retryable(make_error(openai.BadRequestError, 400))
+    assert is_retryable(openai.APITimeoutError(request=httpx.Request('POST', 'http://test')))
+
+
+def test_get_retry_after():
+    assert get_retry_after(make_error(openai.RateLimitError, 429, {'retry-after': '2'})) == 2
+    assert get_retry_after(make_error(openai.RateLimitError, 429, {'retry-after-ms': '250'})) == 0.25
+    assert get_retry_after(make_error(openai.RateLimitError, 429, {'retry-after': 'Wed, 21 Oct 2015 07:28:00 GMT'})) == 0  # in the past
+    assert get_retry_after(make_error(openai.RateLimitError, 429)) is None
+
+
+def test_retry_then_succeed(app):
+    call, calls = failing_then([make_error(openai.RateLimitError, 429), make_error(openai.InternalServerError, 500)])
+    stats = CallStats()
+    with app.app_context():
+        assert run_sync(call_with_retry(call, FAST_POLICY, stats)) == "result"
+    assert len(calls) == 3
+    assert stats.retries == 2
+
+
+def test_not_retryable(app):
+    call, calls = failing_then([make_error(openai.AuthenticationError, 401)])
+    with app.app_context(), pytest.raises(openai.AuthenticationError):
+        run_sync(call_with_retry(call, FAST_POLICY, CallStats()))
+    assert len(calls) == 1
+
+
+def test_attempts_exhausted(app):
+    call, calls = failing_then([make_error(openai.InternalServerError, 500)] * 5)
+    with app.app_context(), pytest.raises(openai.InternalServerError):
+        run_sync(call_with_retry(call, FAST_POLICY, CallStats()))
+    assert len(calls) == 3
+
+
+def test_retry_after_past_deadline(app):
+    # a retry-after beyond the deadline fails now rather than waiting
+    call, calls = failing_then([make_error(openai.RateLimitError, 429, {'retry-after': '60'})])
+    with app.app_context(), pytest.raises(openai.RateLimitError):
+        run_sync(call_with_retry(call, FAST_POLICY, CallStats()), timeout=1)
+    assert len(calls) == 1
+
+
+def test_deadline(app):
+    call, _ = failing_then([], delay=1)
+    policy = RetryPolicy(deadline=0.05)
+    with app.app_context(), pytest.raises(DeadlineExceededError):
+        run_sync(call_with_retry(call, policy, CallStats()))
+
+
+def test_hedge(app):
+    calls = []
+
+    async def call():
+        calls.append(1)
+        # the first call is slow; the hedged call is fast
+        await asyncio.sleep(1 if len(calls) == 1 else 0)
+        return len(calls)
+
+    stats = CallStats()
+    with app.app_context():
+        assert run_sync(call_with_retry(call, FAST_POLICY, stats, hedge_after=0.02), timeout=0.5) == 2
+    assert stats.hedges == 1
+
+
+def test_client_retries(app, monkeypatch):
+    mock = mock_async_completion(0.0)
+    errors = [make_error(openai.RateLimitError, 429, {'retry-after': '0'})]
+
+    async def flaky_mock(*args, **kwargs):
+        if errors:
+            raise errors.pop()
+        return await mock(*args, **kwargs)
+
+    monkeypatch.setattr(openai.resources.chat.AsyncCompletions, "create", flaky_mock)
+    app.config['LLM_RETRY_BASE_DELAY'] = 0.01
+
+    client = OpenAIClient("model", "retry-test-key")
+    stats = CallStats()
+    with app.app_context():
+        response, text = run_sync(client.get_completion(prompt="prompt", stats=stats))
+    assert 'error' not in response
+    assert 'retries' not in response  # counted in stats (recorded in llm_calls), not stored with the response
+    assert stats.retries == 1
+    assert text
+
+
+def test_stream_retries_admitted(app, monkeypatch):
+    mock = mock_async_completion(0.0)
+    errors = [make_error(openai.InternalServerError, 500)]
+
+    async def flaky_mock(*args, **kwargs):
+        if errors:
+            raise errors.pop()
+        return await mock(*args, **kwargs)
+
+    monkeypatch.setattr(openai.resources.chat.AsyncCompletions, "create", flaky_mock)
+    app.config['LLM_RETRY_BASE_DELAY'] = 0.01
+
+    client = OpenAIClient("model", "stream-retry-key-zq81", limits=KeyLimits(max_inflight=1))
+
+    async def stream():
+        completion = client.stream_completion(prompt="prompt")
+        deltas = [delta async for delta in completion]
+        return deltas, completion
+
+    with app.app_context():
+        deltas, completion = run_sync(stream())
+    assert deltas
+    assert completion.stats.retries == 1
+    assert 'retries' not in completion.response
+
+    # each attempt was admitted, and each admission was released
+    [stats] = [s for s in get_limiter_stats() if s.key_suffix == "zq81"]
+    assert (stats.admitted, stats.inflight) == (2, 0)
@@ -0,0 +1,115 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import json
+import os
+import time
+
+import pytest
+
+from gened import sql_stats
+from gened.db import get_db
+from gened.sql_stats import (
+    dump_snapshot,
+    get_slow_statements,
+    get_sql_stats,
+    normalize_sql,
+    param_shapes,
+    reset_sql_stats,
+)
+
+
+@pytest.fixture(autouse=True)
+def _reset_stats():
+    reset_sql_stats()
+
+
+@pytest.mark.parametrize(('sql', 'shape'), [
+    ("SELECT * FROM users WHERE id=1", "SELECT * FROM users WHERE id=?"),
+    ("SELECT *\n  FROM users\n  WHERE id=?  -- by id", "SELECT * FROM users WHERE id=?"),
+    ("SELECT * FROM users WHERE name='it''s' AND x=-1.5e3", "SELECT * FROM users WHERE name=? AND x=?"),
+    ("SELECT * FROM users WHERE id=:id", "SELECT * FROM users WHERE id=?"),
+    ("SELECT * FROM users WHERE id IN (1, 2, 3)", "SELECT * FROM users WHERE id IN (?, ...)"),
+    ("SELECT * FROM users WHERE id IN (?,?)", "SELECT * FROM users WHERE id IN (?, ...)"),
+    ("INSERT INTO t(a, b) VALUES (?, ?), (?, ?), (?, ?)", "INSERT INTO t(a, b) VALUES (?, ...), ..."),
+    ("SELECT * FROM t2 /* comment */ WHERE col1=2", "SELECT * FROM t2 WHERE col1=?"),
+])
+def test_normalize_sql(sql, shape):
+    assert normalize_sql(sql) == shape
+
+
+def test_param_shapes():
+    assert param_shapes([1, "abc", None, b"xy", 1.5]) == "[int, str(3), NoneType, bytes(2), float]"
+    assert param_shapes({'id': 5}) == "{id: int}"
+    assert param_shapes(()) == "[]"
+
+
+def test_statements_recorded(app):
+    with app.app_context():
+        db = get_db()
+        for user_id in (11, 12):
+            db.execute("SELECT * FROM users WHERE id=?", [user_id]).fetchall()
+        rows = list(db.execute("SELECT * FROM users WHERE id > 0 -- iterated"))
+        db.execute("UPDATE users SET query_tokens=query_tokens WHERE id > ?", [0])
+
+    stats = {s.shape: s for s in get_sql_stats()}
+    by_id = stats["SELECT * FROM users WHERE id=?"]
+    assert by_id.calls == 2
+    assert by_id.rows == 2
+    assert by_id.max_time >= by_id.mean_time > 0
+    assert stats["SELECT * FROM users WHERE id > ?"].rows == len(rows)
+    assert stats["UPDATE users SET query_tokens=query_tokens WHERE id > ?"].rows == len(rows)
+
+
+def test_slow_log(app, monkeypatch):
+    monkeypatch.setattr(sql_stats._recorder, 'slow_threshold', 0.0)
+    with app.app_context():
+        get_db().execute("SELECT * FROM users WHERE auth_name=?", ["secret"]).fetchall()
+
+    slow = get_slow_statements()
+    assert slow[0].shape == "SELECT * FROM users WHERE auth_name=?"
+    assert slow[0].params == "[str(6)]"  # never the values themselves
+
+
+def test_admin_page(client, auth):
+    auth.login('testadmin', 'testadminpassword')
+    response = client.get('/admin/db/')
+    assert response.status_code == 200
+    assert "Connection Pool" in response.text
+    assert "No statements yet." not in response.text  # at least the queries loading the admin user for the request
+
+
+def test_sql_stats_command(app, runner):
+    with app.app_context():
+        get_db().execute("SELECT * FROM users WHERE id=?", [11]).fetchall()
+        dump_snapshot(app)
+
+        result = runner.invoke(args=['sql-stats'])
+        assert "SELECT * FROM users WHERE id=?" in result.output
+
+        result = runner.invoke(args=['sql-stats', '--json'])
+        data = json.loads(result.output)
+        assert any(s['shape'] == "SELECT * FROM users WHERE id=?" and s['rows'] == 1 for s in data['statements'])
+
+        result = runner.invoke(args=['sql-stats', '--reset'])
+        assert "Deleted" in result.output
+        result = runner.invoke(args=['sql-stats'])
+        assert "SELECT" not in result.output
+
+
+def test_stale_snapshots_deleted(app):
+    app.config['SQL_STATS_DUMP_INTERVAL'] = 60
+    snapshot_dir = sql_stats._snapshot_dir(app)
+    snapshot_dir.mkdir(exist_ok=True)
+    stale = snapshot_dir / "1.json"  # from a process that exited long ago
+    recent = snapshot_dir / "2.json"
+    for path in (stale, recent):
+        path.write_text(json.dumps({'statements': [], 'slow': []}))
+    long_ago = time.time() - 3600
+    os.utime(stale, (long_ago, long_ago))
+
+    dump_snapshot(app)
+    assert not stale.exists()
+    assert recent.exists()
+    assert (snapshot_dir / f"{os.getpid()}.json").exists()
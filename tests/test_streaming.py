@@ -0,0 +1,173 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import json
+
+import pytest
+
+from gened.async_runner import run_sync
+from gened.db import get_db
+from gened.openai_client import OpenAIClient
+from gened.testing.mocks import _create_dummy_completion
+
+DUMMY_TEXT = (_create_dummy_completion().choices[0].message.content or "").strip()
+
+
+@pytest.fixture
+def streaming_app(app):
+    app.config['STREAMING_RESPONSES'] = True
+    return app
+
+
+def parse_events(response):
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        event_line, data_line = block.split("\n")
+        assert event_line.startswith("event: ")
+        assert data_line.startswith("data: ")
+        events.append((event_line.removeprefix("event: "), json.loads(data_line.removeprefix("data: "))))
+    return events
+
+
+def test_stream_completion(app):
+    async def stream():
+        completion = OpenAIClient("model", "key").stream_completion(prompt="test")
+        deltas = [delta async for delta in completion]
+        return deltas, completion
+
+    with app.app_context():
+        deltas, completion = run_sync(stream())
+
+    assert len(deltas) > 1
+    assert "".join(deltas).strip() == DUMMY_TEXT
+    assert completion.text == DUMMY_TEXT
+    assert completion.response is not None
+    assert completion.response['choices'][0]['message']['content'] == DUMMY_TEXT
+    assert completion.response['choices'][0]['finish_reason'] == "stop"
+
+
+def test_help_stream(streaming_app, client, auth):
+    auth.login()
+
+    response = client.post('/help/request', data={'code': 'code', 'error': 'error', 'issue': 'issue'})
+    assert response.status_code == 302
+    view_url = response.location
+    query_id = int(view_url.rsplit('/', 1)[1])
+
+    # response not generated yet; the view will stream it
+    response = client.get(view_url)
+    stream_url = f"/help/stream/{query_id}"
+    assert stream_url in response.text
+    assert "EventSource" in response.text
+
+    response = client.get(stream_url)
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    events = parse_events(response)
+    assert events[-1] == ('done', None)
+    deltas = [data for event, data in events if event == 'delta']
+    assert "".join(deltas).strip() == DUMMY_TEXT
+
+    # response recorded; view shows it and no longer streams
+    response = client.get(view_url)
+    assert "EventSource" not in response.text
+    assert DUMMY_TEXT in response.text
+
+    # streaming again only ends the stream
+    response = client.get(stream_url)
+    assert parse_events(response) == [('done', None)]
+
+
+def test_help_stream_other_user(streaming_app, client, auth):
+    auth.login()
+    response = client.post('/help/request', data={'code': 'code', 'error': 'error', 'issue': 'issue'})
+    query_id = int(response.location.rsplit('/', 1)[1])
+    auth.logout()
+
+    # an admin can view the query but not generate its response
+    auth.login('testadmin', 'testadminpassword')
+    response = client.get(f"/help/view/{query_id}")
+    assert response.status_code == 200
+    assert "EventSource" not in response.text
+    response = client.get(f"/help/stream/{query_id}")
+    assert parse_events(response) == [('done', None)]
+
+    with streaming_app.app_context():
+        row = get_db().execute("SELECT response_json FROM queries WHERE id=?", [query_id]).fetchone()
+        assert row['response_json'] is None
+
+
+def test_help_stream_interrupted(streaming_app, client, auth):
+    auth.login()
+    response = client.post('/help/request', data={'code': 'code', 'error': 'error', 'issue': 'issue'})
+    query_id = int(response.location.rsplit('/', 1)[1])
+
+    # the client disconnects after the first event
+    response = client.get(f"/help/stream/{query_id}", buffered=False)
+    first = next(iter(response.response))
+    assert b"event: delta" in first
+    response.close()
+
+    with streaming_app.app_context():
+        row = get_db().execute("SELECT response_text FROM queries WHERE id=?", [query_id]).fetchone()
+    texts = json.loads(row['response_text'])
+    assert "interrupted" in texts['error']
+    assert DUMMY_TEXT.startswith(texts['main'].strip())
+
+
+def test_tutor_stream(streaming_app, client, auth):
+    auth.login()
+    client.get('/classes/switch/2')  # switch to class 2 (where the chats experiment is active)
+
+    response = client.post('/tutor/message', data={'id': 1, 'message': 'new_user_msg'})
+    assert response.status_code == 302
+
+    response = client.get('/tutor/chat/1')
+    assert "new_user_msg" in response.text
+    assert "/tutor/stream/1" in response.text
+
+    response = client.get('/tutor/stream/1')
+    events = parse_events(response)
+    assert events[-1] == ('done', None)
+    assert "".join(data for event, data in events if event == 'delta').strip() == DUMMY_TEXT
+
+    with streaming_app.app_context():
+        row = get_db().execute("SELECT chat_json FROM chats WHERE id=1").fetchone()
+    chat = json.loads(row['chat_json'])
+    assert chat[-2] == {'role': 'user', 'content': 'new_user_msg'}
+    assert chat[-1] == {'role': 'assistant', 'content': DUMMY_TEXT}
+
+    # no longer waiting for a response
+    response = client.get('/tutor/chat/1')
+    assert "/tutor/stream/1" not in response.text
+    response = client.get('/tutor/stream/1')
+    assert parse_events(response) == [('done', None)]
+
+
+def test_tutor_stream_claimed(streaming_app, client, auth):
+    auth.login()
+    client.get('/classes/switch/2')
+    client.post('/tutor/message', data={'id': 1, 'message': 'new_user_msg'})
+
+    # another request is streaming the response
+    with streaming_app.app_context():
+        db = get_db()
+        db.execute("UPDATE chats SET responding_since=CURRENT_TIMESTAMP WHERE id=1")
+        db.commit()
+    assert "/tutor/stream/1" not in client.get('/tutor/chat/1').text
+    assert parse_events(client.get('/tutor/stream/1')) == [('done', None)]
+
+    # a stale claim (from a stream that died) can be taken over, and is released afterward
+    with streaming_app.app_context():
+        db = get_db()
+        db.execute("UPDATE chats SET responding_since=datetime('now', '-10 minutes') WHERE id=1")
+        db.commit()
+    assert "/tutor/stream/1" in client.get('/tutor/chat/1').text
+    events = parse_events(client.get('/tutor/stream/1'))
+    assert "".join(data for event, data in events if event == 'delta').strip() == DUMMY_TEXT
+
+    with streaming_app.app_context():
+        row = get_db().execute("SELECT chat_json, responding_since FROM chats WHERE id=1").fetchone()
+    assert row['responding_since'] is None
+    assert json.loads(row['chat_json'])[-1] == {'role': 'assistant', 'content': DUMMY_TEXT}
@@ -0,0 +1,169 @@
+# SPDX-FileCopyrightText: 2025 Mark Liffiton <liffiton@gmail.com>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from importlib import resources
+
+import pytest
+
+from gened.admin.main import get_classes, get_consumers, get_users
+from gened.app_data import Filters
+from gened.db import get_db
+from gened.usage import check_usage_rollups, rebuild_usage_rollups
+
+
+def assert_consistent():
+    for result in check_usage_rollups():
+        assert result.mismatched == 0, result.table
+
+
+def count_queries(where, params=()):
+    return get_db().execute(f"""
+        SELECT COUNT(*) FROM queries
+        LEFT JOIN roles ON roles.id=queries.role_id
+        LEFT JOIN classes_lti ON classes_lti.class_id=roles.class_id
+        WHERE {where}
+    """, params).fetchone()[0]
+
+
+def test_test_data_rolled_up(app):
+    with app.app_context():
+        assert_consistent()
+        user_rows = next(r for r in check_usage_rollups() if r.table == 'usage_user_daily').rows
+        assert user_rows > 0
+
+
+def test_triggers(app):
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO queries (issue, user_id, role_id) VALUES ('new', 11, 4)")
+        db.execute("INSERT INTO queries (issue, user_id, role_id, query_time) VALUES ('old', 11, 4, '2020-01-01 10:00:00')")
+        db.execute("INSERT INTO queries (issue, user_id) VALUES ('no class', 14)")
+        assert_consistent()
+
+        # responses set afterward, as in record_response()
+        db.execute("""UPDATE queries SET response_json='[{"error": "oops"}]', response_text='{"insufficient": "more"}' WHERE issue='new'""")
+        assert_consistent()
+        row = db.execute("SELECT errors, insufficient FROM usage_role_daily WHERE role_id=4 AND day=date('now')").fetchone()
+        assert (row['errors'], row['insufficient']) == (1, 1)
+
+        # moved to another user (as in data deletion), and deleted
+        db.execute("UPDATE queries SET user_id=-1 WHERE user_id=11")
+        db.execute("DELETE FROM queries WHERE issue='old'")
+        assert_consistent()
+        db.commit()
+
+
+def test_invalid_json_counted(app):
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO queries (issue, user_id, role_id, response_json, response_text) VALUES ('x', 11, 4, 'not json', 'plain')")
+        assert_consistent()
+
+
+def test_check_and_rebuild(app, runner):
+    with app.app_context():
+        db = get_db()
+        db.execute("DELETE FROM usage_class_daily")
+        db.execute("UPDATE usage_user_daily SET queries=queries+1 WHERE user_id=13")
+        db.commit()
+        mismatched = {r.table: r.mismatched for r in check_usage_rollups()}
+        assert mismatched['usage_class_daily'] > 0
+        assert mismatched['usage_user_daily'] == 1
+        assert mismatched['usage_role_daily'] == 0
+
+        result = runner.invoke(args=['usage-rollups', 'check'])
+        assert result.exit_code == 1
+        assert "mismatched" in result.output
+
+        result = runner.invoke(args=['usage-rollups', 'rebuild'])
+        assert result.exit_code == 0
+        assert_consistent()
+
+        result = runner.invoke(args=['usage-rollups', 'check'])
+        assert result.exit_code == 0
+
+
+def test_lti_link_changes(app):
+    with app.app_context():
+        db = get_db()
+        # class 1 (with queries) unlinked from its consumer, as in deleting the class
+        db.execute("DELETE FROM classes_lti WHERE class_id=1")
+        assert_consistent()
+        assert db.execute("SELECT SUM(queries) FROM usage_consumer_daily WHERE consumer_id=1").fetchone()[0] == 0
+
+        # linked to another consumer, then moved back
+        db.execute("INSERT INTO classes_lti (class_id, lti_consumer_id, lti_context_id) VALUES (1, 2, 'ctx_id')")
+        assert_consistent()
+        db.execute("UPDATE classes_lti SET lti_consumer_id=1 WHERE class_id=1")
+        assert_consistent()
+        assert db.execute("SELECT SUM(queries) FROM usage_consumer_daily WHERE consumer_id=1").fetchone()[0] == count_queries("roles.class_id=1")
+        db.commit()
+
+
+def test_migration_backfills(app):
+    with app.app_context():
+        db = get_db()
+        db.executescript("""
+            DROP TRIGGER queries_usage_insert;
+            DROP TRIGGER queries_usage_delete;
+            DROP TRIGGER queries_usage_update_before;
+            DROP TRIGGER queries_usage_update_after;
+            DROP TRIGGER classes_lti_usage_insert;
+            DROP TRIGGER classes_lti_usage_delete;
+            DROP TRIGGER classes_lti_usage_update;
+            DROP VIEW usage_events;
+            DROP TABLE usage_user_daily;
+            DROP TABLE usage_role_daily;
+            DROP TABLE usage_class_daily;
+            DROP TABLE usage_consumer_daily;
+        """)
+        migrations = [
+            ('gened', '20261017--add_usage_rollups.sql'),
+            ('codehelp', '20261017--codehelp--usage_rollup_triggers.sql'),
+            ('gened', '20261017--usage_rollup_lti_triggers.sql'),
+        ]
+        for package, name in migrations:
+            db.executescript(resources.files(package).joinpath('migrations', name).read_text(encoding='utf-8'))
+        assert_consistent()
+        db.execute("INSERT INTO queries (issue, user_id, role_id) VALUES ('new', 11, 4)")
+        assert_consistent()
+
+
+@pytest.mark.parametrize(('function', 'key', 'where'), [
+    (get_consumers, 'id', "classes_lti.lti_consumer_id=?"),
+    (get_classes, 'id', "roles.class_id=?"),
+    (get_users, 'id', "queries.user_id=?"),
+])
+def test_admin_counts(app, function, key, where):
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO queries (issue, user_id, role_id, query_time) VALUES ('old', 21, 1, '2020-01-01 10:00:00')")
+        rows = function(Filters()).fetchall()
+        assert rows
+        for row in rows:
+            assert row['#queries'] == count_queries(where, [row[key]])
+            assert row['1wk'] == count_queries(f"{where} AND queries.query_time > date('now', '-7 days')", [row[key]])
+
+
+def test_admin_users_filtered(app):
+    with app.app_context():
+        filters = Filters()
+        filters.add('class', 1)
+        rows = get_users(filters).fetchall()
+        assert {row['id'] for row in rows} == {r[0] for r in get_db().execute("SELECT user_id FROM roles WHERE class_id=1")}
+        for row in rows:
+            assert row['#queries'] == count_queries("queries.user_id=? AND roles.class_id=1", [row['id']])
+
+
+def test_charts(app):
+    with app.app_context():
+        from codehelp.queries import gen_query_charts
+        for name, value in [(None, None), ('user', 13), ('class', 2), ('consumer', 1), ('role', 6), ('query', 5)]:
+            filters = Filters()
+            if name:
+                filters.add(name, value)
+            charts = gen_query_charts(filters)
+            queries_today = charts[0].series['queries'][-1]
+            where = {None: "1", 'user': "queries.user_id=?", 'class': "roles.class_id=?", 'consumer': "classes_lti.lti_consumer_id=?", 'role': "queries.role_id=?", 'query': "queries.id=?"}[name]
+            assert queries_today == count_queries(where, [value] if name else []), name